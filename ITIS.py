@@ -10,12 +10,22 @@
 
 # In[1]:
 
-import requests,json
 from IPython.display import display
-from bis import bis
-from bis import itis
-from bis import tir
 from bis2 import gc2
+from tirutils import claim
+from tirutils import writer
+from tirutils import metrics
+from tirutils import journal
+from tirutils import workers
+from tirutils import ratelimit
+from tirutils import runstate
+from tirutils import lookups
+from tirutils import names
+from tirutils import itisbatch
+from tirutils import itissnapshot
+from tirutils import fuzzynames
+from tirutils import sessions
+from tirutils import responsecache
 
 
 # In[3]:
@@ -28,97 +38,80 @@ thisRun["baseURL"] = gc2.sqlAPI(thisRun["instance"],thisRun["db"])
 thisRun["commitToDB"] = True
 thisRun["totalRecordsToProcess"] = 500
 thisRun["totalRecordsProcessed"] = 0
-
-numberWithoutTIRData = 1
-
-while numberWithoutTIRData == 1 and thisRun["totalRecordsProcessed"] < thisRun["totalRecordsToProcess"]:
-
-    q_recordToSearch = "SELECT id,         registration->>'source' AS source,         registration->>'followTaxonomy' AS followtaxonomy,         registration->>'taxonomicLookupProperty' AS taxonomiclookupproperty,         registration->>'scientificname' AS scientificname,         registration->>'tsn' AS tsn         FROM tir.tir         WHERE itis IS NULL         LIMIT 1"
-    recordToSearch  = requests.get(thisRun["baseURL"]+"&q="+q_recordToSearch).json()
-    
-    numberWithoutTIRData = len(recordToSearch["features"])
-    
-    if numberWithoutTIRData == 1:
-        tirRecord = recordToSearch["features"][0]
-        
-        # Set up a local data structure for storage and processing
-        thisRecord = {}
-
-        # Set data from query results
-        thisRecord["id"] = tirRecord["properties"]["id"]
-        thisRecord["source"] = tirRecord["properties"]["source"]
-        thisRecord["followTaxonomy"] = tirRecord["properties"]["followtaxonomy"]
-        thisRecord["taxonomicLookupProperty"] = tirRecord["properties"]["taxonomiclookupproperty"]
-        thisRecord["tsn"] = tirRecord["properties"]["tsn"]
-        thisRecord["scientificname"] = tirRecord["properties"]["scientificname"]
-        thisRecord["scientificname_search"] = bis.cleanScientificName(thisRecord["scientificname"])
-
-        # Set defaults for thisRecord
-        thisRecord["matchMethod"] = "Not Matched"
-        thisRecord["matchString"] = thisRecord["scientificname_search"]
-        thisRecord["itisData"] = itis.packageITISJSON(thisRecord["matchMethod"],thisRecord["matchString"],0)
-        thisRecord["numResults"] = 0
-        itisDoc = {}
-
-        if thisRecord["taxonomicLookupProperty"] == "scientificname" and len(thisRecord["scientificname_search"]) != 0:
-
-            thisRecord["itisSearchURL"] = itis.getITISSearchURL(thisRecord["scientificname_search"],False,True)
-
-            # Try an exact match search
-            try:
-                itisSearchResults = requests.get(thisRecord["itisSearchURL"]).json()
-                thisRecord["numResults"] = len(itisSearchResults["response"]["docs"])
-            except Exception as e:
-                print (e)
-                pass
-
-
-            # If we got only a single record on an exact match search, set the method and proceed
-            if thisRecord["numResults"] == 1:
-                thisRecord["matchMethod"] = "Exact Match"
-                itisDoc = itisSearchResults["response"]["docs"][0]
-
-            # If we found nothing on an exact match search, try a fuzzy match
-            elif thisRecord["numResults"] == 0:
-                try:
-                    thisRecord["itisSearchURL"] = itis.getITISSearchURL(thisRecord["scientificname_search"],True,True)
-                    itisSearchResults = requests.get(thisRecord["itisSearchURL"]).json()
-                    thisRecord["numResults"] = len(itisSearchResults["response"]["docs"])
-                except Exception as e:
-                    print (e)
-                    pass
-                if thisRecord["numResults"] == 1:
-                    thisRecord["matchMethod"] = "Fuzzy Match"
-                    itisDoc = itisSearchResults["response"]["docs"][0]
-
-            # If we got a result but the usage is not accepted/invalid and we should follow taxonomy for this record, then retrieve the record for the accepted TSN
-            if len(itisDoc) > 0 and itisDoc["usage"] in ["not accepted","invalid"] and thisRecord["followTaxonomy"]:
-                thisRecord["itisSearchURL"] = itis.getITISSearchURL(itisDoc["acceptedTSN"][0],False,False)
-                try:
-                    itisSearchResults = requests.get(thisRecord["itisSearchURL"]).json()
-                except Exception as e:
-                    print (e)
-                    pass
-                if thisRecord["numResults"] == 1:
-                    thisRecord["matchMethod"] = "Followed Accepted TSN"
-                    itisDoc = itisSearchResults["response"]["docs"][0]
-
-            # If we got an ITIS Doc returned, package the results
-            if len(itisDoc) > 0:
-                thisRecord["itisData"] = itis.packageITISJSON(thisRecord["matchMethod"],thisRecord["matchString"],itisDoc)
-
-        elif thisRecord["taxonomicLookupProperty"] == "tsn" and thisRecord["tsn"] is not None:
-            thisRecord["itisSearchURL"] = itis.getITISSearchURL(thisRecord["tsn"],False,False)
-            itisSearchResults = requests.get(thisRecord["itisSearchURL"]).json()
-            thisRecord["matchMethod"] = "TSN Query"
-            thisRecord["matchString"] = thisRecord["tsn"]
-            itisDoc = itisSearchResults["response"]["docs"][0]
-            thisRecord["itisData"] = itis.packageITISJSON(thisRecord["matchMethod"],thisRecord["matchString"],itisDoc)
-            
-        display (thisRecord)
-        if thisRun["commitToDB"]:
-            print (tir.cacheToTIR(thisRun["baseURL"],thisRecord["id"],"itis",json.dumps(thisRecord["itisData"])))
-        thisRun["totalRecordsProcessed"] = thisRun["totalRecordsProcessed"] + 1
+thisRun["pageSize"] = 500
+thisRun["itisBatchSize"] = 100
+# Path to a local ITIS snapshot (built from the ITIS SQLite download with itissnapshot.buildSnapshot) to match
+# against offline instead of the ITIS Solr service
+thisRun["itisSnapshot"] = None
+# Try fuzzy matches against the ITIS names already cached in the TIR before running fuzzy searches
+thisRun["localFuzzy"] = True
+thisRun["writeBatchSize"] = 100
+thisRun["verbosity"] = 0
+thisRun["metricsFile"] = "metrics/ITIS"
+thisRun["maxWorkers"] = 8
+thisRun["hostLimit"] = 4
+# Requests per second to the service (None for no limit); requests in flight adapt between 1 and hostLimit, and after
+# repeated failures lookups pause (up to maxPauseSeconds) instead of caching "Not Matched" for everything
+thisRun["requestRate"] = None
+thisRun["maxPauseSeconds"] = 900
+# Checkpoints and dead letters (records whose lookups keep raising) so that runs resume where they stopped, and a time
+# budget in seconds for the run (None for no limit); see tirutils/runstate.py
+thisRun["runStateFile"] = "cache/runstate/ITIS.json"
+thisRun["maxAttempts"] = 3
+thisRun["maxSeconds"] = None
+thisRun["responseCache"] = "cache/responses.sqlite"
+thisRun["responseCacheTTL"] = 2592000
+
+q_selectColumns = "registration->>'source' AS source, registration->>'followTaxonomy' AS followtaxonomy, registration->>'taxonomicLookupProperty' AS taxonomiclookupproperty, registration->>'scientificname' AS scientificname, registration->>'tsn' AS tsn"
+q_whereClause = "itis IS NULL"
+
+runMetrics = metrics.startRun("ITIS")
+metrics.setUpstreamName(thisRun["baseURL"],"GC2")
+runMetrics.addCache("names",names.memo)
+workers.setHostLimit(lookups.itisHost,thisRun["hostLimit"])
+ratelimit.configure(lookups.itisHost,rate=thisRun["requestRate"],maxConcurrency=thisRun["hostLimit"])
+sessions.configure(poolSize=thisRun["hostLimit"])
+responseCache = responsecache.openCache(thisRun["responseCache"],thisRun["responseCacheTTL"])
+runMetrics.addCache("responses",responseCache)
+journal.ensureJournal(thisRun["baseURL"])
+itisSource = None
+if thisRun["itisSnapshot"] is not None:
+    itisSource = itissnapshot.ITISSnapshot(thisRun["itisSnapshot"])
+nameIndex = None
+if thisRun["localFuzzy"]:
+    nameIndex = fuzzynames.loadITISNames(thisRun["baseURL"])
+runState = runstate.RunState(thisRun["runStateFile"],thisRun["maxAttempts"],thisRun["maxSeconds"],thisRun["totalRecordsToProcess"],thisRun["commitToDB"])
+tirWriter = writer.TIRWriter(thisRun["baseURL"],{"itis":"json"},thisRun["writeBatchSize"],journalBucket="itis",onFlush=runState.flushed)
+
+# Lookups pause while the service's circuit is open, and records that keep failing become dead letters
+lookupFunction = runState.guardBatch(ratelimit.pausing(lambda tirRecords: itisbatch.lookupITISPage(tirRecords,thisRun["itisBatchSize"],itisSource,nameIndex),thisRun["maxPauseSeconds"]))
+# Registrations still to do, starting from the last checkpoint
+pendingRecords = runState.records(claim.pendingRecords(thisRun["baseURL"],q_selectColumns,q_whereClause,thisRun["pageSize"],None,runState.cursor))
+pages = claim.pages(pendingRecords,thisRun["pageSize"])
+
+# Resolve a page of registrations at a time with batched Solr queries (or the local snapshot), running a few pages
+# concurrently
+try:
+    for thisPage in workers.processConcurrently(lookupFunction,pages,thisRun["maxWorkers"]):
+        for thisRecord in thisPage:
+            if thisRun["verbosity"] > 0:
+                display (thisRecord)
+            if thisRun["commitToDB"]:
+                tirWriter.write(thisRecord["id"],{"itis":thisRecord["itisData"]})
+            else:
+                runState.settle([thisRecord["id"]])
+            thisRun["totalRecordsProcessed"] = thisRun["totalRecordsProcessed"] + 1
+            runMetrics.recordProcessed(thisRecord["matchMethod"])
+finally:
+    # Flush anything left in the write buffer and checkpoint, even when the run stops on an error
+    if thisRun["commitToDB"]:
+        print (tirWriter.close())
+    print (runState.finish())
+
+runMetrics.export(thisRun["metricsFile"]+".json")
+runMetrics.export(thisRun["metricsFile"]+".prom")
+print (runMetrics.summary())
+print (ratelimit.summary())
 
         
 
@@ -7,12 +7,20 @@
 
 # In[1]:
 
-import requests,json
+import json
 from IPython.display import display
-from bis import natureserve
-from bis import tir
 from bis2 import gc2
 from bis2 import natureserve as natureservekeys
+from tirutils import claim
+from tirutils import writer
+from tirutils import metrics
+from tirutils import workers
+from tirutils import ratelimit
+from tirutils import runstate
+from tirutils import dedup
+from tirutils import lookups
+from tirutils import sessions
+from tirutils import responsecache
 
 
 # In[9]:
@@ -25,45 +33,71 @@ thisRun["baseURL"] = gc2.sqlAPI(thisRun["instance"],thisRun["db"])
 thisRun["commitToDB"] = True
 thisRun["totalRecordsToProcess"] = 5000
 thisRun["totalRecordsProcessed"] = 0
-
-numberWithoutTIRData = 1
-
-while numberWithoutTIRData == 1 and thisRun["totalRecordsProcessed"] < thisRun["totalRecordsToProcess"]:
-
-    q_recordToSearch = "SELECT id, registration->>'scientificname' AS name_registered, itis->>'nameWInd' AS name_itis, worms->>'valid_name' AS name_worms FROM tir.tir WHERE natureserve IS NULL ORDER BY id ASC LIMIT 1"
-    recordToSearch  = requests.get(thisRun["baseURL"]+"&q="+q_recordToSearch).json()
-    
-    numberWithoutTIRData = len(recordToSearch["features"])
-    
-    if numberWithoutTIRData == 1:
-        tirRecord = recordToSearch["features"][0]
-
-        thisRecord = {}
-        thisRecord["id"] = tirRecord["properties"]["id"]
-        thisRecord["name_registered"] = tirRecord["properties"]["name_registered"]
-        thisRecord["name_itis"] = tirRecord["properties"]["name_itis"]
-        thisRecord["name_worms"] = tirRecord["properties"]["name_worms"]
-
-        thisRecord["tryNames"] = []
-        thisRecord["tryNames"].append(thisRecord["name_registered"])
-        if thisRecord["name_itis"] is not None and thisRecord["name_itis"] not in thisRecord["tryNames"]:
-            thisRecord["tryNames"].append(thisRecord["name_itis"])
-        if thisRecord["name_worms"] is not None and thisRecord["name_worms"] not in thisRecord["tryNames"]:
-            thisRecord["tryNames"].append(thisRecord["name_worms"])
-        
-        for name in thisRecord["tryNames"]:
-            thisRecord["elementGlobalID"] = natureserve.queryNatureServeID(name)
-            if thisRecord["elementGlobalID"] is not None:
-                break
-
-        # Run the function to query and package NatureServe data
-        thisRecord["natureServeData"] = natureserve.packageNatureServeJSON(natureservekeys.speciesAPI(),thisRecord["elementGlobalID"])
-
-        # Display the record, cache results, and show query status
-        display (thisRecord)
+thisRun["pageSize"] = 100
+# Pending records are grouped by the names they would be looked up with, a page of this many at a time, so that each
+# distinct name is only looked up once
+thisRun["dedupPageSize"] = 1000
+thisRun["writeBatchSize"] = 100
+thisRun["verbosity"] = 0
+thisRun["metricsFile"] = "metrics/NatureServe"
+thisRun["maxWorkers"] = 8
+thisRun["hostLimit"] = 4
+# Requests per second to the service (None for no limit); requests in flight adapt between 1 and hostLimit, and after
+# repeated failures lookups pause (up to maxPauseSeconds) instead of caching "Not Matched" for everything
+thisRun["requestRate"] = None
+thisRun["maxPauseSeconds"] = 900
+# Checkpoints and dead letters (records whose lookups keep raising) so that runs resume where they stopped, and a time
+# budget in seconds for the run (None for no limit); see tirutils/runstate.py
+thisRun["runStateFile"] = "cache/runstate/NatureServe.json"
+thisRun["maxAttempts"] = 3
+thisRun["maxSeconds"] = None
+thisRun["responseCache"] = "cache/responses.sqlite"
+thisRun["responseCacheTTL"] = 2592000
+thisRun["natureServeSpeciesAPI"] = natureservekeys.speciesAPI()
+
+q_selectColumns = "registration->>'scientificname' AS name_registered, itis->>'nameWInd' AS name_itis, worms->>'valid_name' AS name_worms"
+q_whereClause = "natureserve IS NULL"
+
+runMetrics = metrics.startRun("NatureServe")
+metrics.setUpstreamName(thisRun["baseURL"],"GC2")
+workers.setHostLimit(lookups.natureServeHost,thisRun["hostLimit"])
+ratelimit.configure(lookups.natureServeHost,rate=thisRun["requestRate"],maxConcurrency=thisRun["hostLimit"])
+sessions.configure(poolSize=thisRun["hostLimit"])
+responseCache = responsecache.openCache(thisRun["responseCache"],thisRun["responseCacheTTL"])
+runMetrics.addCache("responses",responseCache)
+deduplicator = dedup.Deduplicator(dedup.natureServeKey,thisRun["dedupPageSize"])
+runMetrics.addCache("dedup",deduplicator)
+runState = runstate.RunState(thisRun["runStateFile"],thisRun["maxAttempts"],thisRun["maxSeconds"],thisRun["totalRecordsToProcess"],thisRun["commitToDB"])
+tirWriter = writer.TIRWriter(thisRun["baseURL"],{"natureserve":"json"},thisRun["writeBatchSize"],onFlush=runState.flushed)
+
+# Lookups pause while the service's circuit is open, and records that keep failing become dead letters
+lookupFunction = runState.guard(ratelimit.pausing(lambda tirRecord: lookups.lookupNatureServe(tirRecord,thisRun["natureServeSpeciesAPI"]),thisRun["maxPauseSeconds"]))
+# Registrations still to do, starting from the last checkpoint
+pendingRecords = runState.records(claim.pendingRecords(thisRun["baseURL"],q_selectColumns,q_whereClause,thisRun["pageSize"],None,runState.cursor))
+
+try:
+    for thisRecord in deduplicator.process(lookupFunction,pendingRecords,thisRun["maxWorkers"],runState.unresolved):
+        # Records whose lookup raised (along with the rest of their group) are in the dead letters
+        if thisRecord is None:
+            continue
+        if thisRun["verbosity"] > 0:
+            display (thisRecord)
         if thisRun["commitToDB"]:
-            print (tir.cacheToTIR(thisRun["baseURL"],thisRecord["id"],"natureserve",json.dumps(thisRecord["natureServeData"]).replace(" ","")))
+            tirWriter.write(thisRecord["id"],{"natureserve":json.dumps(thisRecord["natureServeData"]).replace(" ","")})
+        else:
+            runState.settle([thisRecord["id"]])
         thisRun["totalRecordsProcessed"] = thisRun["totalRecordsProcessed"] + 1
+        runMetrics.recordProcessed("Matched" if thisRecord["elementGlobalID"] is not None else "Not Matched")
+finally:
+    # Flush anything left in the write buffer and checkpoint, even when the run stops on an error
+    if thisRun["commitToDB"]:
+        print (tirWriter.close())
+    print (runState.finish())
+
+runMetrics.export(thisRun["metricsFile"]+".json")
+runMetrics.export(thisRun["metricsFile"]+".prom")
+print (runMetrics.summary())
+print (ratelimit.summary())
 
 
 # In[ ]:
@@ -5,31 +5,21 @@
 
 # In[1]:
 
-import requests,json
 from IPython.display import display
-from datetime import datetime
-import pandas as pd
-from bis import tir
 from bis2 import gc2
-from bis import sgcn
+from tirutils import claim
+from tirutils import writer
+from tirutils import metrics
+from tirutils import journal
+from tirutils import sbconfig
+from tirutils import sgcnindex
 
 
 # In[2]:
 
-# Retrieve information from stored files on the SGCN base repository item
-sb_sgcnCollectionItem = requests.get("https://www.sciencebase.gov/catalog/item/56d720ece4b015c306f442d5?format=json&fields=files").json()
-
-for file in sb_sgcnCollectionItem["files"]:
-    if file["title"] == "Configuration:Taxonomic Group Mappings":
-        tgMappings = pd.read_table(file["url"], sep=",", encoding="utf-8")
-    elif file["title"] == "Original 2005 SWAP National List for reference":
-        swap2005 = pd.read_table(file["url"])
-
-tgDict = {}
-for index, row in tgMappings.iterrows():
-    providedName = str(row["ProvidedName"])
-    preferredName = str(row["PreferredName"])
-    tgDict[providedName] = preferredName
+# Retrieve the configuration files stored on the SGCN base repository item (cached locally between runs)
+sgcnConfig = sbconfig.loadSGCNConfig()
+tgDict = sgcnConfig["tgDict"]
 
 
 # In[4]:
@@ -42,51 +32,49 @@ thisRun["baseURL"] = gc2.sqlAPI(thisRun["instance"],thisRun["db"])
 thisRun["commitToDB"] = True
 thisRun["totalRecordsToProcess"] = 5000
 thisRun["totalRecordsProcessed"] = 0
+thisRun["pageSize"] = 100
+thisRun["writeBatchSize"] = 100
+thisRun["verbosity"] = 0
+thisRun["metricsFile"] = "metrics/SGCN"
+
+q_selectColumns = "registration->>'scientificname' AS name_submitted, itis->>'nameWInd' AS name_itis, worms->>'valid_name' AS name_worms"
+q_whereClause = "registration->>'source' = 'SGCN' AND sgcn->>'dateCached' IS NULL"
+
+runMetrics = metrics.startRun("SGCN")
+metrics.setUpstreamName(thisRun["baseURL"],"GC2")
+# Load the SGCN lookups once for the whole run
+sgcnIndex = sgcnindex.buildSGCNIndex(thisRun["baseURL"],sgcnConfig["swap2005Names"],tgDict)
+
+journal.ensureJournal(thisRun["baseURL"])
+tirWriter = writer.TIRWriter(thisRun["baseURL"],{"sgcn":"json"},thisRun["writeBatchSize"],journalBucket="sgcn")
+
+for tirRecord in claim.pendingRecords(thisRun["baseURL"],q_selectColumns,q_whereClause,thisRun["pageSize"],thisRun["totalRecordsToProcess"]):
+
+    thisRecord = {}
+    thisRecord["id"] = tirRecord["properties"]["id"]
+
+    thisRecord["names"] = [tirRecord["properties"]["name_submitted"]]
+    if tirRecord["properties"]["name_itis"] is not None and tirRecord["properties"]["name_itis"] not in thisRecord["names"]:
+        thisRecord["names"].append(tirRecord["properties"]["name_itis"])
+    if tirRecord["properties"]["name_worms"] is not None and tirRecord["properties"]["name_worms"] not in thisRecord["names"]:
+        thisRecord["names"].append(tirRecord["properties"]["name_worms"])
+
+    thisRecord["annotation"] = sgcnindex.annotateSGCN(sgcnIndex,tirRecord["properties"]["name_submitted"],thisRecord["names"])
 
-numberWithoutTIRData = 1
-
-while numberWithoutTIRData == 1 and thisRun["totalRecordsProcessed"] < thisRun["totalRecordsToProcess"]:
-
-    q_recordToSearch = "SELECT id, registration->>'scientificname' AS name_submitted, itis->>'nameWInd' AS name_itis, worms->>'valid_name' AS name_worms FROM tir.tir WHERE registration->>'source' = 'SGCN' AND sgcn->>'dateCached' IS NULL LIMIT 1"
-    recordToSearch  = requests.get(thisRun["baseURL"]+"&q="+q_recordToSearch).json()
-
-    numberWithoutTIRData = len(recordToSearch["features"])
-    
-    if numberWithoutTIRData == 1:
-        tirRecord = recordToSearch["features"][0]
-    
-        thisRecord = {}
-        thisRecord["id"] = tirRecord["properties"]["id"]
-        
-        thisRecord["names"] = [tirRecord["properties"]["name_submitted"]]
-        if tirRecord["properties"]["name_itis"] is not None and tirRecord["properties"]["name_itis"] not in thisRecord["names"]:
-            thisRecord["names"].append(tirRecord["properties"]["name_itis"])
-        if tirRecord["properties"]["name_worms"] is not None and tirRecord["properties"]["name_worms"] not in thisRecord["names"]:
-            thisRecord["names"].append(tirRecord["properties"]["name_worms"])
-        
-        thisRecord["annotation"] = {}
-        thisRecord["annotation"]["swap2005"] = False
-
-        taxonomicgroup_submitted = sgcn.getSGCNTaxonomicGroup(thisRun["baseURL"],tirRecord["properties"]["name_submitted"])
-        if taxonomicgroup_submitted in tgDict.keys():
-            thisRecord["annotation"]["taxonomicgroup"] = tgDict[taxonomicgroup_submitted]
-        elif taxonomicgroup_submitted in tgDict.values():
-            thisRecord["annotation"]["taxonomicgroup"] = taxonomicgroup_submitted
-        else:
-            thisRecord["annotation"]["taxonomicgroup"] = "Other"
-
-        for name in thisRecord["names"]:
-            if name in list(swap2005["scientificname"]):
-                thisRecord["annotation"]["swap2005"] = True
-                break
-                
-        thisRecord["annotation"]["stateLists"] = sgcn.getSGCNStatesByYear(thisRun["baseURL"],tirRecord["properties"]["name_submitted"])
-        thisRecord["annotation"]["dateCached"] = datetime.utcnow().isoformat()
-        
+    if thisRun["verbosity"] > 0:
         display (thisRecord)
-        if thisRun["commitToDB"]:
-            print (tir.cacheToTIR(thisRun["baseURL"],thisRecord["id"],"sgcn",json.dumps(thisRecord["annotation"])))
-        thisRun["totalRecordsProcessed"] = thisRun["totalRecordsProcessed"] + 1
+    if thisRun["commitToDB"]:
+        tirWriter.write(thisRecord["id"],{"sgcn":thisRecord["annotation"]})
+    thisRun["totalRecordsProcessed"] = thisRun["totalRecordsProcessed"] + 1
+    runMetrics.recordProcessed()
+
+# Flush anything left in the write buffer and show the results of caching
+if thisRun["commitToDB"]:
+    print (tirWriter.close())
+
+runMetrics.export(thisRun["metricsFile"]+".json")
+runMetrics.export(thisRun["metricsFile"]+".prom")
+print (runMetrics.summary())
 
 
 # In[ ]:
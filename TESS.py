@@ -9,11 +9,18 @@
 
 # In[3]:
 
-import requests,json
 from IPython.display import display
-from bis import tir
-from bis import tess
 from bis2 import gc2
+from tirutils import claim
+from tirutils import writer
+from tirutils import metrics
+from tirutils import workers
+from tirutils import ratelimit
+from tirutils import runstate
+from tirutils import dedup
+from tirutils import lookups
+from tirutils import sessions
+from tirutils import responsecache
 
 
 # In[4]:
@@ -26,57 +33,77 @@ thisRun["baseURL"] = gc2.sqlAPI(thisRun["instance"],thisRun["db"])
 thisRun["commitToDB"] = True
 thisRun["totalRecordsToProcess"] = 5000
 thisRun["totalRecordsProcessed"] = 0
-
-numberWithoutTIRData = 1
-
-while numberWithoutTIRData == 1 and thisRun["totalRecordsProcessed"] < thisRun["totalRecordsToProcess"]:
-    
-    q_recordToSearch = "SELECT id,         registration->>'scientificname' AS name_state,         itis->>'itisMatchMethod' AS matchmethod_itis,         itis->>'tsn' AS tsn,         itis->>'acceptedTSN' AS acceptedtsn,         itis->>'nameWInd' AS name_itis,         worms->>'MatchMethod' AS matchmethod_worms,         worms->>'valid_name' AS name_worms         FROM tir.tir         WHERE tess IS NULL         LIMIT 1"
-    recordToSearch = requests.get(gc2.sqlAPI("DataDistillery","BCB")+"&q="+q_recordToSearch).json()
-
-    numberWithoutTIRData = len(recordToSearch["features"])
-
-    if numberWithoutTIRData == 1:
-        tirRecord = recordToSearch["features"][0]
-
-        thisRecord = {}
-        thisRecord["id"] = tirRecord["properties"]["id"]
-        thisRecord["tsnsToSearch"] = []
-        thisRecord["namesToSearch"] = [tirRecord["properties"]["name_state"]]
-        thisRecord["tessJSON"] = tess.queryTESS()
-
-        if tirRecord["properties"]["matchmethod_itis"] not in [None,"Not Matched"]:
-            if tirRecord["properties"]["tsn"] is not None:
-                thisRecord["tsnsToSearch"].append(tirRecord["properties"]["tsn"])
-            if tirRecord["properties"]["acceptedtsn"] not in [None,thisRecord["tsnsToSearch"]]:
-                thisRecord["tsnsToSearch"].append(tirRecord["properties"]["acceptedtsn"])
-            if tirRecord["properties"]["name_itis"] not in [None,thisRecord["namesToSearch"]]:
-                thisRecord["namesToSearch"].append(tirRecord["properties"]["name_itis"])
-        
-        if tirRecord["properties"]["matchmethod_worms"] not in [None,"Not Matched"]:
-            if tirRecord["properties"]["name_worms"] not in [None,thisRecord["namesToSearch"]]:
-                thisRecord["namesToSearch"].append(tirRecord["properties"]["name_worms"])
-
-        if len(thisRecord["tsnsToSearch"]) > 0:
-            for tsn in thisRecord["tsnsToSearch"]:
-                thisRecord["tessJSON"] = tess.queryTESS("TSN",tsn)
-                if thisRecord["tessJSON"]["result"]:
-                    break
-
-        if not thisRecord["tessJSON"]["result"] and len(thisRecord["namesToSearch"]) > 0:
-            for name in thisRecord["namesToSearch"]:
-                thisRecord["tessJSON"] = tess.queryTESS("SCINAME",name)
-                if thisRecord["tessJSON"]["result"]:
-                    break
-
-        display (thisRecord["tessJSON"])
+thisRun["pageSize"] = 100
+# Pending records are grouped by the names they would be looked up with, a page of this many at a time, so that each
+# distinct name is only looked up once
+thisRun["dedupPageSize"] = 1000
+thisRun["writeBatchSize"] = 100
+thisRun["verbosity"] = 0
+thisRun["metricsFile"] = "metrics/TESS"
+thisRun["maxWorkers"] = 8
+thisRun["hostLimit"] = 4
+# Requests per second to the service (None for no limit); requests in flight adapt between 1 and hostLimit, and after
+# repeated failures lookups pause (up to maxPauseSeconds) instead of caching "Not Matched" for everything
+thisRun["requestRate"] = None
+thisRun["maxPauseSeconds"] = 900
+# Checkpoints and dead letters (records whose lookups keep raising) so that runs resume where they stopped, and a time
+# budget in seconds for the run (None for no limit); see tirutils/runstate.py
+thisRun["runStateFile"] = "cache/runstate/TESS.json"
+thisRun["maxAttempts"] = 3
+thisRun["maxSeconds"] = None
+thisRun["responseCache"] = "cache/responses.sqlite"
+thisRun["responseCacheTTL"] = 2592000
+
+q_selectColumns = "registration->>'scientificname' AS name_state, itis->>'itisMatchMethod' AS matchmethod_itis, itis->>'tsn' AS tsn, itis->>'acceptedTSN' AS acceptedtsn, itis->>'nameWInd' AS name_itis, worms->>'MatchMethod' AS matchmethod_worms, worms->>'valid_name' AS name_worms"
+q_whereClause = "tess IS NULL"
+
+# Some TESS documents with long lists of refuges cause problems in caching, so we retry those without that property
+# (on a copy, since records with the same name share their TESS document)
+def retryWithoutRefuges(recordID,values,message):
+    if "REFUGE_OCCURRENCE" in values["tess"]:
+        tessJSON = {key:value for key,value in values["tess"].items() if key != "REFUGE_OCCURRENCE"}
+        tirWriter.write(recordID,dict(values,tess=tessJSON))
+
+runMetrics = metrics.startRun("TESS")
+metrics.setUpstreamName(thisRun["baseURL"],"GC2")
+workers.setHostLimit(lookups.tessHost,thisRun["hostLimit"])
+ratelimit.configure(lookups.tessHost,rate=thisRun["requestRate"],maxConcurrency=thisRun["hostLimit"])
+sessions.configure(poolSize=thisRun["hostLimit"])
+responseCache = responsecache.openCache(thisRun["responseCache"],thisRun["responseCacheTTL"])
+runMetrics.addCache("responses",responseCache)
+deduplicator = dedup.Deduplicator(dedup.tessKey,thisRun["dedupPageSize"])
+runMetrics.addCache("dedup",deduplicator)
+runState = runstate.RunState(thisRun["runStateFile"],thisRun["maxAttempts"],thisRun["maxSeconds"],thisRun["totalRecordsToProcess"],thisRun["commitToDB"])
+tirWriter = writer.TIRWriter(thisRun["baseURL"],{"tess":"json"},thisRun["writeBatchSize"],onFailure=retryWithoutRefuges,onFlush=runState.flushed)
+
+# Lookups pause while the service's circuit is open, and records that keep failing become dead letters
+lookupFunction = runState.guard(ratelimit.pausing(lookups.lookupTESS,thisRun["maxPauseSeconds"]))
+# Registrations still to do, starting from the last checkpoint
+pendingRecords = runState.records(claim.pendingRecords(thisRun["baseURL"],q_selectColumns,q_whereClause,thisRun["pageSize"],None,runState.cursor))
+
+try:
+    for thisRecord in deduplicator.process(lookupFunction,pendingRecords,thisRun["maxWorkers"],runState.unresolved):
+        # Records whose lookup raised (along with the rest of their group) are in the dead letters
+        if thisRecord is None:
+            continue
+        if thisRun["verbosity"] > 0:
+            display (thisRecord["tessJSON"])
         if thisRun["commitToDB"]:
-            r = tir.cacheToTIR(thisRun["baseURL"],thisRecord["id"],"tess",json.dumps(thisRecord["tessJSON"]))
-            print (r)
-            if not r["success"]:
-                thisRecord["tessJSON"].pop("REFUGE_OCCURRENCE",None)
-                print (tir.cacheToTIR(thisRun["baseURL"],thisRecord["id"],"tess",json.dumps(thisRecord["tessJSON"])))
+            tirWriter.write(thisRecord["id"],{"tess":thisRecord["tessJSON"]})
+        else:
+            runState.settle([thisRecord["id"]])
         thisRun["totalRecordsProcessed"] = thisRun["totalRecordsProcessed"] + 1
+        runMetrics.recordProcessed(str(thisRecord["tessJSON"]["result"]))
+finally:
+    # Flush anything left in the write buffer and checkpoint, even when the run stops on an error
+    if thisRun["commitToDB"]:
+        print (tirWriter.close())
+    print (runState.finish())
+
+runMetrics.export(thisRun["metricsFile"]+".json")
+runMetrics.export(thisRun["metricsFile"]+".prom")
+print (runMetrics.summary())
+print (ratelimit.summary())
 
 
 # In[ ]:
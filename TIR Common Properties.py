@@ -12,12 +12,16 @@
 
 # In[1]:
 
-import requests,json
+import os
 from IPython.display import display
-from datetime import datetime
 from bis2 import gc2
-from bis import bis
-from bis import sgcn
+from tirutils import claim
+from tirutils import writer
+from tirutils import metrics
+from tirutils import journal
+from tirutils import commonproperties
+from tirutils import names
+from tirutils import sgcnindex
 
 
 # In[3]:
@@ -30,85 +34,76 @@ thisRun["baseURL"] = gc2.sqlAPI(thisRun["instance"],thisRun["db"])
 thisRun["commitToDB"] = True
 thisRun["totalRecordsToProcess"] = 1000
 thisRun["totalRecordsProcessed"] = 0
-
-numberWithoutTIRData = 1
-
-while numberWithoutTIRData == 1 and thisRun["totalRecordsProcessed"] < thisRun["totalRecordsToProcess"]:
-    q_recordToSearch = "SELECT *         FROM tir.tir         WHERE itis IS NOT NULL         AND worms IS NOT NULL         AND (cachedate < (itis->>'cacheDate')::date         OR cachedate < (worms->>'cacheDate')::date         OR cachedate < (sgcn->>'cacheDate')::date)         LIMIT 1"
-    recordToSearch = requests.get(thisRun["baseURL"]+"&q="+q_recordToSearch).json()
-
-    numberWithoutTIRData = len(recordToSearch["features"])
-
-    if numberWithoutTIRData == 1:
-        tirRecord = recordToSearch["features"][0]
-
-        thisRecord = {}
-        thisRecord["id"] = tirRecord["properties"]["id"]
-        thisRecord["registration"] = json.loads(tirRecord["properties"]["registration"])
-        thisRecord["itis"] = json.loads(tirRecord["properties"]["itis"])
-        thisRecord["worms"] = json.loads(tirRecord["properties"]["worms"])
-        if tirRecord["properties"]["sgcn"] is not None:
-            thisRecord["sgcn"] = json.loads(tirRecord["properties"]["sgcn"])
-        _source = thisRecord["registration"]["source"]
-
-        tirCommon = {}
-        tirCommon["commonname"] = None
-        tirCommon["authorityid"] = None
-        tirCommon["rank"] = None
-        tirCommon["matchmethod"] = None
-        tirCommon["taxonomicgroup"] = None
-        tirCommon["cachedate"] = datetime.utcnow().isoformat()
-        
-        tirCommon["scientificname"] = bis.stringCleaning(thisRecord["registration"]["scientificname"])
-        tirCommon["source"] = thisRecord["registration"]["source"]
-        tirCommon["matchmethod"] = "Not Matched"
-        tirCommon["authorityid"] = "Not Matched to Taxonomic Authority"
-        tirCommon["rank"] = "Unknown Taxonomic Rank"
-
-        if thisRecord["itis"]["MatchMethod"] != "Not Matched":
-            tirCommon["scientificname"] = thisRecord["itis"]["nameWInd"]
-            tirCommon["matchmethod"] = thisRecord["itis"]["MatchMethod"]
-            tirCommon["authorityid"] = "http://services.itis.gov/?q=tsn:"+str(thisRecord["itis"]["tsn"])
-            tirCommon["rank"] = thisRecord["itis"]["rank"]
-        elif thisRecord["worms"]["MatchMethod"] != "Not Matched":
-            tirCommon["scientificname"] = thisRecord["worms"]["valid_name"]
-            tirCommon["matchmethod"] = thisRecord["worms"]["MatchMethod"]
-            tirCommon["authorityid"] = "http://www.marinespecies.org/rest/AphiaRecordsByName/"+str(thisRecord["worms"]["AphiaID"])
-            tirCommon["rank"] = thisRecord["worms"]["rank"]
-            
-        if tirCommon["commonname"] is None and _source == 'SGCN':
-            tirCommon["commonname"] = sgcn.getSGCNCommonName(thisRun["baseURL"],bis.stringCleaning(thisRecord["registration"]["scientificname"]))
-
-        if tirCommon["commonname"] is None and "commonnames" in list(thisRecord["itis"].keys()):
-            for name in thisRecord["itis"]["commonnames"]:
-                if name["language"] == "English" or name["language"] == "unspecified":
-                    tirCommon["commonname"] = name["name"]
-                    break
-        
-        if tirCommon["commonname"] is None:
-            tirCommon["commonname"] = "no common name"
-
-        if _source == "SGCN" and "sgcn" in list(thisRecord.keys()):
-            tirCommon["taxonomicgroup"] = thisRecord["sgcn"]["taxonomicgroup"]
-            
-            if tirCommon["matchmethod"] == "Not Matched" and "swap2005" in list(thisRecord["sgcn"].keys()) and thisRecord["sgcn"]["swap2005"] is True:
-                tirCommon["matchmethod"] = "Legacy Match"
-                tirCommon["authorityid"] = "https://www.sciencebase.gov/catalog/file/get/56d720ece4b015c306f442d5?f=__disk__38%2F22%2F26%2F38222632f48bf0c893ad1017f6ba557d0f672432"
-        elif _source == "GAP Species":
-            tirCommon["taxonomicgroup"] = thisRecord["registration"]["taxonomicgroup"]
-            
-            if tirCommon["scientificname"] != thisRecord["registration"]["scientificname"]:
-                tirCommon["scientificname"] = thisRecord["registration"]["scientificname"]
-            if tirCommon["commonname"] != thisRecord["registration"]["commonname"]:
-                tirCommon["commonname"] = thisRecord["registration"]["commonname"]
-        else:
-            tirCommon["taxonomicgroup"] = "Other"
-
-        display (tirCommon)
-        if thisRun["commitToDB"]:
-            q_tirCommon = "UPDATE tir.tir SET                 source='"+tirCommon["source"]+"',                 scientificname='"+tirCommon["scientificname"]+"',                 commonname='"+bis.stringCleaning(tirCommon["commonname"])+"',                 authorityid='"+tirCommon["authorityid"]+"',                 rank='"+tirCommon["rank"]+"',                 taxonomicgroup='"+tirCommon["taxonomicgroup"]+"',                 matchmethod='"+tirCommon["matchmethod"]+"',                 cachedate='"+tirCommon["cachedate"]+"'                 WHERE id = "+str(thisRecord["id"])
-            print (requests.get(thisRun["baseURL"]+"&q="+q_tirCommon).json())
-        thisRun["totalRecordsProcessed"] = thisRun["totalRecordsProcessed"] + 1
+thisRun["pageSize"] = 100
+thisRun["writeBatchSize"] = 100
+thisRun["verbosity"] = 0
+thisRun["metricsFile"] = "metrics/CommonProperties"
+# "incremental" works from the journal of records written by the ITIS, WoRMS and SGCN processors since the last run
+# "stale" checks the whole table for cache dates that are older than the cached information
+# "full" is the backfill of every record without common properties or with stale ones. The journal only has what the
+# processors wrote since it was added, so we run full until a pass gets through everything, and only then save the
+# watermark that switches us to incremental.
+thisRun["watermarkFile"] = "cache/commonproperties_watermark.json"
+thisRun["mode"] = "incremental" if os.path.exists(thisRun["watermarkFile"]) else "full"
+thisRun["lastJournalSeq"] = journal.readWatermark(thisRun["watermarkFile"])
+# Delete journal entries through the watermark once it is saved (this is the only process that reads the journal)
+thisRun["pruneJournal"] = True
+
+q_selectColumns = "registration, itis, worms, sgcn"
+q_whereClause = "itis IS NOT NULL AND worms IS NOT NULL"
+q_staleClause = "(cachedate < (itis->>'cacheDate')::date OR cachedate < (worms->>'cacheDate')::date OR cachedate < (sgcn->>'cacheDate')::date)"
+q_backfillClause = "(cachedate IS NULL OR "+q_staleClause+")"
+
+runMetrics = metrics.startRun("CommonProperties")
+metrics.setUpstreamName(thisRun["baseURL"],"GC2")
+runMetrics.addCache("names",names.memo)
+
+journal.ensureJournal(thisRun["baseURL"])
+if thisRun["mode"] == "incremental":
+    recordsToProcess = journal.changedRecords(thisRun["baseURL"],q_selectColumns,q_whereClause,["itis","worms","sgcn"],thisRun["lastJournalSeq"],thisRun["pageSize"],thisRun["totalRecordsToProcess"])
+elif thisRun["mode"] == "full":
+    # Anything journaled from here on is picked up by the incremental runs after the backfill
+    thisRun["lastJournalSeq"] = journal.currentSeq(thisRun["baseURL"])
+    recordsToProcess = claim.pendingRecords(thisRun["baseURL"],q_selectColumns,q_whereClause+" AND "+q_backfillClause,thisRun["pageSize"],thisRun["totalRecordsToProcess"])
+else:
+    recordsToProcess = claim.pendingRecords(thisRun["baseURL"],q_selectColumns,q_whereClause+" AND "+q_staleClause,thisRun["pageSize"],thisRun["totalRecordsToProcess"])
+
+# Load submitted SGCN common names once for the whole run
+sgcnCommonNames = sgcnindex.loadCommonNames(thisRun["baseURL"])
+
+tirWriter = writer.TIRWriter(thisRun["baseURL"],{"source":None,"scientificname":None,"commonname":None,"authorityid":None,"rank":None,"taxonomicgroup":None,"matchmethod":None,"cachedate":"timestamp"},thisRun["writeBatchSize"])
+
+# Work through the records a page at a time, deriving the common properties for the whole page at once
+for tirRecordPage in claim.pages(recordsToProcess,thisRun["pageSize"]):
+    tirCommonPage = commonproperties.deriveCommonProperties(commonproperties.recordsFrame(tirRecordPage),sgcnCommonNames)
+
+    if thisRun["verbosity"] > 0:
+        display (tirCommonPage)
+    if thisRun["commitToDB"]:
+        for tirCommon in tirCommonPage.to_dict("records"):
+            tirWriter.write(tirCommon.pop("id"),tirCommon)
+    thisRun["totalRecordsProcessed"] = thisRun["totalRecordsProcessed"] + len(tirRecordPage)
+    for matchMethod in tirCommonPage["matchmethod"]:
+        runMetrics.recordProcessed(matchMethod)
+    if "journalseq" in tirRecordPage[-1]["properties"]:
+        thisRun["lastJournalSeq"] = tirRecordPage[-1]["properties"]["journalseq"]
+
+# Flush anything left in the write buffer and show the results of caching
+if thisRun["commitToDB"]:
+    writeSummary = tirWriter.close()
+    print (writeSummary)
+    # GC2 errors while paging raise, so a full pass that stopped short of the record limit got to the end of the data.
+    # One that stopped on the limit has more to do, so the next run is full again. If any write failed we keep the old
+    # watermark (and the journal) so that the failed records are picked up again.
+    backfillDone = thisRun["mode"] == "full" and thisRun["totalRecordsProcessed"] < thisRun["totalRecordsToProcess"]
+    if writeSummary["failed"] == 0 and (thisRun["mode"] == "incremental" or backfillDone):
+        journal.writeWatermark(thisRun["watermarkFile"],thisRun["lastJournalSeq"])
+        if thisRun["pruneJournal"]:
+            print (journal.pruneJournal(thisRun["baseURL"],thisRun["lastJournalSeq"]))
+
+runMetrics.export(thisRun["metricsFile"]+".json")
+runMetrics.export(thisRun["metricsFile"]+".prom")
+print (runMetrics.summary())
         
 
 
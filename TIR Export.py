@@ -0,0 +1,54 @@
+
+# coding: utf-8
+
+# This writes a columnar snapshot of the TIR to a local Parquet (or Arrow) file with just the properties we ask for pulled out of the JSON buckets on the database side. Views like the SGCN National List and GAP species and recompute jobs can then work from the memory mapped file (tirutils.export.openExport) instead of pulling and parsing whole buckets through the GC2 SQL API over and over.
+
+# In[1]:
+
+from bis2 import gc2
+from tirutils import export
+
+
+# In[2]:
+
+# Set up the actions/targets for this particular instance
+thisRun = {}
+thisRun["instance"] = "DataDistillery"
+thisRun["db"] = "BCB"
+thisRun["baseURL"] = gc2.sqlAPI(thisRun["instance"],thisRun["db"])
+thisRun["exportFile"] = "cache/tir.parquet"
+# parquet or arrow
+thisRun["fileFormat"] = "parquet"
+# Records per GC2 API request and per row group in the file
+thisRun["pageSize"] = 5000
+thisRun["totalRecordsToProcess"] = None
+thisRun["whereClause"] = "TRUE"
+# Columns (tir.tir column names) and JSON paths (bucket.property) to export
+thisRun["paths"] = [
+    "registration.source",
+    "registration.scientificname",
+    "itis.tsn",
+    "itis.nameWInd",
+    "itis.itisMatchMethod",
+    "itis.rank",
+    "worms.AphiaID",
+    "worms.valid_name",
+    "worms.MatchMethod",
+    "sgcn.taxonomicgroup",
+    "sgcn.swap2005",
+    "scientificname",
+    "commonname",
+    "authorityid",
+    "rank",
+    "taxonomicgroup",
+    "matchmethod",
+    "cachedate"
+]
+
+print (export.exportTIR(thisRun["baseURL"],thisRun["exportFile"],thisRun["paths"],thisRun["whereClause"],thisRun["pageSize"],thisRun["fileFormat"],thisRun["totalRecordsToProcess"]))
+
+
+# In[ ]:
+
+
+
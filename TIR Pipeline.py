@@ -0,0 +1,174 @@
+
+# coding: utf-8
+
+# This runs the ITIS, WoRMS, TESS, NatureServe, SGCN and TIR Common Properties processing as one pipeline instead of one script after another. Each registration that is still missing something flows through ITIS, then WoRMS, then TESS and NatureServe side by side, then the SGCN annotations and the common properties, with bounded queues between the stages so that a slow upstream service holds the stages in front of it back instead of piling up records. A record is fully enriched as soon as its own lookups are done rather than waiting for whole passes over the TIR. The individual scripts still work on their own for reprocessing a single bucket. In refresh mode the pipeline instead looks up again the cached buckets that are due under the refresh policies in tirutils/refresh.py (e.g. TESS weekly, ITIS monthly, "Not Matched" results sooner), most overdue first and only as many as fit in the request budget, so that running it regularly keeps the TIR up to date without full re-runs.
+
+# In[1]:
+
+from IPython.display import display
+from bis2 import gc2
+from bis2 import natureserve as natureservekeys
+from tirutils import writer
+from tirutils import metrics
+from tirutils import journal
+from tirutils import workers
+from tirutils import ratelimit
+from tirutils import dedup
+from tirutils import lookups
+from tirutils import names
+from tirutils import pipeline
+from tirutils import refresh
+from tirutils import itissnapshot
+from tirutils import fuzzynames
+from tirutils import sbconfig
+from tirutils import sgcnindex
+from tirutils import sessions
+from tirutils import responsecache
+
+
+# In[2]:
+
+# Retrieve the configuration files stored on the SGCN base repository item (cached locally between runs)
+sgcnConfig = sbconfig.loadSGCNConfig()
+tgDict = sgcnConfig["tgDict"]
+
+
+# In[3]:
+
+# Set up the actions/targets for this particular instance
+thisRun = {}
+thisRun["instance"] = "DataDistillery"
+thisRun["db"] = "BCB"
+thisRun["baseURL"] = gc2.sqlAPI(thisRun["instance"],thisRun["db"])
+thisRun["commitToDB"] = True
+thisRun["totalRecordsToProcess"] = 5000
+thisRun["totalRecordsProcessed"] = 0
+thisRun["pageSize"] = 500
+# "pending" fills in registrations that are missing something, "refresh" looks up buckets due under refresh.policies
+thisRun["mode"] = "pending"
+# Rough number of upstream requests a refresh run may make
+thisRun["requestBudget"] = 20000
+thisRun["itisBatchSize"] = 100
+# Path to a local ITIS snapshot (built from the ITIS SQLite download with itissnapshot.buildSnapshot) to match
+# against offline instead of the ITIS Solr service
+thisRun["itisSnapshot"] = None
+# Try fuzzy matches against the ITIS and WoRMS names already cached in the TIR before running fuzzy searches
+thisRun["localFuzzy"] = True
+thisRun["writeBatchSize"] = 100
+thisRun["verbosity"] = 0
+thisRun["metricsFile"] = "metrics/Pipeline"
+# Records waiting in front of each stage before the stages ahead of it have to wait
+thisRun["queueSize"] = 1000
+# Worker threads and the most records taken at a time for each stage
+thisRun["stageWorkers"] = {"ITIS":2,"WoRMS":8,"TESS":8,"NatureServe":8,"SGCN":1,"CommonProperties":1}
+thisRun["stageBatchSize"] = {"ITIS":500,"CommonProperties":100}
+thisRun["hostLimit"] = 4
+# Requests per second to each service (None for no limit); requests in flight adapt between 1 and hostLimit
+thisRun["requestRate"] = None
+thisRun["responseCache"] = "cache/responses.sqlite"
+thisRun["responseCacheTTL"] = 2592000
+# Cached responses older than this are revalidated (or fetched again) in refresh mode
+thisRun["refreshCacheTTL"] = 86400
+thisRun["wormsNameService"] = "http://www.marinespecies.org/rest/AphiaRecordsByName/"
+thisRun["wormsIDService"] = "http://www.marinespecies.org/rest/AphiaRecordByAphiaID/"
+thisRun["natureServeSpeciesAPI"] = natureservekeys.speciesAPI()
+
+# Some TESS documents with long lists of refuges cause problems in caching, so we retry those without that property
+# (on a copy, since records with the same name share their TESS document)
+def retryWithoutRefuges(recordID,values,message):
+    if "REFUGE_OCCURRENCE" in values["tess"]:
+        tessJSON = {key:value for key,value in values["tess"].items() if key != "REFUGE_OCCURRENCE"}
+        tirWriters["tess"].write(recordID,dict(values,tess=tessJSON))
+
+runMetrics = metrics.startRun("Pipeline")
+metrics.setUpstreamName(thisRun["baseURL"],"GC2")
+runMetrics.addCache("names",names.memo)
+for host in [lookups.itisHost,lookups.wormsHost,lookups.tessHost,lookups.natureServeHost]:
+    workers.setHostLimit(host,thisRun["hostLimit"])
+    ratelimit.configure(host,rate=thisRun["requestRate"],maxConcurrency=thisRun["hostLimit"])
+sessions.configure(poolSize=thisRun["hostLimit"])
+responseCache = responsecache.openCache(thisRun["responseCache"],thisRun["refreshCacheTTL"] if thisRun["mode"] == "refresh" else thisRun["responseCacheTTL"])
+runMetrics.addCache("responses",responseCache)
+journal.ensureJournal(thisRun["baseURL"])
+
+itisSource = None
+if thisRun["itisSnapshot"] is not None:
+    itisSource = itissnapshot.ITISSnapshot(thisRun["itisSnapshot"])
+itisNames = None
+wormsNames = None
+if thisRun["localFuzzy"]:
+    itisNames = fuzzynames.loadITISNames(thisRun["baseURL"])
+    wormsNames = fuzzynames.loadWoRMSNames(thisRun["baseURL"])
+
+# Look each distinct name up once across the whole run, as the WoRMS, TESS and NatureServe scripts do
+deduplicators = {"WoRMS":dedup.Deduplicator(dedup.wormsKey),"TESS":dedup.Deduplicator(dedup.tessKey),"NatureServe":dedup.Deduplicator(dedup.natureServeKey)}
+for name,deduplicator in deduplicators.items():
+    runMetrics.addCache("dedup"+name,deduplicator)
+
+# Load the SGCN lookups and submitted SGCN common names once for the whole run
+sgcnIndex = sgcnindex.buildSGCNIndex(thisRun["baseURL"],sgcnConfig["swap2005Names"],tgDict)
+sgcnCommonNames = sgcnindex.loadCommonNames(thisRun["baseURL"])
+
+tirWriters = {}
+tirWriters["itis"] = writer.TIRWriter(thisRun["baseURL"],{"itis":"json"},thisRun["writeBatchSize"],journalBucket="itis")
+tirWriters["worms"] = writer.TIRWriter(thisRun["baseURL"],{"worms":"json"},thisRun["writeBatchSize"],journalBucket="worms")
+tirWriters["tess"] = writer.TIRWriter(thisRun["baseURL"],{"tess":"json"},thisRun["writeBatchSize"],onFailure=retryWithoutRefuges)
+tirWriters["natureserve"] = writer.TIRWriter(thisRun["baseURL"],{"natureserve":"json"},thisRun["writeBatchSize"])
+tirWriters["sgcn"] = writer.TIRWriter(thisRun["baseURL"],{"sgcn":"json"},thisRun["writeBatchSize"],journalBucket="sgcn")
+# Refreshed buckets that come back unchanged only get their cache date moved forward
+dateWriters = {bucket:writer.CacheDateWriter(thisRun["baseURL"],bucket,dateKey,thisRun["writeBatchSize"]) for bucket,dateKey in refresh.dateKeys.items()}
+tirWriters["common"] = writer.TIRWriter(thisRun["baseURL"],{"source":None,"scientificname":None,"commonname":None,"authorityid":None,"rank":None,"taxonomicgroup":None,"matchmethod":None,"cachedate":"timestamp"},thisRun["writeBatchSize"])
+
+tirPipeline = pipeline.Pipeline([
+    pipeline.Stage("ITIS",pipeline.itisStage(thisRun["itisBatchSize"],itisSource,itisNames),thisRun["stageWorkers"]["ITIS"],thisRun["stageBatchSize"]["ITIS"],thisRun["queueSize"]),
+    pipeline.Stage("WoRMS",pipeline.wormsStage(thisRun["wormsNameService"],thisRun["wormsIDService"],wormsNames,deduplicators["WoRMS"]),thisRun["stageWorkers"]["WoRMS"],1,thisRun["queueSize"]),
+    [
+        pipeline.Stage("TESS",pipeline.tessStage(deduplicators["TESS"]),thisRun["stageWorkers"]["TESS"],1,thisRun["queueSize"]),
+        pipeline.Stage("NatureServe",pipeline.natureServeStage(thisRun["natureServeSpeciesAPI"],deduplicators["NatureServe"]),thisRun["stageWorkers"]["NatureServe"],1,thisRun["queueSize"])
+    ],
+    pipeline.Stage("SGCN",pipeline.sgcnStage(sgcnIndex),thisRun["stageWorkers"]["SGCN"],1,thisRun["queueSize"]),
+    pipeline.Stage("CommonProperties",pipeline.commonPropertiesStage(sgcnCommonNames),thisRun["stageWorkers"]["CommonProperties"],thisRun["stageBatchSize"]["CommonProperties"],thisRun["queueSize"])
+],thisRun["queueSize"])
+
+if thisRun["mode"] == "refresh":
+    refreshPlan = refresh.scheduleRefresh(thisRun["baseURL"],thisRun["requestBudget"])
+    print (refresh.planSummary(refreshPlan))
+    recordsToProcess = refresh.refreshRecords(thisRun["baseURL"],refreshPlan[:thisRun["totalRecordsToProcess"]],thisRun["pageSize"])
+else:
+    recordsToProcess = pipeline.pendingRecords(thisRun["baseURL"],thisRun["pageSize"],thisRun["totalRecordsToProcess"])
+
+# Write each bucket as its record comes out of the end of the pipeline
+for record in tirPipeline.run(recordsToProcess):
+    if thisRun["verbosity"] > 0:
+        display (record)
+    if thisRun["commitToDB"]:
+        changedBuckets = refresh.changedBuckets(record)
+        for bucket in record["updated"]:
+            if bucket in changedBuckets:
+                tirWriters[bucket].write(record["id"],{bucket:pipeline.bucketValue(record,bucket)})
+            else:
+                dateWriters[bucket].write(record["id"],refresh.cacheDate(record,bucket))
+        if "common" in record and len(changedBuckets) > 0:
+            tirCommon = dict(record["common"])
+            tirWriters["common"].write(tirCommon.pop("id"),tirCommon)
+    thisRun["totalRecordsProcessed"] = thisRun["totalRecordsProcessed"] + 1
+    runMetrics.recordProcessed(record["common"]["matchmethod"] if "common" in record else "Incomplete")
+
+# Flush anything left in the write buffers and show the results of caching and what each stage did
+if thisRun["commitToDB"]:
+    for bucket,tirWriter in tirWriters.items():
+        print (bucket,tirWriter.close())
+    for bucket,dateWriter in dateWriters.items():
+        print (bucket+" dates",dateWriter.close())
+print (tirPipeline.summary())
+
+runMetrics.export(thisRun["metricsFile"]+".json")
+runMetrics.export(thisRun["metricsFile"]+".prom")
+print (runMetrics.summary())
+print (ratelimit.summary())
+
+
+# In[ ]:
+
+
+
@@ -0,0 +1,112 @@
+
+# coding: utf-8
+
+# This runs one of the TIR processors (ITIS, WoRMS, TESS or NatureServe) as a worker on the Kafka message queue, following on the move toward a microservices architecture described in the readme. A worker consumes the events for its processor, looks up a batch of them the same way the processor script and TIR Pipeline do, writes its bucket to the TIR and sends the enriched registrations on to the next processor, committing its place in the queue only once the writes are done. Run as many copies of a worker as needed on different nodes; they share the work out between them. Setting publishPending sends the registrations in the TIR that are still missing something out to the ITIS workers to get things started.
+
+# In[1]:
+
+from bis2 import gc2
+from bis2 import natureserve as natureservekeys
+from tirutils import writer
+from tirutils import metrics
+from tirutils import journal
+from tirutils import workers
+from tirutils import ratelimit
+from tirutils import dedup
+from tirutils import lookups
+from tirutils import names
+from tirutils import pipeline
+from tirutils import messaging
+from tirutils import fuzzynames
+from tirutils import sessions
+from tirutils import responsecache
+
+
+# In[2]:
+
+# Set up the actions/targets for this particular instance
+thisRun = {}
+thisRun["instance"] = "DataDistillery"
+thisRun["db"] = "BCB"
+thisRun["baseURL"] = gc2.sqlAPI(thisRun["instance"],thisRun["db"])
+# ITIS, WoRMS, TESS or NatureServe
+thisRun["processor"] = "ITIS"
+thisRun["kafkaServers"] = "localhost:9092"
+thisRun["publishPending"] = False
+thisRun["pageSize"] = 500
+# Stop once there is nothing left to do instead of waiting for more registrations
+thisRun["stopWhenIdle"] = True
+# Seconds to wait for events before deciding there is nothing left (long enough for the consumer to join its group)
+thisRun["pollSeconds"] = 10
+thisRun["totalRecordsToProcess"] = None
+thisRun["batchSize"] = 100
+thisRun["itisBatchSize"] = 100
+# Lookups run at the same time within a batch (ITIS batches its own Solr queries, so it looks a batch up as one)
+thisRun["maxWorkers"] = 8
+thisRun["localFuzzy"] = True
+thisRun["metricsFile"] = "metrics/Worker"+thisRun["processor"]
+thisRun["hostLimit"] = 4
+# Requests per second to each service (None for no limit); requests in flight adapt between 1 and hostLimit
+thisRun["requestRate"] = None
+thisRun["responseCache"] = "cache/responses.sqlite"
+thisRun["responseCacheTTL"] = 2592000
+thisRun["wormsNameService"] = "http://www.marinespecies.org/rest/AphiaRecordsByName/"
+thisRun["wormsIDService"] = "http://www.marinespecies.org/rest/AphiaRecordByAphiaID/"
+thisRun["natureServeSpeciesAPI"] = natureservekeys.speciesAPI()
+
+# Some TESS documents with long lists of refuges cause problems in caching, so we retry those without that property
+# (on a copy, since records with the same name share their TESS document)
+def retryWithoutRefuges(recordID,values,message):
+    if "REFUGE_OCCURRENCE" in values["tess"]:
+        tessJSON = {key:value for key,value in values["tess"].items() if key != "REFUGE_OCCURRENCE"}
+        tirWriter.write(recordID,dict(values,tess=tessJSON))
+
+broker = messaging.KafkaBroker(thisRun["kafkaServers"])
+if thisRun["publishPending"]:
+    print (messaging.publishRegistrations(broker,pipeline.pendingRecords(thisRun["baseURL"],thisRun["pageSize"])))
+
+runMetrics = metrics.startRun("Worker"+thisRun["processor"])
+metrics.setUpstreamName(thisRun["baseURL"],"GC2")
+runMetrics.addCache("names",names.memo)
+for host in [lookups.itisHost,lookups.wormsHost,lookups.tessHost,lookups.natureServeHost]:
+    workers.setHostLimit(host,thisRun["hostLimit"])
+    ratelimit.configure(host,rate=thisRun["requestRate"],maxConcurrency=thisRun["hostLimit"])
+sessions.configure(poolSize=thisRun["hostLimit"])
+responseCache = responsecache.openCache(thisRun["responseCache"],thisRun["responseCacheTTL"])
+runMetrics.addCache("responses",responseCache)
+journal.ensureJournal(thisRun["baseURL"])
+
+if thisRun["processor"] == "ITIS":
+    itisNames = fuzzynames.loadITISNames(thisRun["baseURL"]) if thisRun["localFuzzy"] else None
+    processFunction = pipeline.itisStage(thisRun["itisBatchSize"],None,itisNames)
+    tirWriter = writer.TIRWriter(thisRun["baseURL"],{"itis":"json"},thisRun["batchSize"],journalBucket="itis")
+elif thisRun["processor"] == "WoRMS":
+    wormsNames = fuzzynames.loadWoRMSNames(thisRun["baseURL"]) if thisRun["localFuzzy"] else None
+    deduplicator = dedup.Deduplicator(dedup.wormsKey)
+    processFunction = pipeline.wormsStage(thisRun["wormsNameService"],thisRun["wormsIDService"],wormsNames,deduplicator)
+    tirWriter = writer.TIRWriter(thisRun["baseURL"],{"worms":"json"},thisRun["batchSize"],journalBucket="worms")
+elif thisRun["processor"] == "TESS":
+    deduplicator = dedup.Deduplicator(dedup.tessKey)
+    processFunction = pipeline.tessStage(deduplicator)
+    tirWriter = writer.TIRWriter(thisRun["baseURL"],{"tess":"json"},thisRun["batchSize"],onFailure=retryWithoutRefuges)
+elif thisRun["processor"] == "NatureServe":
+    deduplicator = dedup.Deduplicator(dedup.natureServeKey)
+    processFunction = pipeline.natureServeStage(thisRun["natureServeSpeciesAPI"],deduplicator)
+    tirWriter = writer.TIRWriter(thisRun["baseURL"],{"natureserve":"json"},thisRun["batchSize"])
+if thisRun["processor"] != "ITIS":
+    runMetrics.addCache("dedup",deduplicator)
+
+worker = messaging.ProcessorWorker(broker,thisRun["processor"],processFunction,tirWriter,thisRun["batchSize"],thisRun["pollSeconds"],runMetrics=runMetrics,maxWorkers=thisRun["maxWorkers"] if thisRun["processor"] != "ITIS" else 1)
+print (worker.run(thisRun["totalRecordsToProcess"],(lambda: True) if thisRun["stopWhenIdle"] else None))
+print (tirWriter.summary())
+
+runMetrics.export(thisRun["metricsFile"]+".json")
+runMetrics.export(thisRun["metricsFile"]+".prom")
+print (runMetrics.summary())
+print (ratelimit.summary())
+
+
+# In[ ]:
+
+
+
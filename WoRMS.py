@@ -1,7 +1,7 @@
 
 # coding: utf-8
 
-# Like all of the current thinking for the TIR, this code works through every registered taxa in the Taxa Information Registry and attempts to find and cache information from the World Register of Marine Species (WoRMS). It does this with a while loop to find something processable in the TIR with a safeguard on the number of records to process at a time that can be set for "thisRun".
+# Like all of the current thinking for the TIR, this code works through every registered taxa in the Taxa Information Registry and attempts to find and cache information from the World Register of Marine Species (WoRMS). It does this by paging through records that are processable in the TIR with a safeguard on the number of records to process at a time that can be set for "thisRun".
 # 
 # I also recently changed the whole data model for the TIR to accommodate JSON data structures in the different "buckets" of information we are caching rather than the key/value pairs in hstore columns. This lets us run a much more simple process here where we simply package a little bit of additional information and the eliminate (pop) a couple of properties from the WoRMS service response that we don't need/want to store. That is all handled in the worms module of the bis package with the packageWoRMSJSON function.
 # 
@@ -9,12 +9,21 @@
 
 # In[1]:
 
-import requests,re,json
 from IPython.display import display
-from bis import worms
-from bis import bis
-from bis import tir
 from bis2 import gc2
+from tirutils import claim
+from tirutils import writer
+from tirutils import metrics
+from tirutils import journal
+from tirutils import workers
+from tirutils import ratelimit
+from tirutils import runstate
+from tirutils import dedup
+from tirutils import lookups
+from tirutils import names
+from tirutils import fuzzynames
+from tirutils import sessions
+from tirutils import responsecache
 
 
 # In[8]:
@@ -27,77 +36,84 @@ thisRun["baseURL"] = gc2.sqlAPI(thisRun["instance"],thisRun["db"])
 thisRun["commitToDB"] = True
 thisRun["totalRecordsToProcess"] = 700
 thisRun["totalRecordsProcessed"] = 0
+thisRun["pageSize"] = 100
+# Pending records are grouped by the names they would be looked up with, a page of this many at a time, so that each
+# distinct name is only looked up once
+thisRun["dedupPageSize"] = 1000
+thisRun["writeBatchSize"] = 100
+thisRun["verbosity"] = 0
+thisRun["metricsFile"] = "metrics/WoRMS"
+thisRun["maxWorkers"] = 8
+thisRun["hostLimit"] = 4
+# Requests per second to the service (None for no limit); requests in flight adapt between 1 and hostLimit, and after
+# repeated failures lookups pause (up to maxPauseSeconds) instead of caching "Not Matched" for everything
+thisRun["requestRate"] = None
+thisRun["maxPauseSeconds"] = 900
+# Checkpoints and dead letters (records whose lookups keep raising) so that runs resume where they stopped, and a time
+# budget in seconds for the run (None for no limit); see tirutils/runstate.py
+thisRun["runStateFile"] = "cache/runstate/WoRMS.json"
+thisRun["maxAttempts"] = 3
+thisRun["maxSeconds"] = None
+thisRun["responseCache"] = "cache/responses.sqlite"
+thisRun["responseCacheTTL"] = 2592000
 thisRun["wormsNameService"] = "http://www.marinespecies.org/rest/AphiaRecordsByName/"
 thisRun["wormsIDService"] = "http://www.marinespecies.org/rest/AphiaRecordByAphiaID/"
-
-numberWithoutTIRData = 1
-
-while numberWithoutTIRData == 1 and thisRun["totalRecordsProcessed"] < thisRun["totalRecordsToProcess"]:
-    q_recordToSearch = "SELECT id,         registration->>'source' AS source,         registration->>'followTaxonomy' AS followtaxonomy,         registration->>'taxonomicLookupProperty' AS taxonomiclookupproperty,         registration->>'scientificname' AS scientificname,         itis->>'nameWInd' AS nameWInd,         itis->>'nameWOInd' AS nameWOInd         FROM tir.tir         WHERE worms IS NULL         LIMIT 1"
-    recordToSearch  = requests.get(gc2.sqlAPI("DataDistillery","BCB")+"&q="+q_recordToSearch).json()
-    
-    numberWithoutTIRData = len(recordToSearch["features"])
-
-    if numberWithoutTIRData == 1:
-        tirRecord = recordToSearch["features"][0]
-
-        # Set up a local data structure for storage and processing
-        thisRecord = {}
-        
-        # Set data from query results
-        thisRecord["id"] = tirRecord["properties"]["id"]
-        thisRecord["followTaxonomy"] = tirRecord["properties"]["followtaxonomy"]
-
-        thisRecord["tryNames"] = []
-        thisRecord["tryNames"].append(bis.cleanScientificName(tirRecord["properties"]["scientificname"]))
-        if tirRecord["properties"]["namewind"] is not None and tirRecord["properties"]["namewind"] not in thisRecord["tryNames"]:
-            thisRecord["tryNames"].append(tirRecord["properties"]["namewind"])
-        if tirRecord["properties"]["namewoind"] is not None and tirRecord["properties"]["namewoind"] not in thisRecord["tryNames"]:
-            thisRecord["tryNames"].append(tirRecord["properties"]["namewoind"])
-        
-        # Set defaults for thisRecord
-        thisRecord["matchMethod"] = "Not Matched"
-        wormsData = 0
-
-        # Handle cases where cleaning the Scientific Name resulted in a single blank value to search on
-        if len(thisRecord["tryNames"]) == 1 and len(thisRecord["tryNames"][0]) == 0:
-            thisRecord["matchString"] = tirRecord["properties"]["scientificname"]
-            thisRecord["tryNames"] = []
-
-        for name in thisRecord["tryNames"]:
-            # Handle the cases where there is enough interesting stuff in the scientific name string that it comes back blank from the cleaners
-            if len(name) != 0:
-                thisRecord["matchString"] = name
-                thisRecord["baseQueryURL"] = thisRun["wormsNameService"]+name
-                wormsSearchResults = requests.get(thisRecord["baseQueryURL"]+"?like=false&marine_only=false&offset=1")
-                if wormsSearchResults.status_code == 204 or wormsSearchResults.json()[0]["valid_name"] is None:
-                    wormsSearchResults = requests.get(thisRecord["baseQueryURL"]+"?like=true&marine_only=false&offset=1")
-                    if wormsSearchResults.status_code != 204 and wormsSearchResults.json()[0]["valid_name"] is not None:
-                        wormsData = wormsSearchResults.json()[0]
-                        thisRecord["matchMethod"] = "Fuzzy Match"
-                else:
-                    wormsData = wormsSearchResults.json()[0]
-                    thisRecord["matchMethod"] = "Exact Match"
-                    break
-        
-        if not type(wormsData) == int and wormsData["status"] != "accepted" and thisRecord["followTaxonomy"] == "true":
-            validAphiaID = str(wormsData["valid_AphiaID"])
-            wormsSearchResults = requests.get(thisRun["wormsIDService"]+validAphiaID)
-            if wormsSearchResults.status_code != 204 and wormsSearchResults.json()["valid_name"] is not None:
-                wormsData = wormsSearchResults.json()
-                thisRecord["matchString"] = validAphiaID
-                thisRecord["matchMethod"] = "Followed Accepted AphiaID"
-        
-        thisRecord["wormsJSON"] = worms.packageWoRMSJSON(thisRecord["matchMethod"],thisRecord["matchString"],wormsData)
-        display (thisRecord)
+# Try fuzzy matches against the WoRMS names already cached in the TIR before running like=true searches
+thisRun["localFuzzy"] = True
+
+q_selectColumns = "registration->>'source' AS source, registration->>'followTaxonomy' AS followtaxonomy, registration->>'taxonomicLookupProperty' AS taxonomiclookupproperty, registration->>'scientificname' AS scientificname, itis->>'nameWInd' AS nameWInd, itis->>'nameWOInd' AS nameWOInd"
+q_whereClause = "worms IS NULL"
+
+runMetrics = metrics.startRun("WoRMS")
+metrics.setUpstreamName(thisRun["baseURL"],"GC2")
+runMetrics.addCache("names",names.memo)
+workers.setHostLimit(lookups.wormsHost,thisRun["hostLimit"])
+ratelimit.configure(lookups.wormsHost,rate=thisRun["requestRate"],maxConcurrency=thisRun["hostLimit"])
+sessions.configure(poolSize=thisRun["hostLimit"])
+responseCache = responsecache.openCache(thisRun["responseCache"],thisRun["responseCacheTTL"])
+runMetrics.addCache("responses",responseCache)
+deduplicator = dedup.Deduplicator(dedup.wormsKey,thisRun["dedupPageSize"])
+runMetrics.addCache("dedup",deduplicator)
+journal.ensureJournal(thisRun["baseURL"])
+nameIndex = None
+if thisRun["localFuzzy"]:
+    nameIndex = fuzzynames.loadWoRMSNames(thisRun["baseURL"])
+runState = runstate.RunState(thisRun["runStateFile"],thisRun["maxAttempts"],thisRun["maxSeconds"],thisRun["totalRecordsToProcess"],thisRun["commitToDB"])
+tirWriter = writer.TIRWriter(thisRun["baseURL"],{"worms":"json"},thisRun["writeBatchSize"],journalBucket="worms",onFlush=runState.flushed)
+
+# Lookups pause while the service's circuit is open, and records that keep failing become dead letters
+lookupFunction = runState.guard(ratelimit.pausing(lambda tirRecord: lookups.lookupWoRMS(tirRecord,thisRun["wormsNameService"],thisRun["wormsIDService"],nameIndex),thisRun["maxPauseSeconds"]))
+# Registrations still to do, starting from the last checkpoint
+pendingRecords = runState.records(claim.pendingRecords(thisRun["baseURL"],q_selectColumns,q_whereClause,thisRun["pageSize"],None,runState.cursor))
+
+try:
+    for thisRecord in deduplicator.process(lookupFunction,pendingRecords,thisRun["maxWorkers"],runState.unresolved):
+        # Records whose lookup raised (along with the rest of their group) are in the dead letters
+        if thisRecord is None:
+            continue
+        if thisRun["verbosity"] > 0:
+            display (thisRecord)
         if thisRun["commitToDB"]:
-            print (tir.cacheToTIR(gc2.sqlAPI("DataDistillery","BCB"),thisRecord["id"],"worms",json.dumps(thisRecord["wormsJSON"])))
+            tirWriter.write(thisRecord["id"],{"worms":thisRecord["wormsJSON"]})
+        else:
+            runState.settle([thisRecord["id"]])
         thisRun["totalRecordsProcessed"] = thisRun["totalRecordsProcessed"] + 1
+        runMetrics.recordProcessed(thisRecord["matchMethod"])
+finally:
+    # Flush anything left in the write buffer and checkpoint, even when the run stops on an error
+    if thisRun["commitToDB"]:
+        print (tirWriter.close())
+    print (runState.finish())
+
+runMetrics.export(thisRun["metricsFile"]+".json")
+runMetrics.export(thisRun["metricsFile"]+".prom")
+print (runMetrics.summary())
+print (ratelimit.summary())
 
 
 # In[4]:
 
-print ("Number without WoRMS: "+str(requests.get(gc2.sqlAPI("DataDistillery","BCB")+"&q=SELECT count(*) AS num FROM tir.tir WHERE worms IS NULL").json()["features"][0]["properties"]["num"]))
+print ("Number without WoRMS: "+str(claim.countPending(thisRun["baseURL"],q_whereClause)))
 
 
 # In[ ]:
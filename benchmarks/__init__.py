@@ -0,0 +1,3 @@
+# Offline benchmarks for the TIR processors. Local stand-ins for GC2, ITIS Solr, WoRMS, TESS and NatureServe run a
+# synthetic tir.tir through the same tirutils code the processor scripts use so that throughput changes can be
+# measured before anything is pointed at production. See benchmarks/run.py.
@@ -0,0 +1,120 @@
+# A stand-in for the GC2 SQL API backed by SQLite. The tir and sgcn schemas are attached SQLite databases so that
+# "tir.tir", "tir.journal" and "sgcn.sgcn" work as table names, and the handful of PostgreSQL constructs the TIR code
+# sends (json ->> operators and json_extract_path_text, :: casts, UPDATE ... FROM (VALUES ...) AS v(...), setting a key
+# with jsonb || jsonb_build_object, array_agg and the journal DDL) are translated before running. Reads come back as
+# GeoJSON-ish features and writes as success/message the way GC2 answers them.
+
+import os,re,json,sqlite3,threading
+
+tirColumns = ["id","registration","itis","worms","tess","natureserve","sgcn","source","scientificname","commonname","authorityid","rank","taxonomicgroup","matchmethod","cachedate"]
+sgcnColumns = ["scientificname","taxonomicgroup","state","year","commonname"]
+
+
+def pgText(bucket,key):
+    # What PostgreSQL gives back for bucket->>'key' on a json column
+    if bucket is None:
+        return None
+    value = json.loads(bucket).get(key)
+    if value is None:
+        return None
+    if isinstance(value,bool):
+        return "true" if value else "false"
+    if isinstance(value,(dict,list)):
+        return json.dumps(value)
+    return str(value)
+
+
+def pgPathText(bucket,*path):
+    # What PostgreSQL gives back for json_extract_path_text(bucket,'key',...) on a json column
+    if bucket is None:
+        return None
+    value = json.loads(bucket)
+    for key in path:
+        if isinstance(value,list) and key.isdigit() and int(key) < len(value):
+            value = value[int(key)]
+        elif isinstance(value,dict):
+            value = value.get(key)
+        else:
+            return None
+    return pgText(json.dumps({"value":value}),"value")
+
+
+def translateValues(match):
+    columns = [column.strip() for column in match.group(3).split(",")]
+    selectList = ", ".join(["column"+str(index+1)+" AS "+column for index,column in enumerate(columns)])
+    return "(SELECT "+selectList+" FROM (VALUES "+match.group(1)+")) AS "+match.group(2)
+
+
+def translateSQL(q):
+    # Turn the PostgreSQL the TIR code sends into something SQLite will run
+    q = re.sub(r"\(VALUES (.*)\) AS (\w+)\(([^)]*)\)",translateValues,q,flags=re.DOTALL)
+    q = re.sub(r"(\w+)->>'([^']+)'",r"pgtext(\1,'\2')",q)
+    q = re.sub(r"\(([\w.]+)::jsonb \|\| jsonb_build_object\('([^']+)',([\w.]+)\)\)::json",r"json_set(\1,'$.\2',\3)",q)
+    q = re.sub(r"::\w+(\[\])?","",q)
+    q = re.sub(r"array_to_string\(array_agg\(DISTINCT (\w+)\),','\)",r"group_concat(DISTINCT \1)",q)
+    q = q.replace("bigserial PRIMARY KEY","INTEGER PRIMARY KEY AUTOINCREMENT")
+    q = q.replace("now()","CURRENT_TIMESTAMP")
+    return q
+
+
+class FakeGC2:
+
+    def __init__(self,dataDir):
+        os.makedirs(dataDir,exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(":memory:",check_same_thread=False)
+        self.db.create_function("pgtext",2,pgText,deterministic=True)
+        self.db.create_function("json_extract_path_text",-1,pgPathText,deterministic=True)
+        self.db.execute("ATTACH DATABASE ? AS tir",(os.path.join(dataDir,"tir.sqlite"),))
+        self.db.execute("ATTACH DATABASE ? AS sgcn",(os.path.join(dataDir,"sgcn.sqlite"),))
+        self.db.execute("CREATE TABLE IF NOT EXISTS tir.tir (id INTEGER PRIMARY KEY, "+", ".join([column+" TEXT" for column in tirColumns[1:]])+")")
+        self.db.execute("CREATE TABLE IF NOT EXISTS sgcn.sgcn (scientificname TEXT, taxonomicgroup TEXT, state TEXT, year INTEGER, commonname TEXT)")
+        self.db.commit()
+        self.counts = {"selects":0,"writes":0,"errors":0}
+
+    def execute(self,q):
+        with self.lock:
+            try:
+                cursor = self.db.execute(translateSQL(q))
+                if cursor.description is None:
+                    self.db.commit()
+                    self.counts["writes"] = self.counts["writes"] + 1
+                    return 200,{"success":True,"message":"Statement succeeded.","affected_rows":cursor.rowcount}
+                # PostgreSQL folds unquoted aliases to lower case (e.g. "AS nameWInd" comes back as namewind)
+                columns = [column[0].lower() for column in cursor.description]
+                rows = cursor.fetchall()
+                self.counts["selects"] = self.counts["selects"] + 1
+                return 200,{"success":True,"features":[{"type":"Feature","properties":dict(zip(columns,row))} for row in rows]}
+            except sqlite3.Error as e:
+                self.db.rollback()
+                self.counts["errors"] = self.counts["errors"] + 1
+                return 400,{"success":False,"message":str(e)}
+
+    def responder(self,method,path,params):
+        # Responder for a FakeService; the statement comes in as the q parameter on a GET or POST
+        q = dict(params).get("q")
+        if q is None:
+            return 400,{"success":False,"message":"No q parameter"}
+        return self.execute(q)
+
+    def loadTIR(self,rows):
+        # Bulk load tir.tir from dictionaries of column values (buckets as dictionaries or JSON strings)
+        with self.lock:
+            self.db.executemany(
+                "INSERT INTO tir.tir ("+",".join(tirColumns)+") VALUES ("+",".join(["?"]*len(tirColumns))+")",
+                [[json.dumps(row[column]) if isinstance(row.get(column),(dict,list)) else row.get(column) for column in tirColumns] for row in rows]
+            )
+            self.db.commit()
+
+    def loadSGCN(self,rows):
+        with self.lock:
+            self.db.executemany("INSERT INTO sgcn.sgcn ("+",".join(sgcnColumns)+") VALUES (?,?,?,?,?)",[[row.get(column) for column in sgcnColumns] for row in rows])
+            self.db.commit()
+
+    def summary(self):
+        with self.lock:
+            return dict(self.counts)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,159 @@
+# Local HTTP stand-ins for the upstream services. Each FakeService runs a threaded HTTP server on localhost that
+# answers from recorded responses when it has one for a request and from a responder function otherwise. Latency
+# (with jitter), server errors (503) and no content (204) responses can be mixed in at configurable rates, and the
+# service counts what it was asked for and what it sent back. GET responses carry an ETag of their content, and a
+# request whose If-None-Match still matches gets a 304 Not Modified with no body.
+#
+# Recorded responses can be loaded from a response cache built by a live run (cache/responses.sqlite) so that the
+# ITIS and WoRMS stand-ins give back real documents for the names they have seen.
+
+import json,time,random,hashlib,sqlite3,threading
+from urllib.parse import urlparse,parse_qsl,urlencode
+from http.server import ThreadingHTTPServer,BaseHTTPRequestHandler
+from collections import Counter
+from tirutils import responsecache
+
+
+def loadRecordings(cachePath,host):
+    # Pull the cached GET responses for one upstream host out of a response cache, keyed on path and query
+    recordings = {}
+    db = sqlite3.connect(cachePath)
+    for key,value in db.execute("SELECT key, value FROM cache WHERE key LIKE ?",("%://"+host+"/%",)):
+        parsedKey = urlparse(key)
+        recordings[requestKey(parsedKey.path,parse_qsl(parsedKey.query,keep_blank_values=True))] = json.loads(value)
+    db.close()
+    return recordings
+
+
+def requestKey(path,params):
+    return responsecache.normalizeURL("http://recorded"+path+"?"+urlencode(params))
+
+
+class FakeService:
+
+    def __init__(self,name,responder,latency=0.0,jitter=0.0,errorRate=0.0,noContentRate=0.0,recordings=None,seed=0):
+        # responder is a function of (method, path, params) that returns (status code, body) where the body is
+        # anything that can be dumped to JSON, or None for no content
+        self.name = name
+        self.responder = responder
+        self.latency = latency
+        self.jitter = jitter
+        self.errorRate = errorRate
+        self.noContentRate = noContentRate
+        self.recordings = recordings if recordings is not None else {}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:"+str(self.server.server_address[1])
+
+    def start(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1",0),self.handlerClass())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever,daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self,excType,excValue,traceback):
+        self.stop()
+
+    def roll(self):
+        with self.lock:
+            return self.random.random()
+
+    def delay(self):
+        if self.latency > 0 or self.jitter > 0:
+            with self.lock:
+                thisDelay = self.latency+self.random.uniform(-self.jitter,self.jitter)
+            time.sleep(max(thisDelay,0))
+
+    def respond(self,method,path,params):
+        # Work out the status and body for a request, counting what we send back
+        with self.lock:
+            self.counts["requests"] += 1
+        self.delay()
+
+        if self.errorRate > 0 and self.roll() < self.errorRate:
+            status,body = 503,{"error":"Service Unavailable"}
+        elif self.noContentRate > 0 and self.roll() < self.noContentRate:
+            status,body = 204,None
+        elif method == "GET" and requestKey(path,params) in self.recordings:
+            recording = self.recordings[requestKey(path,params)]
+            status,body = recording["status_code"],recording["body"]
+            with self.lock:
+                self.counts["recorded"] += 1
+        else:
+            status,body = self.responder(method,path,params)
+
+        with self.lock:
+            self.counts[str(status)] += 1
+        return status,body
+
+    def handlerClass(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Send headers and body in one write without Nagle delays so the stand-in adds only the latency we ask for
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def handle(self):
+                # Clients dropping keep-alive connections at shutdown are expected here
+                try:
+                    super().handle()
+                except ConnectionError:
+                    pass
+
+            def log_message(self,format,*args):
+                pass
+
+            def answer(self,method,params):
+                parsedPath = urlparse(self.path)
+                params = parse_qsl(parsedPath.query,keep_blank_values=True)+params
+                status,body = service.respond(method,parsedPath.path,params)
+                content = b"" if status == 204 or body is None else json.dumps(body).encode("utf-8")
+                etag = None
+                if method == "GET" and status == 200:
+                    etag = '"'+hashlib.sha1(content).hexdigest()+'"'
+                    if self.headers.get("If-None-Match") == etag:
+                        status,content = 304,b""
+                        with service.lock:
+                            service.counts["notModified"] += 1
+                self.send_response(status)
+                self.send_header("Content-Type","application/json")
+                if etag is not None:
+                    self.send_header("ETag",etag)
+                self.send_header("Content-Length",str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_GET(self):
+                self.answer("GET",[])
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length",0))
+                self.answer("POST",parse_qsl(self.rfile.read(length).decode("utf-8"),keep_blank_values=True))
+
+        return Handler
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+
+    def summary(self):
+        with self.lock:
+            return dict(self.counts)
@@ -0,0 +1,552 @@
+# Benchmark the TIR processors offline. This builds a synthetic tir.tir in a SQLite backed stand-in for the GC2 SQL
+# API, starts local stand-ins for ITIS Solr, WoRMS, TESS and NatureServe with configurable latency, error and no
+# content rates, points the sessions layer at them and then runs the processors in pipeline order (ITIS, WoRMS, TESS,
+# NatureServe, SGCN, TIR Common Properties) the same way the processor scripts do. It reports records per second,
+# requests per upstream (as the client saw them and as the stand-in services counted them) and write totals for
+# each processor.
+#
+#   python -m benchmarks.run --rows 10000 --latency 0.05 --error-rate 0.01 --no-content-rate 0.02
+#
+# TESS and NatureServe lookups are made inside the bis package, which we can't point somewhere else, so for the
+# benchmark those calls are swapped for small clients that send equivalent requests to the stand-ins through the
+# sessions layer. Everything else (claiming, lookups, caching, writing, the journal) is the production code path.
+# Without bis installed, the functions we use from it are swapped for the approximations in benchmarks/standinbis.py.
+
+import os,json,time,argparse,threading
+from collections import Counter
+from urllib.parse import urlencode
+from tirutils import claim
+from tirutils import writer
+from tirutils import metrics
+from tirutils import journal
+from tirutils import workers
+from tirutils import ratelimit
+from tirutils import lookups
+from tirutils import names
+from tirutils import dedup
+from tirutils import pipeline
+from tirutils import refresh
+from tirutils import messaging
+from tirutils import itisbatch
+from tirutils import itissnapshot
+from tirutils import sessions
+from tirutils import sgcnindex
+from tirutils import responsecache
+from tirutils import commonproperties
+from benchmarks import synthetic
+from benchmarks import fakeservices
+from benchmarks import standinbis
+from benchmarks.fakegc2 import FakeGC2
+
+processorOrder = ["ITIS","WoRMS","TESS","NatureServe","SGCN","CommonProperties"]
+gc2Host = "gc2.benchmark"
+wormsNameService = "http://"+lookups.wormsHost+"/rest/AphiaRecordsByName/"
+wormsIDService = "http://"+lookups.wormsHost+"/rest/AphiaRecordByAphiaID/"
+natureServeSpeciesAPI = "https://"+lookups.natureServeHost+"/species"
+loadChunkSize = 10000
+
+
+def standInQueryTESS(queryType,queryValue):
+    r = sessions.get("https://"+lookups.tessHost+"/tess?"+urlencode({"type":queryType,"value":queryValue}))
+    ratelimit.raiseForStatus(lookups.tessHost,r.status_code)
+    if r.status_code != 200:
+        lookups.raiseForErrorMessage(lookups.tessHost,"TESS returned "+str(r.status_code))
+    return r.json()
+
+
+def standInQueryNatureServeID(name):
+    r = sessions.get("https://"+lookups.natureServeHost+"/nameSearch?"+urlencode({"name":name}))
+    ratelimit.raiseForStatus(lookups.natureServeHost,r.status_code)
+    if r.status_code != 200:
+        return None
+    return r.json()["elementGlobalID"]
+
+
+def standInPackageNatureServeJSON(speciesAPI,elementGlobalID):
+    r = sessions.get(speciesAPI+"?"+urlencode({"id":str(elementGlobalID)}))
+    ratelimit.raiseForStatus(lookups.natureServeHost,r.status_code)
+    if r.status_code != 200:
+        lookups.raiseForErrorMessage(lookups.natureServeHost,"NatureServe returned "+str(r.status_code))
+    return r.json()
+
+
+def installStandIns():
+    lookups.queryTESS = standInQueryTESS
+    lookups.queryNatureServeID = standInQueryNatureServeID
+    lookups.packageNatureServeJSON = standInPackageNatureServeJSON
+
+
+def startServices(taxonomy,fakeGC2,options):
+    services = {}
+    services[gc2Host] = fakeservices.FakeService("GC2",fakeGC2.responder,latency=options.gc2_latency)
+    upstreamResponders = {
+        lookups.itisHost:("ITIS Solr",synthetic.itisResponder(taxonomy)),
+        lookups.wormsHost:("WoRMS",synthetic.wormsResponder(taxonomy)),
+        lookups.tessHost:("TESS",synthetic.tessResponder(taxonomy)),
+        lookups.natureServeHost:("NatureServe",synthetic.natureServeResponder(taxonomy))
+    }
+    for seed,(host,(name,responder)) in enumerate(upstreamResponders.items()):
+        recordings = None
+        if options.recordings is not None:
+            recordings = fakeservices.loadRecordings(options.recordings,host)
+        services[host] = fakeservices.FakeService(
+            name,
+            responder,
+            latency=options.latency,
+            jitter=options.jitter,
+            errorRate=options.error_rate,
+            noContentRate=options.no_content_rate if host == lookups.wormsHost else 0,
+            recordings=recordings,
+            seed=options.seed+seed
+        )
+    for service in services.values():
+        service.start()
+    sessions.configure(hostOverrides={host:service.url for host,service in services.items()})
+    return services
+
+
+def loadSyntheticData(fakeGC2,taxonomy,numRows,seed):
+    rows = []
+    for row in synthetic.registrations(taxonomy,numRows,seed=seed):
+        rows.append(row)
+        if len(rows) >= loadChunkSize:
+            fakeGC2.loadTIR(rows)
+            fakeGC2.loadSGCN(synthetic.sgcnSubmissions(taxonomy,rows,seed=seed+row["id"]))
+            rows = []
+    if len(rows) > 0:
+        fakeGC2.loadTIR(rows)
+        fakeGC2.loadSGCN(synthetic.sgcnSubmissions(taxonomy,rows,seed=seed+numRows))
+
+
+def guarded(lookupFunction,recordErrors,errorLock):
+    # Count records whose lookup raises instead of stopping the whole benchmark
+    def guardedLookup(tirRecord):
+        try:
+            return lookupFunction(tirRecord)
+        except Exception as e:
+            with errorLock:
+                recordErrors[type(e).__name__] += 1
+            return None
+    return guardedLookup
+
+
+def runLookupProcessor(thisRun,lookupFunction,selectColumns,whereClause,columnTypes,values,matchMethod,journalBucket=None,keyFunction=None):
+    recordErrors = Counter()
+    if journalBucket is not None:
+        journal.ensureJournal(thisRun["baseURL"])
+    tirWriter = writer.TIRWriter(thisRun["baseURL"],columnTypes,thisRun["writeBatchSize"],journalBucket=journalBucket)
+    records = claim.pendingRecords(thisRun["baseURL"],selectColumns,whereClause,thisRun["pageSize"],thisRun["totalRecordsToProcess"])
+    if keyFunction is not None and thisRun["dedup"]:
+        # Look each distinct name up once, as the WoRMS, TESS and NatureServe scripts do
+        deduplicator = dedup.Deduplicator(keyFunction,thisRun["dedupPageSize"])
+        thisRun["runMetrics"].addCache("dedup",deduplicator)
+        processed = deduplicator.process(guarded(ratelimit.pausing(lookupFunction,thisRun["maxPauseSeconds"]),recordErrors,threading.Lock()),records,thisRun["maxWorkers"])
+    else:
+        processed = workers.processConcurrently(guarded(ratelimit.pausing(lookupFunction,thisRun["maxPauseSeconds"]),recordErrors,threading.Lock()),records,thisRun["maxWorkers"])
+    for thisRecord in processed:
+        if thisRecord is None:
+            continue
+        tirWriter.write(thisRecord["id"],values(thisRecord))
+        thisRun["runMetrics"].recordProcessed(matchMethod(thisRecord))
+    return {"writer":tirWriter.close(),"recordErrors":dict(recordErrors)}
+
+
+def runITIS(thisRun):
+    selectColumns = "registration->>'source' AS source, registration->>'followTaxonomy' AS followtaxonomy, registration->>'taxonomicLookupProperty' AS taxonomiclookupproperty, registration->>'scientificname' AS scientificname, registration->>'tsn' AS tsn"
+    if thisRun["itisMode"] == "record":
+        return runLookupProcessor(
+            thisRun,
+            lookups.lookupITIS,
+            selectColumns,
+            "itis IS NULL",
+            {"itis":"json"},
+            lambda thisRecord: {"itis":thisRecord["itisData"]},
+            lambda thisRecord: thisRecord["matchMethod"],
+            journalBucket="itis"
+        )
+
+    # Batched Solr queries (or a local snapshot) over a page of records at a time, as ITIS.py does
+    journal.ensureJournal(thisRun["baseURL"])
+    tirWriter = writer.TIRWriter(thisRun["baseURL"],{"itis":"json"},thisRun["writeBatchSize"],journalBucket="itis")
+    records = claim.pendingRecords(thisRun["baseURL"],selectColumns,"itis IS NULL",thisRun["itisPageSize"],thisRun["totalRecordsToProcess"])
+    for thisPage in workers.processConcurrently(ratelimit.pausing(lambda tirRecords: itisbatch.lookupITISPage(tirRecords,thisRun["itisBatchSize"],thisRun["itisSource"]),thisRun["maxPauseSeconds"]),claim.pages(records,thisRun["itisPageSize"]),thisRun["maxWorkers"]):
+        for thisRecord in thisPage:
+            tirWriter.write(thisRecord["id"],{"itis":thisRecord["itisData"]})
+            thisRun["runMetrics"].recordProcessed(thisRecord["matchMethod"])
+    return {"writer":tirWriter.close(),"recordErrors":{}}
+
+
+def runWoRMS(thisRun):
+    return runLookupProcessor(
+        thisRun,
+        lambda tirRecord: lookups.lookupWoRMS(tirRecord,wormsNameService,wormsIDService),
+        "registration->>'source' AS source, registration->>'followTaxonomy' AS followtaxonomy, registration->>'taxonomicLookupProperty' AS taxonomiclookupproperty, registration->>'scientificname' AS scientificname, itis->>'nameWInd' AS nameWInd, itis->>'nameWOInd' AS nameWOInd",
+        "worms IS NULL",
+        {"worms":"json"},
+        lambda thisRecord: {"worms":thisRecord["wormsJSON"]},
+        lambda thisRecord: thisRecord["matchMethod"],
+        journalBucket="worms",
+        keyFunction=dedup.wormsKey
+    )
+
+
+def runTESS(thisRun):
+    return runLookupProcessor(
+        thisRun,
+        lookups.lookupTESS,
+        "registration->>'scientificname' AS name_state, itis->>'itisMatchMethod' AS matchmethod_itis, itis->>'tsn' AS tsn, itis->>'acceptedTSN' AS acceptedtsn, itis->>'nameWInd' AS name_itis, worms->>'MatchMethod' AS matchmethod_worms, worms->>'valid_name' AS name_worms",
+        "tess IS NULL",
+        {"tess":"json"},
+        lambda thisRecord: {"tess":thisRecord["tessJSON"]},
+        lambda thisRecord: str(thisRecord["tessJSON"]["result"]),
+        keyFunction=dedup.tessKey
+    )
+
+
+def runNatureServe(thisRun):
+    return runLookupProcessor(
+        thisRun,
+        lambda tirRecord: lookups.lookupNatureServe(tirRecord,natureServeSpeciesAPI),
+        "registration->>'scientificname' AS name_registered, itis->>'nameWInd' AS name_itis, worms->>'valid_name' AS name_worms",
+        "natureserve IS NULL",
+        {"natureserve":"json"},
+        lambda thisRecord: {"natureserve":json.dumps(thisRecord["natureServeData"]).replace(" ","")},
+        lambda thisRecord: "Matched" if thisRecord["elementGlobalID"] is not None else "Not Matched",
+        keyFunction=dedup.natureServeKey
+    )
+
+
+def runSGCN(thisRun):
+    sgcnConfig = thisRun["sgcnConfig"]
+    sgcnIndex = sgcnindex.buildSGCNIndex(thisRun["baseURL"],sgcnConfig["swap2005Names"],sgcnConfig["tgDict"])
+
+    def annotate(tirRecord):
+        thisRecord = {}
+        thisRecord["id"] = tirRecord["properties"]["id"]
+        thisRecord["names"] = [tirRecord["properties"]["name_submitted"]]
+        if tirRecord["properties"]["name_itis"] is not None and tirRecord["properties"]["name_itis"] not in thisRecord["names"]:
+            thisRecord["names"].append(tirRecord["properties"]["name_itis"])
+        if tirRecord["properties"]["name_worms"] is not None and tirRecord["properties"]["name_worms"] not in thisRecord["names"]:
+            thisRecord["names"].append(tirRecord["properties"]["name_worms"])
+        thisRecord["annotation"] = sgcnindex.annotateSGCN(sgcnIndex,tirRecord["properties"]["name_submitted"],thisRecord["names"])
+        return thisRecord
+
+    return runLookupProcessor(
+        dict(thisRun,maxWorkers=1),
+        annotate,
+        "registration->>'scientificname' AS name_submitted, itis->>'nameWInd' AS name_itis, worms->>'valid_name' AS name_worms",
+        "registration->>'source' = 'SGCN' AND sgcn->>'dateCached' IS NULL",
+        {"sgcn":"json"},
+        lambda thisRecord: {"sgcn":thisRecord["annotation"]},
+        lambda thisRecord: None,
+        journalBucket="sgcn"
+    )
+
+
+def runCommonProperties(thisRun):
+    journal.ensureJournal(thisRun["baseURL"])
+    recordsToProcess = journal.changedRecords(thisRun["baseURL"],"registration, itis, worms, sgcn","itis IS NOT NULL AND worms IS NOT NULL",["itis","worms","sgcn"],0,thisRun["pageSize"],thisRun["totalRecordsToProcess"])
+    sgcnCommonNames = sgcnindex.loadCommonNames(thisRun["baseURL"])
+    tirWriter = writer.TIRWriter(thisRun["baseURL"],{"source":None,"scientificname":None,"commonname":None,"authorityid":None,"rank":None,"taxonomicgroup":None,"matchmethod":None,"cachedate":"timestamp"},thisRun["writeBatchSize"])
+    for tirRecordPage in claim.pages(recordsToProcess,thisRun["pageSize"]):
+        tirCommonPage = commonproperties.deriveCommonProperties(commonproperties.recordsFrame(tirRecordPage),sgcnCommonNames)
+        for tirCommon in tirCommonPage.to_dict("records"):
+            tirWriter.write(tirCommon.pop("id"),tirCommon)
+            thisRun["runMetrics"].recordProcessed(tirCommon["matchmethod"])
+    return {"writer":tirWriter.close(),"recordErrors":{}}
+
+
+def runPipeline(thisRun,refreshBudget=None):
+    # Every processor at once through pipeline.Pipeline, the way TIR Pipeline.py runs them (in refresh mode when given
+    # a request budget)
+    sgcnConfig = thisRun["sgcnConfig"]
+    sgcnIndex = sgcnindex.buildSGCNIndex(thisRun["baseURL"],sgcnConfig["swap2005Names"],sgcnConfig["tgDict"])
+    sgcnCommonNames = sgcnindex.loadCommonNames(thisRun["baseURL"])
+    deduplicators = {}
+    if thisRun["dedup"]:
+        deduplicators = {"WoRMS":dedup.Deduplicator(dedup.wormsKey),"TESS":dedup.Deduplicator(dedup.tessKey),"NatureServe":dedup.Deduplicator(dedup.natureServeKey)}
+        for name,deduplicator in deduplicators.items():
+            thisRun["runMetrics"].addCache("dedup"+name,deduplicator)
+
+    journal.ensureJournal(thisRun["baseURL"])
+    tirWriters = {}
+    for bucket in pipeline.buckets:
+        tirWriters[bucket] = writer.TIRWriter(thisRun["baseURL"],{bucket:"json"},thisRun["writeBatchSize"],journalBucket=bucket if bucket in ["itis","worms","sgcn"] else None)
+    tirWriters["common"] = writer.TIRWriter(thisRun["baseURL"],{"source":None,"scientificname":None,"commonname":None,"authorityid":None,"rank":None,"taxonomicgroup":None,"matchmethod":None,"cachedate":"timestamp"},thisRun["writeBatchSize"])
+    dateWriters = {bucket:writer.CacheDateWriter(thisRun["baseURL"],bucket,dateKey,thisRun["writeBatchSize"]) for bucket,dateKey in refresh.dateKeys.items()}
+
+    tirPipeline = pipeline.Pipeline([
+        pipeline.Stage("ITIS",pipeline.itisStage(thisRun["itisBatchSize"],thisRun["itisSource"]),2,thisRun["itisPageSize"],thisRun["queueSize"]),
+        pipeline.Stage("WoRMS",pipeline.wormsStage(wormsNameService,wormsIDService,None,deduplicators.get("WoRMS")),thisRun["maxWorkers"],1,thisRun["queueSize"]),
+        [
+            pipeline.Stage("TESS",pipeline.tessStage(deduplicators.get("TESS")),thisRun["maxWorkers"],1,thisRun["queueSize"]),
+            pipeline.Stage("NatureServe",pipeline.natureServeStage(natureServeSpeciesAPI,deduplicators.get("NatureServe")),thisRun["maxWorkers"],1,thisRun["queueSize"])
+        ],
+        pipeline.Stage("SGCN",pipeline.sgcnStage(sgcnIndex),1,1,thisRun["queueSize"]),
+        pipeline.Stage("CommonProperties",pipeline.commonPropertiesStage(sgcnCommonNames),1,thisRun["pageSize"],thisRun["queueSize"])
+    ],thisRun["queueSize"])
+
+    if refreshBudget is not None:
+        # Refresh runs revalidate cached responses older than a short time to live, as TIR Pipeline does
+        if responsecache.activeCache is not None:
+            responsecache.activeCache.ttlSeconds = thisRun["refreshCacheTTL"]
+        refreshPlan = refresh.scheduleRefresh(thisRun["baseURL"],refreshBudget)
+        print ("Refresh plan "+json.dumps(refresh.planSummary(refreshPlan)))
+        recordsToProcess = refresh.refreshRecords(thisRun["baseURL"],refreshPlan[:thisRun["totalRecordsToProcess"]],thisRun["pageSize"])
+    else:
+        recordsToProcess = pipeline.pendingRecords(thisRun["baseURL"],thisRun["pageSize"],thisRun["totalRecordsToProcess"])
+
+    recordErrors = Counter()
+    unchanged = Counter()
+    for record in tirPipeline.run(recordsToProcess):
+        changedBuckets = refresh.changedBuckets(record)
+        for bucket in record["updated"]:
+            if bucket in changedBuckets:
+                tirWriters[bucket].write(record["id"],{bucket:pipeline.bucketValue(record,bucket)})
+            else:
+                dateWriters[bucket].write(record["id"],refresh.cacheDate(record,bucket))
+                unchanged[bucket] += 1
+        if "common" in record and len(changedBuckets) > 0:
+            tirCommon = dict(record["common"])
+            tirWriters["common"].write(tirCommon.pop("id"),tirCommon)
+        for stage in record["errors"]:
+            recordErrors[stage] += 1
+        thisRun["runMetrics"].recordProcessed(record["common"]["matchmethod"] if "common" in record else "Incomplete")
+
+    writerTotals = {"written":0,"failed":0,"batches":0}
+    for tirWriter in list(tirWriters.values())+list(dateWriters.values()):
+        writerSummary = tirWriter.close()
+        for total in writerTotals:
+            writerTotals[total] = writerTotals[total]+writerSummary[total]
+    return {"writer":writerTotals,"recordErrors":dict(recordErrors),"stages":tirPipeline.summary(),"unchanged":dict(unchanged)}
+
+
+def runMessaging(thisRun):
+    # The ITIS, WoRMS, TESS and NatureServe workers from TIR Worker.py on threads sharing a LocalBroker, each stopping
+    # once the workers it depends on are done and it has nothing left to consume
+    broker = messaging.LocalBroker(thisRun["numPartitions"])
+    numPublished = messaging.publishRegistrations(broker,pipeline.pendingRecords(thisRun["baseURL"],thisRun["pageSize"],thisRun["totalRecordsToProcess"]))
+    journal.ensureJournal(thisRun["baseURL"])
+
+    def newDeduplicator(keyFunction):
+        if not thisRun["dedup"]:
+            return None
+        return dedup.Deduplicator(keyFunction)
+
+    processFunctions = {
+        "ITIS":lambda: pipeline.itisStage(thisRun["itisBatchSize"],thisRun["itisSource"]),
+        "WoRMS":lambda: pipeline.wormsStage(wormsNameService,wormsIDService,None,newDeduplicator(dedup.wormsKey)),
+        "TESS":lambda: pipeline.tessStage(newDeduplicator(dedup.tessKey)),
+        "NatureServe":lambda: pipeline.natureServeStage(natureServeSpeciesAPI,newDeduplicator(dedup.natureServeKey))
+    }
+    dependsOn = {"ITIS":[],"WoRMS":["ITIS"],"TESS":["WoRMS"],"NatureServe":["WoRMS"]}
+
+    done = {processor:threading.Event() for processor in processFunctions}
+    processorWorkers = {}
+    threads = []
+    for processor,processFunction in processFunctions.items():
+        bucket = messaging.processors[processor]["bucket"]
+        processorWorkers[processor] = []
+        for index in range(thisRun["workersPerProcessor"]):
+            tirWriter = writer.TIRWriter(thisRun["baseURL"],{bucket:"json"},thisRun["writeBatchSize"],journalBucket=bucket if bucket in ["itis","worms"] else None)
+            processorWorkers[processor].append(messaging.ProcessorWorker(broker,processor,processFunction(),tirWriter,thisRun["writeBatchSize"],0.1,runMetrics=thisRun["runMetrics"],maxWorkers=thisRun["maxWorkers"] if processor != "ITIS" else 1))
+
+    def runWorkers(processor):
+        workerThreads = [threading.Thread(target=worker.run,args=(None,lambda: all([done[upstream].is_set() for upstream in dependsOn[processor]]))) for worker in processorWorkers[processor]]
+        for thread in workerThreads:
+            thread.start()
+        for thread in workerThreads:
+            thread.join()
+        done[processor].set()
+
+    for processor in processFunctions:
+        threads.append(threading.Thread(target=runWorkers,args=(processor,)))
+        threads[-1].start()
+    for thread in threads:
+        thread.join()
+
+    writerTotals = {"written":0,"failed":0,"batches":0}
+    workerTotals = {}
+    for processor,processorWorkerList in processorWorkers.items():
+        workerTotals[processor] = Counter()
+        for worker in processorWorkerList:
+            workerTotals[processor].update(worker.summary())
+            for total in writerTotals:
+                writerTotals[total] = writerTotals[total]+worker.tirWriter.summary()[total]
+    stages = {"Registrations":{"produced":numPublished}}
+    stages.update({processor:dict(totals) for processor,totals in workerTotals.items()})
+    return {"writer":writerTotals,"recordErrors":{},"stages":stages}
+
+
+processorFunctions = {
+    "ITIS":runITIS,
+    "WoRMS":runWoRMS,
+    "TESS":runTESS,
+    "NatureServe":runNatureServe,
+    "SGCN":runSGCN,
+    "CommonProperties":runCommonProperties,
+    "Pipeline":runPipeline,
+    "Messaging":runMessaging,
+    "Refresh":lambda thisRun: runPipeline(thisRun,thisRun["refreshBudget"])
+}
+
+
+def benchmarkProcessor(processor,thisRun,services):
+    for service in services.values():
+        service.reset()
+    thisRun["runMetrics"] = metrics.startRun(processor)
+    metrics.setUpstreamName(thisRun["baseURL"],"GC2")
+    thisRun["runMetrics"].addCache("names",names.memo)
+    if responsecache.activeCache is not None:
+        thisRun["runMetrics"].addCache("responses",responsecache.activeCache)
+
+    started = time.time()
+    result = processorFunctions[processor](thisRun)
+    elapsed = time.time()-started
+
+    runSummary = thisRun["runMetrics"].summary()
+    report = {}
+    report["processor"] = processor
+    report["records"] = runSummary["records"]
+    report["elapsedSeconds"] = round(elapsed,3)
+    report["recordsPerSecond"] = round(runSummary["records"]/elapsed,2) if elapsed > 0 else 0
+    report["requests"] = {name:thisUpstream["requests"] for name,thisUpstream in runSummary["upstream"].items()}
+    report["requestErrors"] = {name:thisUpstream["errors"] for name,thisUpstream in runSummary["upstream"].items()}
+    report["retries"] = runSummary["retries"]
+    report["served"] = {service.name:service.summary() for service in services.values() if service.summary().get("requests",0) > 0}
+    report["matchMethods"] = runSummary["matchMethods"]
+    report["written"] = result["writer"]["written"]
+    report["failed"] = result["writer"]["failed"]
+    report["batches"] = result["writer"]["batches"]
+    report["recordErrors"] = result["recordErrors"]
+    report["caches"] = runSummary["caches"]
+    if "stages" in result:
+        report["stages"] = result["stages"]
+    if "unchanged" in result:
+        report["unchanged"] = result["unchanged"]
+    return report
+
+
+def parseOptions(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark the TIR processors against local stand-in services")
+    parser.add_argument("--rows",type=int,default=10000,help="number of synthetic tir.tir registrations")
+    parser.add_argument("--names",type=int,default=None,help="number of distinct names in the synthetic taxonomy (default a quarter of the rows)")
+    parser.add_argument("--processors",default=",".join(processorOrder),help="comma separated processors to run, in pipeline order")
+    parser.add_argument("--latency",type=float,default=0.05,help="seconds of latency added by the upstream stand-ins")
+    parser.add_argument("--jitter",type=float,default=0.01,help="plus or minus seconds of latency jitter")
+    parser.add_argument("--gc2-latency",type=float,default=0.01,help="seconds of latency added by the GC2 stand-in")
+    parser.add_argument("--error-rate",type=float,default=0.0,help="fraction of upstream requests answered with a 503")
+    parser.add_argument("--no-content-rate",type=float,default=0.0,help="fraction of WoRMS requests answered with a 204 on top of unknown names")
+    parser.add_argument("--recordings",default=None,help="response cache (e.g. cache/responses.sqlite) to replay recorded ITIS and WoRMS responses from")
+    parser.add_argument("--response-cache",default=None,help="response cache to use during the run (none by default, so every lookup goes upstream)")
+    parser.add_argument("--pipeline",action="store_true",help="run everything through one pipeline (as TIR Pipeline.py does) instead of one processor after another")
+    parser.add_argument("--messaging",action="store_true",help="run the ITIS, WoRMS, TESS and NatureServe workers (as TIR Worker.py does) against an in-process message broker")
+    parser.add_argument("--workers-per-processor",type=int,default=2,help="message workers in each processor's consumer group")
+    parser.add_argument("--partitions",type=int,default=4,help="partitions per topic on the in-process message broker")
+    parser.add_argument("--refresh-budget",type=int,default=None,help="after the processors, run a refresh (as TIR Pipeline.py does in refresh mode) with this request budget")
+    parser.add_argument("--refresh-cache-ttl",type=int,default=0,help="response cache time to live for the refresh run, after which cached responses are revalidated")
+    parser.add_argument("--queue-size",type=int,default=1000,help="records waiting in front of each pipeline stage")
+    parser.add_argument("--itis-mode",choices=["batch","record","snapshot"],default="batch",help="batched Solr queries per page (as ITIS.py does), one lookup per record, or a local snapshot built from a synthetic ITIS export")
+    parser.add_argument("--itis-page-size",type=int,default=500)
+    parser.add_argument("--itis-batch-size",type=int,default=100)
+    parser.add_argument("--no-dedup",action="store_true",help="look WoRMS, TESS and NatureServe up once per record instead of once per distinct name")
+    parser.add_argument("--dedup-page-size",type=int,default=1000)
+    parser.add_argument("--max-workers",type=int,default=8)
+    parser.add_argument("--host-limit",type=int,default=4)
+    parser.add_argument("--rate-limit",action="store_true",help="put the upstream hosts behind adaptive limiters and circuit breakers (as the processor scripts do)")
+    parser.add_argument("--request-rate",type=float,default=None,help="requests per second to each upstream host with --rate-limit")
+    parser.add_argument("--open-seconds",type=float,default=5,help="seconds a host's circuit stays open before a trial request with --rate-limit")
+    parser.add_argument("--max-pause-seconds",type=float,default=60,help="longest a lookup waits on an open circuit before giving up on the record")
+    parser.add_argument("--page-size",type=int,default=100)
+    parser.add_argument("--write-batch-size",type=int,default=100)
+    parser.add_argument("--max-records",type=int,default=None,help="stop each processor after this many records")
+    parser.add_argument("--data-dir",default="cache/benchmark",help="where the synthetic GC2 databases are built")
+    parser.add_argument("--report",default="metrics/benchmark.json",help="where to write the JSON report")
+    parser.add_argument("--seed",type=int,default=0)
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    options = parseOptions(args)
+    processors = [processor for processor in processorOrder if processor in options.processors.split(",")]
+    if options.pipeline:
+        processors = ["Pipeline"]
+    if options.messaging:
+        processors = ["Messaging"]
+    if options.refresh_budget is not None:
+        processors.append("Refresh")
+
+    for fileName in ["tir.sqlite","sgcn.sqlite"]:
+        if os.path.exists(os.path.join(options.data_dir,fileName)):
+            os.remove(os.path.join(options.data_dir,fileName))
+
+    taxonomy = synthetic.Taxonomy(options.names if options.names is not None else max(int(options.rows/4),10))
+    fakeGC2 = FakeGC2(options.data_dir)
+    print ("Building "+str(options.rows)+" synthetic registrations")
+    loadSyntheticData(fakeGC2,taxonomy,options.rows,options.seed)
+
+    installStandIns()
+    usingStandInBis = standinbis.install()
+    if usingStandInBis:
+        print ("bis is not installed, using the stand-ins in benchmarks/standinbis.py")
+    services = startServices(taxonomy,fakeGC2,options)
+    for host in [lookups.itisHost,lookups.wormsHost,lookups.tessHost,lookups.natureServeHost]:
+        workers.setHostLimit(host,options.host_limit)
+        if options.rate_limit:
+            ratelimit.configure(host,rate=options.request_rate,maxConcurrency=options.host_limit,openSeconds=options.open_seconds)
+    sessions.configure(poolSize=max(options.host_limit,options.max_workers))
+    if options.response_cache is not None:
+        responsecache.openCache(options.response_cache)
+    else:
+        responsecache.activeCache = None
+
+    thisRun = {}
+    thisRun["baseURL"] = "http://"+gc2Host+"/api/v1/sql/benchmark?key=benchmark"
+    thisRun["totalRecordsToProcess"] = options.max_records
+    thisRun["pageSize"] = options.page_size
+    thisRun["writeBatchSize"] = options.write_batch_size
+    thisRun["maxWorkers"] = options.max_workers
+    thisRun["dedup"] = not options.no_dedup
+    thisRun["dedupPageSize"] = options.dedup_page_size
+    thisRun["maxPauseSeconds"] = options.max_pause_seconds
+    thisRun["queueSize"] = options.queue_size
+    thisRun["refreshBudget"] = options.refresh_budget
+    thisRun["refreshCacheTTL"] = options.refresh_cache_ttl
+    thisRun["workersPerProcessor"] = options.workers_per_processor
+    thisRun["numPartitions"] = options.partitions
+    thisRun["itisMode"] = options.itis_mode
+    thisRun["itisPageSize"] = options.itis_page_size
+    thisRun["itisBatchSize"] = options.itis_batch_size
+    thisRun["itisSource"] = None
+    if options.itis_mode == "snapshot":
+        synthetic.writeITISExport(taxonomy,os.path.join(options.data_dir,"itis_export.sqlite"))
+        started = time.time()
+        numDocs = itissnapshot.buildSnapshot(os.path.join(options.data_dir,"itis_export.sqlite"),os.path.join(options.data_dir,"itis_snapshot.sqlite"))
+        print ("Built ITIS snapshot of "+str(numDocs)+" docs in "+str(round(time.time()-started,3))+"s")
+        thisRun["itisSource"] = itissnapshot.ITISSnapshot(os.path.join(options.data_dir,"itis_snapshot.sqlite"))
+    thisRun["sgcnConfig"] = synthetic.sgcnConfig(taxonomy,options.seed)
+
+    reports = []
+    try:
+        for processor in processors:
+            report = benchmarkProcessor(processor,thisRun,services)
+            reports.append(report)
+            print (processor+": "+str(report["records"])+" records in "+str(report["elapsedSeconds"])+"s ("+str(report["recordsPerSecond"])+" records/sec), requests "+json.dumps(report["requests"]))
+    finally:
+        for service in services.values():
+            service.stop()
+        fakeGC2.close()
+        if responsecache.activeCache is not None:
+            responsecache.activeCache.close()
+
+    benchmarkReport = {"options":vars(options),"standInBis":usingStandInBis,"processors":reports,"limiters":ratelimit.summary()}
+    if os.path.dirname(options.report) != "":
+        os.makedirs(os.path.dirname(options.report),exist_ok=True)
+    with open(options.report,"w") as f:
+        json.dump(benchmarkReport,f,indent=2)
+    print ("Report written to "+options.report)
+    return benchmarkReport
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# Stand-ins for the parts of the bis package the processors call, for benchmarking where bis isn't installed. They
+# build the same search URLs (the shape the ITIS Solr stand-in reads) and package results the same way closely enough
+# for timing runs, but the name cleaning is a simple approximation of bis.cleanScientificName, so match counts from a
+# run on the stand-ins are not comparable to a run with bis. The SGCN lookups read the sgcn table through the GC2 SQL
+# API one name at a time, the way the bis.sgcn functions do, and are what tests/test_sgcnindex.py holds the aggregate
+# queries in tirutils/sgcnindex.py to. install() only puts them in place when bis can't be imported.
+
+import re,sys,types
+from collections import Counter
+from datetime import datetime
+from importlib import util
+from tirutils import claim
+
+parentheticalPattern = re.compile(r"\([^)]*\)")
+qualifierPattern = re.compile(r"\s+(sp|spp|ssp|var|cf|aff)\.?(\s|$).*$",re.IGNORECASE)
+whitespacePattern = re.compile(r"\s+")
+
+
+def stringCleaning(text):
+    if text is None:
+        return None
+    return whitespacePattern.sub(" ",str(text)).strip()
+
+
+def cleanScientificName(scientificName):
+    # Take out parentheticals and anything after a qualifier like sp. or var., and collapse spacing
+    if scientificName is None:
+        return ""
+    cleanedName = parentheticalPattern.sub(" ",scientificName)
+    cleanedName = qualifierPattern.sub("",whitespacePattern.sub(" ",cleanedName).strip())
+    return cleanedName.strip().capitalize()
+
+
+def getITISSearchURL(searchString,fuzzy=False,validAccepted=True):
+    field = "tsn" if str(searchString).isdigit() else "nameWOInd"
+    return "http://services.itis.gov/?wt=json&rows=10&q="+field+":"+str(searchString).replace(" ","\\%20")+("~0.5" if fuzzy else "")
+
+
+def packageITISJSON(matchMethod,matchString,itisDoc):
+    itisData = {"itisMatchMethod":matchMethod,"matchString":matchString,"cacheDate":datetime.utcnow().isoformat()}
+    if isinstance(itisDoc,dict):
+        itisData.update(itisDoc)
+    return itisData
+
+
+def packageWoRMSJSON(matchMethod,matchString,wormsData):
+    wormsJSON = {"MatchMethod":matchMethod,"matchString":matchString,"cacheDate":datetime.utcnow().isoformat()}
+    if isinstance(wormsData,dict):
+        wormsJSON.update(wormsData)
+    return wormsJSON
+
+
+def queryTESS(queryType=None,queryValue=None):
+    # Only the empty result lookups.lookupTESS starts from; the benchmark sends real TESS queries to its stand-in
+    return {"result":False,"dateCached":datetime.utcnow().isoformat()}
+
+
+def sgcnRows(baseURL,name,column):
+    q_rows = "SELECT "+column+" AS value, year FROM sgcn.sgcn WHERE scientificname = '"+name.replace("'","''")+"' AND "+column+" IS NOT NULL"
+    return [row["properties"] for row in claim.sqlQuery(baseURL,q_rows)["features"]]
+
+
+def mostCommon(values):
+    # The most often submitted value, the first alphabetically on a tie
+    counts = Counter(values)
+    if len(counts) == 0:
+        return None
+    return min(counts,key=lambda value: (-counts[value],value))
+
+
+def getSGCNTaxonomicGroup(baseURL,scientificname):
+    return mostCommon([row["value"] for row in sgcnRows(baseURL,scientificname,"taxonomicgroup")])
+
+
+def getSGCNCommonName(baseURL,scientificname):
+    return mostCommon([row["value"] for row in sgcnRows(baseURL,scientificname,"commonname")])
+
+
+def getSGCNStatesByYear(baseURL,scientificname):
+    statesByYear = {}
+    for row in sgcnRows(baseURL,scientificname,"state"):
+        statesByYear.setdefault(row["year"],set()).add(row["value"])
+    return [{"year":year,"states":sorted(states)} for year,states in sorted(statesByYear.items())]
+
+
+def standInModules():
+    # Modules for bis, bis.bis, bis.itis, bis.worms, bis.tess, bis.natureserve and bis.sgcn holding the stand-ins
+    functionsByModule = {
+        "bis.bis":{"cleanScientificName":cleanScientificName,"stringCleaning":stringCleaning},
+        "bis.itis":{"getITISSearchURL":getITISSearchURL,"packageITISJSON":packageITISJSON},
+        "bis.worms":{"packageWoRMSJSON":packageWoRMSJSON},
+        "bis.tess":{"queryTESS":queryTESS},
+        "bis.natureserve":{},
+        "bis.sgcn":{"getSGCNTaxonomicGroup":getSGCNTaxonomicGroup,"getSGCNStatesByYear":getSGCNStatesByYear,"getSGCNCommonName":getSGCNCommonName}
+    }
+    package = types.ModuleType("bis")
+    package.__path__ = []
+    modules = {"bis":package}
+    for moduleName,functions in functionsByModule.items():
+        module = types.ModuleType(moduleName)
+        module.__dict__.update(functions)
+        modules[moduleName] = module
+        setattr(package,moduleName.split(".")[1],module)
+    return modules
+
+
+def install():
+    # Register the stand-ins if bis is missing, and say whether they were needed
+    if util.find_spec("bis") is not None:
+        return False
+    sys.modules.update(standInModules())
+    return True
@@ -0,0 +1,390 @@
+# Synthetic data for the benchmarks: a made up taxonomy of scientific names with ITIS TSNs, WoRMS AphiaIDs, TESS
+# listings and NatureServe element IDs, registrations in tir.tir that draw on it, and SGCN submissions for the SGCN
+# registrations. Everything about a name (whether ITIS knows it exactly or only fuzzily, whether it's accepted, if
+# it's marine, etc.) comes from a hash of the name so the stand-in services answer the same way on every run.
+#
+# Names are drawn with a skew toward the front of the list so that, like the real TIR, many registrations share the
+# same name (the same SGCN species submitted by many states, for instance).
+
+import os,re,random,sqlite3,hashlib
+from urllib.parse import unquote
+
+genera = ["Ambystoma","Bufo","Catostomus","Dendroica","Empidonax","Fundulus","Gopherus","Haliaeetus","Ictalurus","Junco","Kinosternon","Lampetra","Myotis","Notropis","Oncorhynchus","Plethodon","Quercus","Rana","Sorex","Thamnophis","Unio","Vireo","Zapus"]
+syllables = ["al","ba","ca","de","fi","gra","li","ma","no","or","pe","ri","sa","ta","ul","vi","bro","cer","dum","hex","ko","lep","mon","tri"]
+states = ["Alabama","Alaska","Arizona","California","Colorado","Florida","Idaho","Maine","Montana","Nevada","Ohio","Oregon","Texas","Utah","Washington","Wyoming"]
+sources = ["SGCN","SGCN","SGCN","GAP Species","BISON"]
+taxonomicGroups = ["Amphibians","Birds","Fish","Mammals","Reptiles","Mollusks","Plants","Insects"]
+years = [2005,2015]
+
+itisBaseTSN = 100000
+wormsBaseAphiaID = 200000
+natureServeBaseID = 300000
+
+
+def editDistance(a,b):
+    previousRow = list(range(len(b)+1))
+    for i,characterA in enumerate(a,1):
+        thisRow = [i]
+        for j,characterB in enumerate(b,1):
+            thisRow.append(min(previousRow[j]+1,thisRow[j-1]+1,previousRow[j-1]+(characterA != characterB)))
+        previousRow = thisRow
+    return previousRow[-1]
+
+
+def fraction(name,salt):
+    # A stable number in [0,1) for a name and purpose
+    return int(hashlib.md5((salt+":"+name).encode("utf-8")).hexdigest()[:8],16)/2**32
+
+
+class Taxonomy:
+
+    def __init__(self,numNames,exactRate=0.75,fuzzyRate=0.1,notAcceptedRate=0.1,marineRate=0.2,listedRate=0.05,natureServeRate=0.6):
+        self.rates = {"exact":exactRate,"fuzzy":fuzzyRate,"notAccepted":notAcceptedRate,"marine":marineRate,"listed":listedRate,"natureServe":natureServeRate}
+        self.names = []
+        for index in range(numNames):
+            genus = genera[index%len(genera)]
+            # Spread neighbouring indexes across four syllable epithets so that names are rarely within a couple of
+            # edits of each other (the multiplier is coprime with the number of epithets, so they stay unique)
+            epithetIndex = ((index//len(genera))*2654435761)%(len(syllables)**4)
+            epithet = ""
+            for syllable in range(4):
+                epithet = epithet+syllables[epithetIndex%len(syllables)]
+                epithetIndex = epithetIndex//len(syllables)
+            self.names.append(genus+" "+epithet+"us")
+        self.index = {name:index for index,name in enumerate(self.names)}
+        self.lowerNames = {name.lower():name for name in self.names}
+        self.buckets = {}
+        for name in self.names:
+            for bucketKey in self.bucketKeys(name):
+                self.buckets.setdefault(bucketKey,[]).append(name)
+
+    def bucketKeys(self,name):
+        # Names close enough to be fuzzy matches of each other are looked for within the same genus and among names
+        # with the same epithet
+        words = name.lower().split(" ")
+        return ["genus:"+words[0],"epithet:"+words[-1]]
+
+    def solrName(self,value):
+        # Solr name searches don't care about case
+        return self.lowerNames.get(value.lower(),value)
+
+    def fuzzyNames(self,name,maxEdits=2):
+        # Names (that ITIS knows) within maxEdits of a searched name, the way a Solr fuzzy search finds them
+        fuzzyNames = []
+        name = name.lower()
+        candidates = dict.fromkeys([candidate for bucketKey in self.bucketKeys(name) for candidate in self.buckets.get(bucketKey,[])])
+        for candidate in candidates:
+            if self.itisStatus(candidate) is not None and abs(len(candidate)-len(name)) <= maxEdits and editDistance(self.itisName(candidate).lower(),name) <= maxEdits:
+                fuzzyNames.append(candidate)
+        return fuzzyNames
+
+    def known(self,name):
+        return name in self.index
+
+    def itisStatus(self,name):
+        # "exact", "fuzzy" (only found with a fuzzy search) or None
+        if not self.known(name):
+            return None
+        thisFraction = fraction(name,"itis")
+        if thisFraction < self.rates["exact"]:
+            return "exact"
+        if thisFraction < self.rates["exact"]+self.rates["fuzzy"]:
+            return "fuzzy"
+        return None
+
+    def itisName(self,name):
+        # Names that ITIS only finds with a fuzzy search are spelled a little differently in ITIS
+        if self.itisStatus(name) == "fuzzy":
+            return name[:-1]+"m"
+        return name
+
+    def acceptedName(self,name):
+        # Names that are not accepted point to the next name in the list
+        if fraction(name,"accepted") < self.rates["notAccepted"]:
+            return self.names[(self.index[name]+1)%len(self.names)]
+        return name
+
+    def tsn(self,name):
+        return itisBaseTSN+self.index[name]
+
+    def nameForTSN(self,tsn):
+        index = int(tsn)-itisBaseTSN
+        if 0 <= index < len(self.names):
+            return self.names[index]
+        return None
+
+    def aphiaID(self,name):
+        return wormsBaseAphiaID+self.index[name]
+
+    def nameForAphiaID(self,aphiaID):
+        index = int(aphiaID)-wormsBaseAphiaID
+        if 0 <= index < len(self.names):
+            return self.names[index]
+        return None
+
+    def isMarine(self,name):
+        return self.known(name) and fraction(name,"marine") < self.rates["marine"]
+
+    def isListed(self,name):
+        return self.known(name) and fraction(name,"tess") < self.rates["listed"]
+
+    def natureServeID(self,name):
+        if self.known(name) and fraction(name,"natureserve") < self.rates["natureServe"]:
+            return "ELEMENT_GLOBAL.2."+str(natureServeBaseID+self.index[name])
+        return None
+
+    def taxonomicGroup(self,name):
+        return taxonomicGroups[self.index[name]%len(taxonomicGroups)]
+
+    def commonName(self,name):
+        return "common "+name.split(" ")[1]
+
+    def itisDoc(self,name):
+        acceptedName = self.acceptedName(name)
+        itisDoc = {}
+        itisDoc["tsn"] = str(self.tsn(name))
+        itisDoc["nameWInd"] = self.itisName(name)
+        itisDoc["nameWOInd"] = self.itisName(name)
+        itisDoc["unit1"],itisDoc["unit2"] = self.itisName(name).split(" ")
+        itisDoc["usage"] = "accepted" if acceptedName == name else "not accepted"
+        if acceptedName != name:
+            itisDoc["acceptedTSN"] = [str(self.tsn(acceptedName))]
+        itisDoc["rank"] = "Species"
+        itisDoc["kingdom"] = "Plantae" if name.startswith("Quercus") else "Animalia"
+        itisDoc["parentTSN"] = str(itisBaseTSN-1-genera.index(name.split(" ")[0]))
+        itisDoc["hierarchySoFarWRanks"] = ["$Kingdom:"+itisDoc["kingdom"]+"$Genus:"+name.split(" ")[0]+"$Species:"+itisDoc["nameWOInd"]+"$"]
+        itisDoc["hierarchyTSN"] = ["$"+itisDoc["parentTSN"]+"$"+itisDoc["tsn"]+"$"]
+        itisDoc["vernacular"] = ["$"+self.commonName(name)+"$English$N$"+itisDoc["tsn"]+"$2017-01-01 00:00:00$"]
+        itisDoc["credibilityRating"] = "TWG standards met"
+        itisDoc["updateDate"] = "2017-01-01T00:00:00Z"
+        return itisDoc
+
+    def genusDoc(self,genus):
+        # Registrations like "Zapus sp." come down to a search on the genus, which ITIS has too
+        itisDoc = {}
+        itisDoc["tsn"] = str(itisBaseTSN-1-genera.index(genus))
+        itisDoc["nameWInd"] = genus
+        itisDoc["nameWOInd"] = genus
+        itisDoc["unit1"] = genus
+        itisDoc["usage"] = "valid"
+        itisDoc["rank"] = "Genus"
+        itisDoc["kingdom"] = "Plantae" if genus == "Quercus" else "Animalia"
+        itisDoc["hierarchySoFarWRanks"] = ["$Kingdom:"+itisDoc["kingdom"]+"$Genus:"+genus+"$"]
+        itisDoc["hierarchyTSN"] = ["$"+itisDoc["tsn"]+"$"]
+        itisDoc["credibilityRating"] = "TWG standards met"
+        itisDoc["updateDate"] = "2017-01-01T00:00:00Z"
+        return itisDoc
+
+    def wormsRecord(self,name):
+        acceptedName = self.acceptedName(name)
+        wormsRecord = {}
+        wormsRecord["AphiaID"] = self.aphiaID(name)
+        wormsRecord["url"] = "http://www.marinespecies.org/aphia.php?p=taxdetails&id="+str(wormsRecord["AphiaID"])
+        wormsRecord["scientificname"] = name
+        wormsRecord["authority"] = "Synthetic, 2017"
+        wormsRecord["status"] = "accepted" if acceptedName == name else "unaccepted"
+        wormsRecord["unacceptreason"] = None
+        wormsRecord["rank"] = "Species"
+        wormsRecord["valid_AphiaID"] = self.aphiaID(acceptedName)
+        wormsRecord["valid_name"] = acceptedName
+        wormsRecord["valid_authority"] = "Synthetic, 2017"
+        wormsRecord["kingdom"] = "Animalia"
+        wormsRecord["genus"] = name.split(" ")[0]
+        wormsRecord["citation"] = "Synthetic record for benchmarks"
+        wormsRecord["lsid"] = "urn:lsid:marinespecies.org:taxname:"+str(wormsRecord["AphiaID"])
+        wormsRecord["isMarine"] = 1
+        wormsRecord["match_type"] = "exact"
+        wormsRecord["modified"] = "2017-01-01T00:00:00Z"
+        return wormsRecord
+
+    def tessDoc(self,name):
+        tessDoc = {}
+        tessDoc["result"] = True
+        tessDoc["ENTITY_ID"] = self.index[name]
+        tessDoc["SCINAME"] = name
+        tessDoc["COMNAME"] = self.commonName(name)
+        tessDoc["TSN"] = str(self.tsn(name))
+        tessDoc["listingStatus"] = [{"STATUS":"Endangered","POP_DESC":"Wherever found","LISTING_DATE":"1990-01-01"}]
+        return tessDoc
+
+
+def writeITISExport(taxonomy,path):
+    # Write the synthetic taxonomy out in the shape of the ITIS SQLite download (the tables itissnapshot reads)
+    if os.path.exists(path):
+        os.remove(path)
+    export = sqlite3.connect(path)
+    export.execute("CREATE TABLE kingdoms (kingdom_id INTEGER, kingdom_name TEXT)")
+    export.execute("CREATE TABLE taxon_unit_types (kingdom_id INTEGER, rank_id INTEGER, rank_name TEXT)")
+    export.execute("CREATE TABLE taxon_authors_lkp (taxon_author_id INTEGER, taxon_author TEXT)")
+    export.execute("CREATE TABLE taxonomic_units (tsn INTEGER, unit_ind1 TEXT, unit_name1 TEXT, unit_ind2 TEXT, unit_name2 TEXT, unit_ind3 TEXT, unit_name3 TEXT, unit_ind4 TEXT, unit_name4 TEXT, name_usage TEXT, unaccept_reason TEXT, credibility_rtng TEXT, completeness_rtng TEXT, currency_rating TEXT, kingdom_id INTEGER, rank_id INTEGER, parent_tsn INTEGER, taxon_author_id INTEGER, initial_time_stamp TEXT, update_date TEXT)")
+    export.execute("CREATE TABLE synonym_links (tsn INTEGER, tsn_accepted INTEGER)")
+    export.execute("CREATE TABLE vernaculars (tsn INTEGER, vernacular_name TEXT, language TEXT, approved_ind TEXT, vern_id INTEGER, update_date TEXT)")
+    export.execute("CREATE TABLE hierarchy (hierarchy_string TEXT, TSN INTEGER, Parent_TSN INTEGER, level INTEGER, ChildrenCount INTEGER)")
+    export.executemany("INSERT INTO kingdoms VALUES (?,?)",[(5,"Animalia"),(3,"Plantae")])
+    export.executemany("INSERT INTO taxon_unit_types VALUES (?,?,?)",[(kingdomID,rankID,rankName) for kingdomID in [3,5] for rankID,rankName in [(10,"Kingdom"),(180,"Genus"),(220,"Species")]])
+    export.execute("INSERT INTO taxon_authors_lkp VALUES (1,'Synthetic, 2017')")
+
+    units = []
+    hierarchy = []
+    for kingdomID,kingdomName in [(5,"Animalia"),(3,"Plantae")]:
+        units.append((kingdomID,None,kingdomName,None,None,None,None,None,None,"valid",None,None,None,None,kingdomID,10,None,None,"2017-01-01","2017-01-01"))
+        hierarchy.append((str(kingdomID),kingdomID,None,0,0))
+    for genus in genera:
+        kingdomID = 3 if genus == "Quercus" else 5
+        genusTSN = itisBaseTSN-1-genera.index(genus)
+        units.append((genusTSN,None,genus,None,None,None,None,None,None,"valid",None,None,None,None,kingdomID,180,kingdomID,1,"2017-01-01","2017-01-01"))
+        hierarchy.append((str(kingdomID)+"-"+str(genusTSN),genusTSN,kingdomID,1,0))
+    synonyms = []
+    vernaculars = []
+    for name in taxonomy.names:
+        if taxonomy.itisStatus(name) is None:
+            continue
+        itisDoc = taxonomy.itisDoc(name)
+        kingdomID = 3 if itisDoc["kingdom"] == "Plantae" else 5
+        units.append((int(itisDoc["tsn"]),None,itisDoc["unit1"],None,itisDoc["unit2"],None,None,None,None,itisDoc["usage"],None,None,None,None,kingdomID,220,int(itisDoc["parentTSN"]),1,"2017-01-01","2017-01-01"))
+        if itisDoc["usage"] == "accepted":
+            hierarchy.append((str(kingdomID)+"-"+itisDoc["parentTSN"]+"-"+itisDoc["tsn"],int(itisDoc["tsn"]),int(itisDoc["parentTSN"]),2,0))
+        else:
+            synonyms.append((int(itisDoc["tsn"]),int(itisDoc["acceptedTSN"][0])))
+        vernaculars.append((int(itisDoc["tsn"]),taxonomy.commonName(name),"English","N",int(itisDoc["tsn"]),"2017-01-01"))
+    export.executemany("INSERT INTO taxonomic_units VALUES ("+",".join(["?"]*20)+")",units)
+    export.executemany("INSERT INTO hierarchy VALUES (?,?,?,?,?)",hierarchy)
+    export.executemany("INSERT INTO synonym_links VALUES (?,?)",synonyms)
+    export.executemany("INSERT INTO vernaculars VALUES (?,?,?,?,?,?)",vernaculars)
+    export.commit()
+    export.close()
+
+
+def itisResponder(taxonomy):
+    # ITIS Solr: q=nameWOInd:Genus\ species (with ~ for a fuzzy search) or q=tsn:123456, or a batch of either as
+    # field:(a OR b OR ...); rows limits the docs sent back the same way Solr does
+    def itisDocs(field,term):
+        fuzzy = re.search(r"(?<!\\)~[0-9.]*$",term) is not None
+        value = re.sub(r"(?<!\\)~[0-9.]*$","",term).replace("\\","").strip('"')
+        if field == "tsn":
+            name = taxonomy.nameForTSN(value) if value.isdigit() else None
+            return [taxonomy.itisDoc(name)] if name is not None and taxonomy.itisStatus(name) is not None else []
+        if fuzzy:
+            return [taxonomy.itisDoc(name) for name in taxonomy.fuzzyNames(value,min(int(0.5*len(value)),2))]
+        if taxonomy.itisStatus(taxonomy.solrName(value)) == "exact":
+            return [taxonomy.itisDoc(taxonomy.solrName(value))]
+        for genus in genera:
+            if genus.lower() == value.lower():
+                return [taxonomy.genusDoc(genus)]
+        return []
+
+    def responder(method,path,params):
+        params = dict(params)
+        q = params.get("q","")
+        field,value = q.split(":",1) if ":" in q else ("",q)
+        if value.startswith("(") and value.endswith(")"):
+            terms = re.split(r"(?<!\\) OR ",value[1:-1])
+        else:
+            terms = [value]
+        docs = []
+        for term in terms:
+            for itisDoc in itisDocs(field,term):
+                if itisDoc not in docs:
+                    docs.append(itisDoc)
+        rows = int(params.get("rows",10))
+        return 200,{"responseHeader":{"status":0},"response":{"numFound":len(docs),"start":0,"docs":docs[:rows]}}
+    return responder
+
+
+def wormsResponder(taxonomy):
+    # WoRMS REST: /rest/AphiaRecordsByName/{name}?like=... and /rest/AphiaRecordByAphiaID/{id}
+    def responder(method,path,params):
+        value = unquote(path.rstrip("/").split("/")[-1])
+        if "/AphiaRecordByAphiaID/" in path:
+            name = taxonomy.nameForAphiaID(value) if value.isdigit() else None
+            if name is None or not taxonomy.isMarine(name):
+                return 204,None
+            return 200,taxonomy.wormsRecord(name)
+        if taxonomy.isMarine(value):
+            return 200,[taxonomy.wormsRecord(value)]
+        return 204,None
+    return responder
+
+
+def tessResponder(taxonomy):
+    # Stand-in TESS query: /tess?type=TSN|SCINAME&value=...
+    def responder(method,path,params):
+        params = dict(params)
+        name = taxonomy.nameForTSN(params.get("value")) if params.get("type") == "TSN" and str(params.get("value")).isdigit() else params.get("value")
+        if name is not None and taxonomy.isListed(name):
+            return 200,taxonomy.tessDoc(name)
+        return 200,{"result":False}
+    return responder
+
+
+def natureServeResponder(taxonomy):
+    # Stand-in NatureServe services: /nameSearch?name=... for an element ID and /species?id=... for the species data
+    def responder(method,path,params):
+        params = dict(params)
+        if path.endswith("/nameSearch"):
+            return 200,{"elementGlobalID":taxonomy.natureServeID(params.get("name",""))}
+        elementGlobalID = params.get("id")
+        if elementGlobalID in [None,"","None"]:
+            return 200,{"result":False}
+        return 200,{"result":True,"elementGlobalID":elementGlobalID,"conservationStatus":{"globalStatus":{"rank":"G4"}}}
+    return responder
+
+
+def decorateName(name,rand):
+    # Registered names come in with authorities, extra spaces and qualifiers that the cleaners deal with
+    thisFraction = rand.random()
+    if thisFraction < 0.1:
+        return name+" (Linnaeus, 1758)"
+    if thisFraction < 0.15:
+        return name.lower()
+    if thisFraction < 0.18:
+        return name.split(" ")[0]+" sp."
+    return name
+
+
+def registrations(taxonomy,numRows,unknownRate=0.05,tsnRate=0.02,seed=0):
+    # Generator of tir.tir rows with only the registration filled in
+    rand = random.Random(seed)
+    for recordID in range(1,numRows+1):
+        name = taxonomy.names[min(int(rand.paretovariate(1.2))-1,len(taxonomy.names)-1)] if rand.random() < 0.5 else rand.choice(taxonomy.names)
+        registration = {}
+        registration["source"] = rand.choice(sources)
+        registration["followTaxonomy"] = "true" if rand.random() < 0.8 else "false"
+        if rand.random() < unknownRate:
+            registration["scientificname"] = "Unknown "+str(recordID)
+        else:
+            registration["scientificname"] = decorateName(name,rand)
+        if rand.random() < tsnRate:
+            registration["taxonomicLookupProperty"] = "tsn"
+            registration["tsn"] = str(taxonomy.tsn(name))
+        else:
+            registration["taxonomicLookupProperty"] = "scientificname"
+        if registration["source"] == "GAP Species":
+            registration["commonname"] = taxonomy.commonName(name)
+            registration["taxonomicgroup"] = taxonomy.taxonomicGroup(name)
+        yield {"id":recordID,"registration":registration}
+
+
+def sgcnSubmissions(taxonomy,tirRows,seed=0):
+    # SGCN table rows for the SGCN registrations, a few states and list years per name
+    rand = random.Random(seed)
+    for tirRow in tirRows:
+        if tirRow["registration"]["source"] != "SGCN":
+            continue
+        name = tirRow["registration"]["scientificname"]
+        for state in rand.sample(states,2):
+            yield {
+                "scientificname":name,
+                "taxonomicgroup":taxonomy.taxonomicGroup(name) if taxonomy.known(name) else rand.choice(taxonomicGroups),
+                "state":state,
+                "year":rand.choice(years),
+                "commonname":taxonomy.commonName(name) if rand.random() < 0.5 else None
+            }
+
+
+def sgcnConfig(taxonomy,seed=0):
+    # Stand-in for the ScienceBase configuration files loaded by sbconfig
+    rand = random.Random(seed)
+    tgDict = {group.lower():group for group in taxonomicGroups}
+    swap2005Names = rand.sample(taxonomy.names,min(len(taxonomy.names),max(1,int(len(taxonomy.names)/20))))
+    return {"tgDict":tgDict,"swap2005Names":swap2005Names}
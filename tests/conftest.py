@@ -0,0 +1,57 @@
+# Shared fixtures. gc2 points the GC2 SQL API calls (reads through claim.sqlQuery, writes and the journal through
+# sessions.post) at the SQLite backed stand-in from the benchmarks, so the SQL the modules build actually runs.
+# cleaner swaps the bis name cleaners for a simple one so nothing here needs bis, and standInBis puts the benchmark
+# stand-ins in place of the bis modules for tests that go through the lookups.
+
+import sys
+import pytest
+from tirutils import names
+from tirutils import sessions
+from benchmarks.fakegc2 import FakeGC2
+from benchmarks import standinbis
+
+baseURL = "http://gc2.test/api/v1/sql/test?key=test"
+
+
+class FakeResponse:
+
+    def __init__(self,statusCode,body):
+        self.status_code = statusCode
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+@pytest.fixture
+def gc2(tmp_path,monkeypatch):
+    fakeGC2 = FakeGC2(str(tmp_path))
+    fakeGC2.statements = []
+
+    def execute(q):
+        fakeGC2.statements.append(q)
+        return FakeResponse(*fakeGC2.execute(q))
+
+    monkeypatch.setattr(sessions,"get",lambda url,**kwargs: execute(url.split("&q=",1)[1]))
+    monkeypatch.setattr(sessions,"post",lambda url,data=None,**kwargs: execute(data["q"]))
+    yield fakeGC2
+    fakeGC2.close()
+
+
+@pytest.fixture
+def cleaner(monkeypatch):
+    monkeypatch.setattr(names,"cleanScientificName",lambda name: " ".join(name.replace("(","").replace(")","").split()).capitalize())
+    monkeypatch.setattr(names,"stringCleaning",lambda name: " ".join(name.split()))
+    names.canonicalKey.cache_clear()
+    yield
+    names.canonicalKey.cache_clear()
+
+
+@pytest.fixture
+def standInBis(monkeypatch):
+    # The bis stand-ins from the benchmarks in place of bis, for the lookups that package results with it
+    for moduleName,module in standinbis.standInModules().items():
+        monkeypatch.setitem(sys.modules,moduleName,module)
+    names.memo.clear()
+    yield
+    names.memo.clear()
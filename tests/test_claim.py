@@ -0,0 +1,41 @@
+import pytest
+from tirutils import claim
+from conftest import baseURL
+
+
+def loadRecords(gc2,numRecords):
+    gc2.loadTIR([{"id":recordID,"registration":{"scientificname":"Name "+str(recordID)},"itis":{"tsn":"1"} if recordID%3 == 0 else None} for recordID in range(1,numRecords+1)])
+
+
+def test_pendingRecordsPagesByID(gc2):
+    loadRecords(gc2,25)
+    tirRecords = list(claim.pendingRecords(baseURL,"itis","itis IS NULL",5))
+    recordIDs = [tirRecord["properties"]["id"] for tirRecord in tirRecords]
+    assert recordIDs == [recordID for recordID in range(1,26) if recordID%3 != 0]
+    assert "id > 0 ORDER BY id ASC LIMIT 5" in gc2.statements[0]
+    assert "id > 7 " in gc2.statements[1]
+    # 17 records in pages of 5, the last one short
+    assert len(gc2.statements) == 4
+
+
+def test_pendingRecordsMaxRecordsAndAfterID(gc2):
+    loadRecords(gc2,25)
+    recordIDs = [tirRecord["properties"]["id"] for tirRecord in claim.pendingRecords(baseURL,"itis","TRUE",4,6,10)]
+    assert recordIDs == [11,12,13,14,15,16]
+    assert gc2.statements[-1].endswith("LIMIT 2")
+
+
+def test_pendingRecordsRaisesOnError(gc2):
+    loadRecords(gc2,3)
+    with pytest.raises(Exception,match="no such column"):
+        list(claim.pendingRecords(baseURL,"itis","no_such_column IS NULL"))
+
+
+def test_countPending(gc2):
+    loadRecords(gc2,10)
+    assert claim.countPending(baseURL,"itis IS NULL") == 7
+
+
+def test_pages():
+    assert list(claim.pages(iter(range(7)),3)) == [[0,1,2],[3,4,5],[6]]
+    assert list(claim.pages(iter([]),3)) == []
@@ -0,0 +1,123 @@
+import json
+from tirutils import commonproperties
+from benchmarks import standinbis
+
+cacheDate = "2018-01-01T00:00:00"
+sgcnCommonNames = {"Puma concolor":"Cougar","Lynx rufus":None}
+itisMatch = {"MatchMethod":"Exact Match","nameWInd":"Puma concolor","tsn":552479,"rank":"Species","commonnames":[{"name":"puma","language":"Spanish"},{"name":"Mountain  lion","language":"English"}]}
+wormsMatch = {"MatchMethod":"Fuzzy Match","valid_name":"Balaena mysticetus","AphiaID":137086,"rank":"Species"}
+noMatch = {"MatchMethod":"Not Matched"}
+
+registrations = [
+    # ITIS is preferred over WoRMS, and an SGCN submitted common name over the ITIS vernacular
+    ({"source":"SGCN","scientificname":"Puma  concolor"},itisMatch,wormsMatch,{"taxonomicgroup":"Mammals","swap2005":False}),
+    # SGCN registration with no submitted common name falls back to ITIS
+    ({"source":"SGCN","scientificname":"Lynx rufus"},dict(itisMatch,nameWInd="Lynx rufus",tsn=180582),noMatch,{"taxonomicgroup":"Mammals","swap2005":True}),
+    ({"source":"Other Source","scientificname":"Balaena mysticetus"},noMatch,wormsMatch,None),
+    # Not matched and on the 2005 SWAP list, or not
+    ({"source":"SGCN","scientificname":"Ammodramus  sp."},noMatch,noMatch,{"taxonomicgroup":"Birds","swap2005":True}),
+    ({"source":"SGCN","scientificname":"Made up"},noMatch,noMatch,{"taxonomicgroup":"Other","swap2005":False}),
+    # SGCN registration that hasn't been annotated yet
+    ({"source":"SGCN","scientificname":"Puma concolor"},itisMatch,noMatch,None),
+    # GAP Species keep their registered names and group
+    ({"source":"GAP Species","scientificname":"Puma concolor coryi","commonname":"Florida Panther","taxonomicgroup":"Mammals"},itisMatch,noMatch,None),
+    ({"source":"GAP Species","scientificname":"Anaxyrus  boreas","commonname":"Western  Toad","taxonomicgroup":"Amphibians"},noMatch,noMatch,None),
+    # No English vernacular
+    ({"source":"Other Source","scientificname":"Puma concolor"},dict(itisMatch,commonnames=[{"name":"puma","language":"Spanish"}]),noMatch,None),
+    ({"source":"Other Source","scientificname":"Puma concolor"},dict(itisMatch,commonnames=[{"name":"cougar","language":"unspecified"}]),noMatch,None)
+]
+
+
+def perRecordCommonProperties(thisRecord):
+    # The rules as they were applied one record at a time in TIR Common Properties before deriveCommonProperties
+    _source = thisRecord["registration"]["source"]
+    tirCommon = {}
+    tirCommon["id"] = thisRecord["id"]
+    tirCommon["commonname"] = None
+    tirCommon["scientificname"] = standinbis.stringCleaning(thisRecord["registration"]["scientificname"])
+    tirCommon["source"] = thisRecord["registration"]["source"]
+    tirCommon["matchmethod"] = "Not Matched"
+    tirCommon["authorityid"] = "Not Matched to Taxonomic Authority"
+    tirCommon["rank"] = "Unknown Taxonomic Rank"
+
+    if thisRecord["itis"]["MatchMethod"] != "Not Matched":
+        tirCommon["scientificname"] = thisRecord["itis"]["nameWInd"]
+        tirCommon["matchmethod"] = thisRecord["itis"]["MatchMethod"]
+        tirCommon["authorityid"] = "http://services.itis.gov/?q=tsn:"+str(thisRecord["itis"]["tsn"])
+        tirCommon["rank"] = thisRecord["itis"]["rank"]
+    elif thisRecord["worms"]["MatchMethod"] != "Not Matched":
+        tirCommon["scientificname"] = thisRecord["worms"]["valid_name"]
+        tirCommon["matchmethod"] = thisRecord["worms"]["MatchMethod"]
+        tirCommon["authorityid"] = "http://www.marinespecies.org/rest/AphiaRecordsByName/"+str(thisRecord["worms"]["AphiaID"])
+        tirCommon["rank"] = thisRecord["worms"]["rank"]
+
+    if tirCommon["commonname"] is None and _source == 'SGCN':
+        tirCommon["commonname"] = sgcnCommonNames.get(standinbis.stringCleaning(thisRecord["registration"]["scientificname"]))
+
+    if tirCommon["commonname"] is None and "commonnames" in list(thisRecord["itis"].keys()):
+        for name in thisRecord["itis"]["commonnames"]:
+            if name["language"] == "English" or name["language"] == "unspecified":
+                tirCommon["commonname"] = name["name"]
+                break
+
+    if tirCommon["commonname"] is None:
+        tirCommon["commonname"] = "no common name"
+
+    if _source == "SGCN" and "sgcn" in list(thisRecord.keys()):
+        tirCommon["taxonomicgroup"] = thisRecord["sgcn"]["taxonomicgroup"]
+
+        if tirCommon["matchmethod"] == "Not Matched" and "swap2005" in list(thisRecord["sgcn"].keys()) and thisRecord["sgcn"]["swap2005"] is True:
+            tirCommon["matchmethod"] = "Legacy Match"
+            tirCommon["authorityid"] = "https://www.sciencebase.gov/catalog/file/get/56d720ece4b015c306f442d5?f=__disk__38%2F22%2F26%2F38222632f48bf0c893ad1017f6ba557d0f672432"
+    elif _source == "GAP Species":
+        tirCommon["taxonomicgroup"] = thisRecord["registration"]["taxonomicgroup"]
+        tirCommon["scientificname"] = thisRecord["registration"]["scientificname"]
+        tirCommon["commonname"] = thisRecord["registration"]["commonname"]
+    else:
+        tirCommon["taxonomicgroup"] = "Other"
+
+    # The common name was cleaned on the way into the database
+    tirCommon["commonname"] = standinbis.stringCleaning(tirCommon["commonname"])
+    tirCommon["cachedate"] = cacheDate
+    return tirCommon
+
+
+def tirRecords():
+    # Records as they come back from the GC2 SQL API, with the buckets as JSON strings
+    tirRecords = []
+    for recordID,(registration,itis,worms,sgcn) in enumerate(registrations,start=1):
+        tirRecords.append({"properties":{"id":recordID,"registration":json.dumps(registration),"itis":json.dumps(itis),"worms":json.dumps(worms),"sgcn":None if sgcn is None else json.dumps(sgcn)}})
+    return tirRecords
+
+
+def test_matchesThePerRecordRules(standInBis):
+    expected = []
+    for tirRecord in tirRecords():
+        thisRecord = {"id":tirRecord["properties"]["id"]}
+        for bucket in ["registration","itis","worms","sgcn"]:
+            if tirRecord["properties"][bucket] is not None:
+                thisRecord[bucket] = json.loads(tirRecord["properties"][bucket])
+        expected.append(perRecordCommonProperties(thisRecord))
+
+    common = commonproperties.deriveCommonProperties(commonproperties.recordsFrame(tirRecords()),sgcnCommonNames,cacheDate)
+
+    assert list(common.columns) == commonproperties.commonColumns
+    assert common.to_dict("records") == [{column:tirCommon[column] for column in commonproperties.commonColumns} for tirCommon in expected]
+
+
+def test_rulesByCase(standInBis):
+    common = commonproperties.deriveCommonProperties(commonproperties.recordsFrame(tirRecords()),sgcnCommonNames.get,cacheDate).set_index("id")
+    assert common.loc[1,"authorityid"] == "http://services.itis.gov/?q=tsn:552479"
+    assert common.loc[1,"commonname"] == "Cougar"
+    assert common.loc[2,"commonname"] == "Mountain lion"
+    assert common.loc[3,"authorityid"] == "http://www.marinespecies.org/rest/AphiaRecordsByName/137086"
+    assert common.loc[3,"taxonomicgroup"] == "Other"
+    assert common.loc[4,"matchmethod"] == commonproperties.legacyMatch
+    assert common.loc[4,"scientificname"] == "Ammodramus sp."
+    assert common.loc[5,"matchmethod"] == commonproperties.notMatched
+    assert common.loc[5,"commonname"] == commonproperties.noCommonName
+    assert common.loc[6,"taxonomicgroup"] == "Other"
+    assert list(common.loc[7,["scientificname","commonname","taxonomicgroup"]]) == ["Puma concolor coryi","Florida Panther","Mammals"]
+    assert common.loc[8,"commonname"] == "Western Toad"
+    assert common.loc[9,"commonname"] == commonproperties.noCommonName
+    assert common.loc[10,"commonname"] == "cougar"
@@ -0,0 +1,65 @@
+from tirutils import dedup
+
+
+def tirRecord(recordID,name):
+    return {"properties":{"id":recordID,"name_registered":name,"name_itis":None,"name_worms":None}}
+
+
+def countingLookup(calls,results=None):
+    def lookupFunction(tirRecord):
+        name = tirRecord["properties"]["name_registered"]
+        calls.append(name)
+        if results is not None and name in results:
+            return results[name]
+        return {"id":tirRecord["properties"]["id"],"name":name}
+    return lookupFunction
+
+
+def test_processLooksUpEachKeyOnce():
+    calls = []
+    deduplicator = dedup.Deduplicator(dedup.natureServeKey,4)
+    tirRecords = [tirRecord(recordID,["Alpha","Beta"][recordID%2]) for recordID in range(1,9)]
+    thisRecords = list(deduplicator.process(countingLookup(calls),iter(tirRecords),2))
+
+    assert sorted(calls) == ["Alpha","Beta"]
+    assert sorted([thisRecord["id"] for thisRecord in thisRecords]) == list(range(1,9))
+    assert all([thisRecord["name"] == ["Alpha","Beta"][thisRecord["id"]%2] for thisRecord in thisRecords])
+    assert deduplicator.summary() == {"hits":6,"misses":2,"entries":2,"hitRate":0.75}
+
+
+def test_processRetriesKeysThatGaveNothing():
+    calls = []
+    deduplicator = dedup.Deduplicator(dedup.natureServeKey,2)
+    thisRecords = list(deduplicator.process(countingLookup(calls,{"Alpha":None}),iter([tirRecord(1,"Alpha"),tirRecord(2,"Alpha"),tirRecord(3,"Alpha")]),1))
+
+    assert thisRecords == [None,None,None]
+    assert calls == ["Alpha","Alpha"]
+
+
+def test_fanOutCopiesResults():
+    deduplicator = dedup.Deduplicator(dedup.natureServeKey)
+    first = deduplicator.lookup(countingLookup([]),tirRecord(1,"Alpha"))
+    second = deduplicator.lookup(countingLookup([]),tirRecord(2,"Alpha"))
+    assert (first["id"],second["id"]) == (1,2)
+    second["name"] = "Changed"
+    assert first["name"] == "Alpha"
+
+
+def test_fanOutCopiesNestedDocuments():
+    # Taking the refuges out of one record's TESS document must not take them out of the rest of the group
+    deduplicator = dedup.Deduplicator(dedup.natureServeKey,4)
+    tessLookup = lambda tirRecord: {"id":tirRecord["properties"]["id"],"tessJSON":{"result":True,"REFUGE_OCCURRENCE":["Refuge"]}}
+    thisRecords = list(deduplicator.process(tessLookup,iter([tirRecord(recordID,"Alpha") for recordID in range(1,4)]),1))
+    thisRecords[0]["tessJSON"].pop("REFUGE_OCCURRENCE")
+
+    assert [("REFUGE_OCCURRENCE" in thisRecord["tessJSON"]) for thisRecord in thisRecords] == [False,True,True]
+    assert "REFUGE_OCCURRENCE" in deduplicator.lookup(tessLookup,tirRecord(4,"Alpha"))["tessJSON"]
+
+
+def test_wormsKeyUsesCleanedName(cleaner):
+    properties = {"followtaxonomy":"true","namewind":None,"namewoind":None}
+    first = {"properties":dict(properties,scientificname="Puma  concolor")}
+    second = {"properties":dict(properties,scientificname="puma concolor")}
+    blank = {"properties":dict(properties,scientificname="()")}
+    assert dedup.wormsKey(first) == dedup.wormsKey(second)
+    assert dedup.wormsKey(blank)[1] == "()"
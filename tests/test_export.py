@@ -0,0 +1,83 @@
+import json
+import pytest
+import pyarrow as pa
+import pyarrow.parquet as pq
+from tirutils import claim
+from tirutils import export
+from conftest import baseURL
+
+paths = ["registration.scientificName","itis.tsn","itis.commonnames","itis.hierarchySoFarWRanks.0","sgcn.swap2005","sgcn.stateLists","matchmethod","itis.notThere"]
+commonnames = [{"name":"mountain lion","language":"English"}]
+stateLists = [{"year":2015,"states":["Arizona","Florida"]}]
+
+
+def tirRows():
+    for recordID in range(1,8):
+        tirRow = {"id":recordID,"registration":{"scientificName":"Name "+str(recordID)},"matchmethod":"Exact Match"}
+        if recordID%2 == 1:
+            tirRow["itis"] = {"tsn":552479+recordID,"commonnames":commonnames,"hierarchySoFarWRanks":["$Kingdom:Animalia$"]}
+        if recordID == 4:
+            tirRow["sgcn"] = {"swap2005":True,"stateLists":stateLists}
+        yield tirRow
+
+
+@pytest.mark.parametrize("fileFormat",export.fileFormats)
+def test_roundTrip(gc2,tmp_path,fileFormat):
+    gc2.loadTIR(tirRows())
+    path = str(tmp_path/"exports"/("tir."+fileFormat))
+    assert export.exportTIR(baseURL,path,paths,pageSize=3,fileFormat=fileFormat) == 7
+
+    table = export.openExport(path)
+    assert table.schema == export.exportSchema(paths)
+    assert table.column_names == ["id","registration_scientificname","itis_tsn","itis_commonnames","itis_hierarchysofarwranks_0","sgcn_swap2005","sgcn_statelists","matchmethod","itis_notthere"]
+    assert table.schema.field("id").type == pa.int64()
+    assert all([field.type == pa.string() for field in table.schema if field.name != "id"])
+
+    exported = table.to_pandas().set_index("id")
+    assert list(exported.index) == [1,2,3,4,5,6,7]
+    assert exported.loc[3,"registration_scientificname"] == "Name 3"
+    # Numbers and booleans come out as text, JSON lists and objects as JSON text, and missing paths as nulls
+    assert exported.loc[3,"itis_tsn"] == "552482"
+    assert json.loads(exported.loc[3,"itis_commonnames"]) == commonnames
+    assert exported.loc[3,"itis_hierarchysofarwranks_0"] == "$Kingdom:Animalia$"
+    assert exported.loc[4,"sgcn_swap2005"] == "true"
+    assert json.loads(exported.loc[4,"sgcn_statelists"]) == stateLists
+    assert exported.loc[2,["itis_tsn","itis_commonnames","sgcn_swap2005"]].isna().all()
+    assert exported["itis_notthere"].isna().all()
+    assert (exported["matchmethod"] == "Exact Match").all()
+
+    # Just the columns asked for
+    assert export.openExport(path,["id","itis_tsn"]).column_names == ["id","itis_tsn"]
+    if fileFormat == "parquet":
+        # One row group per page
+        assert pq.ParquetFile(path).num_row_groups == 3
+
+
+def test_whereClauseAndMaxRecords(gc2,tmp_path):
+    gc2.loadTIR(tirRows())
+    path = str(tmp_path/"tir.parquet")
+    assert export.exportTIR(baseURL,path,["itis.tsn"],"itis IS NOT NULL",pageSize=2,maxRecords=3) == 3
+    assert export.openExport(path).column("id").to_pylist() == [1,3,5]
+
+
+def test_failedExportKeepsTheLastFile(gc2,tmp_path,monkeypatch):
+    gc2.loadTIR(tirRows())
+    path = str(tmp_path/"tir.parquet")
+    export.exportTIR(baseURL,path,["itis.tsn"])
+
+    pendingRecords = claim.pendingRecords
+
+    def failingRecords(*args):
+        yield from list(pendingRecords(*args))[:2]
+        raise Exception("connection reset")
+
+    monkeypatch.setattr(claim,"pendingRecords",failingRecords)
+    with pytest.raises(Exception,match="connection reset"):
+        export.exportTIR(baseURL,path,["itis.tsn"],pageSize=1)
+    assert export.openExport(path).num_rows == 7
+    assert not (tmp_path/"tir.parquet.tmp").exists()
+
+
+def test_badFileFormat(tmp_path):
+    with pytest.raises(ValueError):
+        export.exportTIR(baseURL,str(tmp_path/"tir.csv"),["itis.tsn"],fileFormat="csv")
@@ -0,0 +1,35 @@
+import random
+from tirutils import fuzzynames
+from tirutils import itisbatch
+
+
+def test_boundedEditDistanceAgreesWithEditDistance():
+    randomNames = random.Random(0)
+    for pair in range(500):
+        a = "".join(randomNames.choice("abc") for character in range(randomNames.randint(0,8)))
+        b = "".join(randomNames.choice("abc") for character in range(randomNames.randint(0,8)))
+        for maxEdits in [0,1,2]:
+            assert fuzzynames.boundedEditDistance(a,b,maxEdits) == min(itisbatch.editDistance(a,b),maxEdits+1)
+
+
+def test_candidatesWithinTheEditLimit():
+    nameIndex = fuzzynames.NameIndex()
+    nameIndex.add("Puma concolor","180577")
+    nameIndex.add("Lynx rufus","180582")
+    nameIndex.add("Lynx canadensis","180581")
+    nameIndex.add("  ",1)
+    nameIndex.add(None,2)
+    assert len(nameIndex) == 3
+
+    matches = nameIndex.candidates("Puma concolr")
+    assert matches == [{"name":"Puma concolor","key":"180577","score":round(1-1/13,4),"edits":1}]
+    assert nameIndex.bestMatch("lynx rufuss")["key"] == "180582"
+    assert nameIndex.candidates("Ursus americanus") == []
+
+
+def test_bestMatchNeedsASingleCandidate():
+    nameIndex = fuzzynames.NameIndex()
+    nameIndex.add("Sorex cinereus","1")
+    nameIndex.add("Sorex cinereas","2")
+    assert len(nameIndex.candidates("Sorex cinereos")) == 2
+    assert nameIndex.bestMatch("Sorex cinereos") is None
@@ -0,0 +1,88 @@
+import pytest
+from urllib.parse import urlparse,parse_qsl
+from tirutils import claim
+from tirutils import itisbatch
+from tirutils import lookups
+from tirutils import responsecache
+from benchmarks import synthetic
+from conftest import baseURL
+
+
+def test_unreadableBatchRaisesInsteadOfMatchingNothing(monkeypatch):
+    monkeypatch.setattr(responsecache,"cachedGet",lambda url: responsecache.CachedResponse(400,None))
+    with pytest.raises(lookups.LookupFailed):
+        itisbatch.docsByName(["Puma concolor","Lynx rufus"])
+    with pytest.raises(lookups.LookupFailed):
+        itisbatch.docsByTSN([180577])
+
+
+selectColumns = "registration->>'source' AS source, registration->>'followTaxonomy' AS followtaxonomy, registration->>'taxonomicLookupProperty' AS taxonomiclookupproperty, registration->>'scientificname' AS scientificname, registration->>'tsn' AS tsn"
+
+
+@pytest.fixture
+def solr(monkeypatch,standInBis):
+    # The benchmark's ITIS Solr stand-in behind responsecache.cachedGet, keeping the query of every request
+    taxonomy = synthetic.Taxonomy(300)
+    responder = synthetic.itisResponder(taxonomy)
+    queries = []
+
+    def cachedGet(url,**kwargs):
+        params = parse_qsl(urlparse(url).query)
+        queries.append(dict(params)["q"])
+        statusCode,body = responder("GET","/",params)
+        return responsecache.CachedResponse(statusCode,body)
+
+    monkeypatch.setattr(responsecache,"cachedGet",cachedGet)
+    monkeypatch.setattr(responsecache,"activeCache",None)
+    taxonomy.queries = queries
+    return taxonomy
+
+
+def withoutCacheDate(itisData):
+    return {key:value for key,value in itisData.items() if key != "cacheDate"}
+
+
+def test_pageMatchesPerRecordLookups(gc2,solr):
+    gc2.loadTIR(synthetic.registrations(solr,300,tsnRate=0.1,seed=3))
+    tirRecords = list(claim.pendingRecords(baseURL,selectColumns,"itis IS NULL",300))
+    expected = [lookups.lookupITIS(tirRecord) for tirRecord in tirRecords]
+    numRecordQueries = len(solr.queries)
+    thisRecords = itisbatch.lookupITISPage(tirRecords,25)
+
+    assert [thisRecord["id"] for thisRecord in thisRecords] == [tirRecord["properties"]["id"] for tirRecord in tirRecords]
+    for thisRecord,expectedRecord in zip(thisRecords,expected):
+        assert thisRecord["matchMethod"] == expectedRecord["matchMethod"]
+        assert thisRecord["matchString"] == expectedRecord["matchString"]
+        assert withoutCacheDate(thisRecord["itisData"]) == withoutCacheDate(expectedRecord["itisData"])
+    # The synthetic names cover every way a record can be matched
+    assert set([thisRecord["matchMethod"] for thisRecord in thisRecords]) == {"Exact Match","Fuzzy Match","Followed Accepted TSN","TSN Query","Not Matched"}
+    assert len(solr.queries)-numRecordQueries < numRecordQueries/10
+
+
+def test_batchesSplitAtTheBatchSize(solr):
+    searchNames = solr.names[:45]
+    matches = itisbatch.docsByName(searchNames,False,20)
+    assert [query.count(" OR ")+1 for query in solr.queries] == [20,20,5]
+    assert all([query.startswith("nameWOInd:(") for query in solr.queries])
+    assert all([itisDoc["nameWOInd"].lower() == name.lower() for name in searchNames for itisDoc in matches[name]])
+
+    solr.queries.clear()
+    itisbatch.docsByTSN([solr.tsn(name) for name in searchNames],20)
+    assert [query.count(" OR ")+1 for query in solr.queries] == [20,20,5]
+
+
+def test_batchSplitsWhenSolrCutsItShort(monkeypatch):
+    # A Solr that never sends back more than three docs, so batches of more than three names get split
+    queries = []
+
+    def cachedGet(url,**kwargs):
+        q = dict(parse_qsl(urlparse(url).query))["q"]
+        queries.append(q)
+        terms = [term.replace("\\","") for term in q.split(":",1)[1].strip("()").split(" OR ")]
+        return responsecache.CachedResponse(200,{"response":{"numFound":len(terms),"docs":[{"nameWOInd":term} for term in terms][:3]}})
+
+    monkeypatch.setattr(responsecache,"cachedGet",cachedGet)
+    searchNames = ["Name "+str(index) for index in range(8)]
+    matches = itisbatch.docsByName(searchNames,False,8)
+    assert [query.count(" OR ")+1 for query in queries] == [8,4,2,2,4,2,2]
+    assert all([len(matches[name]) == 1 for name in searchNames])
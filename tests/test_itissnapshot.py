@@ -0,0 +1,99 @@
+import sqlite3
+import pytest
+from tirutils import itissnapshot
+from tirutils import itisbatch
+
+# A small ITIS download: Animalia, two genera, an accepted name with a vernacular, a synonym pointing at it and an
+# accepted name in the other genus
+units = [
+    (202423,None,"Animalia",None,None,None,None,None,None,"valid",None,"TWG standards met",None,None,5,10,None,None,"1996-06-13","2017-01-01"),
+    (552478,None,"Puma",None,None,None,None,None,None,"valid",None,"TWG standards met",None,None,5,180,202423,1,"2002-03-25","2017-01-01"),
+    (552479,None,"Puma",None,"concolor",None,None,None,None,"valid",None,"TWG standards met",None,None,5,220,552478,2,"2002-03-25","2017-01-01"),
+    (180587,None,"Felis",None,"concolor",None,None,None,None,"invalid","synonym","TWG standards met",None,None,5,220,180581,2,"1996-06-13","2017-01-01"),
+    (180581,None,"Felis",None,None,None,None,None,None,"valid",None,"TWG standards met",None,None,5,180,202423,1,"1996-06-13","2017-01-01"),
+    (180582,None,"Lynx",None,"rufus",None,None,None,None,"valid",None,"TWG standards met",None,None,5,220,180581,3,"1996-06-13","2017-01-01")
+]
+
+
+@pytest.fixture
+def snapshotPath(tmp_path):
+    exportPath = str(tmp_path/"ITIS.sqlite")
+    export = sqlite3.connect(exportPath)
+    export.execute("CREATE TABLE kingdoms (kingdom_id INTEGER, kingdom_name TEXT)")
+    export.execute("CREATE TABLE taxon_unit_types (kingdom_id INTEGER, rank_id INTEGER, rank_name TEXT)")
+    export.execute("CREATE TABLE taxon_authors_lkp (taxon_author_id INTEGER, taxon_author TEXT)")
+    export.execute("CREATE TABLE taxonomic_units (tsn INTEGER, unit_ind1 TEXT, unit_name1 TEXT, unit_ind2 TEXT, unit_name2 TEXT, unit_ind3 TEXT, unit_name3 TEXT, unit_ind4 TEXT, unit_name4 TEXT, name_usage TEXT, unaccept_reason TEXT, credibility_rtng TEXT, completeness_rtng TEXT, currency_rating TEXT, kingdom_id INTEGER, rank_id INTEGER, parent_tsn INTEGER, taxon_author_id INTEGER, initial_time_stamp TEXT, update_date TEXT)")
+    export.execute("CREATE TABLE synonym_links (tsn INTEGER, tsn_accepted INTEGER)")
+    export.execute("CREATE TABLE vernaculars (tsn INTEGER, vernacular_name TEXT, language TEXT, approved_ind TEXT, vern_id INTEGER, update_date TEXT)")
+    export.execute("CREATE TABLE hierarchy (hierarchy_string TEXT, TSN INTEGER, Parent_TSN INTEGER, level INTEGER, ChildrenCount INTEGER)")
+    export.execute("INSERT INTO kingdoms VALUES (5,'Animalia')")
+    export.executemany("INSERT INTO taxon_unit_types VALUES (?,?,?)",[(5,10,"Kingdom "),(5,180,"Genus "),(5,220,"Species ")])
+    export.executemany("INSERT INTO taxon_authors_lkp VALUES (?,?)",[(1,"Jardine, 1834"),(2,"(Linnaeus, 1771)"),(3,"(Schreber, 1777)")])
+    export.executemany("INSERT INTO taxonomic_units VALUES ("+",".join(["?"]*20)+")",units)
+    export.execute("INSERT INTO synonym_links VALUES (180587,552479)")
+    export.executemany("INSERT INTO vernaculars VALUES (?,?,?,?,?,?)",[(552479,"mountain lion","English","N",1,"2003-04-15"),(552479,"puma","Spanish",None,2,"2003-04-15")])
+    export.executemany("INSERT INTO hierarchy VALUES (?,?,?,?,?)",[("202423",202423,None,0,3),("202423-552478",552478,202423,1,1),("202423-552478-552479",552479,552478,2,0),("202423-180581-180582",180582,180581,2,0)])
+    export.commit()
+    export.close()
+
+    snapshotPath = str(tmp_path/"snapshot"/"itis.sqlite")
+    assert itissnapshot.buildSnapshot(exportPath,snapshotPath,batchSize=4) == len(units)
+    return snapshotPath
+
+
+def test_buildSnapshotDocs(snapshotPath):
+    snapshot = itissnapshot.ITISSnapshot(snapshotPath)
+    itisDoc = snapshot.docsByTSN([552479])["552479"]
+    assert itisDoc["nameWInd"] == "Puma concolor"
+    assert itisDoc["unit1"] == "Puma" and itisDoc["unit2"] == "concolor"
+    assert itisDoc["rank"] == "Species"
+    assert itisDoc["kingdom"] == "Animalia"
+    assert itisDoc["parentTSN"] == "552478"
+    assert itisDoc["author"] == "(Linnaeus, 1771)"
+    assert itisDoc["vernacular"] == ["$mountain lion$English$N$1$2003-04-15$","$puma$Spanish$$2$2003-04-15$"]
+    assert itisDoc["hierarchyTSN"] == ["$202423$552478$552479$"]
+    assert itisDoc["hierarchySoFarWRanks"] == ["$Kingdom:Animalia$Genus:Puma$Species:Puma concolor$"]
+    assert "acceptedTSN" not in itisDoc
+
+    synonymDoc = snapshot.docsByTSN(["180587"])["180587"]
+    assert synonymDoc["usage"] == "invalid"
+    assert synonymDoc["unacceptReason"] == "synonym"
+    assert synonymDoc["acceptedTSN"] == ["552479"]
+    # Unknown TSNs are left out the way Solr leaves them out
+    assert snapshot.docsByTSN([1,552479,"552479"]).keys() == {"552479"}
+    snapshot.close()
+
+
+def test_exactAndFuzzyNames(snapshotPath):
+    snapshot = itissnapshot.ITISSnapshot(snapshotPath)
+    exactDocs = snapshot.docsByName(["puma CONCOLOR","Lynx rufa","Puma"])
+    assert [itisDoc["tsn"] for itisDoc in exactDocs["puma CONCOLOR"]] == ["552479"]
+    assert exactDocs["Lynx rufa"] == []
+    assert [itisDoc["rank"] for itisDoc in exactDocs["Puma"]] == ["Genus"]
+
+    fuzzyDocs = snapshot.docsByName(["Lynx rufa","Pumma concolor","Pama conclor"],True)
+    assert [itisDoc["tsn"] for itisDoc in fuzzyDocs["Lynx rufa"]] == ["180582"]
+    # Same final epithet, so both concolors are candidates and only the close one is kept
+    assert [itisDoc["tsn"] for itisDoc in fuzzyDocs["Pumma concolor"]] == ["552479"]
+    # Neither word matches, which is the documented gap against Solr
+    assert fuzzyDocs["Pama conclor"] == []
+    assert all([itisbatch.fuzzyMatches("lynx rufa",itisDoc["nameWOInd"].lower()) for itisDoc in fuzzyDocs["Lynx rufa"]])
+    snapshot.close()
+
+
+def test_lookupITISPageAgainstTheSnapshot(snapshotPath,standInBis):
+    snapshot = itissnapshot.ITISSnapshot(snapshotPath)
+    registrations = [
+        ("Puma concolor",True,"scientificname",None),
+        ("Lynx rufa",True,"scientificname",None),
+        ("Felis concolor",True,"scientificname",None),
+        ("Felis concolor",False,"scientificname",None),
+        ("Made up",True,"tsn",180582),
+        ("Nothing like it",True,"scientificname",None)
+    ]
+    tirRecords = [{"properties":{"id":recordID,"source":"Test","followtaxonomy":followTaxonomy,"taxonomiclookupproperty":lookupProperty,"scientificname":name,"tsn":tsn}} for recordID,(name,followTaxonomy,lookupProperty,tsn) in enumerate(registrations,start=1)]
+    thisRecords = itisbatch.lookupITISPage(tirRecords,2,snapshot)
+
+    assert [thisRecord["matchMethod"] for thisRecord in thisRecords] == ["Exact Match","Fuzzy Match","Followed Accepted TSN","Exact Match","TSN Query","Not Matched"]
+    assert [thisRecord["itisData"].get("tsn") for thisRecord in thisRecords] == ["552479","180582","552479","180587","180582",None]
+    snapshot.close()
@@ -0,0 +1,47 @@
+import pytest
+from tirutils import journal
+from conftest import baseURL
+
+
+def changedIDs(afterSeq):
+    return [tirRecord["properties"]["id"] for tirRecord in journal.changedRecords(baseURL,"itis","itis IS NOT NULL",["itis","sgcn"],afterSeq,2)]
+
+
+def test_changedRecordsInJournalOrder(gc2):
+    gc2.loadTIR([{"id":recordID,"itis":{"tsn":str(recordID)}} for recordID in range(1,6)])
+    journal.ensureJournal(baseURL)
+    assert journal.currentSeq(baseURL) == 0
+    journal.recordChanges(baseURL,[3,1],"itis")
+    journal.recordChanges(baseURL,[2],"tess")
+    journal.recordChanges(baseURL,[4,3],"sgcn")
+    assert journal.currentSeq(baseURL) == 5
+    # Record 3 shows up once, at its latest journal entry
+    assert changedIDs(0) == [1,4,3]
+    assert changedIDs(2) == [4,3]
+
+
+def test_pruneJournalKeepsEntriesPastTheWatermark(gc2,tmp_path):
+    gc2.loadTIR([{"id":recordID,"itis":{"tsn":str(recordID)}} for recordID in range(1,6)])
+    journal.ensureJournal(baseURL)
+    journal.recordChanges(baseURL,[1,2,3],"itis")
+    watermarkFile = str(tmp_path/"watermark.json")
+    assert journal.readWatermark(watermarkFile) == 0
+    journal.writeWatermark(watermarkFile,journal.currentSeq(baseURL))
+    journal.recordChanges(baseURL,[5],"itis")
+
+    assert journal.pruneJournal(baseURL,journal.readWatermark(watermarkFile))["success"]
+    assert gc2.execute("SELECT count(*) AS num FROM tir.journal")[1]["features"][0]["properties"]["num"] == 1
+    assert changedIDs(journal.readWatermark(watermarkFile)) == [5]
+    # Sequence numbers carry on after a prune, so the watermark stays valid
+    journal.recordChanges(baseURL,[1],"itis")
+    assert journal.currentSeq(baseURL) == 5
+
+
+def test_changedRecordsRaisesOnError(gc2):
+    journal.ensureJournal(baseURL)
+    journal.recordChanges(baseURL,[1],"itis")
+    with pytest.raises(Exception,match="no such column"):
+        list(journal.changedRecords(baseURL,"itis","no_such_column IS NULL",["itis"]))
+    gc2.execute("DROP TABLE tir.journal")
+    with pytest.raises(Exception,match="no such table"):
+        journal.currentSeq(baseURL)
@@ -0,0 +1,91 @@
+import sys,types
+import pytest
+from tirutils import lookups
+from tirutils import ratelimit
+from tirutils import responsecache
+
+
+@pytest.fixture
+def bisTESS(monkeypatch):
+    # A bis.tess that hands back whatever result the test sets
+    tess = types.ModuleType("bis.tess")
+    tess.result = {"result":False}
+    tess.queryTESS = lambda queryType=None,queryValue=None: dict(tess.result)
+    bis = types.ModuleType("bis")
+    bis.tess = tess
+    monkeypatch.setitem(sys.modules,"bis",bis)
+    monkeypatch.setitem(sys.modules,"bis.tess",tess)
+    monkeypatch.setattr(ratelimit,"limiters",{})
+    ratelimit.configure(lookups.tessHost,failureThreshold=1)
+    return tess
+
+
+def test_queryTESSRaisesRecordErrorsForTheRecord(bisTESS):
+    bisTESS.result = {"result":False,"errorMessage":"not well-formed (invalid token): line 1, column 2"}
+    with pytest.raises(lookups.LookupFailed):
+        lookups.queryTESS("SCINAME","Puma concolor")
+    assert ratelimit.limiterFor(lookups.tessHost).summary()["circuit"] == "closed"
+
+
+def test_queryTESSRaisesTransportErrorsForTheHost(bisTESS):
+    bisTESS.result = {"result":False,"errorMessage":"('Connection aborted.', RemoteDisconnected('Remote end closed connection'))"}
+    with pytest.raises(ratelimit.UpstreamUnavailable):
+        lookups.queryTESS("SCINAME","Puma concolor")
+    assert ratelimit.limiterFor(lookups.tessHost).summary()["circuit"] == "open"
+
+
+def test_queryTESS(bisTESS):
+    bisTESS.result = {"result":True,"SCINAME":"Puma concolor"}
+    assert lookups.queryTESS("SCINAME","Puma concolor")["result"]
+
+
+@pytest.fixture
+def bisNatureServe(monkeypatch,tmp_path):
+    natureserve = types.ModuleType("bis.natureserve")
+    natureserve.result = None
+    natureserve.queryNatureServeID = lambda name: natureserve.result
+    bis = types.ModuleType("bis")
+    bis.natureserve = natureserve
+    monkeypatch.setitem(sys.modules,"bis",bis)
+    monkeypatch.setitem(sys.modules,"bis.natureserve",natureserve)
+    monkeypatch.setattr(ratelimit,"limiters",{})
+    ratelimit.configure(lookups.natureServeHost,failureThreshold=1)
+    responseCache = responsecache.ResponseCache(str(tmp_path/"responses.sqlite"))
+    monkeypatch.setattr(responsecache,"activeCache",responseCache)
+    yield natureserve
+    responseCache.close()
+
+
+def cachedNatureServeID(name):
+    return responsecache.cachedCall("natureserve.queryNatureServeID",lookups.queryNatureServeID,name)
+
+
+def test_natureServeErrorsAreNotCachedAsNoMatch(bisNatureServe):
+    bisNatureServe.result = {"errorMessage":"HTTPSConnectionPool(host='services.natureserve.org'): Read timed out."}
+    with pytest.raises(ratelimit.UpstreamUnavailable):
+        cachedNatureServeID("Puma concolor")
+    assert ratelimit.limiterFor(lookups.natureServeHost).summary()["circuit"] == "open"
+
+    ratelimit.configure(lookups.natureServeHost,failureThreshold=1)
+    bisNatureServe.result = {"errorMessage":"syntax error: line 1, column 0"}
+    with pytest.raises(lookups.LookupFailed):
+        cachedNatureServeID("Puma concolor")
+    assert responsecache.activeCache.summary()["entries"] == 0
+
+    # Once the service answers, the ID (or None for no match) is what gets cached
+    bisNatureServe.result = "ELEMENT_GLOBAL.2.102191"
+    assert cachedNatureServeID("Puma concolor") == "ELEMENT_GLOBAL.2.102191"
+    bisNatureServe.result = None
+    assert cachedNatureServeID("Puma concolor") == "ELEMENT_GLOBAL.2.102191"
+    assert cachedNatureServeID("Felis concolor") is None
+    assert responsecache.activeCache.summary()["entries"] == 2
+
+
+def test_unreadableITISSearchRaises(monkeypatch,standInBis):
+    # An error page from Solr is not a search that found nothing
+    monkeypatch.setattr(responsecache,"cachedGet",lambda url: responsecache.CachedResponse(500,{"error":{"msg":"undefined field"}}))
+    tirRecord = {"properties":{"id":1,"source":"SGCN","followtaxonomy":"true","taxonomiclookupproperty":"scientificname","scientificname":"Puma concolor","tsn":None}}
+    with pytest.raises(lookups.LookupFailed,match="KeyError"):
+        lookups.lookupITIS(tirRecord)
+    with pytest.raises(lookups.LookupFailed):
+        lookups.lookupITIS({"properties":dict(tirRecord["properties"],taxonomiclookupproperty="tsn",tsn="552479")})
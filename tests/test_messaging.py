@@ -0,0 +1,51 @@
+import pytest
+from tirutils import writer
+from tirutils import pipeline
+from tirutils import messaging
+from tirutils import ratelimit
+from conftest import baseURL
+
+
+def event(recordID):
+    return {"id":recordID,"registration":{"scientificname":"Name "+str(recordID)},"itis":{"tsn":str(recordID)},"worms":None,"tess":None,"natureserve":None,"sgcn":None}
+
+
+def wormsStandIn(records):
+    # Fills in WoRMS for every record except 3, which raises, and 4, which gets nothing back
+    for record in records:
+        if record["id"] == 3:
+            raise KeyError("valid_name")
+        if record["id"] != 4:
+            pipeline.fillBucket(record,"worms",{"MatchMethod":"Exact Match"},"Exact Match")
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    monkeypatch.setattr(writer,"sqlExecute",lambda baseURL,q: {"success":True})
+    broker = messaging.LocalBroker(1)
+    for recordID in range(1,7):
+        broker.produce("tir.itis",str(recordID),event(recordID))
+    return broker
+
+
+def test_badEventsAreDeadLetteredAndCommitted(broker):
+    worker = messaging.ProcessorWorker(broker,"WoRMS",wormsStandIn,writer.TIRWriter(baseURL,{"worms":"json"}),10,0)
+    assert worker.runOnce() == 6
+
+    summary = worker.summary()
+    assert (summary["produced"],summary["written"],summary["lookupErrors"],summary["noResult"],summary["deadLettered"]) == (4,4,1,1,2)
+    assert broker.lag("tir-worms","tir.itis") == 0
+    deadLetters = {key:value for key,value in broker.partitions(messaging.deadLetterTopic)[0]}
+    assert sorted(deadLetters.keys()) == ["3","4"]
+    assert '"reason": "KeyError: \'valid_name\'"' in deadLetters["3"]
+    assert '"reason": "No result"' in deadLetters["4"]
+
+
+def test_upstreamTroubleLeavesTheBatchUncommitted(broker):
+    def upstreamDown(records):
+        raise ratelimit.UpstreamUnavailable("www.marinespecies.org","returned 503")
+
+    worker = messaging.ProcessorWorker(broker,"WoRMS",upstreamDown,writer.TIRWriter(baseURL,{"worms":"json"}),10,0)
+    with pytest.raises(ratelimit.UpstreamUnavailable):
+        worker.runOnce()
+    assert broker.lag("tir-worms","tir.itis") == 6
@@ -0,0 +1,79 @@
+import json
+import pytest
+from tirutils import metrics
+
+
+class FakeCache:
+
+    def summary(self):
+        return {"hits":3,"misses":1,"hitRate":0.75}
+
+
+@pytest.fixture
+def runMetrics(monkeypatch):
+    monkeypatch.setattr(metrics,"activeRun",None)
+    runMetrics = metrics.startRun("ITIS")
+    for matchMethod in ["Exact Match","Exact Match","Fuzzy Match",None]:
+        runMetrics.recordProcessed(matchMethod)
+    metrics.observeRequest("services.itis.gov",0.03,200)
+    metrics.observeRequest("services.itis.gov",0.3,200)
+    metrics.observeRequest("services.itis.gov",40,503)
+    metrics.observeRequest("gc2.test",0.07,None)
+    runMetrics.observeRetry("services.itis.gov")
+    runMetrics.observeRetry("services.itis.gov")
+    runMetrics.addCache("responses",FakeCache())
+    return runMetrics
+
+
+def test_jsonExport(runMetrics,tmp_path):
+    path = str(tmp_path/"metrics"/"itis.json")
+    runMetrics.export(path)
+    with open(path) as f:
+        summary = json.load(f)
+
+    assert summary["processor"] == "ITIS"
+    assert summary["records"] == 4
+    assert summary["matchMethods"] == {"Exact Match":2,"Fuzzy Match":1}
+    assert summary["retries"] == {"ITIS Solr":2}
+    assert summary["upstream"]["ITIS Solr"]["requests"] == 3
+    assert summary["upstream"]["ITIS Solr"]["errors"] == 1
+    assert summary["upstream"]["ITIS Solr"]["meanSeconds"] == 13.4433
+    assert summary["upstream"]["ITIS Solr"]["latencyHistogram"] == {"0.05":1,"0.1":0,"0.25":0,"0.5":1,"1":0,"2.5":0,"5":0,"10":0,"30":0,"+Inf":1}
+    # Hosts without a name are reported by host, and a request that got no response is an error
+    assert summary["upstream"]["gc2.test"]["errors"] == 1
+    assert summary["caches"] == {"responses":{"hits":3,"misses":1,"hitRate":0.75}}
+
+
+def test_prometheusExport(runMetrics,tmp_path):
+    path = str(tmp_path/"itis.prom")
+    runMetrics.export(path)
+    with open(path) as f:
+        text = f.read()
+    lines = text.splitlines()
+    samples = dict([line.rsplit(" ",1) for line in lines if not line.startswith("#")])
+
+    assert text.endswith("\n")
+    assert samples['tir_records_processed_total{processor="ITIS"}'] == "4"
+    assert samples['tir_match_method_total{processor="ITIS",method="Exact Match"}'] == "2"
+    assert samples['tir_upstream_retries_total{processor="ITIS",upstream="ITIS Solr"}'] == "2"
+    assert samples['tir_upstream_errors_total{processor="ITIS",upstream="ITIS Solr"}'] == "1"
+    # Histogram buckets are cumulative and end with +Inf equal to the count
+    bucketCounts = [int(samples['tir_upstream_request_seconds_bucket{processor="ITIS",upstream="ITIS Solr",le="'+str(bucket)+'"}']) for bucket in metrics.latencyBuckets+["+Inf"]]
+    assert bucketCounts == [1,1,1,2,2,2,2,2,2,3]
+    assert samples['tir_upstream_request_seconds_count{processor="ITIS",upstream="ITIS Solr"}'] == "3"
+    assert samples['tir_upstream_request_seconds_sum{processor="ITIS",upstream="ITIS Solr"}'] == "40.33"
+    assert samples['tir_cache_hit_rate{processor="ITIS",cache="responses"}'] == "0.75"
+    # Every sample follows a TYPE line for its metric family
+    families = [line.split(" ")[2] for line in lines if line.startswith("# TYPE")]
+    assert all([any([line.startswith(family) for family in families]) for line in lines if not line.startswith("#")])
+
+
+def test_timedCountsErrors(runMetrics):
+    with metrics.timed("ecos.fws.gov"):
+        pass
+    with pytest.raises(ValueError):
+        with metrics.timed("ecos.fws.gov"):
+            raise ValueError("bad response")
+    summary = runMetrics.summary()["upstream"]["TESS"]
+    assert summary["requests"] == 2
+    assert summary["errors"] == 1
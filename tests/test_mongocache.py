@@ -0,0 +1,89 @@
+import threading
+import pytest
+import mongomock
+from pymongo import UpdateOne
+from tirutils import mongocache
+
+
+class RecordingCollection:
+    # A mongomock collection that keeps the operations of every bulk_write
+
+    def __init__(self,collection):
+        self.collection = collection
+        self.bulkWrites = []
+
+    def find(self,*args,**kwargs):
+        return self.collection.find(*args,**kwargs)
+
+    def bulk_write(self,operations,ordered=True):
+        self.bulkWrites.append({"operations":list(operations),"ordered":ordered})
+        return self.collection.bulk_write(operations,ordered=ordered)
+
+
+@pytest.fixture
+def collection():
+    collection = mongomock.MongoClient().bis.tesscache
+    collection.insert_many([{"_id":documentID,"searchURL":"https://ecos.fws.gov/?tsn="+str(documentID),"notes":"x"*100} for documentID in range(1,26)])
+    return RecordingCollection(collection)
+
+
+def test_processCollectionProjectsAndBatches(collection):
+    fetchedFields = []
+    lock = threading.Lock()
+
+    def fetchFunction(document):
+        with lock:
+            fetchedFields.append(sorted(document.keys()))
+        return {"result":document["searchURL"].split("=")[1]}
+
+    summary = mongocache.processCollection(collection,{"result":{"$exists":False}},fetchFunction,{"searchURL":1},maxWorkers=4,cursorBatchSize=7,writeBatchSize=10)
+
+    assert summary["processed"] == 25
+    assert summary["written"] == 25
+    assert summary["batches"] == 3
+    assert fetchedFields == [["_id","searchURL"]]*25
+    assert [len(bulkWrite["operations"]) for bulkWrite in collection.bulkWrites] == [10,10,5]
+    assert all([isinstance(operation,UpdateOne) for bulkWrite in collection.bulkWrites for operation in bulkWrite["operations"]])
+    assert not any([bulkWrite["ordered"] for bulkWrite in collection.bulkWrites])
+    assert collection.find({"_id":7})[0]["result"] == "7"
+    # Nothing left to do on a second run
+    assert mongocache.processCollection(collection,{"result":{"$exists":False}},fetchFunction,{"searchURL":1})["processed"] == 0
+
+
+def test_failedFetchesStayPending(collection):
+    def fetchFunction(document):
+        if document["_id"]%5 == 0:
+            raise ValueError("could not parse response")
+        if document["_id"] == 3:
+            return None
+        return {"result":True}
+
+    summary = mongocache.processCollection(collection,{"result":{"$exists":False}},fetchFunction,{"searchURL":1},writeBatchSize=4)
+    assert summary["processed"] == 25
+    assert summary["fetchErrors"] == {"ValueError":5}
+    assert summary["written"] == 19
+    pendingIDs = sorted([document["_id"] for document in collection.find({"result":{"$exists":False}})])
+    assert pendingIDs == [3,5,10,15,20,25]
+
+
+def test_bulkWriteErrorsAreCountedPerDocument(collection):
+    collection.collection.create_index("key",unique=True,sparse=True)
+    mongoWriter = mongocache.MongoCacheWriter(collection,batchSize=10)
+    for documentID,key in [(1,"a"),(2,"a"),(3,"b"),(4,"c"),(5,"b")]:
+        mongoWriter.write(documentID,{"key":key})
+    summary = mongoWriter.close()
+
+    assert summary["batches"] == 1
+    assert summary["written"] == 3
+    assert summary["failed"] == 2
+    assert sorted([failure["id"] for failure in summary["failures"]]) == [2,5]
+    assert summary["modified"] == 3
+    assert collection.find({"_id":2})[0].get("key") is None
+
+
+def test_writerUpserts(collection):
+    with mongocache.MongoCacheWriter(collection,batchSize=2,upsert=True) as mongoWriter:
+        mongoWriter.write(100,{"searchURL":"new"})
+        mongoWriter.write(1,{"result":False})
+    assert mongoWriter.summary()["upserted"] == 1
+    assert collection.find({"_id":100})[0]["searchURL"] == "new"
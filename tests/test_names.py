@@ -0,0 +1,27 @@
+import pandas as pd
+from tirutils import names
+
+
+def test_canonicalKey(cleaner):
+    assert names.canonicalKey("Puma  (concolor)") == names.canonicalKey("puma concolor")
+    assert names.canonicalKey("Bombus affinis-x") == "bombus affinis x"
+    assert names.canonicalKey("Cnemidophorus gulariś") == "cnemidophorus gularis"
+    assert names.canonicalKey(None) == ""
+
+
+def test_cleanNamesCleansEachNameOnce():
+    calls = []
+
+    def countingCleaner(name):
+        calls.append(name)
+        return name.upper()
+
+    assert names.cleanNames(["a","b","a"],countingCleaner) == ["A","B","A"]
+    assert calls == ["a","b"]
+
+
+def test_cleanColumnKeepsMissingValues():
+    column = pd.Series(["a ","b",None,"a "])
+    cleaned = names.cleanColumn(column,lambda name: name.strip())
+    assert list(cleaned[[0,1,3]]) == ["a","b","a"]
+    assert pd.isna(cleaned[2])
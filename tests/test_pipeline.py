@@ -0,0 +1,115 @@
+import time
+import threading
+import pytest
+from tirutils import pipeline
+
+
+def tirRecords(numRecords):
+    for recordID in range(1,numRecords+1):
+        yield {"properties":{"id":recordID,"registration":'{"scientificname":"Name '+str(recordID)+'"}'}}
+
+
+def visit(name,visits,lock):
+    # Stage function that notes which stage saw each record and the size of each batch
+    def processRecords(records):
+        with lock:
+            visits.setdefault(name,[]).append(len(records))
+        for record in records:
+            record["updated"].append(name)
+    return processRecords
+
+
+def allThreads(thisPipeline):
+    return [thread for stage in thisPipeline.stages() for thread in stage.threads]
+
+
+def test_recordsGoThroughEveryLevel():
+    visits = {}
+    lock = threading.Lock()
+    thisPipeline = pipeline.Pipeline([
+        pipeline.Stage("first",visit("first",visits,lock),workers=2,batchSize=5),
+        [pipeline.Stage("left",visit("left",visits,lock),workers=3),pipeline.Stage("right",visit("right",visits,lock))],
+        pipeline.Stage("last",visit("last",visits,lock),batchSize=4)
+    ])
+    records = list(thisPipeline.run(tirRecords(60)))
+
+    assert sorted([record["id"] for record in records]) == list(range(1,61))
+    for record in records:
+        assert record["updated"][0] == "first"
+        assert sorted(record["updated"][1:3]) == ["left","right"]
+        assert record["updated"][3] == "last"
+        assert record["registration"]["scientificname"] == "Name "+str(record["id"])
+    assert max(visits["first"]) <= 5 and sum(visits["first"]) == 60
+    assert max(visits["last"]) <= 4 and sum(visits["last"]) == 60
+    # A record only moves on once both stages working side by side are done with it
+    assert thisPipeline.joins == {}
+    assert {name:summary["records"] for name,summary in thisPipeline.summary().items()} == {"first":60,"left":60,"right":60,"last":60}
+    assert not any([thread.is_alive() for thread in allThreads(thisPipeline)])
+
+
+def test_queuesHoldBackTheFeed():
+    released = threading.Event()
+    pulled = []
+
+    def countedRecords():
+        for tirRecord in tirRecords(50):
+            pulled.append(tirRecord["properties"]["id"])
+            yield tirRecord
+
+    def blocked(records):
+        released.wait()
+
+    thisPipeline = pipeline.Pipeline([pipeline.Stage("first",lambda records: None,queueSize=2),pipeline.Stage("blocked",blocked,queueSize=2)],queueSize=2)
+    records = []
+    consumer = threading.Thread(target=lambda: records.extend(thisPipeline.run(countedRecords())))
+    consumer.start()
+
+    # Each stage has a record in hand and two waiting, and the feeder one more on its way in
+    deadline = time.time()+5
+    while len(pulled) < 7 and time.time() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.1)
+    assert len(pulled) == 7
+    assert thisPipeline.summary()["blocked"]["waiting"] == 2
+
+    released.set()
+    consumer.join(5)
+    assert not consumer.is_alive()
+    assert len(records) == 50
+
+
+def test_stageErrorsStayWithTheRecord():
+    def failing(records):
+        if any([record["id"]%3 == 0 for record in records]):
+            raise ValueError("upstream said no")
+        for record in records:
+            record["updated"].append("failing")
+
+    thisPipeline = pipeline.Pipeline([pipeline.Stage("failing",failing),pipeline.Stage("after",lambda records: None)])
+    records = {record["id"]:record for record in thisPipeline.run(tirRecords(9))}
+
+    assert len(records) == 9
+    assert records[3]["errors"] == {"failing":"upstream said no"}
+    assert records[3]["updated"] == []
+    assert records[4]["errors"] == {}
+    assert records[4]["updated"] == ["failing"]
+    summary = thisPipeline.summary()
+    assert summary["failing"]["errors"] == 3
+    assert summary["after"]["records"] == 9
+
+
+def test_feedErrorIsRaisedAfterShuttingDown():
+    def brokenRecords():
+        yield from tirRecords(4)
+        raise Exception("no such column")
+
+    thisPipeline = pipeline.Pipeline([pipeline.Stage("only",lambda records: None,workers=3)])
+    received = []
+    with pytest.raises(Exception,match="no such column"):
+        for record in thisPipeline.run(brokenRecords()):
+            received.append(record["id"])
+
+    # Everything fed before the error still came out, and every worker has stopped
+    assert sorted(received) == [1,2,3,4]
+    assert not any([thread.is_alive() for thread in allThreads(thisPipeline)])
+    assert thisPipeline.outbox.empty()
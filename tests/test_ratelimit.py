@@ -0,0 +1,117 @@
+import time
+import requests
+import pytest
+from tirutils import ratelimit
+
+
+@pytest.fixture
+def limiters(monkeypatch):
+    monkeypatch.setattr(ratelimit,"limiters",{})
+    return ratelimit.limiters
+
+
+def failRequest(host):
+    with pytest.raises(RuntimeError):
+        with ratelimit.limited(host):
+            raise RuntimeError("connection reset")
+
+
+def test_isFailure():
+    assert ratelimit.isFailure(None)
+    assert ratelimit.isFailure(429)
+    assert ratelimit.isFailure(503)
+    assert not ratelimit.isFailure(200)
+    assert not ratelimit.isFailure(204)
+    assert not ratelimit.isFailure(404)
+    with pytest.raises(ratelimit.UpstreamUnavailable):
+        ratelimit.raiseForStatus("example.org",502)
+
+
+def test_unconfiguredHostsAreNotLimited(limiters):
+    with ratelimit.limited("example.org") as outcome:
+        outcome["statusCode"] = 503
+    assert ratelimit.summary() == {}
+
+
+def test_concurrencyBacksOffAndRecovers(limiters):
+    limiter = ratelimit.configure("example.org",maxConcurrency=8,latencyTarget=60)
+    with ratelimit.limited("example.org") as outcome:
+        outcome["statusCode"] = 429
+    assert limiter.concurrency == 4
+    # A second failure inside the same latency target doesn't cut again
+    with ratelimit.limited("example.org") as outcome:
+        outcome["statusCode"] = 503
+    assert limiter.concurrency == 4
+    for request in range(8):
+        with ratelimit.limited("example.org"):
+            pass
+    assert 5 < limiter.concurrency <= 8
+
+
+def test_circuitOpensAndClosesAfterATrial(limiters):
+    limiter = ratelimit.configure("example.org",failureThreshold=3,openSeconds=0.05)
+    for request in range(3):
+        failRequest("example.org")
+    assert limiter.summary()["circuit"] == "open"
+    with pytest.raises(ratelimit.UpstreamUnavailable):
+        with ratelimit.limited("example.org"):
+            pass
+    assert limiter.summary()["rejected"] == 1
+
+    # A failed trial keeps it open for another round, a good one closes it
+    time.sleep(0.06)
+    failRequest("example.org")
+    assert limiter.summary()["circuit"] == "open"
+    time.sleep(0.06)
+    with ratelimit.limited("example.org"):
+        pass
+    assert limiter.summary()["circuit"] == "closed"
+    assert limiter.summary()["opened"] == 2
+
+
+def test_tokenBucketHoldsTheRate(limiters):
+    ratelimit.configure("example.org",rate=50,burst=1)
+    started = time.time()
+    for request in range(6):
+        with ratelimit.limited("example.org"):
+            pass
+    assert time.time()-started >= 0.09
+
+
+def test_pausingWaitsForTheCircuit(limiters):
+    ratelimit.configure("example.org",failureThreshold=1,openSeconds=0.02)
+    calls = []
+
+    def lookupFunction(value):
+        calls.append(value)
+        if len(calls) < 3:
+            raise ratelimit.UpstreamUnavailable("example.org","returned 503")
+        return value
+
+    assert ratelimit.pausing(lookupFunction,1,0.01)("x") == "x"
+    assert len(calls) == 3
+
+    def alwaysDown(value):
+        raise ratelimit.UpstreamUnavailable("example.org","returned 503")
+
+    with pytest.raises(ratelimit.UpstreamUnavailable):
+        ratelimit.pausing(alwaysDown,0.05,0.02)("x")
+
+
+def test_isTransportError():
+    assert ratelimit.isTransportError(requests.exceptions.ConnectTimeout("connect timeout"))
+    assert ratelimit.isTransportError("HTTPSConnectionPool(host='ecos.fws.gov'): Max retries exceeded with url: /x")
+    assert ratelimit.isTransportError("TESS returned 503")
+    assert not ratelimit.isTransportError(ValueError("Expecting value: line 1 column 1 (char 0)"))
+    assert not ratelimit.isTransportError("no element found: line 1, column 0")
+    assert ratelimit.isTransportError("429 Client Error: Too Many Requests for url: https://ecos.fws.gov/x")
+    assert not ratelimit.isTransportError("No species found for element 500")
+
+
+def test_recordErrorsDontCountAgainstTheHost(limiters):
+    limiter = ratelimit.configure("example.org",failureThreshold=1)
+    with pytest.raises(KeyError):
+        with ratelimit.limited("example.org"):
+            raise KeyError("SCINAME")
+    assert limiter.summary()["failures"] == 0
+    assert limiter.summary()["circuit"] == "closed"
@@ -0,0 +1,63 @@
+from datetime import datetime,timedelta
+from tirutils import refresh
+from conftest import baseURL
+
+now = datetime(2026,6,1)
+
+
+def daysAgo(days):
+    return (now-timedelta(days=days)).isoformat()
+
+
+def loadBuckets(gc2):
+    gc2.loadTIR([
+        {"id":1,"itis":{"itisMatchMethod":"Exact Match","tsn":"1","cacheDate":daysAgo(40)}},
+        {"id":2,"itis":{"itisMatchMethod":"Exact Match","tsn":"2","cacheDate":daysAgo(90)}},
+        {"id":3,"itis":{"itisMatchMethod":"Exact Match","tsn":"3","cacheDate":daysAgo(5)}},
+        {"id":4,"itis":{"itisMatchMethod":"Not Matched","cacheDate":daysAgo(10)}},
+        {"id":5,"itis":{"itisMatchMethod":"Exact Match","tsn":"5"}},
+        {"id":6,"tess":{"result":False,"dateCached":daysAgo(4)}},
+        {"id":7,"tess":{"result":True,"dateCached":daysAgo(2)}}
+    ])
+
+
+def test_overdue():
+    assert refresh.overdue(daysAgo(60),30,now) == 2
+    assert refresh.overdue(None,30,now) == float("inf")
+    assert refresh.overdue("not a date",30,now) == float("inf")
+
+
+def test_scheduleRefreshOrder(gc2):
+    loadBuckets(gc2)
+    plan = refresh.scheduleRefresh(baseURL,100,now=now)
+    # Not matched retries first, then stale buckets with undated ones and the most overdue first
+    assert plan == [{"id":4,"buckets":["itis"]},{"id":6,"buckets":["tess"]},{"id":5,"buckets":["itis"]},{"id":2,"buckets":["itis"]},{"id":1,"buckets":["itis"]}]
+    assert refresh.planSummary(plan) == {"records":5,"buckets":{"tess":1,"itis":4},"requests":1.7}
+
+
+def test_scheduleRefreshBudget(gc2):
+    loadBuckets(gc2)
+    # TESS costs 1.5 requests a record, so a budget of 1 only leaves room for cheap ITIS lookups
+    plan = refresh.scheduleRefresh(baseURL,1,now=now)
+    assert [plannedRecord["buckets"] for plannedRecord in plan] == [["itis"]]*4
+    assert refresh.scheduleRefresh(baseURL,0.1,now=now) == [{"id":4,"buckets":["itis"]},{"id":5,"buckets":["itis"]}]
+
+
+def test_contentHashIgnoresTheCacheDate():
+    assert refresh.contentHash({"tsn":"1","cacheDate":"2020-01-01"}) == refresh.contentHash('{"cacheDate": "2026-01-01", "tsn": "1"}')
+    assert refresh.contentHash({"tsn":"1"}) != refresh.contentHash({"tsn":"2"})
+    assert refresh.contentHash(None) is None
+
+
+def test_refreshRecordsAndChangedBuckets(gc2):
+    loadBuckets(gc2)
+    tirRecords = list(refresh.refreshRecords(baseURL,[{"id":2,"buckets":["itis"]},{"id":1,"buckets":["itis"]},{"id":99,"buckets":["itis"]}],1))
+    assert [tirRecord["properties"]["id"] for tirRecord in tirRecords] == [2,1]
+    assert tirRecords[0]["properties"]["itis"] is None
+
+    record = {"updated":["itis"],"previousHashes":tirRecords[0]["previousHashes"]}
+    record["itis"] = {"itisMatchMethod":"Exact Match","tsn":"2","cacheDate":now.isoformat()}
+    assert refresh.changedBuckets(record) == []
+    assert refresh.cacheDate(record,"itis") == {"cacheDate":now.isoformat()}
+    record["itis"]["tsn"] = "20"
+    assert refresh.changedBuckets(record) == ["itis"]
@@ -0,0 +1,131 @@
+import pytest
+from tirutils import responsecache
+
+
+@pytest.fixture
+def responseCache(tmp_path,monkeypatch):
+    responseCache = responsecache.ResponseCache(str(tmp_path/"responses.sqlite"))
+    monkeypatch.setattr(responsecache,"activeCache",responseCache)
+    yield responseCache
+    responseCache.close()
+
+
+def test_cachedCallRestampsTheCacheDate(responseCache):
+    calls = []
+
+    def queryTESS(queryType,queryValue):
+        calls.append(queryValue)
+        return {"result":True,"SCINAME":queryValue,"dateCached":"2020-01-01T00:00:00"}
+
+    first = responsecache.cachedCall("tess.queryTESS",queryTESS,"SCINAME","Puma concolor",dateKey="dateCached")
+    second = responsecache.cachedCall("tess.queryTESS",queryTESS,"SCINAME","Puma concolor",dateKey="dateCached")
+    assert calls == ["Puma concolor"]
+    assert first["dateCached"] == "2020-01-01T00:00:00"
+    assert second["dateCached"] > "2026"
+    assert second["SCINAME"] == "Puma concolor"
+
+
+def test_cachedCallCachesNone(responseCache):
+    calls = []
+
+    def queryNatureServeID(name):
+        calls.append(name)
+        return None
+
+    assert responsecache.cachedCall("natureserve.queryNatureServeID",queryNatureServeID,"Puma concolor") is None
+    assert responsecache.cachedCall("natureserve.queryNatureServeID",queryNatureServeID,"Puma concolor") is None
+    assert calls == ["Puma concolor"]
+    assert responseCache.summary()["hits"] == 1
+
+
+def test_normalizeURL():
+    assert responsecache.normalizeURL("HTTP://Services.ITIS.gov/?wt=json&q=tsn:1") == responsecache.normalizeURL("http://services.itis.gov/?q=tsn:1&wt=json")
+
+
+class FakeService:
+    # A service behind sessions.get that keeps the headers of each request and answers 304 when the ETag matches
+
+    def __init__(self):
+        self.requests = []
+        self.etag = '"v1"'
+        self.body = {"response":{"numFound":1,"docs":[{"tsn":"552479"}]}}
+
+    def get(self,url,headers=None,**kwargs):
+        headers = headers if headers is not None else {}
+        self.requests.append(headers)
+        response = type("Response",(),{})()
+        response.headers = {"ETag":self.etag,"Last-Modified":"Mon, 01 Jan 2018 00:00:00 GMT"}
+        if headers.get("If-None-Match") == self.etag:
+            response.status_code = 304
+            response.json = lambda: None
+        else:
+            response.status_code = 200
+            response.json = lambda body=dict(self.body): body
+        return response
+
+
+@pytest.fixture
+def service(monkeypatch):
+    service = FakeService()
+    monkeypatch.setattr(responsecache.sessions,"get",service.get)
+    return service
+
+
+def expire(responseCache,key):
+    with responseCache.lock:
+        responseCache.db.execute("UPDATE cache SET created = created - ? WHERE key = ?",(responseCache.ttlSeconds+1,key))
+
+
+def created(responseCache,key):
+    return responseCache.db.execute("SELECT created FROM cache WHERE key = ?",(key,)).fetchone()[0]
+
+
+searchURL = "https://services.itis.gov/?q=tsn:552479&wt=json"
+
+
+def test_revalidationSendsTheStoredValidators(responseCache,service):
+    assert responsecache.cachedGet(searchURL).json() == service.body
+    assert service.requests == [{}]
+    key = responsecache.normalizeURL(searchURL)
+    assert responseCache.getExpired(key)["validators"] == {"etag":'"v1"',"lastModified":"Mon, 01 Jan 2018 00:00:00 GMT"}
+
+    # Still fresh, so nothing is sent
+    responsecache.cachedGet(searchURL)
+    assert len(service.requests) == 1
+
+    expire(responseCache,key)
+    responsecache.cachedGet(searchURL)
+    assert service.requests[1] == {"If-None-Match":'"v1"',"If-Modified-Since":"Mon, 01 Jan 2018 00:00:00 GMT"}
+
+
+def test_notModifiedRenewsTheEntryAndKeepsTheBody(responseCache,service):
+    originalBody = service.body
+    responsecache.cachedGet(searchURL)
+    key = responsecache.normalizeURL(searchURL)
+    expire(responseCache,key)
+    expiredAt = created(responseCache,key)
+
+    # The service would now send something else, but says our copy is still current
+    service.body = {"response":{"numFound":0,"docs":[]}}
+    response = responsecache.cachedGet(searchURL)
+    assert response.status_code == 200
+    assert response.json() == originalBody
+    assert responseCache.summary()["revalidated"] == 1
+    assert created(responseCache,key) > expiredAt
+    assert responseCache.get(key) == (True,{"status_code":200,"body":originalBody,"validators":{"etag":'"v1"',"lastModified":"Mon, 01 Jan 2018 00:00:00 GMT"}})
+
+    # The renewed entry is served from the cache without asking again
+    responsecache.cachedGet(searchURL)
+    assert len(service.requests) == 2
+
+
+def test_changedDocumentReplacesTheEntry(responseCache,service):
+    responsecache.cachedGet(searchURL)
+    key = responsecache.normalizeURL(searchURL)
+    expire(responseCache,key)
+
+    service.etag = '"v2"'
+    service.body = {"response":{"numFound":0,"docs":[]}}
+    assert responsecache.cachedGet(searchURL).json() == service.body
+    assert responseCache.summary()["revalidated"] == 0
+    assert responseCache.getExpired(key) == {"status_code":200,"body":service.body,"validators":{"etag":'"v2"',"lastModified":"Mon, 01 Jan 2018 00:00:00 GMT"}}
@@ -0,0 +1,140 @@
+import os,json
+import pytest
+from tirutils import runstate
+from tirutils import ratelimit
+from tirutils import dedup
+
+
+def tirRecords(recordIDs):
+    return iter([{"properties":{"id":recordID}} for recordID in recordIDs])
+
+
+def lookupFailingOn(failingIDs):
+    def lookupFunction(tirRecord):
+        if tirRecord["properties"]["id"] in failingIDs:
+            raise KeyError("docs")
+        return {"id":tirRecord["properties"]["id"]}
+    return lookupFunction
+
+
+def savedState(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def test_cursorOnlyMovesPastFlushedRecords(tmp_path):
+    path = str(tmp_path/"state.json")
+    runState = runstate.RunState(path)
+    guardedLookup = runState.guard(lookupFailingOn([]))
+    thisRecords = [guardedLookup(tirRecord) for tirRecord in runState.records(tirRecords(range(1,7)))]
+
+    runState.flushed({"written":[2,1,3],"failed":[]})
+    assert savedState(path)["cursor"] == 3
+    runState.flushed({"written":[5],"failed":[{"id":4}]})
+    assert savedState(path)["cursor"] == 5
+    assert len(thisRecords) == 6
+    # Record 6 was never written, so a run stopped here picks up from it
+    assert runstate.RunState(path).cursor == 5
+    assert not os.path.exists(path+".tmp")
+
+
+def test_deadLettersCountAttemptsAndAreSkipped(tmp_path):
+    path = str(tmp_path/"state.json")
+    for attempt in range(1,4):
+        runState = runstate.RunState(path,maxAttempts=2)
+        guardedLookup = runState.guard(lookupFailingOn([2]))
+        thisRecords = [guardedLookup(tirRecord) for tirRecord in runState.records(tirRecords([1,2,3]))]
+        runState.flushed({"written":[thisRecord["id"] for thisRecord in thisRecords if thisRecord is not None],"failed":[]})
+        summary = runState.finish()
+        assert summary["cursor"] == 0
+        if attempt < 3:
+            assert thisRecords[1] is None
+            assert savedState(path)["deadLetters"]["2"]["attempts"] == attempt
+            assert savedState(path)["deadLetters"]["2"]["message"] == "KeyError: 'docs'"
+        else:
+            # Failed maxAttempts times, so it isn't handed out any more
+            assert len(thisRecords) == 2
+            assert summary["skipped"] == 1
+    assert savedState(path)["completedRuns"] == 3
+
+
+def test_recoveredRecordLeavesTheDeadLetters(tmp_path):
+    path = str(tmp_path/"state.json")
+    runState = runstate.RunState(path)
+    runState.guard(lookupFailingOn([1]))({"properties":{"id":1}})
+    runState.checkpoint()
+    runState = runstate.RunState(path)
+    assert runState.guard(lookupFailingOn([]))({"properties":{"id":1}}) == {"id":1}
+    assert runState.summary()["recovered"] == 1
+    assert runState.state["deadLetters"] == {}
+
+
+def test_upstreamTroubleIsNotCountedAgainstTheRecord(tmp_path):
+    runState = runstate.RunState(str(tmp_path/"state.json"))
+
+    def lookupFunction(tirRecord):
+        raise ratelimit.UpstreamUnavailable("ecos.fws.gov","returned 503")
+
+    with pytest.raises(ratelimit.UpstreamUnavailable):
+        runState.guard(lookupFunction)({"properties":{"id":1}})
+    assert runState.state["deadLetters"] == {}
+
+
+def test_guardBatchFallsBackToSingleRecords(tmp_path):
+    runState = runstate.RunState(str(tmp_path/"state.json"))
+    calls = []
+
+    def batchFunction(page):
+        calls.append(len(page))
+        return [lookupFailingOn([2])(tirRecord) for tirRecord in page]
+
+    thisRecords = runState.guardBatch(batchFunction)(list(tirRecords([1,2,3])))
+    assert [thisRecord["id"] for thisRecord in thisRecords] == [1,3]
+    assert calls == [3,1,1,1]
+    assert list(runState.state["deadLetters"].keys()) == ["2"]
+
+
+def test_recordBudget(tmp_path):
+    runState = runstate.RunState(str(tmp_path/"state.json"),maxRecords=3)
+    assert len(list(runState.records(tirRecords(range(1,10))))) == 3
+    runState.flushed({"written":[1,2,3],"failed":[]})
+    summary = runState.finish()
+    assert summary["stoppedBy"] == "maxRecords"
+    # Stopped on the budget, so the next run carries on from here instead of starting over
+    assert summary["cursor"] == 3
+
+
+def test_failedDedupGroupDoesNotStallTheCursor(tmp_path):
+    path = str(tmp_path/"state.json")
+    runState = runstate.RunState(path)
+    deduplicator = dedup.Deduplicator(dedup.natureServeKey,3)
+
+    def lookupFunction(tirRecord):
+        if tirRecord["properties"]["name_registered"] == "Bad":
+            raise ValueError("unparseable response")
+        return {"id":tirRecord["properties"]["id"]}
+
+    names = {1:"Good",2:"Bad",3:"Bad",4:"Good",5:"Bad",6:"Other"}
+    tirRecords = iter([{"properties":{"id":recordID,"name_registered":name,"name_itis":None,"name_worms":None}} for recordID,name in names.items()])
+    written = []
+    for thisRecord in deduplicator.process(runState.guard(lookupFunction),runState.records(tirRecords),2,runState.unresolved):
+        if thisRecord is not None:
+            written.append(thisRecord["id"])
+    runState.flushed({"written":written,"failed":[]})
+
+    assert sorted(written) == [1,4,6]
+    assert savedState(path)["cursor"] == 6
+    # Every record in the failed groups is a dead letter, not just the one the lookup ran on
+    assert sorted(savedState(path)["deadLetters"].keys()) == ["2","3","5"]
+    assert runState.finish()["cursor"] == 0
+
+
+def test_dryRunSettlesRecordsWithoutSaving(tmp_path):
+    path = str(tmp_path/"state.json")
+    runState = runstate.RunState(path,saveState=False)
+    for tirRecord in runState.records(tirRecords(range(1,5))):
+        runState.settle([tirRecord["properties"]["id"]])
+    assert runState.cursor == 4
+    assert len(runState.inFlight) == 0
+    runState.finish()
+    assert not os.path.exists(path)
@@ -0,0 +1,87 @@
+import pytest
+from tirutils import sbconfig
+
+tgMappingsURL = "https://www.sciencebase.gov/catalog/file/get/56d720ece4b015c306f442d5?f=tg"
+swap2005URL = "https://www.sciencebase.gov/catalog/file/get/56d720ece4b015c306f442d5?f=swap"
+
+
+class FakeScienceBase:
+    # The SGCN source repository item and its configuration files behind sessions.get
+
+    def __init__(self):
+        self.requests = []
+        self.available = True
+        self.files = {
+            tgMappingsURL:"ProvidedName,PreferredName\nBees,Insects\nmammals,Mammals\n",
+            swap2005URL:"scientificname\tcommonname\nLynx rufus\tBobcat\n\tno name\nAmmodramus savannarum\tGrasshopper Sparrow\n"
+        }
+        self.checksums = {tgMappingsURL:"tg1",swap2005URL:"swap1"}
+
+    def get(self,url,**kwargs):
+        if not self.available:
+            raise ConnectionError("ScienceBase is down")
+        self.requests.append(url)
+        response = type("Response",(),{})()
+        if url == sbconfig.sgcnItemURL:
+            files = [
+                {"title":sbconfig.taxonomicGroupMappingsTitle,"url":tgMappingsURL,"checksum":{"value":self.checksums[tgMappingsURL],"type":"MD5"}},
+                {"title":sbconfig.swap2005Title,"url":swap2005URL,"checksum":{"value":self.checksums[swap2005URL],"type":"MD5"}},
+                {"title":"Something else","url":"https://www.sciencebase.gov/other"}
+            ]
+            response.json = lambda: {"files":files}
+        else:
+            response.text = self.files[url]
+        return response
+
+
+@pytest.fixture
+def scienceBase(monkeypatch):
+    scienceBase = FakeScienceBase()
+    monkeypatch.setattr(sbconfig.sessions,"get",scienceBase.get)
+    return scienceBase
+
+
+def test_loadAndCache(scienceBase,tmp_path):
+    cachePath = str(tmp_path/"cache"/"sgcnconfig.pickle")
+    config = sbconfig.loadSGCNConfig(cachePath)
+    assert config == {"tgDict":{"Bees":"Insects","mammals":"Mammals"},"swap2005Names":["Lynx rufus","Ammodramus savannarum"]}
+    assert scienceBase.requests == [sbconfig.sgcnItemURL,tgMappingsURL,swap2005URL]
+
+    # Fresh enough that ScienceBase isn't asked at all
+    assert sbconfig.loadSGCNConfig(cachePath) == config
+    assert len(scienceBase.requests) == 3
+
+
+def test_onlyChangedFilesAreDownloaded(scienceBase,tmp_path):
+    cachePath = str(tmp_path/"sgcnconfig.pickle")
+    sbconfig.loadSGCNConfig(cachePath)
+    scienceBase.requests.clear()
+
+    assert sbconfig.loadSGCNConfig(cachePath,maxAge=0)["tgDict"]["Bees"] == "Insects"
+    assert scienceBase.requests == [sbconfig.sgcnItemURL]
+
+    scienceBase.requests.clear()
+    scienceBase.files[tgMappingsURL] = "ProvidedName,PreferredName\nBees,Pollinators\n"
+    scienceBase.checksums[tgMappingsURL] = "tg2"
+    config = sbconfig.loadSGCNConfig(cachePath,maxAge=0)
+    assert config["tgDict"] == {"Bees":"Pollinators"}
+    assert config["swap2005Names"] == ["Lynx rufus","Ammodramus savannarum"]
+    assert scienceBase.requests == [sbconfig.sgcnItemURL,tgMappingsURL]
+
+
+def test_unreachableScienceBase(scienceBase,tmp_path):
+    cachePath = str(tmp_path/"sgcnconfig.pickle")
+    scienceBase.available = False
+    with pytest.raises(ConnectionError):
+        sbconfig.loadSGCNConfig(cachePath)
+
+    scienceBase.available = True
+    config = sbconfig.loadSGCNConfig(cachePath)
+    scienceBase.available = False
+    assert sbconfig.loadSGCNConfig(cachePath,maxAge=0) == config
+
+
+def test_fileVersion():
+    assert sbconfig.fileVersion({"url":tgMappingsURL,"checksum":{"value":"abc","type":"MD5"}}) == "abc"
+    assert sbconfig.fileVersion({"url":tgMappingsURL,"checksum":None,"size":42}) == tgMappingsURL+":42"
+    assert sbconfig.fileVersion({"url":tgMappingsURL}) == tgMappingsURL+":None"
@@ -0,0 +1,82 @@
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler,ThreadingHTTPServer
+from urllib3.exceptions import ConnectTimeoutError,ReadTimeoutError
+from tirutils import sessions
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    # Answers 503 to the first failures requests for each method and then 200
+
+    def answer(self):
+        server = self.server
+        server.requests.append(self.command)
+        if self.command == "POST":
+            self.rfile.read(int(self.headers.get("Content-Length",0)))
+        statusCode = 503 if server.requests.count(self.command) <= server.failures else 200
+        self.send_response(statusCode)
+        self.send_header("Content-Type","application/json")
+        self.send_header("Content-Length","2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    do_GET = answer
+    do_POST = answer
+
+    def log_message(self,*args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1",0),FlakyHandler)
+    server.requests = []
+    server.failures = 2
+    thread = threading.Thread(target=server.serve_forever,daemon=True)
+    thread.start()
+    monkeypatch.setitem(sessions.settings,"retryBackoff",0)
+    sessions.configure()
+    yield server
+    server.shutdown()
+    server.server_close()
+    sessions.configure()
+
+
+def serverURL(server):
+    return "http://127.0.0.1:"+str(server.server_address[1])+"/api/v1/sql/test?key=test"
+
+
+def test_getIsRetriedOnServerErrors(server):
+    r = sessions.get(serverURL(server))
+    assert r.status_code == 200
+    assert server.requests == ["GET","GET","GET"]
+
+
+def test_postIsNotRetriedOnServerErrors(server):
+    # The statement may have been applied before the error, so it is not sent again
+    r = sessions.post(serverURL(server),data={"q":"INSERT INTO tir.journal (id) VALUES (1)"})
+    assert r.status_code == 503
+    assert server.requests == ["POST"]
+
+
+def test_postIsRetriedOnlyWhenItNeverConnected():
+    retry = sessions.newSession().get_adapter("https://").max_retries
+    url = "https://gc2.test/api/v1/sql/test"
+    assert retry.increment("POST",url,error=ConnectTimeoutError("timed out")).total == retry.total-1
+    with pytest.raises(ReadTimeoutError):
+        retry.increment("POST",url,error=ReadTimeoutError(None,url,"timed out"))
+    assert retry.increment("GET",url,error=ReadTimeoutError(None,url,"timed out")).total == retry.total-1
+    assert not retry.is_retry("POST",503)
+    assert retry.is_retry("GET",503)
+
+
+def test_oneSessionPerHost(monkeypatch):
+    monkeypatch.setitem(sessions.settings,"hostOverrides",{"services.itis.gov":"http://127.0.0.1:8001"})
+    sessions.configure()
+    assert sessions.getSession("https://services.itis.gov/?q=tsn:1") is sessions.getSession("https://services.itis.gov/?q=tsn:2")
+    assert sessions.getSession("https://services.itis.gov/") is not sessions.getSession("https://ecos.fws.gov/")
+    assert sessions.routeURL("https://services.itis.gov/?q=tsn:1&wt=json") == "http://127.0.0.1:8001/?q=tsn:1&wt=json"
+    assert sessions.routeURL("https://ecos.fws.gov/tess") == "https://ecos.fws.gov/tess"
+    session = sessions.getSession("https://services.itis.gov/")
+    sessions.configure()
+    assert sessions.getSession("https://services.itis.gov/") is not session
@@ -0,0 +1,47 @@
+from tirutils import sgcnindex
+from benchmarks import standinbis
+from conftest import baseURL
+
+submissions = [
+    {"scientificname":"Puma concolor","taxonomicgroup":"Mammals","state":"Texas","year":2015,"commonname":"Cougar"},
+    {"scientificname":"Puma concolor","taxonomicgroup":"Mammals","state":"Florida","year":2005,"commonname":"Florida panther"},
+    {"scientificname":"Puma concolor","taxonomicgroup":"mammals","state":"Florida","year":2015,"commonname":"Cougar"},
+    {"scientificname":"Puma concolor","taxonomicgroup":"Mammals","state":"Arizona","year":2015,"commonname":None},
+    # A tie between two groups, and no common name at all
+    {"scientificname":"Bombus affinis","taxonomicgroup":"Insects","state":"Iowa","year":2015,"commonname":None},
+    {"scientificname":"Bombus affinis","taxonomicgroup":"Bees","state":"Ohio","year":2015,"commonname":None},
+    {"scientificname":"Ammodramus sp.","taxonomicgroup":None,"state":"Ohio","year":2005,"commonname":"A sparrow"},
+    {"scientificname":"Lynx o'rufus","taxonomicgroup":"Mammals","state":"Maine","year":2005,"commonname":"Bobcat"}
+]
+tgDict = {"mammals":"Mammals","Bees":"Insects"}
+
+
+def test_indexMatchesThePerNameLookups(gc2):
+    gc2.loadSGCN(submissions)
+    sgcnIndex = sgcnindex.buildSGCNIndex(baseURL,["Lynx o'rufus"],tgDict)
+    numQueries = len(gc2.statements)
+    for name in ["Puma concolor","Bombus affinis","Ammodramus sp.","Lynx o'rufus","Not submitted"]:
+        assert sgcnIndex["taxonomicGroups"].get(name) == standinbis.getSGCNTaxonomicGroup(baseURL,name)
+        assert sgcnIndex["stateLists"].get(name,[]) == standinbis.getSGCNStatesByYear(baseURL,name)
+        assert sgcnIndex["commonNames"].get(name) == standinbis.getSGCNCommonName(baseURL,name)
+    assert numQueries == 3
+    assert sgcnIndex["stateLists"]["Puma concolor"] == [{"year":2005,"states":["Florida"]},{"year":2015,"states":["Arizona","Florida","Texas"]}]
+    assert sgcnIndex["taxonomicGroups"]["Bombus affinis"] == "Bees"
+
+
+def test_annotateSGCN(gc2):
+    gc2.loadSGCN(submissions)
+    sgcnIndex = sgcnindex.buildSGCNIndex(baseURL,["Lynx rufus"],tgDict)
+    numQueries = len(gc2.statements)
+
+    annotation = sgcnindex.annotateSGCN(sgcnIndex,"Lynx o'rufus",["Lynx o'rufus","Lynx rufus"])
+    assert list(annotation.keys()) == ["swap2005","taxonomicgroup","stateLists","dateCached"]
+    assert annotation["swap2005"] is True
+    assert annotation["taxonomicgroup"] == "Mammals"
+    assert annotation["stateLists"] == [{"year":2005,"states":["Maine"]}]
+    # Groups map through the config, preferred names pass through and anything else is Other
+    assert sgcnindex.annotateSGCN(sgcnIndex,"Bombus affinis",["Bombus affinis"])["taxonomicgroup"] == "Insects"
+    assert sgcnindex.annotateSGCN(sgcnIndex,"Ammodramus sp.",["Ammodramus sp."])["taxonomicgroup"] == "Other"
+    assert sgcnindex.annotateSGCN(sgcnIndex,"Not submitted",["Not submitted"])["stateLists"] == []
+    # Annotating is all in memory
+    assert len(gc2.statements) == numQueries
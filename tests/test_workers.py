@@ -0,0 +1,77 @@
+import time
+import threading
+import pytest
+from tirutils import workers
+
+
+@pytest.fixture(autouse=True)
+def hostLimits(monkeypatch):
+    monkeypatch.setattr(workers,"hostLimits",{})
+    monkeypatch.setattr(workers,"hostSemaphores",{})
+
+
+def peakConcurrency(host,numThreads):
+    # Most calls inside the host's slot at once across numThreads threads
+    state = {"current":0,"peak":0}
+    lock = threading.Lock()
+
+    def call():
+        with workers.hostSlot(host):
+            with lock:
+                state["current"] = state["current"]+1
+                state["peak"] = max(state["peak"],state["current"])
+            time.sleep(0.02)
+            with lock:
+                state["current"] = state["current"]-1
+
+    threads = [threading.Thread(target=call) for index in range(numThreads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return state["peak"]
+
+
+def test_hostLimits():
+    workers.setHostLimit("services.itis.gov",2)
+    assert peakConcurrency("services.itis.gov",8) == 2
+    assert peakConcurrency("www.marinespecies.org",12) == workers.defaultHostLimit
+    assert workers.hostSlot("services.itis.gov") is workers.hostSlot("services.itis.gov")
+    assert workers.hostSlot("services.itis.gov") is not workers.hostSlot("www.marinespecies.org")
+
+
+def test_resultsComeBackInOrder():
+    def slowSquare(number):
+        # Early records take longest, so they finish last
+        time.sleep(0.002*(20-number))
+        return number*number
+
+    assert list(workers.processConcurrently(slowSquare,range(20),maxWorkers=8)) == [number*number for number in range(20)]
+    assert list(workers.processConcurrently(slowSquare,range(20),maxWorkers=1)) == [number*number for number in range(20)]
+
+
+def test_readAheadIsBounded():
+    pulled = []
+
+    def records():
+        for number in range(50):
+            pulled.append(number)
+            yield number
+
+    for numYielded,result in enumerate(workers.processConcurrently(lambda number: number,records(),maxWorkers=4,maxInFlight=6),start=1):
+        assert len(pulled)-numYielded <= 6
+    assert numYielded == 50
+
+
+@pytest.mark.parametrize("maxWorkers",[1,4])
+def test_exceptionsReachTheConsumerInPlace(maxWorkers):
+    def process(number):
+        if number == 5:
+            raise ValueError("bad record 5")
+        return number
+
+    received = []
+    with pytest.raises(ValueError,match="bad record 5"):
+        for result in workers.processConcurrently(process,range(10),maxWorkers=maxWorkers):
+            received.append(result)
+    assert received == [0,1,2,3,4]
@@ -0,0 +1,72 @@
+import json
+from tirutils import writer
+from tirutils import journal
+from conftest import baseURL
+
+
+def bucket(gc2,recordID,column):
+    value = gc2.execute("SELECT "+column+" FROM tir.tir WHERE id = "+str(recordID))[1]["features"][0]["properties"][column]
+    return None if value is None else json.loads(value)
+
+
+def test_sqlLiteral():
+    assert writer.sqlLiteral(None) == "NULL"
+    assert writer.sqlLiteral(True) == "TRUE"
+    assert writer.sqlLiteral(3) == "3"
+    assert writer.sqlLiteral("O'Brien") == "'O''Brien'"
+    assert writer.sqlLiteral({"a":"it's"}) == "'{\"a\": \"it''s\"}'"
+
+
+def test_buildUpdate():
+    q = writer.buildUpdate({"itis":"json","source":None},[(1,{"itis":{"tsn":"5"},"source":"x"}),("2",{"itis":None})])
+    assert q == "UPDATE tir.tir AS t SET itis = v.itis::json, source = v.source FROM (VALUES (1,'{\"tsn\": \"5\"}','x'),(2,NULL,NULL)) AS v(id,itis,source) WHERE t.id = v.id"
+
+
+def test_writerBatchesAndJournals(gc2):
+    gc2.loadTIR([{"id":recordID} for recordID in range(1,8)])
+    gc2.execute(journal.journalDDL)
+    flushResults = []
+    tirWriter = writer.TIRWriter(baseURL,{"itis":"json"},3,journalBucket="itis",onFlush=flushResults.append)
+    for recordID in range(1,8):
+        tirWriter.write(recordID,{"itis":{"tsn":str(recordID)}})
+    summary = tirWriter.close()
+
+    assert summary["written"] == 7
+    assert summary["batches"] == 3
+    assert [flushResult["written"] for flushResult in flushResults] == [[1,2,3],[4,5,6],[7]]
+    assert bucket(gc2,5,"itis") == {"tsn":"5"}
+    assert len([q for q in gc2.statements if q.startswith("UPDATE")]) == 3
+    journaled = gc2.execute("SELECT id FROM tir.journal WHERE bucket = 'itis'")[1]["features"]
+    assert sorted([row["properties"]["id"] for row in journaled]) == list(range(1,8))
+
+
+def test_failedBatchFallsBackToSingleRows(monkeypatch):
+    statements = []
+
+    def sqlExecute(baseURL,q):
+        statements.append(q)
+        if "bad" in q:
+            return {"success":False,"message":"invalid input syntax for type json"}
+        return {"success":True}
+
+    monkeypatch.setattr(writer,"sqlExecute",sqlExecute)
+    failures = []
+    tirWriter = writer.TIRWriter(baseURL,{"itis":"json"},10,onFailure=lambda recordID,values,message: failures.append(recordID))
+    tirWriter.write(1,{"itis":"good"})
+    tirWriter.write(2,{"itis":"bad"})
+    tirWriter.write(3,{"itis":"good"})
+    flushResult = tirWriter.flush()
+
+    assert flushResult["written"] == [1,3]
+    assert [failure["id"] for failure in flushResult["failed"]] == [2]
+    assert failures == [2]
+    # One batch statement, then one statement per row
+    assert len(statements) == 4
+
+
+def test_cacheDateWriter(gc2):
+    gc2.loadTIR([{"id":1,"tess":{"result":False,"dateCached":"2020-01-01T00:00:00"}}])
+    dateWriter = writer.CacheDateWriter(baseURL,"tess","dateCached")
+    dateWriter.write(1,{"dateCached":"2026-01-01T00:00:00"})
+    assert dateWriter.close()["written"] == 1
+    assert bucket(gc2,1,"tess") == {"result":False,"dateCached":"2026-01-01T00:00:00"}
@@ -0,0 +1,3 @@
+# Shared processing helpers for the TIR processor scripts. The scripts in the root of this repo are nbconvert
+# versions of the notebooks and still import most of their logic from the bis package, but the pieces here deal
+# with how we move records through the TIR in bulk rather than one registration per API call.
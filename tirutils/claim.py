@@ -0,0 +1,59 @@
+# The TIR processors all need to find registrations that do not yet have a given bucket of information cached. We
+# used to do that with a "LIMIT 1" query through the GC2 SQL API for every record, which meant a full round trip
+# just to find the next thing to work on. These functions pull pages of pending records in one query and hand them
+# back one at a time so the processor loops can stay about the same.
+
+from tirutils import sessions
+
+
+def sqlQuery(baseURL,q):
+    # Run a SQL statement through the GC2 SQL API and return the parsed response
+    return sessions.get(baseURL+"&q="+q).json()
+
+
+def pendingRecords(baseURL,selectColumns,whereClause,pageSize=100,maxRecords=None,afterID=0):
+    # Generator that pages through tir.tir records matching the where clause by id (keyset paging) so that we never
+    # pick the same record up twice in a run, even if it is not written back (e.g. commitToDB is False)
+    # selectColumns is the part of the select statement after "id," and should return everything the processor needs
+    # afterID starts after a checkpoint (see runstate)
+    lastID = afterID
+    numberYielded = 0
+
+    while maxRecords is None or numberYielded < maxRecords:
+        thisPageSize = pageSize
+        if maxRecords is not None:
+            thisPageSize = min(pageSize,maxRecords-numberYielded)
+
+        q_pendingRecords = "SELECT id, "+selectColumns+" FROM tir.tir WHERE ("+whereClause+") AND id > "+str(lastID)+" ORDER BY id ASC LIMIT "+str(thisPageSize)
+        pendingPage = sqlQuery(baseURL,q_pendingRecords)
+
+        # An error from GC2 has to stop the run; treating it as the end of the data would look like a finished run
+        if "features" not in pendingPage:
+            raise Exception(pendingPage.get("message","Could not page through pending records"))
+        if len(pendingPage["features"]) == 0:
+            break
+
+        for tirRecord in pendingPage["features"]:
+            lastID = tirRecord["properties"]["id"]
+            numberYielded = numberYielded + 1
+            yield tirRecord
+
+        if len(pendingPage["features"]) < thisPageSize:
+            break
+
+
+def countPending(baseURL,whereClause):
+    # Simple count of records still waiting on a processor
+    return sqlQuery(baseURL,"SELECT count(*) AS num FROM tir.tir WHERE "+whereClause)["features"][0]["properties"]["num"]
+
+
+def pages(records,pageSize):
+    # Group an iterator of records back into lists of up to pageSize for processes that work on batches
+    page = []
+    for record in records:
+        page.append(record)
+        if len(page) >= pageSize:
+            yield page
+            page = []
+    if len(page) > 0:
+        yield page
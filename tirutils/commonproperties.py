@@ -0,0 +1,119 @@
+# The logic for the TIR common properties (scientific name, common name, authority ID, rank, taxonomic group and
+# match method) used to live inline in the TIR Common Properties loop. It's pulled out here into a function that
+# works on a whole batch of records at once as a pandas DataFrame so that we can run it over a page of records
+# from the TIR or rebuild the common properties for the whole table in one pass from a bulk export.
+#
+# The rules are the same as they have been:
+# * Prefer the ITIS match, then the WoRMS match, for scientific name, match method, authority ID and rank
+# * Common name comes from the SGCN submitted names for SGCN registrations, then the first English (or unspecified)
+#   ITIS vernacular, and "no common name" otherwise
+# * SGCN registrations take their taxonomic group from the SGCN annotation, and names that were not matched to a
+#   taxonomic authority but are on the 2005 SWAP list are flagged as a "Legacy Match"
+# * GAP Species registrations keep their registered scientific name, common name and taxonomic group
+
+import json
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from tirutils import names
+
+notMatched = "Not Matched"
+notMatchedAuthorityID = "Not Matched to Taxonomic Authority"
+unknownRank = "Unknown Taxonomic Rank"
+noCommonName = "no common name"
+itisAuthorityBase = "http://services.itis.gov/?q=tsn:"
+wormsAuthorityBase = "http://www.marinespecies.org/rest/AphiaRecordsByName/"
+legacyMatch = "Legacy Match"
+legacyAuthorityID = "https://www.sciencebase.gov/catalog/file/get/56d720ece4b015c306f442d5?f=__disk__38%2F22%2F26%2F38222632f48bf0c893ad1017f6ba557d0f672432"
+
+commonColumns = ["id","source","scientificname","commonname","authorityid","rank","taxonomicgroup","matchmethod","cachedate"]
+
+
+def parseBucket(bucket):
+    # Buckets come back from the GC2 API as JSON strings, from a bulk export as dictionaries, or are missing
+    if bucket is None or (isinstance(bucket,float) and np.isnan(bucket)):
+        return {}
+    if isinstance(bucket,str):
+        return json.loads(bucket)
+    return bucket
+
+
+def recordsFrame(tirRecords):
+    # Build the input DataFrame from a list of records (features) returned from the GC2 SQL API
+    return pd.DataFrame([tirRecord["properties"] for tirRecord in tirRecords],columns=["id","registration","itis","worms","sgcn"])
+
+
+def bucketField(buckets,key):
+    # Pull one property out of a column of buckets, keeping it as objects so numbers like TSNs don't become floats
+    return pd.Series([bucket.get(key) for bucket in buckets],index=buckets.index,dtype=object)
+
+
+def firstEnglishName(commonnames):
+    if not isinstance(commonnames,list):
+        return None
+    for name in commonnames:
+        if name["language"] == "English" or name["language"] == "unspecified":
+            return name["name"]
+    return None
+
+
+def deriveCommonProperties(records,sgcnCommonName=None,cacheDate=None):
+    # records is a DataFrame with id, registration, itis, worms and sgcn columns (JSON strings or dictionaries)
+    # sgcnCommonName is a dictionary or a function that returns a common name for a cleaned SGCN scientific name
+    # Returns a DataFrame with the common properties for each record, ready for caching in tir.tir
+    if cacheDate is None:
+        cacheDate = datetime.utcnow().isoformat()
+
+    registration = records["registration"].map(parseBucket)
+    itisData = records["itis"].map(parseBucket)
+    wormsData = records["worms"].map(parseBucket)
+    sgcnData = records["sgcn"].map(parseBucket) if "sgcn" in records.columns else pd.Series([{}]*len(records),index=records.index)
+
+    source = bucketField(registration,"source")
+    registeredName = bucketField(registration,"scientificname")
+    cleanedName = names.cleanColumn(registeredName)
+
+    itisMatchMethod = bucketField(itisData,"MatchMethod").fillna(notMatched)
+    wormsMatchMethod = bucketField(wormsData,"MatchMethod").fillna(notMatched)
+    itisMatched = (itisMatchMethod != notMatched).to_numpy()
+    wormsMatched = (~itisMatched) & (wormsMatchMethod != notMatched).to_numpy()
+
+    common = pd.DataFrame(index=records.index)
+    common["id"] = records["id"]
+    common["source"] = source
+
+    # Taxonomic authority properties, preferring ITIS over WoRMS
+    common["scientificname"] = np.select([itisMatched,wormsMatched],[bucketField(itisData,"nameWInd"),bucketField(wormsData,"valid_name")],cleanedName)
+    common["matchmethod"] = np.select([itisMatched,wormsMatched],[itisMatchMethod,wormsMatchMethod],notMatched)
+    common["authorityid"] = np.select(
+        [itisMatched,wormsMatched],
+        [itisAuthorityBase+bucketField(itisData,"tsn").astype(str),wormsAuthorityBase+bucketField(wormsData,"AphiaID").astype(str)],
+        notMatchedAuthorityID
+    )
+    common["rank"] = np.select([itisMatched,wormsMatched],[bucketField(itisData,"rank"),bucketField(wormsData,"rank")],unknownRank)
+
+    # Common names from SGCN submissions first (for SGCN registrations), then ITIS vernaculars
+    isSGCN = (source == "SGCN").to_numpy()
+    common["commonname"] = None
+    if sgcnCommonName is not None and isSGCN.any():
+        lookup = sgcnCommonName.get if isinstance(sgcnCommonName,dict) else sgcnCommonName
+        common.loc[isSGCN,"commonname"] = cleanedName[isSGCN].map(lookup)
+    common["commonname"] = common["commonname"].fillna(bucketField(itisData,"commonnames").map(firstEnglishName))
+    common["commonname"] = common["commonname"].fillna(noCommonName)
+
+    # Source specific handling for SGCN and GAP Species
+    hasSGCN = isSGCN & sgcnData.map(len).gt(0).to_numpy()
+    isGAP = (source == "GAP Species").to_numpy()
+    common["taxonomicgroup"] = np.select([hasSGCN,isGAP],[bucketField(sgcnData,"taxonomicgroup"),bucketField(registration,"taxonomicgroup")],"Other")
+
+    isLegacy = hasSGCN & (common["matchmethod"] == notMatched).to_numpy() & bucketField(sgcnData,"swap2005").map(lambda swap2005: swap2005 is True).to_numpy()
+    common.loc[isLegacy,"matchmethod"] = legacyMatch
+    common.loc[isLegacy,"authorityid"] = legacyAuthorityID
+
+    common.loc[isGAP,"scientificname"] = registeredName[isGAP]
+    common.loc[isGAP,"commonname"] = bucketField(registration,"commonname")[isGAP]
+
+    common["commonname"] = names.cleanColumn(common["commonname"])
+    common["cachedate"] = cacheDate
+
+    return common[commonColumns]
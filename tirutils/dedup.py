@@ -0,0 +1,115 @@
+# The same scientific name is registered in the TIR many times over (every state that listed an SGCN species, GAP
+# Species, BISON, ...), and the WoRMS, TESS and NatureServe lookups only depend on the names (and TSNs) for a record,
+# not on which registration it is. A Deduplicator groups pending records by a key made from everything a lookup
+# uses, runs the lookup once for each distinct key and hands the result back out for every record in the group, so
+# the number of upstream calls goes with the number of distinct names instead of the number of registrations.
+#
+# Keys are made of exactly the strings a lookup sends upstream (the cleaned registered name for WoRMS, the registered
+# name as it is for TESS and NatureServe, which search on it directly) so that every record gets the same result it
+# would have gotten from its own lookup. Grouping on names.canonicalKey instead would let a registration with an
+# authority string or odd casing share the result of a cleaner sibling, which changes results rather than just
+# saving requests. Results are remembered by key for the whole run, not just the page they were found in.
+
+import copy,threading
+from tirutils import claim
+from tirutils import names
+from tirutils import workers
+
+
+def cleanedNameKey(name):
+    # The cleaned name that lookupWoRMS searches on, or the name itself when cleaning leaves nothing of it (the
+    # lookup reports the registered name as the match string then)
+    if name is None:
+        return None
+    cleanedName = names.cleanScientificName(name)
+    if len(cleanedName) == 0:
+        return name
+    return cleanedName
+
+
+def isMatched(matchMethod):
+    return matchMethod not in [None,"Not Matched"]
+
+
+def wormsKey(tirRecord):
+    properties = tirRecord["properties"]
+    return (properties["followtaxonomy"],cleanedNameKey(properties["scientificname"]),properties["namewind"],properties["namewoind"])
+
+
+def tessKey(tirRecord):
+    properties = tirRecord["properties"]
+    return (properties["name_state"],isMatched(properties["matchmethod_itis"]),properties["tsn"],properties["acceptedtsn"],properties["name_itis"],isMatched(properties["matchmethod_worms"]),properties["name_worms"])
+
+
+def natureServeKey(tirRecord):
+    properties = tirRecord["properties"]
+    return (properties["name_registered"],properties["name_itis"],properties["name_worms"])
+
+
+class Deduplicator:
+
+    def __init__(self,keyFunction,pageSize=1000):
+        # keyFunction takes a record (feature) from the GC2 SQL API and returns a hashable key that is the same for
+        # any two records the lookup would treat the same way
+        self.keyFunction = keyFunction
+        self.pageSize = pageSize
+        self.resolved = {}
+        self.stats = {"records":0,"lookups":0}
+        self.lock = threading.Lock()
+
+    def process(self,lookupFunction,records,maxWorkers=8,onUnresolved=None):
+        # Generator like workers.processConcurrently that yields a thisRecord for every record, running lookupFunction
+        # concurrently over one record for each key in a page that we have not already resolved
+        # onUnresolved is called with each record (and the record the lookup ran on) whose key gave nothing back, for
+        # callers that need to know which records the None results are for (e.g. runstate.RunState.unresolved)
+        for page in claim.pages(records,self.pageSize):
+            groups = {}
+            for tirRecord in page:
+                groups.setdefault(self.keyFunction(tirRecord),[]).append(tirRecord)
+
+            newKeys = [key for key in groups if key not in self.resolved]
+            pageResults = dict(zip(newKeys,workers.processConcurrently(lookupFunction,[groups[key][0] for key in newKeys],maxWorkers)))
+            self.stats["lookups"] = self.stats["lookups"]+len(newKeys)
+            # A lookup that gave nothing back (None) is tried again if the key comes up in a later page
+            self.resolved.update({key:thisRecord for key,thisRecord in pageResults.items() if thisRecord is not None})
+
+            for key,members in groups.items():
+                for tirRecord in members:
+                    self.stats["records"] = self.stats["records"]+1
+                    if key not in self.resolved and onUnresolved is not None:
+                        onUnresolved(tirRecord,members[0])
+                    yield self.fanOut(self.resolved.get(key),tirRecord)
+
+    def lookup(self,lookupFunction,tirRecord):
+        # One record at a time version of process for callers that don't see records a page at a time (the pipeline
+        # stages). Two threads that get the same new key at the same time may both run the lookup.
+        key = self.keyFunction(tirRecord)
+        with self.lock:
+            self.stats["records"] = self.stats["records"]+1
+            thisRecord = self.resolved.get(key)
+        if thisRecord is None:
+            thisRecord = lookupFunction(tirRecord)
+            with self.lock:
+                self.stats["lookups"] = self.stats["lookups"]+1
+                if thisRecord is not None:
+                    self.resolved[key] = thisRecord
+        return self.fanOut(thisRecord,tirRecord)
+
+    def fanOut(self,thisRecord,tirRecord):
+        # Copy of a resolved thisRecord for another record in the group. The copy is deep so that a caller changing
+        # a document in one record (e.g. the TESS refuge retry) doesn't change it for the rest of the group or the
+        # records still to come from the cache
+        if thisRecord is None:
+            return None
+        memberRecord = copy.deepcopy(thisRecord)
+        memberRecord["id"] = tirRecord["properties"]["id"]
+        return memberRecord
+
+    def summary(self):
+        # Stats in the same shape as the other caches for metrics.RunMetrics.addCache
+        summary = {}
+        summary["hits"] = self.stats["records"]-self.stats["lookups"]
+        summary["misses"] = self.stats["lookups"]
+        summary["entries"] = len(self.resolved)
+        summary["hitRate"] = round(summary["hits"]/self.stats["records"],4) if self.stats["records"] > 0 else 0
+        return summary
@@ -0,0 +1,100 @@
+# Columnar bulk export of tir.tir. Downstream views and recompute jobs that pull whole rows through the GC2 SQL API end
+# up parsing every registration, itis, worms and sgcn bucket in full (the ITIS bucket alone carries the whole hierarchy
+# and vernacular lists) for the handful of properties they use. exportTIR has PostgreSQL pull just the JSON paths asked
+# for out of the buckets, pages through the table by id the same way the processors do, and writes each page out as it
+# comes to a Parquet file (one row group per page) or an Arrow IPC file, so memory use stays at a page whatever the size
+# of the table. openExport memory maps the result for local analysis with pyarrow or pandas.
+#
+# Columns are given as paths: "itis.nameWInd" is itis->>'nameWInd', deeper paths like "itis.hierarchySoFarWRanks.0" use
+# json_extract_path_text, and a plain column name ("matchmethod") is the column itself. Every exported column is text
+# (JSON lists and objects come out as JSON text, the way ->> gives them back) except id. Column names in the file are
+# the paths with dots swapped for underscores, in lower case as PostgreSQL gives unquoted aliases back.
+#
+# pyarrow is only needed by the export functions, so it is imported there.
+
+import os
+from tirutils import claim
+
+fileFormats = ["parquet","arrow"]
+
+
+def columnName(path):
+    return path.replace(".","_").lower()
+
+
+def columnSQL(path):
+    # SQL expression that pulls a path out of tir.tir as text
+    parts = path.split(".")
+    if len(parts) == 1:
+        return parts[0]+"::text"
+    if len(parts) == 2:
+        return parts[0]+"->>'"+parts[1].replace("'","''")+"'"
+    # Same as #>>, which can't go in the GC2 API URL
+    return "json_extract_path_text("+parts[0]+","+",".join(["'"+part.replace("'","''")+"'" for part in parts[1:]])+")"
+
+
+def selectColumns(paths):
+    # The part of the select statement after "id," for claim.pendingRecords
+    return ", ".join([columnSQL(path)+" AS "+columnName(path) for path in paths])
+
+
+def exportSchema(paths):
+    import pyarrow as pa
+    return pa.schema([("id",pa.int64())]+[(columnName(path),pa.string()) for path in paths])
+
+
+def pageTable(tirRecords,schema):
+    # Arrow table for a page of records from the GC2 SQL API
+    import pyarrow as pa
+    columns = {}
+    for field in schema:
+        values = [tirRecord["properties"].get(field.name) for tirRecord in tirRecords]
+        if field.name != "id":
+            values = [str(value) if value is not None else None for value in values]
+        columns[field.name] = values
+    return pa.Table.from_pydict(columns,schema=schema)
+
+
+def exportTIR(baseURL,path,paths,whereClause="TRUE",pageSize=5000,fileFormat="parquet",maxRecords=None):
+    # Write the projected paths for every tir.tir record matching the where clause to path, returning how many records
+    # went out. The file is written under a temporary name and swapped in at the end so that a failed export never
+    # leaves a partial file where the last good one was.
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    if fileFormat not in fileFormats:
+        raise ValueError("fileFormat must be one of "+", ".join(fileFormats))
+
+    schema = exportSchema(paths)
+    if os.path.dirname(path) != "":
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+    temporaryPath = path+".tmp"
+
+    numExported = 0
+    if fileFormat == "parquet":
+        fileWriter = pq.ParquetWriter(temporaryPath,schema)
+    else:
+        fileWriter = pa.ipc.new_file(temporaryPath,schema)
+    try:
+        for tirRecordPage in claim.pages(claim.pendingRecords(baseURL,selectColumns(paths),whereClause,pageSize,maxRecords),pageSize):
+            fileWriter.write_table(pageTable(tirRecordPage,schema))
+            numExported = numExported+len(tirRecordPage)
+    except Exception:
+        fileWriter.close()
+        os.remove(temporaryPath)
+        raise
+    fileWriter.close()
+
+    os.replace(temporaryPath,path)
+    return numExported
+
+
+def openExport(path,columns=None):
+    # Memory mapped pyarrow Table of an export (to_pandas() for a DataFrame)
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    if path.endswith(".arrow"):
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        if columns is not None:
+            table = table.select(columns)
+        return table
+    return pq.read_table(path,columns=columns,memory_map=True)
@@ -0,0 +1,135 @@
+# Local approximate name matching. When an exact search turns up nothing, the ITIS and WoRMS processors fall back on
+# a remote fuzzy search (a ~0.5 Solr search for ITIS, like=true for WoRMS), which makes the passes over unmatched
+# names wait on the network for every name. Most names that need a fuzzy match are near misses on names we have
+# already matched and cached in tir.tir, so a NameIndex built from the cached authority names (ITIS nameWOInd/tsn,
+# WoRMS scientificname/AphiaID) can answer most of these locally.
+#
+# The index splits every name into five pieces. Fuzzy searches allow at most two edits, and two edits can only touch
+# two of the pieces, so any name within the limit of a search name has at least three of its pieces show up
+# unchanged in the search name, no more than two characters from where they sit in the indexed name. A search looks
+# up the pieces of the search name at those spots (a hundred or so dictionary lookups whatever the size of the
+# index). A name with three of five pieces matching has to turn up for at least one of any three pieces, so only the
+# names holding the three rarest pieces are looked at; those with enough matching pieces are checked with the same
+# edit limit the Solr fuzzy searches use. Needing more than one piece keeps a shared genus or a common ending like
+# -ensis from pulling in thousands of names. Candidates come back ranked by score (1 - edits/length of the longer
+# name).
+#
+# The index only knows names we have cached, so a single local candidate is a good match but not proof that the
+# authority has no other close names. Names with no single local candidate still go to the remote fuzzy search.
+
+from collections import Counter
+from tirutils import claim
+from tirutils import itisbatch
+
+numPieces = 5
+
+
+def pieces(length):
+    # (start, size) of each piece of a name of this length
+    return [(int(index*length/numPieces),int((index+1)*length/numPieces)-int(index*length/numPieces)) for index in range(numPieces)]
+
+
+def boundedEditDistance(a,b,maxEdits):
+    # Edit distance between a and b, or maxEdits+1 as soon as it is clear the distance is more than maxEdits. Only the
+    # band of cells within maxEdits of the diagonal can hold a distance that small, so nothing outside it is worked out
+    tooFar = maxEdits+1
+    if abs(len(a)-len(b)) > maxEdits:
+        return tooFar
+    # A shared beginning and ending don't change the distance, so only the part in between needs working out
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start = start+1
+    end = 0
+    while end < len(a)-start and end < len(b)-start and a[-1-end] == b[-1-end]:
+        end = end+1
+    a = a[start:len(a)-end]
+    b = b[start:len(b)-end]
+    previousRow = [j if j <= maxEdits else tooFar for j in range(len(b)+1)]
+    for i in range(1,len(a)+1):
+        low = max(1,i-maxEdits)
+        high = min(len(b),i+maxEdits)
+        thisRow = [tooFar]*(len(b)+1)
+        if i <= maxEdits:
+            thisRow[0] = i
+        characterA = a[i-1]
+        for j in range(low,high+1):
+            thisRow[j] = min(previousRow[j]+1,thisRow[j-1]+1,previousRow[j-1]+(characterA != b[j-1]))
+        if min(thisRow[low-1:high+1]) > maxEdits:
+            return tooFar
+        previousRow = thisRow
+    return min(previousRow[-1],tooFar)
+
+
+class NameIndex:
+
+    def __init__(self):
+        self.keys = {}
+        self.pieces = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self,name,key):
+        # Add an authority name with its identifier (TSN, AphiaID, ...)
+        if name is None or key is None or len(name.strip()) == 0:
+            return
+        lowerName = name.strip().lower()
+        if lowerName not in self.keys:
+            self.keys[lowerName] = {}
+            for index,(start,size) in enumerate(pieces(len(lowerName))):
+                self.pieces.setdefault((len(lowerName),index,lowerName[start:start+size]),set()).add(lowerName)
+        self.keys[lowerName][str(key)] = name.strip()
+
+    def candidates(self,name,limit=10):
+        # Ranked list of the indexed names within the fuzzy search edit limit of a name
+        lowerName = name.strip().lower()
+        maxEdits = itisbatch.maxEdits(lowerName)
+
+        pool = set()
+        for length in range(max(len(lowerName)-maxEdits,1),len(lowerName)+maxEdits+1):
+            # Sets of indexed names holding each piece at each of the spots it could have shifted to in the search name
+            piecePostings = []
+            for index,(start,size) in enumerate(pieces(length)):
+                pieceKeys = [(length,index,lowerName[shifted:shifted+size]) for shifted in range(max(start-maxEdits,0),min(start+maxEdits,len(lowerName)-size)+1)]
+                piecePostings.append([self.pieces[pieceKey] for pieceKey in pieceKeys if pieceKey in self.pieces])
+            piecePostings.sort(key=lambda postings: sum([len(names) for names in postings]))
+
+            lengthPool = set().union(*[names for postings in piecePostings[:maxEdits+1] for names in postings])
+            matchedPieces = Counter()
+            for postings in piecePostings:
+                matchedPieces.update(set().union(*[names & lengthPool for names in postings]))
+            pool.update([candidate for candidate,numMatched in matchedPieces.items() if numMatched >= numPieces-maxEdits])
+
+        matches = []
+        for candidate in pool:
+            edits = boundedEditDistance(lowerName,candidate,maxEdits)
+            if edits <= maxEdits:
+                score = round(1-edits/max(len(lowerName),len(candidate),1),4)
+                for key,candidateName in self.keys[candidate].items():
+                    matches.append({"name":candidateName,"key":key,"score":score,"edits":edits})
+        matches.sort(key=lambda match: (-match["score"],match["name"],match["key"]))
+        return matches[:limit]
+
+    def bestMatch(self,name):
+        # The candidate for a name when there is exactly one, the same rule the processors use for remote fuzzy results
+        matches = self.candidates(name,2)
+        if len(matches) == 1:
+            return matches[0]
+        return None
+
+
+def loadNames(baseURL,bucket,nameProperty,keyProperty):
+    # Build an index from the distinct names and identifiers cached in one bucket of tir.tir
+    q_names = "SELECT DISTINCT "+bucket+"->>'"+nameProperty+"' AS name, "+bucket+"->>'"+keyProperty+"' AS key FROM tir.tir WHERE "+bucket+"->>'"+keyProperty+"' IS NOT NULL"
+    nameIndex = NameIndex()
+    for row in claim.sqlQuery(baseURL,q_names)["features"]:
+        nameIndex.add(row["properties"]["name"],row["properties"]["key"])
+    return nameIndex
+
+
+def loadITISNames(baseURL):
+    return loadNames(baseURL,"itis","nameWOInd","tsn")
+
+
+def loadWoRMSNames(baseURL):
+    return loadNames(baseURL,"worms","scientificname","AphiaID")
@@ -0,0 +1,160 @@
+# Batched ITIS matching. Looking names up one at a time means an exact match request, often a fuzzy match request
+# and sometimes a request to follow the accepted TSN for every registration. Solr will take many values for a field
+# in one query (nameWOInd:(a OR b OR ...) or tsn:(...)), so here we resolve a whole page of registrations with a
+# handful of requests and hand the docs back out to the records they belong to.
+#
+# The matching rules are the same as lookups.lookupITIS:
+# * A name with exactly one exact match doc is an "Exact Match"
+# * A name with no exact match docs and exactly one fuzzy match doc is a "Fuzzy Match"
+# * A matched doc that is not accepted/invalid is swapped for the doc of its first accepted TSN when we follow
+#   taxonomy for the record ("Followed Accepted TSN")
+# * Registrations that give a TSN are looked up directly ("TSN Query")
+#
+# Docs for a batch are assigned back to names by comparing nameWOInd without regard to case for exact searches and
+# by the same edit distance limit Solr uses for fuzzy searches. If Solr finds more docs than a batch asked for,
+# the batch is split in half and tried again.
+#
+# A batch whose response can't be read raises lookups.LookupFailed rather than leaving its names without docs, which
+# would write every name in it as "Not Matched". runstate.guardBatch then tries the records of the page one at a time.
+
+from urllib.parse import urlencode
+from tirutils import lookups
+from tirutils import responsecache
+
+itisSolrURL = "http://services.itis.gov/"
+fuzzySimilarity = 0.5
+rowsPerName = 10
+solrSpecialCharacters = '+-&|!(){}[]^"~*?:\\/ '
+
+
+def solrEscape(value):
+    return "".join(["\\"+character if character in solrSpecialCharacters else character for character in str(value)])
+
+
+def batchSearchURL(field,values,fuzzy=False):
+    terms = [solrEscape(value)+("~"+str(fuzzySimilarity) if fuzzy else "") for value in values]
+    return itisSolrURL+"?"+urlencode({"wt":"json","rows":len(values)*rowsPerName,"q":field+":("+" OR ".join(terms)+")"})
+
+
+def editDistance(a,b):
+    previousRow = list(range(len(b)+1))
+    for i,characterA in enumerate(a,1):
+        thisRow = [i]
+        for j,characterB in enumerate(b,1):
+            thisRow.append(min(previousRow[j]+1,thisRow[j-1]+1,previousRow[j-1]+(characterA != characterB)))
+        previousRow = thisRow
+    return previousRow[-1]
+
+
+def maxEdits(term):
+    # How Lucene turns a ~0.5 style similarity into the number of edits a fuzzy search allows (never more than 2)
+    return min(int((1-fuzzySimilarity)*len(term)),2)
+
+
+def fuzzyMatches(name,docName):
+    return abs(len(name)-len(docName)) <= maxEdits(name) and editDistance(name,docName) <= maxEdits(name)
+
+
+def searchBatch(field,values,fuzzy=False):
+    # Returns the list of docs Solr gives back for a batch of values, splitting the batch if it was cut short
+    if len(values) == 0:
+        return []
+    searchURL = batchSearchURL(field,values,fuzzy)
+    try:
+        itisSearchResults = responsecache.cachedGet(searchURL).json()
+        docs = itisSearchResults["response"]["docs"]
+        numFound = itisSearchResults["response"]["numFound"]
+    except (ValueError,KeyError,TypeError) as e:
+        raise lookups.LookupFailed(lookups.itisHost+": could not read the "+field+" search for "+str(len(values))+" values ("+type(e).__name__+": "+str(e)+")")
+    if numFound > len(docs) and len(values) > 1:
+        middle = int(len(values)/2)
+        return searchBatch(field,values[:middle],fuzzy)+searchBatch(field,values[middle:],fuzzy)
+    return docs
+
+
+def docsByName(names,fuzzy=False,batchSize=50):
+    # Dictionary of each name to the list of docs that match it
+    matches = {name:[] for name in names}
+    for start in range(0,len(names),batchSize):
+        batchNames = names[start:start+batchSize]
+        for itisDoc in searchBatch("nameWOInd",batchNames,fuzzy):
+            docName = itisDoc.get("nameWOInd","").lower()
+            for name in batchNames:
+                if (fuzzy and fuzzyMatches(name.lower(),docName)) or (not fuzzy and name.lower() == docName):
+                    matches[name].append(itisDoc)
+    return matches
+
+
+def docsByTSN(tsns,batchSize=50):
+    # Dictionary of each TSN (as a string) to its doc, for the TSNs that ITIS has
+    tsnDocs = {}
+    tsns = list(dict.fromkeys([str(tsn) for tsn in tsns]))
+    for start in range(0,len(tsns),batchSize):
+        for itisDoc in searchBatch("tsn",tsns[start:start+batchSize]):
+            tsnDocs[str(itisDoc["tsn"])] = itisDoc
+    return tsnDocs
+
+
+def lookupITISPage(tirRecords,batchSize=50,source=None,nameIndex=None):
+    # Batched version of lookups.lookupITIS over a page of records, returning thisRecord structures in the same order
+    # source is anything with docsByName and docsByTSN functions like this module (e.g. an itissnapshot.ITISSnapshot
+    # for offline matching); by default we search the ITIS Solr service
+    # nameIndex is an optional fuzzynames.NameIndex of cached ITIS names to try before fuzzy searches
+    from bis import itis
+    searchNames = docsByName if source is None else source.docsByName
+    searchTSNs = docsByTSN if source is None else source.docsByTSN
+    thisRecords = [lookups.itisRecord(tirRecord) for tirRecord in tirRecords]
+    itisDocs = {}
+
+    nameRecords = [thisRecord for thisRecord in thisRecords if thisRecord["taxonomicLookupProperty"] == "scientificname" and len(thisRecord["scientificname_search"]) != 0]
+    names = list(dict.fromkeys([thisRecord["scientificname_search"] for thisRecord in nameRecords]))
+
+    # Exact match searches for every name, then fuzzy matches for the names that found nothing, from the local name
+    # index where it has a single candidate and from fuzzy searches for the rest
+    exactDocs = searchNames(names,False,batchSize)
+    unmatchedNames = [name for name in names if len(exactDocs[name]) == 0]
+    localMatches = {}
+    for name in unmatchedNames:
+        localMatch = lookups.localFuzzyMatch(nameIndex,name)
+        if localMatch is not None:
+            localMatches[name] = localMatch
+    localDocs = searchTSNs([localMatch["key"] for localMatch in localMatches.values()],batchSize)
+    fuzzyDocs = {name:[localDocs[localMatch["key"]]] for name,localMatch in localMatches.items() if localMatch["key"] in localDocs}
+    fuzzyDocs.update(searchNames([name for name in unmatchedNames if name not in fuzzyDocs],True,batchSize))
+
+    for thisRecord in nameRecords:
+        name = thisRecord["scientificname_search"]
+        thisRecord["numResults"] = len(exactDocs[name])
+        if thisRecord["numResults"] == 1:
+            thisRecord["matchMethod"] = "Exact Match"
+            itisDocs[thisRecord["id"]] = exactDocs[name][0]
+        elif thisRecord["numResults"] == 0:
+            thisRecord["numResults"] = len(fuzzyDocs[name])
+            if thisRecord["numResults"] == 1:
+                thisRecord["matchMethod"] = "Fuzzy Match"
+                thisRecord["localFuzzyMatch"] = localMatches.get(name)
+                itisDocs[thisRecord["id"]] = fuzzyDocs[name][0]
+
+    # Follow accepted TSNs for matches that are not accepted/invalid when we follow taxonomy for the record
+    followRecords = [thisRecord for thisRecord in nameRecords if thisRecord["id"] in itisDocs and itisDocs[thisRecord["id"]]["usage"] in ["not accepted","invalid"] and thisRecord["followTaxonomy"]]
+    acceptedDocs = searchTSNs([itisDocs[thisRecord["id"]]["acceptedTSN"][0] for thisRecord in followRecords],batchSize)
+    for thisRecord in followRecords:
+        acceptedTSN = str(itisDocs[thisRecord["id"]]["acceptedTSN"][0])
+        if acceptedTSN in acceptedDocs:
+            thisRecord["matchMethod"] = "Followed Accepted TSN"
+            itisDocs[thisRecord["id"]] = acceptedDocs[acceptedTSN]
+
+    # Registrations that give us a TSN to look up directly
+    tsnRecords = [thisRecord for thisRecord in thisRecords if thisRecord["taxonomicLookupProperty"] == "tsn" and thisRecord["tsn"] is not None]
+    tsnDocs = searchTSNs([thisRecord["tsn"] for thisRecord in tsnRecords],batchSize)
+    for thisRecord in tsnRecords:
+        if str(thisRecord["tsn"]) in tsnDocs:
+            thisRecord["matchMethod"] = "TSN Query"
+            thisRecord["matchString"] = thisRecord["tsn"]
+            itisDocs[thisRecord["id"]] = tsnDocs[str(thisRecord["tsn"])]
+
+    for thisRecord in thisRecords:
+        if thisRecord["id"] in itisDocs:
+            thisRecord["itisData"] = itis.packageITISJSON(thisRecord["matchMethod"],thisRecord["matchString"],itisDocs[thisRecord["id"]])
+
+    return thisRecords
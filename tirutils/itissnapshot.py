@@ -0,0 +1,150 @@
+# Local ITIS matching from a downloaded ITIS export. ITIS publishes the full database as a SQLite download
+# (taxonomic_units, synonym_links, vernaculars, hierarchy and the lookup tables); buildSnapshot turns that into a
+# compact local store of the same docs the ITIS Solr service gives back, indexed by name and TSN. An ITISSnapshot
+# answers the same questions as the Solr searches in itisbatch (docs by exact name, by fuzzy name and by TSN) so
+# that itisbatch.lookupITISPage can match a whole registry against it without any network calls.
+#
+# Fuzzy candidates are names in the same genus or with the same final epithet as the search name, filtered with the
+# same edit limit Solr uses, so a name with a typo in both words will not be found locally where Solr might.
+
+import os,json,sqlite3,threading
+from tirutils import itisbatch
+
+snapshotDDL = [
+    "CREATE TABLE IF NOT EXISTS docs (tsn TEXT PRIMARY KEY, name TEXT, firstWord TEXT, lastWord TEXT, doc TEXT)",
+    "CREATE INDEX IF NOT EXISTS docs_name ON docs (name)",
+    "CREATE INDEX IF NOT EXISTS docs_firstword ON docs (firstWord)",
+    "CREATE INDEX IF NOT EXISTS docs_lastword ON docs (lastWord)"
+]
+
+
+def joinName(parts):
+    return " ".join([part.strip() for part in parts if part is not None and len(part.strip()) > 0])
+
+
+def nameKeys(nameWOInd):
+    # Lowercased name and its first and last words for the name indexes
+    name = nameWOInd.lower()
+    words = name.split(" ")
+    return name,words[0],words[-1]
+
+
+def buildSnapshot(exportPath,snapshotPath,batchSize=10000):
+    # Build a local snapshot from the ITIS SQLite export at exportPath, replacing anything at snapshotPath
+    export = sqlite3.connect(exportPath)
+
+    ranks = {}
+    for kingdomID,rankID,rankName in export.execute("SELECT kingdom_id, rank_id, rank_name FROM taxon_unit_types"):
+        ranks[(kingdomID,rankID)] = rankName.strip()
+    kingdoms = dict(export.execute("SELECT kingdom_id, kingdom_name FROM kingdoms"))
+    authors = dict(export.execute("SELECT taxon_author_id, taxon_author FROM taxon_authors_lkp"))
+
+    acceptedTSNs = {}
+    for tsn,acceptedTSN in export.execute("SELECT tsn, tsn_accepted FROM synonym_links"):
+        acceptedTSNs.setdefault(tsn,[]).append(str(acceptedTSN))
+
+    vernaculars = {}
+    for tsn,vernacularName,language,approved,vernacularID,updateDate in export.execute("SELECT tsn, vernacular_name, language, approved_ind, vern_id, update_date FROM vernaculars"):
+        vernaculars.setdefault(tsn,[]).append("$"+"$".join([str(value) if value is not None else "" for value in [vernacularName,language,approved,vernacularID,updateDate]])+"$")
+
+    hierarchies = dict(export.execute("SELECT TSN, hierarchy_string FROM hierarchy"))
+
+    # Every taxonomic unit is loaded up front because hierarchy strings refer to ancestors by TSN
+    units = {}
+    unitQuery = "SELECT tsn, unit_ind1, unit_name1, unit_ind2, unit_name2, unit_ind3, unit_name3, unit_ind4, unit_name4, name_usage, unaccept_reason, credibility_rtng, completeness_rtng, currency_rating, kingdom_id, rank_id, parent_tsn, taxon_author_id, initial_time_stamp, update_date FROM taxonomic_units"
+    for row in export.execute(unitQuery):
+        units[row[0]] = row
+
+    if os.path.dirname(snapshotPath) != "":
+        os.makedirs(os.path.dirname(snapshotPath),exist_ok=True)
+    if os.path.exists(snapshotPath):
+        os.remove(snapshotPath)
+    snapshot = sqlite3.connect(snapshotPath)
+    for statement in snapshotDDL:
+        snapshot.execute(statement)
+
+    def unitName(unit):
+        return joinName([unit[2],unit[4],unit[6],unit[8]])
+
+    batch = []
+    for tsn,unit in units.items():
+        itisDoc = {}
+        itisDoc["tsn"] = str(tsn)
+        itisDoc["nameWInd"] = joinName(unit[1:9])
+        itisDoc["nameWOInd"] = unitName(unit)
+        for index in range(4):
+            if unit[2+index*2] is not None and len(unit[2+index*2].strip()) > 0:
+                itisDoc["unit"+str(index+1)] = unit[2+index*2].strip()
+        itisDoc["usage"] = unit[9]
+        if unit[10] is not None:
+            itisDoc["unacceptReason"] = unit[10]
+        itisDoc["credibilityRating"] = unit[11]
+        itisDoc["completenessRating"] = unit[12]
+        itisDoc["currencyRating"] = unit[13]
+        itisDoc["kingdom"] = kingdoms.get(unit[14])
+        itisDoc["rankID"] = unit[15]
+        itisDoc["rank"] = ranks.get((unit[14],unit[15]))
+        itisDoc["parentTSN"] = str(unit[16]) if unit[16] is not None else None
+        if unit[17] in authors:
+            itisDoc["author"] = authors[unit[17]]
+        if tsn in acceptedTSNs:
+            itisDoc["acceptedTSN"] = acceptedTSNs[tsn]
+        if tsn in vernaculars:
+            itisDoc["vernacular"] = vernaculars[tsn]
+        if tsn in hierarchies:
+            hierarchyTSNs = [int(hierarchyTSN) for hierarchyTSN in hierarchies[tsn].split("-") if hierarchyTSN.isdigit() and int(hierarchyTSN) in units]
+            itisDoc["hierarchyTSN"] = ["$"+"$".join([str(hierarchyTSN) for hierarchyTSN in hierarchyTSNs])+"$"]
+            itisDoc["hierarchySoFarWRanks"] = ["$"+"$".join([str(ranks.get((units[hierarchyTSN][14],units[hierarchyTSN][15])))+":"+unitName(units[hierarchyTSN]) for hierarchyTSN in hierarchyTSNs])+"$"]
+        itisDoc["createDate"] = unit[18]
+        itisDoc["updateDate"] = unit[19]
+
+        name,firstWord,lastWord = nameKeys(itisDoc["nameWOInd"])
+        batch.append((itisDoc["tsn"],name,firstWord,lastWord,json.dumps(itisDoc)))
+        if len(batch) >= batchSize:
+            snapshot.executemany("INSERT INTO docs (tsn, name, firstWord, lastWord, doc) VALUES (?,?,?,?,?)",batch)
+            batch = []
+    if len(batch) > 0:
+        snapshot.executemany("INSERT INTO docs (tsn, name, firstWord, lastWord, doc) VALUES (?,?,?,?,?)",batch)
+
+    snapshot.commit()
+    numDocs = snapshot.execute("SELECT count(*) FROM docs").fetchone()[0]
+    snapshot.close()
+    export.close()
+    return numDocs
+
+
+class ITISSnapshot:
+    # Local stand-in for the ITIS Solr searches, with the same docsByName/docsByTSN interface as itisbatch
+
+    def __init__(self,path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path,check_same_thread=False)
+
+    def exactDocs(self,name):
+        with self.lock:
+            return [json.loads(row[0]) for row in self.db.execute("SELECT doc FROM docs WHERE name = ?",(name.lower(),))]
+
+    def fuzzyDocs(self,name):
+        searchName,firstWord,lastWord = nameKeys(name)
+        with self.lock:
+            rows = self.db.execute("SELECT name, doc FROM docs WHERE firstWord = ? UNION SELECT name, doc FROM docs WHERE lastWord = ?",(firstWord,lastWord)).fetchall()
+        return [json.loads(doc) for docName,doc in rows if itisbatch.fuzzyMatches(searchName,docName)]
+
+    def docsByName(self,names,fuzzy=False,batchSize=None):
+        if fuzzy:
+            return {name:self.fuzzyDocs(name) for name in names}
+        return {name:self.exactDocs(name) for name in names}
+
+    def docsByTSN(self,tsns,batchSize=None):
+        tsnDocs = {}
+        with self.lock:
+            for tsn in dict.fromkeys([str(tsn) for tsn in tsns]):
+                row = self.db.execute("SELECT doc FROM docs WHERE tsn = ?",(tsn,)).fetchone()
+                if row is not None:
+                    tsnDocs[tsn] = json.loads(row[0])
+        return tsnDocs
+
+    def close(self):
+        with self.lock:
+            self.db.close()
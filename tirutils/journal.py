@@ -0,0 +1,107 @@
+# The bucket processors record the ids they write to a small journal table in the TIR schema so that downstream
+# work like TIR Common Properties can pick up just the records that changed since it last ran (tracked with a local
+# watermark on the journal sequence) instead of scanning the whole table for stale cache dates.
+#
+# The journal only holds what the processors wrote since it was added, so a reader starts with one full pass over the
+# table and takes the journal position from the start of that pass as its first watermark. Entries at or below a
+# watermark are no longer needed; TIR Common Properties is the only reader, so it prunes the journal through its own
+# watermark each time it saves one. A second reader would have to prune through the lowest of the watermarks instead.
+
+import os,json
+from tirutils import sessions
+from tirutils import claim
+
+journalTable = "tir.journal"
+journalDDL = "CREATE TABLE IF NOT EXISTS "+journalTable+" (seq bigserial PRIMARY KEY, id integer NOT NULL, bucket text NOT NULL, journaled timestamp NOT NULL DEFAULT now())"
+
+
+def ensureJournal(baseURL):
+    # Create the journal table if it isn't there yet
+    return sessions.post(baseURL,data={"q":journalDDL}).json()
+
+
+def recordChanges(baseURL,ids,bucket):
+    # Add one journal entry per id for the bucket that was written
+    if len(ids) == 0:
+        return {"success":True}
+    valuesList = ["("+str(int(recordID))+",'"+bucket.replace("'","''")+"')" for recordID in ids]
+    q_journal = "INSERT INTO "+journalTable+" (id,bucket) VALUES "+",".join(valuesList)
+    return sessions.post(baseURL,data={"q":q_journal}).json()
+
+
+def currentSeq(baseURL):
+    # The last sequence number in the journal, or 0 if it is empty
+    seqResult = claim.sqlQuery(baseURL,"SELECT max(seq) AS seq FROM "+journalTable)
+    if "features" not in seqResult:
+        raise Exception(seqResult.get("message","Could not read the journal sequence"))
+    seq = seqResult["features"][0]["properties"]["seq"]
+    if seq is None:
+        return 0
+    return seq
+
+
+def pruneJournal(baseURL,throughSeq):
+    # Delete the entries up to and including a sequence number that has been worked through
+    q_prune = "DELETE FROM "+journalTable+" WHERE seq <= "+str(int(throughSeq))
+    return sessions.post(baseURL,data={"q":q_prune}).json()
+
+
+def readWatermark(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return json.load(f)["seq"]
+
+
+def writeWatermark(path,seq):
+    # Write to a temporary file and swap it in so that a crash never leaves a half written watermark
+    if os.path.dirname(path) != "":
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+    with open(path+".tmp","w") as f:
+        json.dump({"seq":seq},f)
+    os.replace(path+".tmp",path)
+
+
+def changedRecords(baseURL,selectColumns,whereClause,buckets,afterSeq=0,pageSize=100,maxRecords=None):
+    # Generator that pages through the journal after a given sequence number for the listed buckets and yields the
+    # matching tir.tir records (selected the same way as claim.pendingRecords) with the journal sequence that brought
+    # them in as the "journalseq" property. Records that show up in the journal more than once in a page are only
+    # yielded once.
+    bucketList = ",".join(["'"+bucket+"'" for bucket in buckets])
+    numberYielded = 0
+
+    while maxRecords is None or numberYielded < maxRecords:
+        q_journal = "SELECT id, max(seq) AS seq FROM "+journalTable+" WHERE seq > "+str(afterSeq)+" AND bucket IN ("+bucketList+") GROUP BY id ORDER BY max(seq) ASC LIMIT "+str(pageSize)
+        journalPage = claim.sqlQuery(baseURL,q_journal)
+
+        # Errors raise rather than end the generator, which would look like the end of the journal
+        if "features" not in journalPage:
+            raise Exception(journalPage.get("message","Could not page through the journal"))
+        if len(journalPage["features"]) == 0:
+            break
+
+        journalSeqs = {}
+        for entry in journalPage["features"]:
+            journalSeqs[entry["properties"]["id"]] = entry["properties"]["seq"]
+
+        q_changed = "SELECT id, "+selectColumns+" FROM tir.tir WHERE ("+whereClause+") AND id IN ("+",".join([str(recordID) for recordID in journalSeqs.keys()])+") ORDER BY id ASC"
+        changedPage = claim.sqlQuery(baseURL,q_changed)
+        if "features" not in changedPage:
+            raise Exception(changedPage.get("message","Could not read the changed records"))
+
+        # Hand records back in journal order so that the last journalseq seen is always safe to use as a watermark
+        changedRecordsInPage = changedPage["features"]
+        for tirRecord in changedRecordsInPage:
+            tirRecord["properties"]["journalseq"] = journalSeqs[tirRecord["properties"]["id"]]
+        changedRecordsInPage.sort(key=lambda tirRecord: tirRecord["properties"]["journalseq"])
+
+        for tirRecord in changedRecordsInPage:
+            if maxRecords is not None and numberYielded >= maxRecords:
+                return
+            numberYielded = numberYielded + 1
+            yield tirRecord
+
+        afterSeq = max(journalSeqs.values())
+
+        if len(journalPage["features"]) < pageSize:
+            break
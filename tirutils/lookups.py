@@ -0,0 +1,304 @@
+# These are the per-record lookup chains from the ITIS, WoRMS, TESS and NatureServe processors, pulled out of the
+# processor loops so that they can be run concurrently over a page of pending records. Each function takes a record
+# (feature) from the GC2 SQL API as selected in the processor script and returns the thisRecord structure that the
+# script displays and caches. All calls to upstream services go through the response cache, the pooled sessions, a
+# host slot from the workers module and the host's limiter from ratelimit. Trouble upstream raises
+# ratelimit.UpstreamUnavailable out of the lookup instead of turning into a "Not Matched" result, so the record is
+# left pending. Other errors the bis functions hand back (a response for one species that won't parse, say) raise
+# LookupFailed, which counts against the record (see runstate) rather than pausing the run.
+#
+# The bis package is imported in the functions that use it, so the rest of tirutils (and the benchmarks) can import
+# this module without bis installed.
+
+from tirutils import workers
+from tirutils import ratelimit
+from tirutils import responsecache
+from tirutils import metrics
+from tirutils import names
+
+itisHost = "services.itis.gov"
+wormsHost = "www.marinespecies.org"
+tessHost = "ecos.fws.gov"
+natureServeHost = "services.natureserve.org"
+
+
+class LookupFailed(Exception):
+    pass
+
+
+def raiseForErrorMessage(host,errorMessage):
+    if ratelimit.isTransportError(errorMessage):
+        raise ratelimit.UpstreamUnavailable(host,str(errorMessage))
+    raise LookupFailed(host+": "+str(errorMessage))
+
+
+def queryTESS(queryType,queryValue):
+    # The bis functions catch their own errors and hand back an errorMessage, which we raise instead of caching. Only
+    # transport errors count against the host's limiter.
+    from bis import tess
+    with workers.hostSlot(tessHost),metrics.timed(tessHost),ratelimit.limited(tessHost) as outcome:
+        tessResult = tess.queryTESS(queryType,queryValue)
+        if "errorMessage" in tessResult and ratelimit.isTransportError(tessResult["errorMessage"]):
+            outcome["statusCode"] = None
+    if "errorMessage" in tessResult:
+        raiseForErrorMessage(tessHost,tessResult["errorMessage"])
+    return tessResult
+
+
+def queryNatureServeID(name):
+    # None is a real answer (no element for the name) and gets cached. Errors the bis function hands back raise like
+    # they do in packageNatureServeJSON, so they are never cached as a name without a match.
+    from bis import natureserve
+    with workers.hostSlot(natureServeHost),metrics.timed(natureServeHost),ratelimit.limited(natureServeHost) as outcome:
+        elementGlobalID = natureserve.queryNatureServeID(name)
+        if isinstance(elementGlobalID,dict) and "errorMessage" in elementGlobalID and ratelimit.isTransportError(elementGlobalID["errorMessage"]):
+            outcome["statusCode"] = None
+    if isinstance(elementGlobalID,dict) and "errorMessage" in elementGlobalID:
+        raiseForErrorMessage(natureServeHost,elementGlobalID["errorMessage"])
+    if elementGlobalID is not None and not isinstance(elementGlobalID,str):
+        raise LookupFailed(natureServeHost+": unexpected element ID "+repr(elementGlobalID)[:200])
+    return elementGlobalID
+
+
+def packageNatureServeJSON(speciesAPI,elementGlobalID):
+    from bis import natureserve
+    with workers.hostSlot(natureServeHost),metrics.timed(natureServeHost),ratelimit.limited(natureServeHost) as outcome:
+        natureServeData = natureserve.packageNatureServeJSON(speciesAPI,elementGlobalID)
+        if isinstance(natureServeData,dict) and "errorMessage" in natureServeData and ratelimit.isTransportError(natureServeData["errorMessage"]):
+            outcome["statusCode"] = None
+    if isinstance(natureServeData,dict) and "errorMessage" in natureServeData:
+        raiseForErrorMessage(natureServeHost,natureServeData["errorMessage"])
+    return natureServeData
+
+
+def wormsMatch(wormsSearchResults,firstRecord=True):
+    # Whether a WoRMS response holds a record with a valid name (the first of a list for name searches). No content,
+    # client errors (like a 400 for a name WoRMS can't parse) and empty lists are no match; throttling and server
+    # errors raise before we get here.
+    if wormsSearchResults.status_code != 200:
+        return False
+    try:
+        wormsRecord = wormsSearchResults.json()
+    except ValueError:
+        return False
+    if firstRecord:
+        wormsRecord = wormsRecord[0] if isinstance(wormsRecord,list) and len(wormsRecord) > 0 else None
+    return isinstance(wormsRecord,dict) and wormsRecord.get("valid_name") is not None
+
+
+def itisRecord(tirRecord):
+    from bis import itis
+    # Set up a local data structure for storage and processing
+    thisRecord = {}
+
+    # Set data from query results
+    thisRecord["id"] = tirRecord["properties"]["id"]
+    thisRecord["source"] = tirRecord["properties"]["source"]
+    thisRecord["followTaxonomy"] = tirRecord["properties"]["followtaxonomy"]
+    thisRecord["taxonomicLookupProperty"] = tirRecord["properties"]["taxonomiclookupproperty"]
+    thisRecord["tsn"] = tirRecord["properties"]["tsn"]
+    thisRecord["scientificname"] = tirRecord["properties"]["scientificname"]
+    thisRecord["scientificname_search"] = names.cleanScientificName(thisRecord["scientificname"])
+
+    # Set defaults for thisRecord
+    thisRecord["matchMethod"] = "Not Matched"
+    thisRecord["matchString"] = thisRecord["scientificname_search"]
+    thisRecord["itisData"] = itis.packageITISJSON(thisRecord["matchMethod"],thisRecord["matchString"],0)
+    thisRecord["numResults"] = 0
+
+    return thisRecord
+
+
+def localFuzzyMatch(nameIndex,name):
+    # Look for a fuzzy match in a fuzzynames.NameIndex of cached authority names before asking the remote service
+    if nameIndex is None:
+        return None
+    return nameIndex.bestMatch(name)
+
+
+def itisSearch(searchURL):
+    # Docs from an ITIS Solr search. A response we can't read raises LookupFailed instead of reading as no match.
+    try:
+        return responsecache.cachedGet(searchURL).json()["response"]["docs"]
+    except (ValueError,KeyError,TypeError) as e:
+        raise LookupFailed(itisHost+": could not read the search "+searchURL+" ("+type(e).__name__+": "+str(e)+")")
+
+
+def lookupITIS(tirRecord,nameIndex=None):
+    from bis import itis
+    thisRecord = itisRecord(tirRecord)
+    itisDoc = {}
+
+    if thisRecord["taxonomicLookupProperty"] == "scientificname" and len(thisRecord["scientificname_search"]) != 0:
+
+        # Try an exact match search
+        thisRecord["itisSearchURL"] = itis.getITISSearchURL(thisRecord["scientificname_search"],False,True)
+        itisDocs = itisSearch(thisRecord["itisSearchURL"])
+        thisRecord["numResults"] = len(itisDocs)
+
+        # If we got only a single record on an exact match search, set the method and proceed
+        if thisRecord["numResults"] == 1:
+            thisRecord["matchMethod"] = "Exact Match"
+            itisDoc = itisDocs[0]
+
+        # If we found nothing on an exact match search, try a fuzzy match, first against names we have already cached
+        elif thisRecord["numResults"] == 0:
+            thisRecord["localFuzzyMatch"] = localFuzzyMatch(nameIndex,thisRecord["scientificname_search"])
+            if thisRecord["localFuzzyMatch"] is not None:
+                thisRecord["itisSearchURL"] = itis.getITISSearchURL(thisRecord["localFuzzyMatch"]["key"],False,False)
+                itisDocs = itisSearch(thisRecord["itisSearchURL"])
+                thisRecord["numResults"] = len(itisDocs)
+            if thisRecord["numResults"] == 0:
+                thisRecord["itisSearchURL"] = itis.getITISSearchURL(thisRecord["scientificname_search"],True,True)
+                itisDocs = itisSearch(thisRecord["itisSearchURL"])
+                thisRecord["numResults"] = len(itisDocs)
+            if thisRecord["numResults"] == 1:
+                thisRecord["matchMethod"] = "Fuzzy Match"
+                itisDoc = itisDocs[0]
+
+        # If we got a result but the usage is not accepted/invalid and we should follow taxonomy for this record, then
+        # retrieve the record for the accepted TSN (keeping the match we have if ITIS doesn't have the accepted TSN)
+        if len(itisDoc) > 0 and itisDoc["usage"] in ["not accepted","invalid"] and thisRecord["followTaxonomy"]:
+            thisRecord["itisSearchURL"] = itis.getITISSearchURL(itisDoc["acceptedTSN"][0],False,False)
+            acceptedDocs = itisSearch(thisRecord["itisSearchURL"])
+            if len(acceptedDocs) > 0:
+                thisRecord["matchMethod"] = "Followed Accepted TSN"
+                itisDoc = acceptedDocs[0]
+
+        # If we got an ITIS Doc returned, package the results
+        if len(itisDoc) > 0:
+            thisRecord["itisData"] = itis.packageITISJSON(thisRecord["matchMethod"],thisRecord["matchString"],itisDoc)
+
+    elif thisRecord["taxonomicLookupProperty"] == "tsn" and thisRecord["tsn"] is not None:
+        thisRecord["itisSearchURL"] = itis.getITISSearchURL(thisRecord["tsn"],False,False)
+        itisDocs = itisSearch(thisRecord["itisSearchURL"])
+        # A TSN that ITIS doesn't have (any more) stays "Not Matched" instead of raising on an empty list of docs
+        if len(itisDocs) > 0:
+            thisRecord["matchMethod"] = "TSN Query"
+            thisRecord["matchString"] = thisRecord["tsn"]
+            itisDoc = itisDocs[0]
+            thisRecord["itisData"] = itis.packageITISJSON(thisRecord["matchMethod"],thisRecord["matchString"],itisDoc)
+
+    return thisRecord
+
+
+def lookupWoRMS(tirRecord,wormsNameService,wormsIDService,nameIndex=None):
+    from bis import worms
+    # Set up a local data structure for storage and processing
+    thisRecord = {}
+
+    # Set data from query results
+    thisRecord["id"] = tirRecord["properties"]["id"]
+    thisRecord["followTaxonomy"] = tirRecord["properties"]["followtaxonomy"]
+
+    thisRecord["tryNames"] = []
+    thisRecord["tryNames"].append(names.cleanScientificName(tirRecord["properties"]["scientificname"]))
+    if tirRecord["properties"]["namewind"] is not None and tirRecord["properties"]["namewind"] not in thisRecord["tryNames"]:
+        thisRecord["tryNames"].append(tirRecord["properties"]["namewind"])
+    if tirRecord["properties"]["namewoind"] is not None and tirRecord["properties"]["namewoind"] not in thisRecord["tryNames"]:
+        thisRecord["tryNames"].append(tirRecord["properties"]["namewoind"])
+
+    # Set defaults for thisRecord
+    thisRecord["matchMethod"] = "Not Matched"
+    wormsData = 0
+
+    # Handle cases where cleaning the Scientific Name resulted in a single blank value to search on
+    if len(thisRecord["tryNames"]) == 1 and len(thisRecord["tryNames"][0]) == 0:
+        thisRecord["matchString"] = tirRecord["properties"]["scientificname"]
+        thisRecord["tryNames"] = []
+
+    for name in thisRecord["tryNames"]:
+        # Handle the cases where there is enough interesting stuff in the scientific name string that it comes back blank from the cleaners
+        if len(name) != 0:
+            thisRecord["matchString"] = name
+            thisRecord["baseQueryURL"] = wormsNameService+name
+            wormsSearchResults = responsecache.cachedGet(thisRecord["baseQueryURL"]+"?like=false&marine_only=false&offset=1")
+            if not wormsMatch(wormsSearchResults):
+                # Try a fuzzy match against names we have already cached before the remote fuzzy search
+                thisRecord["localFuzzyMatch"] = localFuzzyMatch(nameIndex,name)
+                if thisRecord["localFuzzyMatch"] is not None:
+                    wormsSearchResults = responsecache.cachedGet(wormsIDService+thisRecord["localFuzzyMatch"]["key"])
+                    if wormsMatch(wormsSearchResults,False):
+                        wormsData = wormsSearchResults.json()
+                        thisRecord["matchMethod"] = "Fuzzy Match"
+                        continue
+                wormsSearchResults = responsecache.cachedGet(thisRecord["baseQueryURL"]+"?like=true&marine_only=false&offset=1")
+                if wormsMatch(wormsSearchResults):
+                    wormsData = wormsSearchResults.json()[0]
+                    thisRecord["matchMethod"] = "Fuzzy Match"
+            else:
+                wormsData = wormsSearchResults.json()[0]
+                thisRecord["matchMethod"] = "Exact Match"
+                break
+
+    if not type(wormsData) == int and wormsData["status"] != "accepted" and thisRecord["followTaxonomy"] == "true":
+        validAphiaID = str(wormsData["valid_AphiaID"])
+        wormsSearchResults = responsecache.cachedGet(wormsIDService+validAphiaID)
+        if wormsMatch(wormsSearchResults,False):
+            wormsData = wormsSearchResults.json()
+            thisRecord["matchString"] = validAphiaID
+            thisRecord["matchMethod"] = "Followed Accepted AphiaID"
+
+    thisRecord["wormsJSON"] = worms.packageWoRMSJSON(thisRecord["matchMethod"],thisRecord["matchString"],wormsData)
+
+    return thisRecord
+
+
+def lookupTESS(tirRecord):
+    from bis import tess
+    thisRecord = {}
+    thisRecord["id"] = tirRecord["properties"]["id"]
+    thisRecord["tsnsToSearch"] = []
+    thisRecord["namesToSearch"] = [tirRecord["properties"]["name_state"]]
+    thisRecord["tessJSON"] = tess.queryTESS()
+
+    if tirRecord["properties"]["matchmethod_itis"] not in [None,"Not Matched"]:
+        if tirRecord["properties"]["tsn"] is not None:
+            thisRecord["tsnsToSearch"].append(tirRecord["properties"]["tsn"])
+        if tirRecord["properties"]["acceptedtsn"] not in [None,thisRecord["tsnsToSearch"]]:
+            thisRecord["tsnsToSearch"].append(tirRecord["properties"]["acceptedtsn"])
+        if tirRecord["properties"]["name_itis"] not in [None,thisRecord["namesToSearch"]]:
+            thisRecord["namesToSearch"].append(tirRecord["properties"]["name_itis"])
+
+    if tirRecord["properties"]["matchmethod_worms"] not in [None,"Not Matched"]:
+        if tirRecord["properties"]["name_worms"] not in [None,thisRecord["namesToSearch"]]:
+            thisRecord["namesToSearch"].append(tirRecord["properties"]["name_worms"])
+
+    if len(thisRecord["tsnsToSearch"]) > 0:
+        for tsn in thisRecord["tsnsToSearch"]:
+            thisRecord["tessJSON"] = responsecache.cachedCall("tess.queryTESS",queryTESS,"TSN",tsn,dateKey="dateCached")
+            if thisRecord["tessJSON"]["result"]:
+                break
+
+    if not thisRecord["tessJSON"]["result"] and len(thisRecord["namesToSearch"]) > 0:
+        for name in thisRecord["namesToSearch"]:
+            thisRecord["tessJSON"] = responsecache.cachedCall("tess.queryTESS",queryTESS,"SCINAME",name,dateKey="dateCached")
+            if thisRecord["tessJSON"]["result"]:
+                break
+
+    return thisRecord
+
+
+def lookupNatureServe(tirRecord,speciesAPI):
+    thisRecord = {}
+    thisRecord["id"] = tirRecord["properties"]["id"]
+    thisRecord["name_registered"] = tirRecord["properties"]["name_registered"]
+    thisRecord["name_itis"] = tirRecord["properties"]["name_itis"]
+    thisRecord["name_worms"] = tirRecord["properties"]["name_worms"]
+
+    thisRecord["tryNames"] = []
+    thisRecord["tryNames"].append(thisRecord["name_registered"])
+    if thisRecord["name_itis"] is not None and thisRecord["name_itis"] not in thisRecord["tryNames"]:
+        thisRecord["tryNames"].append(thisRecord["name_itis"])
+    if thisRecord["name_worms"] is not None and thisRecord["name_worms"] not in thisRecord["tryNames"]:
+        thisRecord["tryNames"].append(thisRecord["name_worms"])
+
+    for name in thisRecord["tryNames"]:
+        thisRecord["elementGlobalID"] = responsecache.cachedCall("natureserve.queryNatureServeID",queryNatureServeID,name)
+        if thisRecord["elementGlobalID"] is not None:
+            break
+
+    # Run the function to query and package NatureServe data
+    thisRecord["natureServeData"] = packageNatureServeJSON(speciesAPI,thisRecord["elementGlobalID"])
+
+    return thisRecord
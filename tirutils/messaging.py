@@ -0,0 +1,302 @@
+# Message driven workers for the TIR processors, for running them as separate services on a Kafka style message
+# queue. Each registration goes out as an event on tir.registrations; the ITIS worker consumes those and sends the
+# record on with its ITIS bucket filled in to tir.itis, WoRMS consumes tir.itis and sends to tir.worms, and TESS and
+# NatureServe both consume tir.worms (in their own consumer groups) and send to tir.tess and tir.natureserve. Events
+# carry the registration and every bucket so far (pipeline.eventFor), so a worker never has to go back to tir.tir
+# for what the processors before it found. The lookups themselves are the pipeline stage functions, so a worker
+# does exactly what the same stage does in TIR Pipeline.
+#
+# A worker takes a batch of events at a time, runs its lookup over them, writes its bucket with a TIRWriter and
+# waits for the writes to finish, sends the enriched events on and only then commits its offsets. Anything that
+# goes wrong before the commit means the batch is picked up again (by this or another worker in the group), so
+# every event is processed at least once. Adding workers to a group spreads the topic partitions (events are keyed
+# by TIR id) over them.
+#
+# One bad event must not hold up its partition, so a batch whose lookup raises is looked up again one event at a time
+# and the events that still raise are set aside. Events that are not sent on (the lookup raised, it gave nothing back
+# or the write failed) go to the tir.deadletters topic with the processor and the reason, and are counted in the
+# worker's summary; the offsets are committed past them. They are still missing the bucket in tir.tir, so they also
+# get picked up again the next time registrations are published. Trouble upstream (ratelimit.UpstreamUnavailable,
+# once the lookups have paused as long as they will) is not the events' fault, so it stops the worker without
+# committing and the batch is picked up again later.
+#
+# LocalBroker is an in-process stand-in with the same partition, consumer group and committed offset behavior for
+# running workers in threads (the benchmarks do this) without a Kafka cluster. KafkaBroker uses the kafka-python
+# package, which only needs to be installed where workers actually run against Kafka.
+
+import json,zlib,threading
+from tirutils import workers
+from tirutils import ratelimit
+from tirutils import pipeline
+
+registrationsTopic = "tir.registrations"
+deadLetterTopic = "tir.deadletters"
+processors = {
+    "ITIS":{"bucket":"itis","consumes":registrationsTopic,"produces":"tir.itis"},
+    "WoRMS":{"bucket":"worms","consumes":"tir.itis","produces":"tir.worms"},
+    "TESS":{"bucket":"tess","consumes":"tir.worms","produces":"tir.tess"},
+    "NatureServe":{"bucket":"natureserve","consumes":"tir.worms","produces":"tir.natureserve"}
+}
+
+
+def partitionFor(key,numPartitions):
+    # Same partition for the same key on every node (Python's hash() of a string changes between processes)
+    return zlib.crc32(key.encode("utf-8"))%numPartitions
+
+
+class LocalBroker:
+
+    def __init__(self,numPartitions=4):
+        self.numPartitions = numPartitions
+        self.topics = {}
+        self.groups = {}
+        self.condition = threading.Condition()
+
+    def partitions(self,topic):
+        # The message lists for a topic, created the first time anything touches it
+        if topic not in self.topics:
+            self.topics[topic] = [[] for partition in range(self.numPartitions)]
+        return self.topics[topic]
+
+    def produce(self,topic,key,value):
+        # Values are stored serialized so that consumers get their own copies, as they would from Kafka
+        with self.condition:
+            self.partitions(topic)[partitionFor(key,self.numPartitions)].append((key,json.dumps(value)))
+            self.condition.notify_all()
+
+    def flush(self):
+        return
+
+    def consumer(self,group,topics):
+        return LocalConsumer(self,group,topics)
+
+    def join(self,consumer):
+        with self.condition:
+            self.groups.setdefault(consumer.group,{"members":[],"committed":{}})["members"].append(consumer)
+
+    def leave(self,consumer):
+        with self.condition:
+            self.groups[consumer.group]["members"].remove(consumer)
+
+    def assignment(self,consumer):
+        # Partitions of the consumer's topics that are its to read, shared out over the members of its group
+        members = self.groups[consumer.group]["members"]
+        memberIndex = members.index(consumer)
+        return [(topic,partition) for topic in consumer.topics for partition in range(self.numPartitions) if partition%len(members) == memberIndex]
+
+    def committed(self,group,topicPartition):
+        return self.groups[group]["committed"].get(topicPartition,0)
+
+    def commit(self,group,offsets):
+        with self.condition:
+            for topicPartition,offset in offsets.items():
+                self.groups[group]["committed"][topicPartition] = max(offset,self.committed(group,topicPartition))
+
+    def lag(self,group,topic):
+        # Messages on a topic the group has not committed yet
+        with self.condition:
+            return sum([len(messages)-self.committed(group,(topic,partition)) for partition,messages in enumerate(self.partitions(topic))])
+
+
+class LocalConsumer:
+
+    def __init__(self,broker,group,topics):
+        self.broker = broker
+        self.group = group
+        self.topics = topics
+        self.positions = {}
+        broker.join(self)
+
+    def take(self,maxRecords):
+        messages = []
+        assigned = self.broker.assignment(self)
+        # Partitions that moved to another member are picked up by it from the last committed offset
+        self.positions = {topicPartition:position for topicPartition,position in self.positions.items() if topicPartition in assigned}
+        for topic,partition in assigned:
+            position = self.positions.get((topic,partition),self.broker.committed(self.group,(topic,partition)))
+            for key,value in self.broker.partitions(topic)[partition][position:position+maxRecords-len(messages)]:
+                messages.append({"topic":topic,"partition":partition,"offset":position,"key":key,"value":json.loads(value)})
+                position = position+1
+            self.positions[(topic,partition)] = position
+        return messages
+
+    def poll(self,maxRecords=100,timeout=1.0):
+        # Up to maxRecords messages, waiting up to timeout seconds for some to show up
+        with self.broker.condition:
+            messages = self.take(maxRecords)
+            if len(messages) == 0:
+                self.broker.condition.wait(timeout)
+                messages = self.take(maxRecords)
+        return messages
+
+    def commit(self,offsets):
+        # offsets is a dictionary of (topic, partition) to the offset of the next message to read
+        self.broker.commit(self.group,offsets)
+
+    def close(self):
+        self.broker.leave(self)
+
+
+class KafkaBroker:
+
+    def __init__(self,servers):
+        from kafka import KafkaProducer
+        self.servers = servers
+        self.producer = KafkaProducer(bootstrap_servers=servers,key_serializer=lambda key: key.encode("utf-8"),value_serializer=lambda value: json.dumps(value).encode("utf-8"))
+
+    def produce(self,topic,key,value):
+        self.producer.send(topic,key=key,value=value)
+
+    def flush(self):
+        self.producer.flush()
+
+    def consumer(self,group,topics):
+        return KafkaConsumer(self.servers,group,topics)
+
+
+class KafkaConsumer:
+    # The same poll and commit calls as LocalConsumer on a kafka-python consumer with offsets committed by hand
+
+    def __init__(self,servers,group,topics):
+        import kafka
+        self.kafka = kafka
+        self.consumer = kafka.KafkaConsumer(*topics,bootstrap_servers=servers,group_id=group,enable_auto_commit=False,auto_offset_reset="earliest",key_deserializer=lambda key: key.decode("utf-8"),value_deserializer=lambda value: json.loads(value.decode("utf-8")))
+
+    def poll(self,maxRecords=100,timeout=1.0):
+        polled = self.consumer.poll(timeout_ms=int(timeout*1000),max_records=maxRecords)
+        return [{"topic":message.topic,"partition":message.partition,"offset":message.offset,"key":message.key,"value":message.value} for messages in polled.values() for message in messages]
+
+    def commit(self,offsets):
+        # Newer kafka-python versions add a leader epoch to OffsetAndMetadata
+        offsetFields = [None,-1][:len(self.kafka.OffsetAndMetadata._fields)-1]
+        self.consumer.commit({self.kafka.TopicPartition(topic,partition):self.kafka.OffsetAndMetadata(offset,*offsetFields) for (topic,partition),offset in offsets.items()})
+
+    def close(self):
+        self.consumer.close()
+
+
+def publishRegistrations(broker,tirRecords):
+    # Send records selected with pipeline.selectColumns (e.g. from pipeline.pendingRecords) out as registration events
+    numPublished = 0
+    for tirRecord in tirRecords:
+        record = pipeline.pipelineRecord(tirRecord)
+        broker.produce(registrationsTopic,str(record["id"]),pipeline.eventFor(record))
+        numPublished = numPublished+1
+    broker.flush()
+    return numPublished
+
+
+class ProcessorWorker:
+
+    def __init__(self,broker,processor,processFunction,tirWriter,batchSize=100,pollSeconds=1.0,group=None,runMetrics=None,maxWorkers=1):
+        # processFunction is the pipeline stage function for the processor (e.g. pipeline.wormsStage(...)) and
+        # tirWriter a TIRWriter for its bucket. With maxWorkers above one a batch is split into that many slices that
+        # are looked up at the same time.
+        self.broker = broker
+        self.processor = processor
+        self.bucket = processors[processor]["bucket"]
+        self.produces = processors[processor]["produces"]
+        self.processFunction = processFunction
+        self.tirWriter = tirWriter
+        self.batchSize = batchSize
+        self.pollSeconds = pollSeconds
+        self.runMetrics = runMetrics
+        self.maxWorkers = maxWorkers
+        self.consumer = broker.consumer(group if group is not None else "tir-"+processor.lower(),[processors[processor]["consumes"]])
+        self.stats = {"consumed":0,"written":0,"writeFailures":0,"lookupErrors":0,"noResult":0,"produced":0,"deadLettered":0,"commits":0}
+
+    def writeBatch(self,records):
+        # Write the bucket for every record that got a new one and wait for the writes to finish, returning the ids that
+        # did not make it in (a failure callback may still get a corrected version of a record in)
+        written = set()
+        failed = set()
+        flushResults = [self.tirWriter.write(record["id"],{self.bucket:pipeline.bucketValue(record,self.bucket)}) for record in records if self.bucket in record["updated"]]
+        while len(self.tirWriter.buffer) > 0:
+            flushResults.append(self.tirWriter.flush())
+        for flushResult in flushResults:
+            if flushResult is not None:
+                written.update(flushResult["written"])
+                failed.update([failure["id"] for failure in flushResult["failed"]])
+        self.stats["written"] = self.stats["written"]+len(written)
+        self.stats["writeFailures"] = self.stats["writeFailures"]+len(failed-written)
+        return failed-written
+
+    def processSlice(self,records):
+        # Look up a slice of records, going one record at a time if the slice raises so that only the records that
+        # still raise are set aside (with the error in record["errors"])
+        try:
+            self.processFunction(records)
+            return
+        except ratelimit.UpstreamUnavailable:
+            raise
+        except Exception:
+            pass
+        for record in records:
+            try:
+                self.processFunction([record])
+            except ratelimit.UpstreamUnavailable:
+                raise
+            except Exception as e:
+                record["errors"][self.processor] = type(e).__name__+": "+str(e)
+
+    def deadLetter(self,record,reason):
+        self.broker.produce(deadLetterTopic,str(record["id"]),{"processor":self.processor,"reason":reason,"event":pipeline.eventFor(record)})
+        self.stats["deadLettered"] = self.stats["deadLettered"]+1
+
+    def runOnce(self):
+        # Process one batch of events, returning how many there were
+        messages = self.consumer.poll(self.batchSize,self.pollSeconds)
+        if len(messages) == 0:
+            return 0
+
+        records = [pipeline.pipelineRecord({"properties":message["value"]}) for message in messages]
+        sliceSize = max(int((len(records)+self.maxWorkers-1)/self.maxWorkers),1)
+        for processed in workers.processConcurrently(self.processSlice,[records[start:start+sliceSize] for start in range(0,len(records),sliceSize)],self.maxWorkers):
+            pass
+        writeFailure = "Write failed"
+        try:
+            failedIDs = self.writeBatch([record for record in records if self.processor not in record["errors"]])
+        except Exception as e:
+            # Nothing in the batch can be counted as written
+            writeFailure = "Write failed: "+type(e).__name__+": "+str(e)
+            failedIDs = set([record["id"] for record in records if self.bucket in record["updated"]])
+            self.stats["writeFailures"] = self.stats["writeFailures"]+len(failedIDs)
+
+        for record in records:
+            if self.runMetrics is not None:
+                self.runMetrics.recordProcessed(record["matchMethods"].get(self.bucket,"Already Cached" if record[self.bucket] is not None else "Not Processed"))
+            if self.processor in record["errors"]:
+                self.stats["lookupErrors"] = self.stats["lookupErrors"]+1
+                self.deadLetter(record,record["errors"][self.processor])
+            elif record["id"] in failedIDs:
+                self.deadLetter(record,writeFailure)
+            elif record[self.bucket] is None:
+                self.stats["noResult"] = self.stats["noResult"]+1
+                self.deadLetter(record,"No result")
+            else:
+                self.broker.produce(self.produces,str(record["id"]),pipeline.eventFor(record))
+                self.stats["produced"] = self.stats["produced"]+1
+        self.broker.flush()
+
+        offsets = {}
+        for message in messages:
+            offsets[(message["topic"],message["partition"])] = max(message["offset"]+1,offsets.get((message["topic"],message["partition"]),0))
+        self.consumer.commit(offsets)
+        self.stats["commits"] = self.stats["commits"]+1
+        self.stats["consumed"] = self.stats["consumed"]+len(messages)
+        return len(messages)
+
+    def run(self,maxRecords=None,stopWhen=None):
+        # Keep processing batches until maxRecords events have been consumed, or until a poll comes back empty after
+        # stopWhen() said we can stop (checked before the poll so nothing sent before then is missed)
+        try:
+            while maxRecords is None or self.stats["consumed"] < maxRecords:
+                stopping = stopWhen is not None and stopWhen()
+                if self.runOnce() == 0 and stopping:
+                    break
+        finally:
+            self.consumer.close()
+        return self.summary()
+
+    def summary(self):
+        return dict(self.stats)
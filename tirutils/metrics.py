@@ -0,0 +1,173 @@
+# Run metrics for the TIR processors. A processor starts a run, and from there the sessions layer records latency
+# and errors for every upstream request (grouped by service), retries are counted from the HTTP retry handler, and
+# the processor records each record it finishes along with its match method. At the end of a run the metrics can be
+# written out as JSON or in the Prometheus text format for whatever is watching the processing engine.
+
+import os,json,time,threading
+from collections import Counter
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from urllib3.util.retry import Retry
+
+latencyBuckets = [0.05,0.1,0.25,0.5,1,2.5,5,10,30]
+
+upstreamNames = {}
+upstreamNames["services.itis.gov"] = "ITIS Solr"
+upstreamNames["www.marinespecies.org"] = "WoRMS"
+upstreamNames["marinespecies.org"] = "WoRMS"
+upstreamNames["ecos.fws.gov"] = "TESS"
+upstreamNames["services.natureserve.org"] = "NatureServe"
+upstreamNames["www.sciencebase.gov"] = "ScienceBase"
+
+activeRun = None
+
+
+def setUpstreamName(hostOrURL,name):
+    # Name a host for reporting (e.g. the GC2 instance as "GC2"), given either the host or a URL on it
+    if "://" in hostOrURL:
+        hostOrURL = urlparse(hostOrURL).netloc
+    upstreamNames[hostOrURL] = name
+
+
+def upstreamName(host):
+    return upstreamNames.get(host,host)
+
+
+class RunMetrics:
+
+    def __init__(self,processor):
+        self.processor = processor
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.records = 0
+        self.matchMethods = Counter()
+        self.retries = Counter()
+        self.upstream = {}
+        self.caches = {}
+
+    def addCache(self,name,cache):
+        # Register anything with a summary() method (like a ResponseCache) to include its stats
+        self.caches[name] = cache
+
+    def recordProcessed(self,matchMethod=None):
+        with self.lock:
+            self.records = self.records + 1
+            if matchMethod is not None:
+                self.matchMethods[matchMethod] += 1
+
+    def observeRequest(self,host,seconds,statusCode=None):
+        name = upstreamName(host)
+        with self.lock:
+            if name not in self.upstream:
+                self.upstream[name] = {"count":0,"errors":0,"seconds":0.0,"buckets":[0]*(len(latencyBuckets)+1)}
+            thisUpstream = self.upstream[name]
+            thisUpstream["count"] = thisUpstream["count"] + 1
+            thisUpstream["seconds"] = thisUpstream["seconds"] + seconds
+            if statusCode is None or statusCode >= 400:
+                thisUpstream["errors"] = thisUpstream["errors"] + 1
+            bucketIndex = len(latencyBuckets)
+            for index,bucket in enumerate(latencyBuckets):
+                if seconds <= bucket:
+                    bucketIndex = index
+                    break
+            thisUpstream["buckets"][bucketIndex] = thisUpstream["buckets"][bucketIndex] + 1
+
+    def observeRetry(self,host):
+        with self.lock:
+            self.retries[upstreamName(host)] += 1
+
+    def summary(self):
+        elapsed = time.time()-self.started
+        summary = {}
+        summary["processor"] = self.processor
+        summary["elapsedSeconds"] = round(elapsed,3)
+        summary["records"] = self.records
+        summary["recordsPerSecond"] = round(self.records/elapsed,3) if elapsed > 0 else 0
+        summary["matchMethods"] = dict(self.matchMethods)
+        summary["retries"] = dict(self.retries)
+        summary["upstream"] = {}
+        for name,thisUpstream in self.upstream.items():
+            summary["upstream"][name] = {
+                "requests":thisUpstream["count"],
+                "errors":thisUpstream["errors"],
+                "meanSeconds":round(thisUpstream["seconds"]/thisUpstream["count"],4),
+                "latencyHistogram":dict(zip([str(bucket) for bucket in latencyBuckets]+["+Inf"],thisUpstream["buckets"]))
+            }
+        summary["caches"] = {name:cache.summary() for name,cache in self.caches.items()}
+        return summary
+
+    def prometheusText(self):
+        labels = 'processor="'+self.processor+'"'
+        summary = self.summary()
+        lines = []
+        lines.append("# TYPE tir_records_processed_total counter")
+        lines.append("tir_records_processed_total{"+labels+"} "+str(summary["records"]))
+        lines.append("# TYPE tir_records_per_second gauge")
+        lines.append("tir_records_per_second{"+labels+"} "+str(summary["recordsPerSecond"]))
+        lines.append("# TYPE tir_match_method_total counter")
+        for matchMethod,count in summary["matchMethods"].items():
+            lines.append("tir_match_method_total{"+labels+',method="'+str(matchMethod)+'"} '+str(count))
+        lines.append("# TYPE tir_upstream_retries_total counter")
+        for name,count in summary["retries"].items():
+            lines.append("tir_upstream_retries_total{"+labels+',upstream="'+name+'"} '+str(count))
+        lines.append("# TYPE tir_upstream_errors_total counter")
+        for name,thisUpstream in self.upstream.items():
+            lines.append("tir_upstream_errors_total{"+labels+',upstream="'+name+'"} '+str(thisUpstream["errors"]))
+        lines.append("# TYPE tir_upstream_request_seconds histogram")
+        for name,thisUpstream in self.upstream.items():
+            upstreamLabels = labels+',upstream="'+name+'"'
+            cumulative = 0
+            for bucket,count in zip([str(bucket) for bucket in latencyBuckets]+["+Inf"],thisUpstream["buckets"]):
+                cumulative = cumulative + count
+                lines.append("tir_upstream_request_seconds_bucket{"+upstreamLabels+',le="'+bucket+'"} '+str(cumulative))
+            lines.append("tir_upstream_request_seconds_sum{"+upstreamLabels+"} "+str(round(thisUpstream["seconds"],4)))
+            lines.append("tir_upstream_request_seconds_count{"+upstreamLabels+"} "+str(thisUpstream["count"]))
+        lines.append("# TYPE tir_cache_hit_rate gauge")
+        for name,cacheSummary in summary["caches"].items():
+            if "hitRate" in cacheSummary:
+                lines.append("tir_cache_hit_rate{"+labels+',cache="'+name+'"} '+str(cacheSummary["hitRate"]))
+        return "\n".join(lines)+"\n"
+
+    def export(self,path):
+        # Write the metrics to a file, in Prometheus text format for .prom files and JSON otherwise
+        if os.path.dirname(path) != "":
+            os.makedirs(os.path.dirname(path),exist_ok=True)
+        with open(path,"w") as f:
+            if path.endswith(".prom"):
+                f.write(self.prometheusText())
+            else:
+                json.dump(self.summary(),f,indent=2)
+
+
+class CountingRetry(Retry):
+    # urllib3 Retry that counts each retry against the active run
+
+    def increment(self,method=None,url=None,response=None,error=None,_pool=None,_stacktrace=None):
+        if activeRun is not None and _pool is not None:
+            activeRun.observeRetry(_pool.host)
+        return super().increment(method=method,url=url,response=response,error=error,_pool=_pool,_stacktrace=_stacktrace)
+
+
+def startRun(processor):
+    # Start collecting metrics for a processor run
+    global activeRun
+    activeRun = RunMetrics(processor)
+    return activeRun
+
+
+def observeRequest(host,seconds,statusCode=None):
+    if activeRun is not None:
+        activeRun.observeRequest(host,seconds,statusCode)
+
+
+@contextmanager
+def timed(host):
+    # Time calls that don't go through the sessions layer (e.g. the bis TESS and NatureServe functions); anything
+    # raised inside is counted as an error
+    started = time.time()
+    try:
+        yield
+    except Exception:
+        observeRequest(host,time.time()-started,None)
+        raise
+    observeRequest(host,time.time()-started,200)
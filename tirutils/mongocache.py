@@ -0,0 +1,108 @@
+# Cache processing for the MongoDB collections (bisoncache, iucncache, itiscache, tesscache) that the BISON, IUCN and
+# MongoDB version ITIS and TESS notebooks fill in. Those notebooks walked a cursor over the whole collection, made one
+# request per document and called update_one for each result before moving on, so every document cost a request
+# round trip and a database round trip in turn. processCollection runs a fetch function for each pending document on
+# a pool of threads (workers.processConcurrently, so only a window of documents is read ahead of the workers) and
+# writes the results with MongoCacheWriter, which sends them as unordered bulk_write batches of UpdateOne operations.
+#
+# The cursor only asks for the fields the fetch function needs (a projection, usually just searchURL) and pulls them
+# from the server in batches of cursorBatchSize. A fetch function takes a document and returns the fields to $set on
+# it, or None to leave it alone; one that raises leaves its document pending for the next run. Anything that acts like
+# a pymongo collection works here, including a mongomock collection for trying things out without a mongod.
+#
+# pymongo is only needed by the writer, so it is imported there.
+
+from collections import Counter
+from tirutils import workers
+
+
+def pendingDocuments(collection,query,projection=None,batchSize=500,maxDocuments=None):
+    # Cursor over the documents matching query with just the projected fields, fetched batchSize at a time
+    cursor = collection.find(query,projection).batch_size(batchSize)
+    if maxDocuments is not None:
+        cursor = cursor.limit(maxDocuments)
+    return cursor
+
+
+class MongoCacheWriter:
+    # Buffered writer of $set updates to a collection, sent as unordered bulk_write batches
+
+    def __init__(self,collection,batchSize=500,upsert=False):
+        self.collection = collection
+        self.batchSize = batchSize
+        self.upsert = upsert
+        self.buffer = []
+        self.totals = {"written":0,"modified":0,"upserted":0,"failed":0,"batches":0}
+        self.failures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,excType,excValue,traceback):
+        self.close()
+
+    def write(self,documentID,values):
+        self.buffer.append((documentID,values))
+        if len(self.buffer) >= self.batchSize:
+            return self.flush()
+
+    def flush(self):
+        # Write everything in the buffer; with ordered=False one bad update doesn't stop the rest of the batch
+        from pymongo import UpdateOne
+        from pymongo.errors import BulkWriteError
+        rows = self.buffer
+        self.buffer = []
+        if len(rows) == 0:
+            return None
+
+        self.totals["batches"] = self.totals["batches"] + 1
+        operations = [UpdateOne({"_id":documentID},{"$set":values},upsert=self.upsert) for documentID,values in rows]
+        try:
+            result = self.collection.bulk_write(operations,ordered=False).bulk_api_result
+        except BulkWriteError as e:
+            result = e.details
+            for writeError in result.get("writeErrors",[]):
+                self.failures.append({"id":rows[writeError["index"]][0],"message":writeError.get("errmsg")})
+
+        numFailed = len(result.get("writeErrors",[]))
+        self.totals["written"] = self.totals["written"] + len(rows) - numFailed
+        self.totals["modified"] = self.totals["modified"] + result.get("nModified",0)
+        self.totals["upserted"] = self.totals["upserted"] + result.get("nUpserted",0)
+        self.totals["failed"] = self.totals["failed"] + numFailed
+        return result
+
+    def close(self):
+        self.flush()
+        return self.summary()
+
+    def summary(self):
+        summary = dict(self.totals)
+        summary["failures"] = list(self.failures)
+        return summary
+
+
+def processCollection(collection,query,fetchFunction,projection=None,maxWorkers=8,cursorBatchSize=500,writeBatchSize=500,maxDocuments=None,upsert=False):
+    # Fetch and cache results for every document matching query, returning the writer totals along with how many
+    # documents were processed and the fetch errors by type
+    fetchErrors = Counter()
+    numProcessed = 0
+
+    def fetch(document):
+        try:
+            return document["_id"],fetchFunction(document),None
+        except Exception as e:
+            return document["_id"],None,e
+
+    with MongoCacheWriter(collection,writeBatchSize,upsert) as mongoWriter:
+        for documentID,values,error in workers.processConcurrently(fetch,pendingDocuments(collection,query,projection,cursorBatchSize,maxDocuments),maxWorkers):
+            numProcessed = numProcessed + 1
+            if error is not None:
+                fetchErrors[type(error).__name__] += 1
+                continue
+            if values is not None:
+                mongoWriter.write(documentID,values)
+
+    summary = mongoWriter.summary()
+    summary["processed"] = numProcessed
+    summary["fetchErrors"] = dict(fetchErrors)
+    return summary
@@ -0,0 +1,76 @@
+# Scientific name normalization shared by the processors. bis.cleanScientificName and bis.stringCleaning get called
+# on every record, often on the same name more than once per record and on the same few thousand names across a
+# whole run, so the versions here remember what they have already cleaned. cleanNames and cleanColumn clean a whole
+# list or DataFrame column at once, calling the cleaner once per distinct name.
+#
+# canonicalKey gives the same key for names that differ only in case, accents, punctuation or spacing once cleaned,
+# for use wherever we need to tell whether two registrations are asking about the same name (cache keys, dedup).
+#
+# bis is imported when a name is first cleaned, so importing this module doesn't need it.
+
+import re,unicodedata
+from functools import lru_cache
+
+memoSize = 100000
+
+combiningPattern = re.compile("[\u0300-\u036f]")
+punctuationPattern = re.compile(r"[^\w\s]")
+whitespacePattern = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=memoSize)
+def cleanScientificName(name):
+    from bis import bis
+    return bis.cleanScientificName(name)
+
+
+@lru_cache(maxsize=memoSize)
+def stringCleaning(name):
+    from bis import bis
+    return bis.stringCleaning(name)
+
+
+@lru_cache(maxsize=memoSize)
+def canonicalKey(name):
+    # Cleaned name in lower case with accents and punctuation taken out and spacing collapsed
+    if name is None:
+        return ""
+    key = combiningPattern.sub("",unicodedata.normalize("NFKD",cleanScientificName(name)))
+    key = punctuationPattern.sub(" ",key.lower())
+    return whitespacePattern.sub(" ",key).strip()
+
+
+def cleanNames(names,cleaner=cleanScientificName):
+    # List of cleaned names in the same order as names
+    cleanedNames = {name:cleaner(name) for name in dict.fromkeys(names)}
+    return [cleanedNames[name] for name in names]
+
+
+def cleanColumn(column,cleaner=stringCleaning):
+    # Cleaned copy of a pandas Series of names (missing values stay missing)
+    uniqueNames = list(column.dropna().unique())
+    return column.map(dict(zip(uniqueNames,cleanNames(uniqueNames,cleaner))))
+
+
+class NameMemo:
+    # Hit and miss counts for the memoized cleaners, with a summary() for metrics.RunMetrics.addCache
+
+    functions = {"cleanScientificName":cleanScientificName,"stringCleaning":stringCleaning,"canonicalKey":canonicalKey}
+
+    def summary(self):
+        summary = {"hits":0,"misses":0,"entries":0}
+        for function in self.functions.values():
+            cacheInfo = function.cache_info()
+            summary["hits"] = summary["hits"]+cacheInfo.hits
+            summary["misses"] = summary["misses"]+cacheInfo.misses
+            summary["entries"] = summary["entries"]+cacheInfo.currsize
+        lookups = summary["hits"]+summary["misses"]
+        summary["hitRate"] = round(summary["hits"]/lookups,4) if lookups > 0 else 0
+        return summary
+
+    def clear(self):
+        for function in self.functions.values():
+            function.cache_clear()
+
+
+memo = NameMemo()
@@ -0,0 +1,376 @@
+# The processor scripts each make their own full pass over tir.tir, and each has to wait on the one before it: WoRMS
+# picks up itis->>'nameWInd', TESS and NatureServe need both ITIS and WoRMS, and TIR Common Properties needs all of
+# them. A Pipeline runs the same lookups as a chain of stages connected by bounded in-process queues, so a record
+# moves on to WoRMS as soon as its own ITIS match is done and is fully enriched without waiting on passes over the
+# whole table. Each stage has its own pool of worker threads, stages can take records a batch at a time (ITIS
+# batches its Solr queries, common properties are worked out a page at a time with pandas), and a group of stages
+# can work on the same record side by side (TESS and NatureServe). Queues are bounded, so a slow stage holds up the
+# stages in front of it instead of letting records pile up in memory.
+#
+# Records in the pipeline are dictionaries with the id, the registration and one entry per bucket (None if it is
+# not cached yet), along with the list of buckets the pipeline has filled in ("updated") and any stage errors. The
+# adapters further down turn a record into the same properties the processor scripts select from tir.tir so that
+# the lookups are exactly the ones the scripts run. A stage whose lookup raises leaves its bucket empty (to be
+# picked up again next run), and stages that depend on that bucket leave the record alone. Lookups go through
+# ratelimit.pausing, so when an upstream's circuit opens only the stage that calls it waits.
+
+import json,time,queue,threading
+from tirutils import claim
+from tirutils import lookups
+from tirutils import itisbatch
+from tirutils import ratelimit
+from tirutils import sgcnindex
+from tirutils import commonproperties
+
+buckets = ["itis","worms","tess","natureserve","sgcn"]
+selectColumns = "registration, itis, worms, tess, natureserve, sgcn"
+whereClause = "itis IS NULL OR worms IS NULL OR tess IS NULL OR natureserve IS NULL OR (registration->>'source' = 'SGCN' AND sgcn->>'dateCached' IS NULL)"
+
+stopWorker = object()
+endOfRecords = object()
+
+
+def parseBucket(bucket):
+    # Buckets come back from the GC2 API as JSON strings; a missing bucket stays None so we know to fill it in
+    if bucket is None:
+        return None
+    if isinstance(bucket,str):
+        return json.loads(bucket)
+    return bucket
+
+
+def bucketText(bucket,key):
+    # What PostgreSQL gives back for bucket->>'key', which is what the processor scripts select
+    if bucket is None:
+        return None
+    value = bucket.get(key)
+    if value is None:
+        return None
+    if isinstance(value,bool):
+        return "true" if value else "false"
+    if isinstance(value,(dict,list)):
+        return json.dumps(value)
+    return str(value)
+
+
+def pipelineRecord(tirRecord):
+    # Set up the in-flight record for a feature selected with selectColumns
+    record = {}
+    record["id"] = tirRecord["properties"]["id"]
+    record["registration"] = parseBucket(tirRecord["properties"]["registration"])
+    for bucket in buckets:
+        record[bucket] = parseBucket(tirRecord["properties"].get(bucket))
+    record["updated"] = []
+    record["matchMethods"] = {}
+    record["errors"] = {}
+    # Content hashes of buckets a refresh run took out (see refresh.refreshRecords) to tell whether they changed
+    record["previousHashes"] = tirRecord.get("previousHashes",{})
+    return record
+
+
+def bucketValue(record,bucket):
+    # Value to write to tir.tir for a bucket the pipeline filled in (NatureServe documents go in the way NatureServe.py
+    # writes them)
+    if bucket == "natureserve":
+        return json.dumps(record[bucket]).replace(" ","")
+    return record[bucket]
+
+
+def eventFor(record):
+    # The parts of an in-flight record that go into a message (see messaging), which pipelineRecord reads back
+    event = {"id":record["id"],"registration":record["registration"]}
+    for bucket in buckets:
+        event[bucket] = record[bucket]
+    return event
+
+
+class Stage:
+
+    def __init__(self,name,processFunction,workers=1,batchSize=1,queueSize=1000):
+        # processFunction takes a list of in-flight records (at most batchSize) and fills them in place
+        self.name = name
+        self.processFunction = processFunction
+        self.workers = workers
+        self.batchSize = batchSize
+        self.inbox = queue.Queue(maxsize=queueSize)
+        self.forward = None
+        self.threads = []
+        self.lock = threading.Lock()
+        self.stats = {"records":0,"batches":0,"errors":0,"busySeconds":0.0}
+
+    def start(self,forward):
+        # forward is called with each record once this stage is done with it
+        self.forward = forward
+        self.threads = [threading.Thread(target=self.work,name=self.name+"-"+str(index),daemon=True) for index in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        for thread in self.threads:
+            self.inbox.put(stopWorker)
+        for thread in self.threads:
+            thread.join()
+
+    def takeBatch(self):
+        # Wait for one record, then take whatever else is already waiting up to the batch size
+        batch = [self.inbox.get()]
+        while len(batch) < self.batchSize and batch[-1] is not stopWorker:
+            try:
+                batch.append(self.inbox.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def work(self):
+        while True:
+            batch = self.takeBatch()
+            stopping = batch[-1] is stopWorker
+            records = [record for record in batch if record is not stopWorker]
+            if len(records) > 0:
+                started = time.time()
+                try:
+                    self.processFunction(records)
+                    errors = 0
+                except Exception as e:
+                    for record in records:
+                        record["errors"][self.name] = str(e)
+                    errors = len(records)
+                with self.lock:
+                    self.stats["records"] = self.stats["records"]+len(records)
+                    self.stats["batches"] = self.stats["batches"]+1
+                    self.stats["errors"] = self.stats["errors"]+errors
+                    self.stats["busySeconds"] = self.stats["busySeconds"]+time.time()-started
+                for record in records:
+                    self.forward(record)
+            if stopping:
+                return
+
+    def summary(self):
+        with self.lock:
+            summary = dict(self.stats)
+        summary["busySeconds"] = round(summary["busySeconds"],3)
+        summary["waiting"] = self.inbox.qsize()
+        return summary
+
+
+class Pipeline:
+
+    def __init__(self,levels,queueSize=1000):
+        # levels is a list of Stages (or lists of Stages that work on the same record side by side) in the order a
+        # record goes through them
+        self.levels = [level if isinstance(level,list) else [level] for level in levels]
+        self.outbox = queue.Queue(maxsize=queueSize)
+        self.joinLock = threading.Lock()
+        self.joins = {}
+
+    def stages(self):
+        return [stage for level in self.levels for stage in level]
+
+    def forwarder(self,levelIndex):
+        # Function that hands a record from a stage at levelIndex on to the next level, once every stage in its own
+        # level is done with it
+        def forward(record):
+            if len(self.levels[levelIndex]) > 1:
+                with self.joinLock:
+                    self.joins[record["id"]] = self.joins.get(record["id"],0)+1
+                    if self.joins[record["id"]] < len(self.levels[levelIndex]):
+                        return
+                    self.joins.pop(record["id"])
+            self.send(levelIndex+1,record)
+        return forward
+
+    def send(self,levelIndex,record):
+        if levelIndex == len(self.levels):
+            self.outbox.put(record)
+            return
+        for stage in self.levels[levelIndex]:
+            stage.inbox.put(record)
+
+    def feed(self,records,fed):
+        # Put every record into the first level, then let the consumer know how many there were
+        try:
+            for tirRecord in records:
+                self.send(0,pipelineRecord(tirRecord))
+                fed["records"] = fed["records"]+1
+        except Exception as e:
+            fed["error"] = e
+        self.outbox.put(endOfRecords)
+
+    def run(self,records):
+        # Generator that yields in-flight records as they come out of the last level (not in the order they went in)
+        for levelIndex,level in enumerate(self.levels):
+            for stage in level:
+                stage.start(self.forwarder(levelIndex))
+
+        fed = {"records":0,"error":None}
+        feeder = threading.Thread(target=self.feed,args=(records,fed),name="pipeline-feeder",daemon=True)
+        feeder.start()
+
+        numReceived = 0
+        numFed = None
+        try:
+            while numFed is None or numReceived < numFed:
+                record = self.outbox.get()
+                if record is endOfRecords:
+                    numFed = fed["records"]
+                    continue
+                numReceived = numReceived+1
+                yield record
+        finally:
+            if numFed is not None:
+                for stage in self.stages():
+                    stage.stop()
+
+        feeder.join()
+        if fed["error"] is not None:
+            raise fed["error"]
+
+    def summary(self):
+        return {stage.name:stage.summary() for stage in self.stages()}
+
+
+def perRecord(processRecord):
+    # Stage function for lookups that work one record at a time
+    def processRecords(records):
+        for record in records:
+            processRecord(record)
+    return processRecords
+
+
+def tirRecord(record,properties):
+    # Feature shaped like the ones claim.pendingRecords gives back for a processor script
+    properties = dict(properties)
+    properties["id"] = record["id"]
+    return {"properties":properties}
+
+
+def itisProperties(record):
+    registration = record["registration"]
+    return {"source":bucketText(registration,"source"),"followtaxonomy":bucketText(registration,"followTaxonomy"),"taxonomiclookupproperty":bucketText(registration,"taxonomicLookupProperty"),"scientificname":bucketText(registration,"scientificname"),"tsn":bucketText(registration,"tsn")}
+
+
+def wormsProperties(record):
+    properties = itisProperties(record)
+    properties.pop("tsn")
+    properties["namewind"] = bucketText(record["itis"],"nameWInd")
+    properties["namewoind"] = bucketText(record["itis"],"nameWOInd")
+    return properties
+
+
+def tessProperties(record):
+    return {"name_state":bucketText(record["registration"],"scientificname"),"matchmethod_itis":bucketText(record["itis"],"itisMatchMethod"),"tsn":bucketText(record["itis"],"tsn"),"acceptedtsn":bucketText(record["itis"],"acceptedTSN"),"name_itis":bucketText(record["itis"],"nameWInd"),"matchmethod_worms":bucketText(record["worms"],"MatchMethod"),"name_worms":bucketText(record["worms"],"valid_name")}
+
+
+def natureServeProperties(record):
+    return {"name_registered":bucketText(record["registration"],"scientificname"),"name_itis":bucketText(record["itis"],"nameWInd"),"name_worms":bucketText(record["worms"],"valid_name")}
+
+
+def sgcnProperties(record):
+    return {"name_submitted":bucketText(record["registration"],"scientificname"),"name_itis":bucketText(record["itis"],"nameWInd"),"name_worms":bucketText(record["worms"],"valid_name")}
+
+
+def fillBucket(record,bucket,value,matchMethod):
+    record[bucket] = value
+    record["updated"].append(bucket)
+    record["matchMethods"][bucket] = matchMethod
+
+
+def itisStage(batchSize=50,source=None,nameIndex=None):
+    # Batched ITIS matching (itisbatch.lookupITISPage) for records without an ITIS bucket
+    def processRecords(records):
+        pending = [record for record in records if record["itis"] is None]
+        if len(pending) == 0:
+            return
+        thisRecords = ratelimit.pausing(itisbatch.lookupITISPage)([tirRecord(record,itisProperties(record)) for record in pending],batchSize,source,nameIndex)
+        for record,thisRecord in zip(pending,thisRecords):
+            fillBucket(record,"itis",thisRecord["itisData"],thisRecord["matchMethod"])
+    return processRecords
+
+
+def lookupStage(bucket,needs,properties,lookupFunction,value,matchMethod,deduplicator=None):
+    # Per record stage that runs a lookup from lookups for records missing a bucket once the buckets it needs are in
+    # place, optionally through a dedup.Deduplicator shared across the run
+    lookupFunction = ratelimit.pausing(lookupFunction)
+
+    def processRecord(record):
+        if record[bucket] is not None or any([record[need] is None for need in needs]):
+            return
+        thisTIRRecord = tirRecord(record,properties(record))
+        if deduplicator is not None:
+            thisRecord = deduplicator.lookup(lookupFunction,thisTIRRecord)
+        else:
+            thisRecord = lookupFunction(thisTIRRecord)
+        if thisRecord is not None:
+            fillBucket(record,bucket,value(thisRecord),matchMethod(thisRecord))
+    return perRecord(processRecord)
+
+
+def wormsStage(wormsNameService,wormsIDService,nameIndex=None,deduplicator=None):
+    return lookupStage(
+        "worms",
+        ["itis"],
+        wormsProperties,
+        lambda thisTIRRecord: lookups.lookupWoRMS(thisTIRRecord,wormsNameService,wormsIDService,nameIndex),
+        lambda thisRecord: thisRecord["wormsJSON"],
+        lambda thisRecord: thisRecord["matchMethod"],
+        deduplicator
+    )
+
+
+def tessStage(deduplicator=None):
+    return lookupStage(
+        "tess",
+        ["itis","worms"],
+        tessProperties,
+        lookups.lookupTESS,
+        lambda thisRecord: thisRecord["tessJSON"],
+        lambda thisRecord: str(thisRecord["tessJSON"]["result"]),
+        deduplicator
+    )
+
+
+def natureServeStage(speciesAPI,deduplicator=None):
+    return lookupStage(
+        "natureserve",
+        ["itis","worms"],
+        natureServeProperties,
+        lambda thisTIRRecord: lookups.lookupNatureServe(thisTIRRecord,speciesAPI),
+        lambda thisRecord: thisRecord["natureServeData"],
+        lambda thisRecord: "Matched" if thisRecord["elementGlobalID"] is not None else "Not Matched",
+        deduplicator
+    )
+
+
+def sgcnStage(sgcnIndex):
+    # SGCN annotations for SGCN registrations that don't have them yet, the same way SGCN.py builds them
+    def processRecord(record):
+        if bucketText(record["registration"],"source") != "SGCN" or bucketText(record["sgcn"],"dateCached") is not None:
+            return
+        if record["itis"] is None or record["worms"] is None:
+            return
+        properties = sgcnProperties(record)
+        names = [properties["name_submitted"]]
+        if properties["name_itis"] is not None and properties["name_itis"] not in names:
+            names.append(properties["name_itis"])
+        if properties["name_worms"] is not None and properties["name_worms"] not in names:
+            names.append(properties["name_worms"])
+        fillBucket(record,"sgcn",sgcnindex.annotateSGCN(sgcnIndex,properties["name_submitted"],names),None)
+    return perRecord(processRecord)
+
+
+def commonPropertiesStage(sgcnCommonNames=None):
+    # Common properties for the records in a batch that have their ITIS and WoRMS buckets and picked up something new
+    def processRecords(records):
+        pending = [record for record in records if len(record["updated"]) > 0 and record["itis"] is not None and record["worms"] is not None]
+        if len(pending) == 0:
+            return
+        tirCommonPage = commonproperties.deriveCommonProperties(commonproperties.recordsFrame([tirRecord(record,{"registration":record["registration"],"itis":record["itis"],"worms":record["worms"],"sgcn":record["sgcn"]}) for record in pending]),sgcnCommonNames)
+        tirCommons = {tirCommon["id"]:tirCommon for tirCommon in tirCommonPage.to_dict("records")}
+        for record in pending:
+            record["common"] = tirCommons[record["id"]]
+    return processRecords
+
+
+def pendingRecords(baseURL,pageSize=100,maxRecords=None):
+    # Records with any bucket still to fill in
+    return claim.pendingRecords(baseURL,selectColumns,whereClause,pageSize,maxRecords)
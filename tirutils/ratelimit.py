@@ -0,0 +1,219 @@
+# Per host rate limiting, adaptive concurrency and circuit breaking for the upstream authorities. The host slots in
+# workers cap how many requests we have open to a host, but a fixed cap is either too low for a service that is
+# doing fine or too high for one that is struggling, and when WoRMS, TESS or NatureServe start failing the lookups
+# used to carry on and cache "Not Matched" for every record until someone noticed, leaving all of those records to
+# be found and reprocessed later.
+#
+# A HostLimiter for a host does three things around every request to it:
+# * A token bucket holds requests to a steady rate (with some burst) when one is set
+# * The number of requests in flight adapts with AIMD: it goes up by about one for every round of requests that come
+#   back fine and is cut in half (at most once per latency target) when a request is throttled (429), fails (5xx or
+#   no response) or is slower than the latency target
+# * A circuit breaker opens after a run of failures, and while it is open requests to the host fail straight away
+#   with UpstreamUnavailable instead of going out. After openSeconds one trial request is let through; the circuit
+#   closes again if it works and stays open for another round if it doesn't.
+#
+# Error responses raise UpstreamUnavailable (see raiseForStatus) rather than looking like an empty result, so a
+# lookup that runs into trouble upstream never produces a result to cache and the record stays pending. Only transport
+# trouble counts (no connection, timeouts, 429 and 5xx, see isTransportError); an error about one record's data, like
+# a response that won't parse, is the record's problem and shouldn't pause everything or open the circuit. pausing()
+# wraps a lookup so that it waits for the circuit to let a trial through and tries again, which pauses whatever is
+# calling that lookup (one processor, one pipeline stage or one worker) and nothing else. Only hosts set up with
+# configure() are limited.
+
+import re,time,threading
+from contextlib import contextmanager
+import requests
+from tirutils import workers
+
+limiters = {}
+limiterLock = threading.Lock()
+# What connection failures, timeouts and throttling or server error statuses look like in the messages the bis
+# functions hand back
+transportErrorPattern = re.compile(r"ConnectionError|ConnectTimeout|ReadTimeout|Timeout|timed out|Max retries exceeded|Connection (aborted|refused|reset)|RemoteDisconnected|Name or service not known|Temporary failure in name resolution|\b(429|50[0-4]) (Client|Server) Error|(status|returned|code)\D{0,20}\b(429|50[0-4])\b",re.IGNORECASE)
+
+
+class UpstreamUnavailable(Exception):
+
+    def __init__(self,host,message):
+        Exception.__init__(self,host+": "+message)
+        self.host = host
+
+
+def isFailure(statusCode):
+    # Responses that say the upstream is struggling, as opposed to answers (including "not found") we can use
+    return statusCode is None or statusCode == 429 or statusCode >= 500
+
+
+def isTransportError(error):
+    # Whether an exception (or an error message) means the upstream couldn't be reached or is struggling, as opposed
+    # to a problem with one record
+    if isinstance(error,UpstreamUnavailable):
+        return True
+    if isinstance(error,(requests.exceptions.ConnectionError,requests.exceptions.Timeout)):
+        return True
+    return transportErrorPattern.search(str(error)) is not None
+
+
+def raiseForStatus(host,statusCode):
+    if isFailure(statusCode):
+        raise UpstreamUnavailable(host,"returned "+str(statusCode))
+
+
+class HostLimiter:
+
+    def __init__(self,host,rate=None,burst=None,maxConcurrency=None,minConcurrency=1,latencyTarget=10.0,failureThreshold=5,openSeconds=60):
+        # rate is requests per second (None for no rate limit) with up to burst requests at once after a quiet spell;
+        # maxConcurrency defaults to the host limit in workers
+        self.host = host
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate or 1,1)
+        self.tokens = self.burst
+        self.lastRefill = time.time()
+        self.maxConcurrency = maxConcurrency if maxConcurrency is not None else workers.hostLimits.get(host,workers.defaultHostLimit)
+        self.minConcurrency = minConcurrency
+        self.concurrency = float(self.maxConcurrency)
+        self.latencyTarget = latencyTarget
+        self.failureThreshold = failureThreshold
+        self.openSeconds = openSeconds
+        self.inFlight = 0
+        self.lastDecrease = 0
+        self.consecutiveFailures = 0
+        self.openedAt = None
+        self.trialInFlight = False
+        self.condition = threading.Condition()
+        self.stats = {"requests":0,"failures":0,"slow":0,"decreases":0,"opened":0,"rejected":0,"throttledSeconds":0.0}
+
+    def secondsUntilTrial(self):
+        # How long until the circuit lets a trial request through (0 when it is closed)
+        with self.condition:
+            if self.openedAt is None:
+                return 0
+            return max(self.openedAt+self.openSeconds-time.time(),0)
+
+    def checkCircuit(self):
+        # Called holding the lock; raises if requests to the host should not go out right now
+        if self.openedAt is None:
+            return
+        if time.time()-self.openedAt < self.openSeconds or self.trialInFlight:
+            self.stats["rejected"] = self.stats["rejected"]+1
+            raise UpstreamUnavailable(self.host,"circuit open after "+str(self.consecutiveFailures)+" failures")
+        self.trialInFlight = True
+
+    def acquire(self):
+        with self.condition:
+            self.checkCircuit()
+            while self.inFlight >= max(int(self.concurrency),self.minConcurrency):
+                self.condition.wait()
+            self.inFlight = self.inFlight+1
+        self.takeToken()
+
+    def takeToken(self):
+        if self.rate is None:
+            return
+        while True:
+            with self.condition:
+                now = time.time()
+                self.tokens = min(self.tokens+(now-self.lastRefill)*self.rate,self.burst)
+                self.lastRefill = now
+                if self.tokens >= 1:
+                    self.tokens = self.tokens-1
+                    return
+                waitSeconds = (1-self.tokens)/self.rate
+                self.stats["throttledSeconds"] = self.stats["throttledSeconds"]+waitSeconds
+            time.sleep(waitSeconds)
+
+    def release(self,seconds,statusCode):
+        # Record how a request went: statusCode None means it raised before we got a response
+        failed = isFailure(statusCode)
+        slow = seconds > self.latencyTarget
+        with self.condition:
+            now = time.time()
+            self.inFlight = self.inFlight-1
+            self.stats["requests"] = self.stats["requests"]+1
+            if failed or slow:
+                # Only cut once per latency target so that one bad spell doesn't take us straight to the floor
+                if now-self.lastDecrease >= self.latencyTarget:
+                    self.concurrency = max(self.concurrency/2,self.minConcurrency)
+                    self.lastDecrease = now
+                    self.stats["decreases"] = self.stats["decreases"]+1
+                if slow:
+                    self.stats["slow"] = self.stats["slow"]+1
+            else:
+                self.concurrency = min(self.concurrency+1/self.concurrency,self.maxConcurrency)
+
+            if failed:
+                self.stats["failures"] = self.stats["failures"]+1
+                self.consecutiveFailures = self.consecutiveFailures+1
+                if self.trialInFlight or (self.openedAt is None and self.consecutiveFailures >= self.failureThreshold):
+                    self.openedAt = now
+                    self.stats["opened"] = self.stats["opened"]+1
+            else:
+                self.consecutiveFailures = 0
+                self.openedAt = None
+            self.trialInFlight = False
+            self.condition.notify_all()
+
+    def summary(self):
+        with self.condition:
+            summary = dict(self.stats)
+            summary["throttledSeconds"] = round(summary["throttledSeconds"],3)
+            summary["concurrency"] = round(self.concurrency,2)
+            summary["circuit"] = "closed" if self.openedAt is None else "open"
+        return summary
+
+
+def configure(host,**kwargs):
+    # Set up (or replace) the limiter for a host with any of the HostLimiter settings
+    with limiterLock:
+        limiters[host] = HostLimiter(host,**kwargs)
+        return limiters[host]
+
+
+def limiterFor(host):
+    with limiterLock:
+        return limiters.get(host)
+
+
+@contextmanager
+def limited(host):
+    # Context manager for a request to a host that goes through its limiter (if it has one). It gives back a
+    # dictionary whose statusCode the caller sets from the response; transport errors raised inside count as a failure.
+    limiter = limiterFor(host)
+    outcome = {"statusCode":200}
+    if limiter is None:
+        yield outcome
+        return
+    limiter.acquire()
+    started = time.time()
+    try:
+        yield outcome
+    except Exception as e:
+        if isTransportError(e):
+            outcome["statusCode"] = None
+        raise
+    finally:
+        limiter.release(time.time()-started,outcome["statusCode"])
+
+
+def pausing(lookupFunction,maxPauseSeconds=900,minPauseSeconds=1):
+    # Wrap a lookup so that when its upstream is unavailable it waits for the circuit to let a trial request through
+    # and tries again, giving up (and raising) once it has waited maxPauseSeconds in all
+    def pausingLookup(*args):
+        pausedSeconds = 0
+        while True:
+            try:
+                return lookupFunction(*args)
+            except UpstreamUnavailable as e:
+                limiter = limiterFor(e.host)
+                pauseSeconds = max(limiter.secondsUntilTrial() if limiter is not None else 0,minPauseSeconds)
+                if pausedSeconds+pauseSeconds > maxPauseSeconds:
+                    raise
+                time.sleep(pauseSeconds)
+                pausedSeconds = pausedSeconds+pauseSeconds
+    return pausingLookup
+
+
+def summary():
+    with limiterLock:
+        return {host:limiter.summary() for host,limiter in limiters.items()}
@@ -0,0 +1,160 @@
+# Staleness aware refreshing of the cached TIR buckets. The processors only pick up records WHERE <bucket> IS NULL, so
+# the only way to bring cached ITIS, WoRMS, TESS or NatureServe information up to date has been to null columns by
+# hand and reprocess the whole table. Every bucket already carries the date it was cached (cacheDate, or dateCached
+# for the documents that come back from the bis TESS and NatureServe functions), so here we work out from those
+# stamps and a refresh policy for each source which records are due, most overdue first, and hand back only as many
+# as fit in a request budget. Running a refresh every day or so with a modest budget spreads the load out over time
+# instead of re-running everything at once, and refreshed records get new stamps that spread out their next refresh.
+#
+# A policy gives the age in days after which a bucket is stale, a (usually shorter) age after which a "Not Matched"
+# result is tried again, the SQL that tells a not matched bucket from a matched one, and a rough count of upstream
+# requests a refresh of one record costs (ITIS looks names up in Solr batches, so it is cheap). Retries of not matched
+# results come before stale matches, and within each the records furthest past their policy age come first.
+#
+# refreshRecords hands the planned records back (selected the way pipeline.pendingRecords does) with the buckets due
+# for a refresh taken out, so the TIR Pipeline stages look them up again and write them the same way they fill in new
+# registrations. A lookup that can't be finished leaves the bucket as it was.
+#
+# Most refreshed documents come back the same as before, so refreshRecords also keeps a hash of the content of each
+# bucket it takes out (everything but the cache date). changedBuckets tells the pipeline which refreshed buckets
+# actually changed; the others only need their cache date moved forward (writer.CacheDateWriter) instead of the whole
+# document going back through the GC2 API and into the journal.
+
+import json,hashlib
+from datetime import datetime,timedelta
+from tirutils import claim
+from tirutils import pipeline
+
+policies = {
+    "itis":{"maxAgeDays":30,"retryDays":7,"notMatched":"itis->>'itisMatchMethod' = 'Not Matched'","requestsPerRecord":0.05},
+    "worms":{"maxAgeDays":30,"retryDays":7,"notMatched":"worms->>'MatchMethod' = 'Not Matched'","requestsPerRecord":1.5},
+    "tess":{"maxAgeDays":7,"retryDays":3,"notMatched":"tess->>'result' = 'false'","requestsPerRecord":1.5},
+    "natureserve":{"maxAgeDays":30,"retryDays":7,"notMatched":"natureserve->>'result' = 'false'","requestsPerRecord":1.5}
+}
+tiers = ["retry","stale"]
+dateKeys = {"itis":"cacheDate","worms":"cacheDate","tess":"dateCached","natureserve":"dateCached"}
+
+
+def stampSQL(bucket):
+    return "COALESCE("+bucket+"->>'cacheDate',"+bucket+"->>'dateCached')"
+
+
+def parseStamp(stamp):
+    # Cache dates are ISO format strings; anything we can't read is treated as having no date
+    if stamp is None:
+        return None
+    try:
+        return datetime.fromisoformat(str(stamp).replace("Z",""))
+    except ValueError:
+        return None
+
+
+def overdue(stamp,ageDays,now):
+    # How far past its policy age a bucket is, as a multiple of that age (buckets without a date are the most overdue)
+    cached = parseStamp(stamp)
+    if cached is None:
+        return float("inf")
+    return (now-cached).total_seconds()/86400/ageDays
+
+
+def dueClause(bucket,policy,tier,now):
+    # Where clause for buckets due for a refresh in a tier. ISO dates compare correctly as text, so the cutoff goes
+    # in as a string and the stamp doesn't need a cast.
+    stamp = stampSQL(bucket)
+    if tier == "retry":
+        cutoff = (now-timedelta(days=policy["retryDays"])).isoformat()
+        return bucket+" IS NOT NULL AND "+policy["notMatched"]+" AND "+stamp+" < '"+cutoff+"'"
+    cutoff = (now-timedelta(days=policy["maxAgeDays"])).isoformat()
+    return bucket+" IS NOT NULL AND ("+stamp+" IS NULL OR "+stamp+" < '"+cutoff+"')"
+
+
+def dueBuckets(baseURL,bucket,policy,tier,now,maxRecords):
+    # The most overdue maxRecords buckets in a tier, oldest (and undated) first
+    q_due = "SELECT id, "+stampSQL(bucket)+" AS stamp FROM tir.tir WHERE "+dueClause(bucket,policy,tier,now)+" ORDER BY stamp IS NOT NULL, stamp ASC, id ASC LIMIT "+str(maxRecords)
+    dueResult = claim.sqlQuery(baseURL,q_due)
+    if "features" not in dueResult:
+        raise Exception(dueResult.get("message","Could not find buckets due for a refresh"))
+    ageDays = policy["retryDays"] if tier == "retry" else policy["maxAgeDays"]
+    return [{"id":feature["properties"]["id"],"bucket":bucket,"tier":tier,"overdue":overdue(feature["properties"]["stamp"],ageDays,now)} for feature in dueResult["features"]]
+
+
+def scheduleRefresh(baseURL,requestBudget,refreshPolicies=None,now=None):
+    # Plan a refresh that fits in about requestBudget upstream requests. Returns a list of {"id", "buckets"} in
+    # priority order, with each record listed once for all of its buckets that are due.
+    if refreshPolicies is None:
+        refreshPolicies = policies
+    if now is None:
+        now = datetime.utcnow()
+
+    due = []
+    for bucket,policy in refreshPolicies.items():
+        maxRecords = int(requestBudget/policy["requestsPerRecord"])
+        if maxRecords < 1:
+            continue
+        for tier in tiers:
+            due.extend(dueBuckets(baseURL,bucket,policy,tier,now,maxRecords))
+    due.sort(key=lambda dueBucket: (tiers.index(dueBucket["tier"]),-dueBucket["overdue"]))
+
+    plan = {}
+    requests = 0
+    for dueBucket in due:
+        if dueBucket["bucket"] in plan.get(dueBucket["id"],[]):
+            continue
+        cost = refreshPolicies[dueBucket["bucket"]]["requestsPerRecord"]
+        if requests+cost > requestBudget:
+            continue
+        plan.setdefault(dueBucket["id"],[]).append(dueBucket["bucket"])
+        requests = requests+cost
+    return [{"id":recordID,"buckets":buckets} for recordID,buckets in plan.items()]
+
+
+def planSummary(plan,refreshPolicies=None):
+    if refreshPolicies is None:
+        refreshPolicies = policies
+    summary = {"records":len(plan),"buckets":{},"requests":0}
+    for plannedRecord in plan:
+        for bucket in plannedRecord["buckets"]:
+            summary["buckets"][bucket] = summary["buckets"].get(bucket,0)+1
+            summary["requests"] = summary["requests"]+refreshPolicies[bucket]["requestsPerRecord"]
+    summary["requests"] = round(summary["requests"],1)
+    return summary
+
+
+def contentHash(bucketValue):
+    # Hash of a bucket (as parsed from tir.tir or as it would be written) leaving out the cache date
+    if bucketValue is None:
+        return None
+    if isinstance(bucketValue,str):
+        bucketValue = json.loads(bucketValue)
+    if isinstance(bucketValue,dict):
+        bucketValue = {key:value for key,value in bucketValue.items() if key not in ["cacheDate","dateCached"]}
+    return hashlib.sha1(json.dumps(bucketValue,sort_keys=True,separators=(",",":")).encode("utf-8")).hexdigest()
+
+
+def changedBuckets(record):
+    # The buckets a pipeline record picked up whose content is new or different from what a refresh took out
+    return [bucket for bucket in record["updated"] if record["previousHashes"].get(bucket) is None or record["previousHashes"][bucket] != contentHash(pipeline.bucketValue(record,bucket))]
+
+
+def cacheDate(record,bucket):
+    # The new cache date for a refreshed bucket that didn't change, as its value for a CacheDateWriter
+    stamp = record[bucket].get(dateKeys[bucket]) if isinstance(record[bucket],dict) else None
+    return {dateKeys[bucket]:stamp if stamp is not None else datetime.utcnow().isoformat()}
+
+
+def refreshRecords(baseURL,plan,pageSize=100):
+    # Generator of tir.tir records for a Pipeline run over a plan, in plan order, with the buckets due for a refresh
+    # set back to None and their content hashes in previousHashes
+    for planPage in claim.pages(iter(plan),pageSize):
+        bucketsByID = {plannedRecord["id"]:plannedRecord["buckets"] for plannedRecord in planPage}
+        q_records = "SELECT id, "+pipeline.selectColumns+" FROM tir.tir WHERE id IN ("+",".join([str(recordID) for recordID in bucketsByID])+")"
+        tirRecordsByID = {}
+        for tirRecord in claim.sqlQuery(baseURL,q_records).get("features",[]):
+            tirRecord["previousHashes"] = {}
+            for bucket in bucketsByID[tirRecord["properties"]["id"]]:
+                tirRecord["previousHashes"][bucket] = contentHash(pipeline.parseBucket(tirRecord["properties"][bucket]))
+                tirRecord["properties"][bucket] = None
+            tirRecordsByID[tirRecord["properties"]["id"]] = tirRecord
+        for plannedRecord in planPage:
+            if plannedRecord["id"] in tirRecordsByID:
+                yield tirRecordsByID[plannedRecord["id"]]
@@ -0,0 +1,203 @@
+# Many registrations in the TIR share a cleaned scientific name or an accepted TSN/AphiaID (e.g. the same SGCN name
+# registered by multiple states), so we end up asking the taxonomic authorities the same question over and over.
+# This is a small on-disk cache in SQLite that sits in front of those calls. Responses are keyed on a normalized
+# request URL (or a function name and its arguments for the bis functions that make their own requests), expire
+# after a time to live, and the least recently used entries are evicted when the cache grows past its size limit.
+#
+# GET responses are stored with the ETag and Last-Modified headers the service sent, if any. When one of those
+# entries expires we ask again with If-None-Match/If-Modified-Since, and a 304 Not Modified answer renews the entry
+# without the service sending (or us parsing) the document again. This keeps refresh runs (see refresh.py), which
+# work with a short time to live, from pulling down everything that hasn't changed. The bis functions don't give us
+# their response headers, so cachedCall entries are simply fetched again.
+#
+# Documents from the bis functions carry their own cache date (dateCached for TESS). A cached copy would put the date
+# of the original call into the TIR, which makes the record look as old as the cache entry and due for a refresh
+# straight away, so cachedCall can stamp a date key with the time of the hit.
+
+import os,json,time,sqlite3,threading
+from datetime import datetime
+from urllib.parse import urlparse,parse_qsl,urlencode,urlunparse
+from tirutils import sessions
+from tirutils import ratelimit
+
+activeCache = None
+
+
+def normalizeURL(url):
+    # Lowercase the scheme and host and sort query parameters so equivalent URLs share a key
+    parsedURL = urlparse(url)
+    query = urlencode(sorted(parse_qsl(parsedURL.query,keep_blank_values=True)))
+    return urlunparse((parsedURL.scheme.lower(),parsedURL.netloc.lower(),parsedURL.path,parsedURL.params,query,""))
+
+
+def callKey(namespace,args):
+    return namespace+":"+json.dumps(args,sort_keys=True,default=str)
+
+
+class ResponseCache:
+
+    def __init__(self,path,ttlSeconds=2592000,maxEntries=250000):
+        if os.path.dirname(path) != "":
+            os.makedirs(os.path.dirname(path),exist_ok=True)
+        self.path = path
+        self.ttlSeconds = ttlSeconds
+        self.maxEntries = maxEntries
+        self.stats = {"hits":0,"misses":0,"expired":0,"evictions":0,"revalidated":0}
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path,check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+        self.db.commit()
+        self.numEntries = self.db.execute("SELECT count(*) FROM cache").fetchone()[0]
+
+    def get(self,key):
+        # Returns a tuple of (found, value) so that we can cache None results
+        with self.lock:
+            row = self.db.execute("SELECT value, created FROM cache WHERE key = ?",(key,)).fetchone()
+            if row is None:
+                self.stats["misses"] = self.stats["misses"] + 1
+                return False,None
+            if time.time()-row[1] > self.ttlSeconds:
+                self.stats["expired"] = self.stats["expired"] + 1
+                self.stats["misses"] = self.stats["misses"] + 1
+                return False,None
+            self.db.execute("UPDATE cache SET accessed = ? WHERE key = ?",(time.time(),key))
+            self.stats["hits"] = self.stats["hits"] + 1
+            return True,json.loads(row[0])
+
+    def getExpired(self,key):
+        # The stored value for a key whatever its age (None if there isn't one), for revalidating an expired entry
+        with self.lock:
+            row = self.db.execute("SELECT value FROM cache WHERE key = ?",(key,)).fetchone()
+            if row is None:
+                return None
+            return json.loads(row[0])
+
+    def set(self,key,value):
+        with self.lock:
+            now = time.time()
+            cursor = self.db.execute("UPDATE cache SET value = ?, created = ?, accessed = ? WHERE key = ?",(json.dumps(value),now,now,key))
+            if cursor.rowcount == 0:
+                self.db.execute("INSERT INTO cache (key, value, created, accessed) VALUES (?,?,?,?)",(key,json.dumps(value),now,now))
+                self.numEntries = self.numEntries + 1
+            if self.numEntries > self.maxEntries:
+                self.evict()
+            self.db.commit()
+
+    def evict(self):
+        # Drop expired entries and then the least recently used tenth of the cache
+        now = time.time()
+        self.db.execute("DELETE FROM cache WHERE created < ?",(now-self.ttlSeconds,))
+        numEvict = max(int(self.maxEntries/10),1)
+        self.db.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed ASC LIMIT ?)",(numEvict,))
+        remaining = self.db.execute("SELECT count(*) FROM cache").fetchone()[0]
+        self.stats["evictions"] = self.stats["evictions"] + self.numEntries - remaining
+        self.numEntries = remaining
+
+    def hitRate(self):
+        lookups = self.stats["hits"]+self.stats["misses"]
+        if lookups == 0:
+            return 0
+        return self.stats["hits"]/lookups
+
+    def summary(self):
+        summary = dict(self.stats)
+        summary["entries"] = self.numEntries
+        summary["hitRate"] = round(self.hitRate(),4)
+        return summary
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+
+class CachedResponse:
+    # Just enough of a requests Response for the processors (status_code and json())
+
+    def __init__(self,status_code,body,validators=None):
+        self.status_code = status_code
+        self.body = body
+        self.validators = validators if validators is not None else {}
+
+    def json(self):
+        if self.body is None:
+            raise ValueError("No content in response")
+        return self.body
+
+
+def openCache(path,ttlSeconds=2592000,maxEntries=250000):
+    # Open a cache and make it the one used by cachedGet and cachedCall
+    global activeCache
+    activeCache = ResponseCache(path,ttlSeconds,maxEntries)
+    return activeCache
+
+
+def conditionalHeaders(validators):
+    headers = {}
+    if validators.get("etag") is not None:
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("lastModified") is not None:
+        headers["If-Modified-Since"] = validators["lastModified"]
+    return headers
+
+
+def fetchJSON(url,validators=None,**kwargs):
+    # Throttled and server error responses raise ratelimit.UpstreamUnavailable so that they are never mistaken for
+    # (or cached as) an answer. With validators from an earlier response the request is conditional and may come
+    # back 304 with no body.
+    if validators:
+        kwargs["headers"] = dict(kwargs.get("headers",{}),**conditionalHeaders(validators))
+    r = sessions.get(url,**kwargs)
+    ratelimit.raiseForStatus(urlparse(url).netloc,r.status_code)
+    responseValidators = {"etag":r.headers.get("ETag"),"lastModified":r.headers.get("Last-Modified")}
+    if r.status_code in [204,304]:
+        return CachedResponse(r.status_code,None,responseValidators)
+    try:
+        return CachedResponse(r.status_code,r.json(),responseValidators)
+    except ValueError:
+        return CachedResponse(r.status_code,None,responseValidators)
+
+
+def cachedGet(url,**kwargs):
+    # GET a JSON service through the cache; only successful (200) and no content (204) responses are cached
+    if activeCache is None:
+        return fetchJSON(url,**kwargs)
+
+    key = normalizeURL(url)
+    found,value = activeCache.get(key)
+    if found:
+        return CachedResponse(value["status_code"],value["body"],value.get("validators"))
+
+    # Revalidate an expired entry that came with an ETag or Last-Modified date instead of fetching it all again
+    expired = activeCache.getExpired(key)
+    validators = expired.get("validators") if expired is not None else None
+    response = fetchJSON(url,validators,**kwargs)
+    if response.status_code == 304 and expired is not None:
+        with activeCache.lock:
+            activeCache.stats["revalidated"] = activeCache.stats["revalidated"] + 1
+        response = CachedResponse(expired["status_code"],expired["body"],dict(validators,**{name:value for name,value in response.validators.items() if value is not None}))
+    if response.status_code == 204 or (response.status_code == 200 and response.body is not None):
+        cachedValue = {"status_code":response.status_code,"body":response.body}
+        if any([value is not None for value in response.validators.values()]):
+            cachedValue["validators"] = response.validators
+        activeCache.set(key,cachedValue)
+    return response
+
+
+def cachedCall(namespace,function,*args,dateKey=None):
+    # Run a function (e.g. tess.queryTESS) through the cache keyed on its namespace and arguments; dateKey is the
+    # cache date in the document the function returns, if it has one, which gets the current time on a hit
+    if activeCache is None:
+        return function(*args)
+
+    key = callKey(namespace,list(args))
+    found,value = activeCache.get(key)
+    if found:
+        if dateKey is not None and isinstance(value,dict) and dateKey in value:
+            value[dateKey] = datetime.utcnow().isoformat()
+        return value
+
+    value = function(*args)
+    activeCache.set(key,value)
+    return value
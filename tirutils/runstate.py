@@ -0,0 +1,206 @@
+# Run state for long unattended processor runs. A run of one of the processors used to be capped only by
+# totalRecordsToProcess and kept nothing between runs, so a crash meant starting over from the first pending record,
+# and one record whose lookup raised (a poisoned registration) took the whole loop down, only for the next run to hit
+# the same record again. A RunState keeps a small JSON file for a processor with:
+# * A checkpoint cursor, the id up to which every record read has been dealt with (written, failed or set aside), to
+#   hand to claim.pendingRecords as afterID so that a run picks up where the last one stopped
+# * Dead letters, the records whose lookups raised, with how many times they have failed and the last error; a record
+#   is tried again on later runs until it has failed maxAttempts times, after which it is skipped
+# * A time and a record budget for the run
+#
+# Records are read through records(), lookups are wrapped with guard() (or guardBatch() for functions that take a
+# page of records), and the TIRWriter for the run is given flushed() as its onFlush callback so that the cursor only
+# moves past records once their writes are done. Every record read has to end up written, failed or settled, or the
+# cursor stops at it: a dedup.Deduplicator is given unresolved() as its onUnresolved callback so that the rest of a
+# group whose lookup raised are failed along with it, and records a run looks up but doesn't write (commitToDB False)
+# are handed to settle(). A run with saveState False (a dry run) keeps all of this in memory and leaves the file
+# alone. The file is written to a temporary name and swapped in, so a crash never leaves a half written checkpoint.
+# When a run gets through all of its pending records the cursor goes back to the start for the next run; dead letters
+# are kept.
+#
+# Upstream trouble (ratelimit.UpstreamUnavailable) is not the record's fault, so it is raised instead of being
+# counted against the record.
+
+import os,json,time,threading
+from collections import deque
+from datetime import datetime
+from tirutils import ratelimit
+
+
+class RunState:
+
+    def __init__(self,path,maxAttempts=3,maxSeconds=None,maxRecords=None,saveState=True):
+        self.path = path
+        self.saveState = saveState
+        self.maxAttempts = maxAttempts
+        self.maxSeconds = maxSeconds
+        self.maxRecords = maxRecords
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.state = {"cursor":0,"deadLetters":{},"completedRuns":0,"checkpointed":None}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.state.update(json.load(f))
+        self.cursor = self.state["cursor"]
+        self.inFlight = deque()
+        self.done = set()
+        self.failedThisRun = {}
+        self.stoppedBy = None
+        self.exhausted = False
+        self.stats = {"read":0,"skipped":0,"failed":0,"recovered":0,"settled":0,"checkpoints":0}
+
+    def budgetLeft(self):
+        # Whether the run has time and records left, noting which budget ran out if not
+        if self.maxSeconds is not None and time.time()-self.started >= self.maxSeconds:
+            self.stoppedBy = "maxSeconds"
+        elif self.maxRecords is not None and self.stats["read"] >= self.maxRecords:
+            self.stoppedBy = "maxRecords"
+        return self.stoppedBy is None
+
+    def isDead(self,recordID):
+        deadLetter = self.state["deadLetters"].get(str(recordID))
+        return deadLetter is not None and deadLetter["attempts"] >= self.maxAttempts
+
+    def records(self,tirRecords):
+        # Pass records through in order until a budget runs out, setting aside those that have failed too often
+        for tirRecord in tirRecords:
+            if not self.budgetLeft():
+                return
+            recordID = tirRecord["properties"]["id"]
+            with self.lock:
+                self.inFlight.append(recordID)
+                if self.isDead(recordID):
+                    self.stats["skipped"] = self.stats["skipped"] + 1
+                    self.done.add(recordID)
+                    continue
+                self.stats["read"] = self.stats["read"] + 1
+            yield tirRecord
+        self.exhausted = True
+
+    def fail(self,recordID,error):
+        # Add a dead letter for a record (or count another attempt) and count the record as dealt with
+        with self.lock:
+            deadLetter = self.state["deadLetters"].setdefault(str(recordID),{"attempts":0})
+            deadLetter["attempts"] = deadLetter["attempts"] + 1
+            deadLetter["message"] = type(error).__name__+": "+str(error)
+            deadLetter["lastAttempt"] = datetime.utcnow().isoformat()
+            self.stats["failed"] = self.stats["failed"] + 1
+            self.failedThisRun[recordID] = error
+            self.done.add(recordID)
+            self.advance()
+
+    def settle(self,recordIDs):
+        # Count records that are dealt with without being written or failing (e.g. looked up in a dry run)
+        with self.lock:
+            self.done.update(recordIDs)
+            self.stats["settled"] = self.stats["settled"] + len(recordIDs)
+            self.advance()
+
+    def unresolved(self,tirRecord,leaderRecord):
+        # onUnresolved callback for a dedup.Deduplicator, for each record in a group whose lookup (run on leaderRecord)
+        # gave nothing back. If the lookup raised, the other records in the group fail with the same error; otherwise
+        # there is nothing to write for them and they are settled.
+        recordID = tirRecord["properties"]["id"]
+        error = self.failedThisRun.get(leaderRecord["properties"]["id"])
+        if recordID in self.failedThisRun:
+            return
+        if error is not None:
+            self.fail(recordID,error)
+        else:
+            self.settle([recordID])
+
+    def succeed(self,recordID):
+        with self.lock:
+            if self.state["deadLetters"].pop(str(recordID),None) is not None:
+                self.stats["recovered"] = self.stats["recovered"] + 1
+
+    def guard(self,lookupFunction):
+        # Wrap a per record lookup so that a record that raises becomes a dead letter and a None result
+        def guardedLookup(tirRecord):
+            recordID = tirRecord["properties"]["id"]
+            try:
+                thisRecord = lookupFunction(tirRecord)
+            except ratelimit.UpstreamUnavailable:
+                raise
+            except Exception as e:
+                self.fail(recordID,e)
+                return None
+            self.succeed(recordID)
+            return thisRecord
+        return guardedLookup
+
+    def guardBatch(self,batchFunction):
+        # Wrap a function of a page of records (like itisbatch.lookupITISPage) that returns a list of results. If the
+        # page raises, the records are tried one at a time so that only the ones that still raise are set aside.
+        def guardedBatch(tirRecords):
+            try:
+                thisRecords = batchFunction(tirRecords)
+            except ratelimit.UpstreamUnavailable:
+                raise
+            except Exception:
+                thisRecords = []
+                for tirRecord in tirRecords:
+                    try:
+                        thisRecords.extend(batchFunction([tirRecord]))
+                    except ratelimit.UpstreamUnavailable:
+                        raise
+                    except Exception as e:
+                        self.fail(tirRecord["properties"]["id"],e)
+                        continue
+                    self.succeed(tirRecord["properties"]["id"])
+                return thisRecords
+            for tirRecord in tirRecords:
+                self.succeed(tirRecord["properties"]["id"])
+            return thisRecords
+        return guardedBatch
+
+    def flushed(self,flushResult):
+        # onFlush callback for a TIRWriter: records written (or that failed to write) are dealt with, so checkpoint
+        with self.lock:
+            self.done.update(flushResult["written"])
+            self.done.update([failure["id"] for failure in flushResult["failed"]])
+        self.checkpoint()
+
+    def advance(self):
+        # Called holding the lock; move the cursor up to the last record read with everything before it dealt with
+        while len(self.inFlight) > 0 and self.inFlight[0] in self.done:
+            self.cursor = self.inFlight.popleft()
+            self.done.discard(self.cursor)
+
+    def checkpoint(self):
+        # Advance the cursor and save the state
+        with self.lock:
+            self.advance()
+            self.state["cursor"] = self.cursor
+            self.state["checkpointed"] = datetime.utcnow().isoformat()
+            self.stats["checkpoints"] = self.stats["checkpoints"] + 1
+            self.save()
+
+    def save(self):
+        if not self.saveState:
+            return
+        if os.path.dirname(self.path) != "":
+            os.makedirs(os.path.dirname(self.path),exist_ok=True)
+        with open(self.path+".tmp","w") as f:
+            json.dump(self.state,f)
+        os.replace(self.path+".tmp",self.path)
+
+    def finish(self):
+        # Checkpoint at the end of a run; a run that got through everything starts the next one from the beginning
+        self.checkpoint()
+        if self.exhausted and self.stoppedBy is None and len(self.inFlight) == 0:
+            with self.lock:
+                self.cursor = 0
+                self.state["cursor"] = 0
+                self.state["completedRuns"] = self.state["completedRuns"] + 1
+                self.save()
+        return self.summary()
+
+    def summary(self):
+        with self.lock:
+            summary = dict(self.stats)
+            summary["cursor"] = self.cursor
+            summary["deadLetters"] = len(self.state["deadLetters"])
+            summary["stoppedBy"] = self.stoppedBy
+            summary["seconds"] = round(time.time()-self.started,3)
+        return summary
@@ -0,0 +1,85 @@
+# The SGCN processor is configured by files on the SGCN source repository item in ScienceBase (taxonomic group
+# mappings and the original 2005 SWAP national list). Those rarely change, so rather than downloading and parsing
+# them on every start, we keep the parsed versions in a local pickle along with the checksum (or URL) of each file.
+# Within maxAge seconds we use the local copy without asking ScienceBase at all; after that we check the item's file
+# list (a small request) and only download files whose checksum has changed. If ScienceBase can't be reached we fall
+# back to whatever we have cached.
+
+import io,os,time,pickle
+import pandas as pd
+from tirutils import sessions
+
+sgcnItemURL = "https://www.sciencebase.gov/catalog/item/56d720ece4b015c306f442d5?format=json&fields=files"
+taxonomicGroupMappingsTitle = "Configuration:Taxonomic Group Mappings"
+swap2005Title = "Original 2005 SWAP National List for reference"
+
+
+def fileVersion(file):
+    # ScienceBase gives us a checksum for most files; fall back to the URL and size if it doesn't
+    if "checksum" in file and file["checksum"] is not None:
+        return file["checksum"]["value"]
+    return file["url"]+":"+str(file.get("size"))
+
+
+def parseTaxonomicGroupMappings(text):
+    tgMappings = pd.read_csv(io.StringIO(text),sep=",")
+    return dict(zip(tgMappings["ProvidedName"].astype(str),tgMappings["PreferredName"].astype(str)))
+
+
+def parseSwap2005Names(text):
+    swap2005 = pd.read_csv(io.StringIO(text),sep="\t")
+    return list(swap2005["scientificname"].dropna().astype(str))
+
+
+def readCache(cachePath):
+    if not os.path.exists(cachePath):
+        return None
+    with open(cachePath,"rb") as f:
+        return pickle.load(f)
+
+
+def writeCache(cachePath,cached):
+    if os.path.dirname(cachePath) != "":
+        os.makedirs(os.path.dirname(cachePath),exist_ok=True)
+    with open(cachePath+".tmp","wb") as f:
+        pickle.dump(cached,f,protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(cachePath+".tmp",cachePath)
+
+
+def loadSGCNConfig(cachePath="cache/sgcnconfig.pickle",maxAge=86400):
+    # Returns a dictionary with tgDict (provided to preferred taxonomic group names) and swap2005Names
+    cached = readCache(cachePath)
+    if cached is not None and time.time()-cached["checked"] < maxAge:
+        return cached["config"]
+
+    try:
+        sb_sgcnCollectionItem = sessions.get(sgcnItemURL).json()
+    except Exception as e:
+        if cached is not None:
+            print ("Using cached SGCN configuration, could not reach ScienceBase: "+str(e))
+            return cached["config"]
+        raise
+
+    if cached is None:
+        cached = {"versions":{},"config":{}}
+
+    parsers = {
+        taxonomicGroupMappingsTitle:("tgDict",parseTaxonomicGroupMappings),
+        swap2005Title:("swap2005Names",parseSwap2005Names)
+    }
+
+    for file in sb_sgcnCollectionItem["files"]:
+        if file["title"] not in parsers:
+            continue
+        configKey,parser = parsers[file["title"]]
+        thisVersion = fileVersion(file)
+        if cached["versions"].get(file["title"]) != thisVersion or configKey not in cached["config"]:
+            r = sessions.get(file["url"])
+            r.encoding = "utf-8"
+            cached["config"][configKey] = parser(r.text)
+            cached["versions"][file["title"]] = thisVersion
+
+    cached["checked"] = time.time()
+    writeCache(cachePath,cached)
+
+    return cached["config"]
@@ -0,0 +1,97 @@
+# Shared HTTP client layer for everything the TIR processors talk to (the GC2 SQL API, ITIS Solr, WoRMS REST, ECOS
+# TESS, NatureServe and ScienceBase). Calling requests.get directly sets up a new connection for most calls, so
+# here we keep one pooled session per host with keep-alive, retries with backoff on server errors and timeouts, and
+# compressed responses. Only GETs are retried on a server error or a read timeout. A POST to the GC2 SQL API may have
+# been committed before the response was lost, and sending an INSERT or UPDATE again could apply it twice, so POSTs are
+# only retried when the connection could not be made (urllib3 retries connect errors whatever the method). Requests also take a slot from the workers module so per-host concurrency limits apply, go
+# through the host's limiter from the ratelimit module if it has one, and have their latency recorded in the run
+# metrics. Hosts can be pointed somewhere else (e.g. the local stand-ins in benchmarks) with the hostOverrides
+# setting; limits and metrics still go by the original host.
+
+import time,threading
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from tirutils import workers
+from tirutils import metrics
+from tirutils import ratelimit
+
+settings = {}
+settings["poolSize"] = 10
+settings["retryTotal"] = 3
+settings["retryBackoff"] = 0.5
+settings["retryStatuses"] = [500,502,503,504]
+settings["retryMethods"] = ["GET"]
+settings["timeout"] = 60
+settings["hostOverrides"] = {}
+
+hostSessions = {}
+sessionLock = threading.Lock()
+
+
+def configure(**kwargs):
+    # Change any of the settings above; sessions created before this are dropped so they pick up the new settings
+    with sessionLock:
+        settings.update(kwargs)
+        for session in hostSessions.values():
+            session.close()
+        hostSessions.clear()
+
+
+def newSession():
+    retry = metrics.CountingRetry(
+        total=settings["retryTotal"],
+        backoff_factor=settings["retryBackoff"],
+        status_forcelist=settings["retryStatuses"],
+        allowed_methods=settings["retryMethods"],
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=1,pool_maxsize=settings["poolSize"],max_retries=retry)
+
+    session = requests.Session()
+    session.mount("http://",adapter)
+    session.mount("https://",adapter)
+    session.headers.update({"Accept-Encoding":"gzip, deflate"})
+    return session
+
+
+def getSession(url):
+    # Return the pooled session for a URL's host, setting one up if we don't have it yet
+    host = urlparse(url).netloc
+    with sessionLock:
+        if host not in hostSessions:
+            hostSessions[host] = newSession()
+        return hostSessions[host]
+
+
+def routeURL(url):
+    # Swap in the override for a URL's host (a base URL like "http://127.0.0.1:8001") if there is one
+    parsedURL = urlparse(url)
+    if parsedURL.netloc not in settings["hostOverrides"]:
+        return url
+    override = urlparse(settings["hostOverrides"][parsedURL.netloc])
+    return parsedURL._replace(scheme=override.scheme,netloc=override.netloc).geturl()
+
+
+def request(method,url,**kwargs):
+    kwargs.setdefault("timeout",settings["timeout"])
+    host = urlparse(url).netloc
+    url = routeURL(url)
+    with workers.hostSlot(host),ratelimit.limited(host) as outcome:
+        started = time.time()
+        try:
+            r = getSession(url).request(method,url,**kwargs)
+        except Exception:
+            metrics.observeRequest(host,time.time()-started,None)
+            raise
+        metrics.observeRequest(host,time.time()-started,r.status_code)
+        outcome["statusCode"] = r.status_code
+        return r
+
+
+def get(url,**kwargs):
+    return request("GET",url,**kwargs)
+
+
+def post(url,**kwargs):
+    return request("POST",url,**kwargs)
@@ -0,0 +1,88 @@
+# The SGCN annotations in the TIR come from a few lookups for each distinct scientific name: the taxonomic group
+# submitted for the name, the states that listed it by year, a submitted common name, and whether the name was on the
+# original 2005 SWAP national list. SGCN.py used to get the first three from bis.sgcn (getSGCNTaxonomicGroup,
+# getSGCNStatesByYear and getSGCNCommonName), one query per record. Rather than asking the SGCN database for each of
+# those on every record, we build an index once per run with a few aggregate queries and annotate records from memory.
+#
+# The index gives back what those functions give for a name looked up exactly as submitted: the most often submitted
+# value of a column (ties going to the first value alphabetically, and None for a name with no value) and a list of
+# {"year","states"} with the states sorted, oldest year first. tests/test_sgcnindex.py holds the index to the per name
+# queries in benchmarks/standinbis.py, which follow the bis functions.
+#
+# The sgcn table and column names are set here so they can be adjusted if the SGCN schema changes.
+
+from datetime import datetime
+from tirutils import claim
+
+sgcnTable = "sgcn.sgcn"
+nameColumn = "scientificname"
+taxonomicGroupColumn = "taxonomicgroup"
+stateColumn = "state"
+yearColumn = "year"
+commonNameColumn = "commonname"
+
+
+def sgcnQuery(baseURL,q):
+    sgcnResult = claim.sqlQuery(baseURL,q)
+    if "features" not in sgcnResult:
+        raise Exception(sgcnResult.get("message","Could not load the SGCN index"))
+    return [row["properties"] for row in sgcnResult["features"]]
+
+
+def mostCommonByName(baseURL,valueColumn):
+    # Pick the most frequently submitted value of a column for each scientific name in one aggregate query
+    q_values = "SELECT "+nameColumn+" AS name, "+valueColumn+" AS value, count(*) AS num FROM "+sgcnTable+" WHERE "+valueColumn+" IS NOT NULL GROUP BY "+nameColumn+", "+valueColumn+" ORDER BY "+nameColumn+", count(*) DESC, "+valueColumn
+    mostCommon = {}
+    for row in sgcnQuery(baseURL,q_values):
+        if row["name"] not in mostCommon:
+            mostCommon[row["name"]] = row["value"]
+    return mostCommon
+
+
+def loadTaxonomicGroups(baseURL):
+    return mostCommonByName(baseURL,taxonomicGroupColumn)
+
+
+def loadCommonNames(baseURL):
+    return mostCommonByName(baseURL,commonNameColumn)
+
+
+def loadStateLists(baseURL):
+    # Lists of states that included each name, by year of the list
+    q_states = "SELECT "+nameColumn+" AS name, "+yearColumn+" AS year, array_to_string(array_agg(DISTINCT "+stateColumn+"),',') AS states FROM "+sgcnTable+" WHERE "+stateColumn+" IS NOT NULL GROUP BY "+nameColumn+", "+yearColumn+" ORDER BY "+yearColumn
+    stateLists = {}
+    for row in sgcnQuery(baseURL,q_states):
+        stateLists.setdefault(row["name"],[]).append({"year":row["year"],"states":sorted(row["states"].split(","))})
+    return stateLists
+
+
+def buildSGCNIndex(baseURL,swap2005Names,tgDict):
+    # Build everything needed to annotate SGCN records in memory
+    sgcnIndex = {}
+    sgcnIndex["swap2005"] = set(swap2005Names)
+    sgcnIndex["tgDict"] = dict(tgDict)
+    sgcnIndex["preferredGroups"] = set(tgDict.values())
+    sgcnIndex["taxonomicGroups"] = loadTaxonomicGroups(baseURL)
+    sgcnIndex["stateLists"] = loadStateLists(baseURL)
+    sgcnIndex["commonNames"] = loadCommonNames(baseURL)
+    return sgcnIndex
+
+
+def preferredTaxonomicGroup(sgcnIndex,nameSubmitted):
+    # Map the submitted taxonomic group to the preferred group from the config file, or "Other"
+    taxonomicgroup_submitted = sgcnIndex["taxonomicGroups"].get(nameSubmitted)
+    if taxonomicgroup_submitted in sgcnIndex["tgDict"]:
+        return sgcnIndex["tgDict"][taxonomicgroup_submitted]
+    elif taxonomicgroup_submitted in sgcnIndex["preferredGroups"]:
+        return taxonomicgroup_submitted
+    return "Other"
+
+
+def annotateSGCN(sgcnIndex,nameSubmitted,names):
+    # Build the SGCN annotation for a registered name and the list of names (submitted, ITIS, WoRMS) for the record
+    annotation = {}
+    annotation["swap2005"] = any(name in sgcnIndex["swap2005"] for name in names)
+    annotation["taxonomicgroup"] = preferredTaxonomicGroup(sgcnIndex,nameSubmitted)
+    annotation["stateLists"] = sgcnIndex["stateLists"].get(nameSubmitted,[])
+    annotation["dateCached"] = datetime.utcnow().isoformat()
+    return annotation
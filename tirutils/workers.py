@@ -0,0 +1,51 @@
+# The lookup chains against the taxonomic authorities and other upstream services are all latency bound, so running
+# them one record at a time means we only ever have one request in flight. These functions run the per-record
+# lookups over a pool of threads with a bounded window of records in flight, and limit how many requests we send to
+# any one upstream host at the same time so that we stay polite with the services we depend on.
+
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+defaultHostLimit = 4
+hostLimits = {}
+hostSemaphores = {}
+hostLock = threading.Lock()
+
+
+def setHostLimit(host,limit):
+    # Set the maximum number of concurrent requests for an upstream host (e.g. "services.itis.gov")
+    with hostLock:
+        hostLimits[host] = limit
+        hostSemaphores[host] = threading.BoundedSemaphore(limit)
+
+
+def hostSlot(host):
+    # Returns a semaphore to use as a context manager around any call to the given host
+    with hostLock:
+        if host not in hostSemaphores:
+            hostSemaphores[host] = threading.BoundedSemaphore(hostLimits.get(host,defaultHostLimit))
+        return hostSemaphores[host]
+
+
+def processConcurrently(processFunction,records,maxWorkers=8,maxInFlight=None):
+    # Generator that runs processFunction over records on a pool of threads and yields the results in the same order
+    # the records came in. Only maxInFlight records (default twice the workers) are pulled from the records iterator
+    # at a time so that we don't read ahead through a whole table of pending records.
+    if maxWorkers <= 1:
+        for record in records:
+            yield processFunction(record)
+        return
+
+    if maxInFlight is None:
+        maxInFlight = maxWorkers*2
+
+    inFlight = deque()
+    with ThreadPoolExecutor(max_workers=maxWorkers) as pool:
+        for record in records:
+            inFlight.append(pool.submit(processFunction,record))
+            if len(inFlight) >= maxInFlight:
+                yield inFlight.popleft().result()
+
+        while len(inFlight) > 0:
+            yield inFlight.popleft().result()
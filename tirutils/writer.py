@@ -0,0 +1,167 @@
+# Caching results back to the TIR one record at a time (tir.cacheToTIR or a string-built UPDATE per row) means the
+# processors spend most of their time waiting on the GC2 API to write. The TIRWriter buffers results and sends them
+# as a single multi-row "UPDATE ... FROM (VALUES ...)" statement when the buffer fills up or gets old enough. If a
+# batch fails, it falls back to writing the rows in that batch one at a time so that we know exactly which records
+# did not make it in and why. Writers for the buckets that other processes depend on can also record the ids they
+# wrote in the journal. A CacheDateWriter sets just the cache date inside a bucket, for refreshed documents that
+# came back unchanged.
+
+import json,time
+from tirutils import sessions
+from tirutils import journal
+
+
+def sqlLiteral(value):
+    # Turn a Python value into a PostgreSQL literal for use in a VALUES list
+    if value is None:
+        return "NULL"
+    if isinstance(value,bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value,(int,float)):
+        return str(value)
+    if isinstance(value,(dict,list)):
+        value = json.dumps(value)
+    return "'"+str(value).replace("'","''")+"'"
+
+
+def sqlExecute(baseURL,q):
+    # Send a SQL statement to the GC2 SQL API as a POST so that large batches don't run into URL length limits
+    return sessions.post(baseURL,data={"q":q}).json()
+
+
+def buildUpdate(columnTypes,rows):
+    # Build one UPDATE statement for a list of (id, values) tuples against the columns in columnTypes
+    # columnTypes is a dictionary of column name to a PostgreSQL type used to cast the VALUES (or None for no cast)
+    columns = list(columnTypes.keys())
+
+    setList = []
+    for column in columns:
+        if columnTypes[column] is None:
+            setList.append(column+" = v."+column)
+        else:
+            setList.append(column+" = v."+column+"::"+columnTypes[column])
+
+    valuesList = []
+    for recordID,values in rows:
+        valuesList.append("("+",".join([str(int(recordID))]+[sqlLiteral(values.get(column)) for column in columns])+")")
+
+    return "UPDATE tir.tir AS t SET "+", ".join(setList)+" FROM (VALUES "+",".join(valuesList)+") AS v(id,"+",".join(columns)+") WHERE t.id = v.id"
+
+
+def buildDateUpdate(bucket,dateKey,rows):
+    # Build one UPDATE statement that sets the dateKey property inside a JSON bucket for a list of (id, values) tuples
+    valuesList = ["("+str(int(recordID))+","+sqlLiteral(values.get(dateKey))+")" for recordID,values in rows]
+    return "UPDATE tir.tir AS t SET "+bucket+" = (t."+bucket+"::jsonb || jsonb_build_object('"+dateKey+"',v.stamp))::json FROM (VALUES "+",".join(valuesList)+") AS v(id,stamp) WHERE t.id = v.id"
+
+
+class TIRWriter:
+    # Buffered, batched writer for one or more columns in tir.tir
+
+    def __init__(self,baseURL,columnTypes,batchSize=100,maxSeconds=60,onFailure=None,journalBucket=None,onFlush=None):
+        # onFlush is called with the result of every flush that wrote anything (e.g. runstate.RunState.flushed)
+        self.baseURL = baseURL
+        self.columnTypes = columnTypes
+        self.batchSize = batchSize
+        self.maxSeconds = maxSeconds
+        self.onFailure = onFailure
+        self.onFlush = onFlush
+        self.journalBucket = journalBucket
+        self.buffer = []
+        self.bufferStarted = None
+        self.totals = {"written":0,"failed":0,"batches":0,"journalFailures":0}
+        self.failures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,excType,excValue,traceback):
+        self.close()
+
+    def write(self,recordID,values):
+        # Add a record to the buffer, flushing if we've hit the size or age threshold
+        if len(self.buffer) == 0:
+            self.bufferStarted = time.time()
+        self.buffer.append((recordID,values))
+
+        if len(self.buffer) >= self.batchSize or time.time()-self.bufferStarted >= self.maxSeconds:
+            return self.flush()
+
+    def statement(self,rows):
+        return buildUpdate(self.columnTypes,rows)
+
+    def flush(self):
+        # Write everything in the buffer and return a summary of what happened
+        rows = self.buffer
+        self.buffer = []
+        self.bufferStarted = None
+
+        flushResult = {"written":[],"failed":[]}
+        if len(rows) == 0:
+            return flushResult
+
+        self.totals["batches"] = self.totals["batches"] + 1
+        try:
+            r = sqlExecute(self.baseURL,self.statement(rows))
+            batchSucceeded = r.get("success",False)
+        except Exception:
+            batchSucceeded = False
+
+        if batchSucceeded:
+            flushResult["written"] = [recordID for recordID,values in rows]
+        else:
+            # Work through the batch one row at a time to find and report the problem records
+            for recordID,values in rows:
+                try:
+                    r = sqlExecute(self.baseURL,self.statement([(recordID,values)]))
+                    if r.get("success",False):
+                        flushResult["written"].append(recordID)
+                    else:
+                        flushResult["failed"].append({"id":recordID,"values":values,"message":r.get("message")})
+                except Exception as e:
+                    flushResult["failed"].append({"id":recordID,"values":values,"message":str(e)})
+
+        if self.journalBucket is not None and len(flushResult["written"]) > 0:
+            try:
+                r = journal.recordChanges(self.baseURL,flushResult["written"],self.journalBucket)
+                journalSucceeded = r.get("success",False)
+            except Exception:
+                journalSucceeded = False
+            if not journalSucceeded:
+                self.totals["journalFailures"] = self.totals["journalFailures"] + len(flushResult["written"])
+
+        self.totals["written"] = self.totals["written"] + len(flushResult["written"])
+        self.totals["failed"] = self.totals["failed"] + len(flushResult["failed"])
+        self.failures.extend([{"id":failure["id"],"message":failure["message"]} for failure in flushResult["failed"]])
+
+        # Callbacks run after the buffer is reset so they can safely write a corrected version of the record
+        if self.onFailure is not None:
+            for failure in flushResult["failed"]:
+                self.onFailure(failure["id"],failure["values"],failure["message"])
+        if self.onFlush is not None:
+            self.onFlush(flushResult)
+
+        return flushResult
+
+    def close(self):
+        # Flush anything left in the buffer (including anything written by failure callbacks) and return the totals
+        while len(self.buffer) > 0:
+            self.flush()
+        return self.summary()
+
+    def summary(self):
+        summary = dict(self.totals)
+        summary["failures"] = list(self.failures)
+        return summary
+
+
+class CacheDateWriter(TIRWriter):
+    # TIRWriter that only moves the cache date (dateKey, e.g. cacheDate) inside a bucket forward; write values are
+    # {dateKey: date}
+
+    def __init__(self,baseURL,bucket,dateKey,batchSize=100,maxSeconds=60):
+        TIRWriter.__init__(self,baseURL,{dateKey:None},batchSize,maxSeconds)
+        self.bucket = bucket
+        self.dateKey = dateKey
+
+    def statement(self,rows):
+        return buildDateUpdate(self.bucket,self.dateKey,rows)